@@ -1,15 +1,23 @@
 # app.py
 
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
+import atexit
+import json
 import os
 import sys
+import time
+import uuid
 
 # 设置路径以便导入根目录模块
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 if ROOT_DIR not in sys.path:
     sys.path.append(ROOT_DIR)
 
-from backend.services.game_service import game_service
+from backend.services.game_service import game_service, SessionBusyError, AdmissionRejected
+from backend.infrastructure.llm import cache_stats, circuit_stats, close_all_clients, rate_limit_stats, LLMFactory, RateLimitExceeded
+from backend.infrastructure.metrics import HTTP_LATENCY, HTTP_REQUESTS, get_metrics_registry
+from backend.infrastructure.tracing import get_trace_ring
+from backend import settings
 from backend.settings import SECRET_KEY, HOST as SETTINGS_HOST, PORT as SETTINGS_PORT, DEBUG as SETTINGS_DEBUG
 
 if not os.environ.get("DEEPSEEK_API_KEY"):
@@ -28,6 +36,47 @@ app = Flask(
 )
 app.secret_key = SECRET_KEY
 
+# LLM 提供商的长连接客户端在进程退出时统一关闭
+atexit.register(close_all_clients)
+
+# 存活会话数在抓取 /metrics 时读取
+get_metrics_registry().gauge_callback(
+    "lyuyuan_active_sessions", "Sessions currently held in the session registry.", lambda: len(game_service.registry)
+)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def _guard_debug_endpoints():
+    # /api/debug/* 暴露会话、限流、缓存等内部状态且没有鉴权，默认关闭（settings.DEBUG_ENDPOINTS）
+    if request.path.startswith('/api/debug/') and not settings.DEBUG_ENDPOINTS:
+        return jsonify({'error': 'Not Found'}), 404
+    return None
+
+
+@app.after_request
+def _record_request_metrics(response):
+    # 按路由模板（而非实际路径）分组；流式接口记录的是响应头就绪前的耗时
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    started = g.get("request_started")
+    if started is not None:
+        HTTP_LATENCY.observe(time.perf_counter() - started, route=route)
+    return response
+
+
+def _session_id():
+    """返回当前浏览器会话的ID（首次访问时生成），用于在注册表中定位该玩家的角色实例"""
+    sid = session.get('sid')
+    if not sid:
+        sid = uuid.uuid4().hex
+        session['sid'] = sid
+    return sid
+
 
 def _filter_history_for_client(history):
     try:
@@ -45,57 +94,102 @@ def index():
 
 @app.route('/api/start_game', methods=['POST'])
 def start_game():
-    """开始新游戏，完全由SimpleGameCore驱动"""
+    """开始新游戏：为当前会话创建独立的角色实例"""
     print("[API] Request to /api/start_game")
     payload = request.get_json(silent=True) or {}
     role = (payload.get('role') or 'su_tang').strip().lower()
     # 暂存所选角色到会话，便于后续 /api/chat 返回给前端
     session['character_key'] = role
 
-    initial_data = game_service.start_game(role)
+    initial_data = game_service.start_game(_session_id(), role)
     # 为前端提供角色键与角色名称
     initial_data['character_key'] = role
-    try:
-        agent = getattr(getattr(game_service, '_core', None), 'agent', None)
-        if agent and getattr(agent, 'name', None):
-            initial_data['character_name'] = str(agent.name)
-    except Exception:
-        pass
+    if not initial_data.get('character_name'):
+        initial_data.pop('character_name', None)
     # 不向前端暴露 system 提示词；如果历史里只有 system，则让前端显示 intro_text
     if 'history' in initial_data:
         initial_data['history'] = _filter_history_for_client(initial_data.get('history'))
     return jsonify(initial_data)
 
+def chat_payload(turn, character_key):
+    """/api/chat 的响应体（Flask 路由与 asgi.py 的协程路由共用）"""
+    payload = {
+        'response': str(turn['response']), # 强制转字符串，更安全
+        'game_state': turn['game_state'],
+        'character_key': character_key
+    }
+    if turn.get('character_name'):
+        payload['character_name'] = turn['character_name']
+    return payload
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """处理聊天请求，完全由SimpleGameCore驱动"""
+    """处理聊天请求：路由到当前会话自己的角色实例"""
     print("[API] Request to /api/chat")
     try:
         user_input = request.json.get('message', '')
         if not user_input:
             return jsonify({'error': 'Message is empty'}), 400
 
-        # 直接调用 SimpleGameCore 的方法
-        response_text = game_service.chat(user_input)
-        current_state = game_service.get_state()
-
-        payload = {
-            'response': str(response_text), # 强制转字符串，更安全
-            'game_state': current_state,
-            'character_key': session.get('character_key', 'su_tang')
-        }
-        try:
-            agent = getattr(getattr(game_service, '_core', None), 'agent', None)
-            if agent and getattr(agent, 'name', None):
-                payload['character_name'] = str(agent.name)
-        except Exception:
-            pass
-        return jsonify(payload)
+        turn = game_service.chat_turn(_session_id(), user_input, session.get('character_key'))
+        return jsonify(chat_payload(turn, session.get('character_key', 'su_tang')))
+    except SessionBusyError:
+        return jsonify({'error': '上一条消息仍在处理中，请稍后再试'}), 409
+    except OVERLOADED_ERRORS as e:
+        return admission_rejected_handler(e)
     except Exception as e:
         import traceback
         print(f"!!! UNEXPECTED ERROR IN CHAT API !!!\n{traceback.format_exc()}")
         return jsonify({'error': '服务器发生未知错误', 'details': str(e)}), 500
 
+OVERLOADED_MESSAGE = '当前聊天人数过多，请稍后再试'
+# 准入队列已满或 API 配额耗尽：均返回 429 + Retry-After
+OVERLOADED_ERRORS = (AdmissionRejected, RateLimitExceeded)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """流式聊天（Server-Sent Events）：逐段推送 <response> 文本，最后推送 done 事件携带 game_state"""
+    print("[API] Request to /api/chat/stream")
+    payload = request.get_json(silent=True) or {}
+    user_input = payload.get('message', '')
+    if not user_input:
+        return jsonify({'error': 'Message is empty'}), 400
+
+    sid = _session_id()
+    character_key = session.get('character_key', 'su_tang')
+
+    def generate():
+        try:
+            for kind, value in game_service.chat_stream_turn(sid, user_input, character_key):
+                if kind == 'delta':
+                    yield _sse('delta', {'text': value})
+                elif kind == 'done':
+                    done = {
+                        'response': str(value['response']),
+                        'game_state': value['game_state'],
+                        'character_key': character_key,
+                    }
+                    if value.get('character_name'):
+                        done['character_name'] = value['character_name']
+                    yield _sse('done', done)
+        except SessionBusyError:
+            yield _sse('error', {'error': '上一条消息仍在处理中，请稍后再试', 'status': 409})
+        except OVERLOADED_ERRORS as e:
+            yield _sse('error', {'error': OVERLOADED_MESSAGE, 'status': 429, 'retry_after': e.retry_after})
+        except Exception as e:
+            import traceback
+            print(f"!!! UNEXPECTED ERROR IN CHAT STREAM API !!!\n{traceback.format_exc()}")
+            yield _sse('error', {'error': '服务器发生未知错误', 'details': str(e), 'status': 500})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
 @app.route('/api/save', methods=['POST'])
 def save_game_api():
     print("[API] Request to /api/save")
@@ -103,15 +197,7 @@ def save_game_api():
     slot = payload.get('slot', 1)
     # 可选命名：label 或 name（写入 meta.label）
     label = payload.get('label') or payload.get('name')
-    if label:
-        try:
-            # 将 label 写到当前 agent 的 state，BaseCharacter.save 会自动带入 meta
-            agent = getattr(getattr(game_service, '_core', None), 'agent', None)
-            if agent and hasattr(agent, 'game_state') and isinstance(agent.game_state, dict):
-                agent.game_state['label'] = str(label)
-        except Exception:
-            pass
-    success = game_service.save(slot)
+    success = game_service.save(_session_id(), slot, label=label)
     return jsonify({'success': success})
 
 @app.route('/api/load', methods=['POST'])
@@ -127,32 +213,28 @@ def load_game_api():
     if raw and isinstance(raw, dict):
         meta = raw.get('meta') or {}
         target_role = meta.get('role')
-    # 若存档包含 role，尝试在开始新游戏时切换到对应角色
+    sid = _session_id()
+    # 若存档包含 role，先切换到对应角色，再用存档覆盖状态（同一把会话锁内完成）
+    snapshot = None
     if target_role:
         try:
-            game_service.start_game(target_role)
+            snapshot = game_service.load(sid, slot, role=target_role)
             session['character_key'] = str(target_role)
-            # 用加载覆盖状态
-            success = game_service.load(slot)
+        except SessionBusyError:
+            raise
         except Exception:
-            success = game_service.load(slot)
+            snapshot = game_service.load(sid, slot)
     else:
-        success = game_service.load(slot)
-    if success:
-        raw_history = getattr(getattr(game_service, '_core', None), 'agent', None)
-        raw_history = raw_history.dialogue_history if raw_history else []
+        snapshot = game_service.load(sid, slot)
+    if snapshot:
         payload = {
             'success': True,
-            'game_state': game_service.get_state(),
-            'history': _filter_history_for_client(raw_history),
+            'game_state': snapshot['game_state'],
+            'history': _filter_history_for_client(snapshot['history']),
             'character_key': session.get('character_key', 'su_tang')
         }
-        try:
-            agent = getattr(getattr(game_service, '_core', None), 'agent', None)
-            if agent and getattr(agent, 'name', None):
-                payload['character_name'] = str(agent.name)
-        except Exception:
-            pass
+        if snapshot.get('character_name'):
+            payload['character_name'] = snapshot['character_name']
         return jsonify(payload)
     return jsonify({'success': False})
 
@@ -166,7 +248,79 @@ def list_saves_api():
     items = storage.list_saves_detailed()
     return jsonify({'saves': items})
 
+
+@app.route('/api/debug/sessions', methods=['GET'])
+def debug_sessions_api():
+    """会话注册表统计：存活会话数、淘汰次数与每个会话的内存估算。"""
+    return jsonify(game_service.session_stats())
+
+
+@app.route('/api/debug/admission', methods=['GET'])
+def debug_admission_api():
+    """LLM 准入控制统计：每个提供商的并发、排队长度、拒绝次数与排队等待时间。"""
+    return jsonify(game_service.admission_stats())
+
+
+@app.route('/api/debug/rate_limit', methods=['GET'])
+def debug_rate_limit_api():
+    """按 API 密钥的限流统计：配额、被节流次数、拒绝次数与累计节流等待时间。"""
+    return jsonify({'limiters': rate_limit_stats()})
+
+
+@app.route('/api/debug/circuits', methods=['GET'])
+def debug_circuits_api():
+    """每个 LLM 提供商的熔断器状态：当前状态、连续失败次数、熔断次数与被短路的调用数。"""
+    return jsonify({'circuits': circuit_stats()})
+
+
+@app.route('/api/debug/hedging', methods=['GET'])
+def debug_hedging_api():
+    """对冲请求统计：对冲比例、当前对冲延迟（普通/流式分开），以及主/备两路的获胜次数、完整响应耗时与流式首 token 耗时分位数。"""
+    return jsonify({'hedged_providers': LLMFactory.hedge_stats()})
+
+
+@app.route('/api/debug/routing', methods=['GET'])
+def debug_routing_api():
+    """提供商路由统计：每个候选的耗时与错误率 EWMA、得分、探测次数以及当前会选中的候选。"""
+    return jsonify({'routers': LLMFactory.route_stats()})
+
+
+@app.route('/api/debug/cache', methods=['GET'])
+def debug_cache_api():
+    """LLM 响应缓存统计：条目数、内存占用、内存/磁盘命中、未命中、因温度策略绕过的次数、因输出不完整未写入的次数与淘汰次数。"""
+    return jsonify({'cache': cache_stats()})
+
+
+@app.route('/api/debug/timings', methods=['GET'])
+def debug_timings_api():
+    """最近回合的分阶段耗时：各阶段 p50/p95、最慢的回合与最近 limit 个回合（llm_first_byte 只来自流式回合）；format=chrome 时返回 Chrome Trace 格式。"""
+    ring = get_trace_ring()
+    if request.args.get('format') == 'chrome':
+        return jsonify(ring.chrome_trace())
+    limit = request.args.get('limit', default=20, type=int)
+    return jsonify(ring.stats(limit=max(0, limit)))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    """Prometheus 文本格式的指标：各路由请求数与耗时、各提供商 LLM 耗时/错误/token、备用回复次数、存活会话数、事件发布数与存档耗时。"""
+    return Response(get_metrics_registry().render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.errorhandler(SessionBusyError)
+def session_busy_handler(exc):
+    return jsonify({'error': '上一条操作仍在处理中，请稍后再试'}), 409
+
+
+@app.errorhandler(AdmissionRejected)
+@app.errorhandler(RateLimitExceeded)
+def admission_rejected_handler(exc):
+    response = jsonify({'error': OVERLOADED_MESSAGE, 'retry_after': exc.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
 # web_start.py 调用
 if __name__ == "__main__":
     # 兜底：若直接运行 app.py，则使用 settings 配置
-    app.run(debug=SETTINGS_DEBUG, port=SETTINGS_PORT, host=SETTINGS_HOST)
\ No newline at end of file
+    app.run(debug=SETTINGS_DEBUG, port=SETTINGS_PORT, host=SETTINGS_HOST, threaded=True)
\ No newline at end of file
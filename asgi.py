@@ -0,0 +1,188 @@
+# asgi.py
+"""ASGI 入口：/api/chat 以协程处理，其余路由交给 Flask
+
+在 WSGI（Flask 多线程）模式下，每个等待 LLM 的玩家都占用一个线程 5~45 秒。
+这里 /api/chat 直接在事件循环上 await 提供商（GameService.achat_turn），
+等待中的回合只是挂起的协程；其余路由（含 SSE 流式接口）仍由 Flask 在线程池中处理。
+
+依赖 uvicorn 与 a2wsgi（可选依赖组 asgi：pip install ".[asgi]"），未安装时导入本模块会报错。
+
+启动：
+    python asgi.py
+    或 uvicorn asgi:application --host 0.0.0.0 --port 8080
+"""
+
+import json
+import time
+import traceback
+import uuid
+
+from werkzeug.http import dump_cookie, parse_cookie
+
+ASGI_EXTRA_HINT = 'ASGI 模式需要可选依赖 uvicorn 与 a2wsgi，请执行 pip install ".[asgi]"'
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError as exc:
+    raise ImportError(ASGI_EXTRA_HINT) from exc
+
+from app import app as flask_app, chat_payload, OVERLOADED_ERRORS, OVERLOADED_MESSAGE
+from backend import settings
+from backend.infrastructure.llm import aclose_all_clients
+from backend.infrastructure.metrics import HTTP_LATENCY, HTTP_REQUESTS
+from backend.services.game_service import game_service, SessionBusyError
+
+
+class FlaskSessionCookie:
+    """读写与 Flask 相同格式的签名会话 Cookie，使协程路由与 Flask 路由共享会话"""
+
+    def __init__(self, app):
+        self.app = app
+        self.interface = app.session_interface
+        self.name = app.config["SESSION_COOKIE_NAME"]
+
+    def load(self, scope) -> dict:
+        cookies = {}
+        for key, value in scope.get("headers", []):
+            if key == b"cookie":
+                cookies.update(parse_cookie(value.decode("latin-1")))
+        raw = cookies.get(self.name)
+        if not raw:
+            return {}
+        serializer = self.interface.get_signing_serializer(self.app)
+        try:
+            max_age = int(self.app.permanent_session_lifetime.total_seconds())
+            data = serializer.loads(raw, max_age=max_age)
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def dump(self, data: dict) -> bytes:
+        """生成 Set-Cookie 头的值"""
+        value = self.interface.get_signing_serializer(self.app).dumps(data)
+        return dump_cookie(
+            self.name,
+            value,
+            path=self.interface.get_cookie_path(self.app),
+            domain=self.interface.get_cookie_domain(self.app),
+            secure=self.interface.get_cookie_secure(self.app),
+            httponly=self.interface.get_cookie_httponly(self.app),
+            samesite=self.interface.get_cookie_samesite(self.app),
+        ).encode("latin-1")
+
+
+class LyuyuanASGI:
+    """把协程路由与 Flask（经 a2wsgi 线程池）组合成一个 ASGI 应用"""
+
+    def __init__(self, app, workers: int = settings.ASGI_WSGI_WORKERS):
+        self.flask_app = app
+        self.wsgi = WSGIMiddleware(app, workers=workers)
+        self.cookies = FlaskSessionCookie(app)
+        self.routes = {("POST", "/api/chat"): self.chat}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "http":
+            handler = self.routes.get((scope["method"], scope["path"]))
+            if handler is not None:
+                await self._instrumented(handler, scope, receive, send)
+                return
+        await self.wsgi(scope, receive, send)
+
+    async def _instrumented(self, handler, scope, receive, send):
+        """记录协程路由的请求数与耗时（Flask 路由由 app.py 的 after_request 记录）"""
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await handler(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS.inc(route=scope["path"], method=scope["method"], status=status)
+            HTTP_LATENCY.observe(time.perf_counter() - started, route=scope["path"])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # 提供商在本事件循环上创建的长连接客户端需在循环结束前关闭
+                await aclose_all_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def chat(self, scope, receive, send):
+        """处理聊天请求（协程版 /api/chat，行为与 Flask 路由一致）"""
+        print("[API] Request to /api/chat (async)")
+        body = await _read_body(receive)
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+        user_input = payload.get("message", "") if isinstance(payload, dict) else ""
+        if not user_input:
+            await _send_json(send, 400, {"error": "Message is empty"})
+            return
+
+        session = self.cookies.load(scope)
+        extra_headers = []
+        sid = session.get("sid")
+        if not sid:
+            session["sid"] = sid = uuid.uuid4().hex
+            extra_headers.append((b"set-cookie", self.cookies.dump(session)))
+
+        try:
+            turn = await game_service.achat_turn(sid, user_input, session.get("character_key"))
+            status, data = 200, chat_payload(turn, session.get("character_key", "su_tang"))
+        except SessionBusyError:
+            status, data = 409, {"error": "上一条消息仍在处理中，请稍后再试"}
+        except OVERLOADED_ERRORS as e:
+            status, data = 429, {"error": OVERLOADED_MESSAGE, "retry_after": e.retry_after}
+            extra_headers.append((b"retry-after", str(e.retry_after).encode("ascii")))
+        except Exception as e:
+            print(f"!!! UNEXPECTED ERROR IN CHAT API !!!\n{traceback.format_exc()}")
+            status, data = 500, {"error": "服务器发生未知错误", "details": str(e)}
+        await _send_json(send, status, data, extra_headers)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send, status: int, data, extra_headers=()):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("ascii")),
+        *extra_headers,
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+application = LyuyuanASGI(flask_app)
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError as exc:
+        raise SystemExit(ASGI_EXTRA_HINT) from exc
+
+    uvicorn.run(application, host=settings.HOST, port=settings.PORT, log_level="info")
@@ -1,22 +1,31 @@
 # base_character.py
 from __future__ import annotations
 
+import asyncio
 import copy
-import json
 import logging
-import os
 import random
 import re
 import traceback
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Tuple
-
-import requests
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
+from backend import settings
 from backend.game_storage import GameStorage
+from backend.domain.dialogue_summary import DialogueSummarizer, build_summary_messages
 from backend.domain.memory_system import MemorySystem
+from backend.domain.output_parser import TaggedOutputParser
+from backend.domain.prompt_context import PromptContext
+from backend.domain.prompt_packer import PackedPrompt, PromptPacker
+from backend.domain.prompt_template import CompiledPrompt, PromptTemplateError, get_compiled_prompt
 from backend.domain.proactive_system import ProactiveSystem
 from backend.infrastructure.events import Event, EventType, get_event_bus
+from backend.infrastructure.character_loader import get_character_loader
+from backend.infrastructure.metrics import BACKUP_REPLIES, PROMPT_TOKENS
+from backend.infrastructure.llm import CircuitOpenError, LLMAdapter, LLMFactory, RateLimitExceeded, prompt_cache_hit_tokens
+from backend.infrastructure.llm.tokens import estimate_tokens
+from backend.infrastructure.tracing import TurnTrace, finish_trace, start_trace
 
 logger = logging.getLogger(__name__)
 
@@ -38,13 +47,31 @@ class BaseCharacter:
         "respect_level": 0,
     }
 
+    # build_prompt_variables 提供的变量；分析模板只能使用这些占位符（加载模板时校验）
+    PROMPT_VARIABLES = (
+        "relationship_state",
+        "closeness",
+        "mood_today",
+        "last_topics",
+        "current_scene_description",
+        "user_input",
+        "conversation_history",
+        "conversation_summary",
+        "important_memories",
+    )
+
+    # 角色配置中的 "api" 可逐项覆盖；值为 None 时使用 settings / 提供商默认值
     DEFAULT_API = {
-        "endpoint": "https://api.deepseek.com/v1/chat/completions",
-        "model": "deepseek-chat",
-        "temperature": 0.8,
-        "max_tokens": 1500,
-        "api_key_env": "DEEPSEEK_API_KEY",
-        "timeout": 45,
+        "provider": None,
+        "endpoint": None,
+        "model": None,
+        "temperature": None,
+        "max_tokens": None,
+        "api_key_env": None,
+        "timeout": None,
+        "hedge": None,  # 备用提供商[:模型]，如 "openai:gpt-4o-mini"；默认使用 settings.LLM_HEDGE_PROVIDER
+        "route": None,  # 参与路由的候选，如 "openai:gpt-4o-mini"；默认使用 settings.LLM_ROUTER_CANDIDATES
+        "cache": None,  # 是否使用响应缓存（仍受 LLM_CACHE_MAX_TEMPERATURE 限制）；默认使用 settings.LLM_CACHE
     }
 
     def __init__(
@@ -66,6 +93,12 @@ class BaseCharacter:
         self.history_size: int = int(config.get("history_size", 100))
         self.api_settings: Dict = {**self.DEFAULT_API, **config.get("api", {})}
         self.scene_description: str = config.get("current_scene_description", "")
+        # 每轮请求的估算 token 上限；None 时使用 settings.PROMPT_TOKEN_BUDGET
+        budget = config.get("prompt_token_budget")
+        self.prompt_packer = PromptPacker(
+            settings.PROMPT_TOKEN_BUDGET if budget is None else budget,
+            recent_messages=settings.PROMPT_RECENT_MESSAGES,
+        )
 
         initial_state_template = copy.deepcopy(self.DEFAULT_STATE)
         initial_state_template.update(copy.deepcopy(config.get("initial_state", {})))
@@ -77,7 +110,25 @@ class BaseCharacter:
         self.dialogue_history: List[Dict[str, str]] = []
         self.game_state: Dict = copy.deepcopy(self._initial_state_template)
 
-        self._prompt_template_cache: Optional[str] = None
+        # 本会话缓存的历史行、记忆与话题字符串（来源变化时才重建）
+        self.prompt_context = PromptContext(self.player_name, self.name)
+        # 移出提示词窗口的对话在后台合并成的滚动摘要（随存档保存）
+        self.dialogue_summary = DialogueSummarizer(
+            max_chars=settings.DIALOGUE_SUMMARY_MAX_CHARS,
+            batch=settings.DIALOGUE_SUMMARY_BATCH,
+            summarize=self._summarize_with_llm if settings.DIALOGUE_SUMMARY_LLM else None,
+            timeout=settings.DIALOGUE_SUMMARY_TIMEOUT,
+        )
+        # 预编译的提示词（同一角色的所有会话共享，构造角色时加载，见 __init__ 末尾）
+        self._compiled_prompt: Optional[CompiledPrompt] = None
+        # 最近一轮提示词各部分的估算 token 数（见 PackedPrompt.report）
+        self.last_prompt_report: Optional[Dict[str, object]] = None
+        # YAML 中 advanced.backup_replies；None 表示尚未加载（熔断时才需要）
+        self._backup_replies: Optional[List[str]] = config.get("backup_replies")
+        self._llm_adapter: Optional[LLMAdapter] = None
+        self.llm_usage: Dict[str, int] = {
+            "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cache_hit_tokens": 0,
+        }
 
         # Phase 1: 记忆与主动性系统
         self.memory_system = MemorySystem()
@@ -87,12 +138,23 @@ class BaseCharacter:
         self.event_bus = get_event_bus()
         self.role_key = config.get("role_key", self.name)
 
+        # 当前回合的耗时追踪（回合之间为 None）
+        self._trace: Optional[TurnTrace] = None
+
+        # 构造时即编译分析模板：占位符写错（PromptTemplateError）在建角色时就暴露，
+        # 而不是等到第一轮对话；模板文件缺失仍按原逻辑在回合中降级为备用回复
+        try:
+            self._get_compiled_prompt()
+        except FileNotFoundError:
+            logger.warning("Prompt template file missing: %s", self.prompt_template_path)
+
     def start_new_game(self, is_new_game: bool = False) -> Dict[str, object]:
         self.game_state = copy.deepcopy(self._initial_state_template)
         self.dialogue_history = self._build_initial_messages(is_new_game=is_new_game)
+        self.dialogue_summary.clear()
 
         # 发布游戏开始事件
-        self.event_bus.publish(Event(
+        self._publish_event(Event(
             event_type=EventType.GAME_STARTED,
             data={
                 "character": self.role_key,
@@ -126,34 +188,138 @@ class BaseCharacter:
         self.history_size = max(10, int(size))
 
     def chat(self, user_input: str) -> str:
+        with self._traced_turn("chat"):
+            user_input, early_reply = self._prepare_turn(user_input)
+            if early_reply is not None:
+                return early_reply
+
+            logger.debug("Step 1: calling think_and_chat")
+            result = self.think_and_chat(user_input)
+            logger.debug("Step 2: think_and_chat returned -> %s", result)
+            return self._finalize_turn(user_input, result)
+
+    async def achat(self, user_input: str) -> str:
+        """chat() 的协程版本：等待 LLM 期间不占用线程，回合前后处理与 chat() 完全相同
+
+        回合前后处理（分词、读备用回复、自动存档等同步 I/O）在工作线程执行，不阻塞事件循环。
+        """
+        with self._traced_turn("achat"):
+            user_input, early_reply = await asyncio.to_thread(self._prepare_turn, user_input)
+            if early_reply is not None:
+                return early_reply
+
+            result = await self.athink_and_chat(user_input)
+            return await asyncio.to_thread(self._finalize_turn, user_input, result)
+
+    def chat_stream(self, user_input: str) -> Iterator[Tuple[str, str]]:
+        """流式回合：边生成边产出 ("delta", 文本片段)，最后产出 ("done", 最终回复)
+
+        最终回复可能与已产出的片段不同（例如剧情事件覆盖、LLM 失败时的备用回复），
+        调用方应以 "done" 携带的文本为准。
+        """
+        with self._traced_turn("chat_stream") as trace:
+            user_input, early_reply = self._prepare_turn(user_input)
+            if early_reply is not None:
+                yield "delta", early_reply
+                yield "done", early_reply
+                return
+
+            try:
+                filled_prompt = self._build_filled_prompt(user_input)
+            except (FileNotFoundError, PromptTemplateError) as exc:
+                result = self._prompt_error_reply(exc)
+                final = self._finalize_turn(user_input, result)
+                yield "done", final
+                return
+
+            raw_chunks: List[str] = []
+            parser = TaggedOutputParser()
+            try:
+                with self._span("llm"):
+                    llm_started = trace.now() if trace is not None else 0.0
+                    for chunk in self._stream_llm(filled_prompt):
+                        if not raw_chunks and trace is not None:
+                            trace.add_span("llm_first_byte", llm_started)
+                        raw_chunks.append(chunk)
+                        visible = parser.feed(chunk)
+                        if visible:
+                            yield "delta", visible
+                with self._span("parse"):
+                    result = self._finish_parse(parser, "".join(raw_chunks))
+            except RateLimitExceeded:
+                # 配额耗尽时交给路由层返回 429，不把备用回复写入对话历史
+                raise
+            except Exception as exc:
+                logger.error("LLM stream failed: %s", exc)
+                logger.debug(traceback.format_exc())
+                result = {"analysis": None, "response": self._fallback_reply(exc), "error": str(exc)}
+
+            yield "done", self._finalize_turn(user_input, result)
+
+    @contextmanager
+    def _traced_turn(self, kind: str) -> Iterator[Optional[TurnTrace]]:
+        """为一个回合开启耗时追踪，结束时放入 /api/debug/timings 的缓冲区；嵌套调用时沿用外层的追踪"""
+        if self._trace is not None:
+            yield self._trace
+            return
+        trace = start_trace(kind, role=self.role_key)
+        self._trace = trace
+        error: Optional[BaseException] = None
+        try:
+            yield trace
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            self._trace = None
+            finish_trace(trace, error)
+
+    def _span(self, name: str):
+        """当前回合中的一个阶段；不在回合内（或追踪已关闭）时不做任何事"""
+        return self._trace.span(name) if self._trace is not None else nullcontext()
+
+    def _publish_event(self, event: Event) -> None:
+        with self._span("event_publish"):
+            self.event_bus.publish(event)
+
+    def _prepare_turn(self, user_input: str) -> Tuple[str, Optional[str]]:
+        """回合前处理：主动问候、特殊指令与剧情前置事件
+
+        Returns:
+            (处理后的用户输入, 提前返回的回复；None 表示需要调用 LLM)
+        """
         print("\n" + "#" * 20 + f" NEW CHAT REQUEST ({self.name}) " + "#" * 20)
         print(f"User Input: {user_input}")
 
         # Phase 1: 主动问候检测
         from datetime import datetime
-        current_time = datetime.now()
-        if self.proactive_system.should_greet_proactively(current_time):
-            time_gap = (current_time - self.proactive_system.last_chat_time).total_seconds() / 3600
-            greeting = self.proactive_system.generate_greeting(
-                time_gap,
-                self.game_state.get("relationship_state", "初始阶段"),
-                self.game_state.get("closeness", 30)
-            )
-            if greeting:
-                user_input = f"[AI主动问候: {greeting}]\n{user_input}"
-                print(f"[PROACTIVE] 主动问候已添加")
-
-        special = self.handle_special_commands(user_input)
+        with self._span("proactive_check"):
+            current_time = datetime.now()
+            if self.proactive_system.should_greet_proactively(current_time):
+                time_gap = (current_time - self.proactive_system.last_chat_time).total_seconds() / 3600
+                greeting = self.proactive_system.generate_greeting(
+                    time_gap,
+                    self.game_state.get("relationship_state", "初始阶段"),
+                    self.game_state.get("closeness", 30)
+                )
+                if greeting:
+                    user_input = f"[AI主动问候: {greeting}]\n{user_input}"
+                    print(f"[PROACTIVE] 主动问候已添加")
+
+        with self._span("special_commands"):
+            special = self.handle_special_commands(user_input)
         if special is not None:
-            return special
+            return user_input, special
 
-        pre_response = self.handle_pre_chat_events(user_input)
+        with self._span("pre_chat_events"):
+            pre_response = self.handle_pre_chat_events(user_input)
         if pre_response is not None:
-            return pre_response
+            return user_input, pre_response
+
+        return user_input, None
 
-        print("\n[DEBUG] Step 1: Calling `think_and_chat`...")
-        result = self.think_and_chat(user_input)
-        print(f"[DEBUG] Step 2: `think_and_chat` returned -> {result}")
+    def _finalize_turn(self, user_input: str, result: Dict) -> str:
+        """回合后处理：应用分析结果、记录历史并触发剧情后置事件"""
         if not isinstance(result, dict):
             logger.error("think_and_chat returned non-dict result: %s", type(result))
             result = {"analysis": None, "response": self.get_backup_reply(), "error": "invalid_return"}
@@ -161,8 +327,8 @@ class BaseCharacter:
         ai_response = result.get("response", self.get_backup_reply())
         analysis = result.get("analysis")
 
-        print(f"[DEBUG] Step 3: Parsed AI Response -> '{ai_response}'")
-        print(f"[DEBUG] Step 4: Parsed Analysis -> {analysis}")
+        logger.debug("Step 3: parsed AI response -> %r", ai_response)
+        logger.debug("Step 4: parsed analysis -> %s", analysis)
 
         print("\n" + "=" * 20 + " LLM ANALYSIS RESULT " + "=" * 20)
         if isinstance(analysis, dict) and "error" not in analysis:
@@ -175,71 +341,87 @@ class BaseCharacter:
             print("Analysis failed or not available.")
         print("=" * 53 + "\n")
 
-        self.dialogue_history.append({"role": "user", "content": user_input})
-
-        print("[DEBUG] Step 5: Updating game state...")
-
-        if isinstance(analysis, dict) and "error" not in analysis:
-            affection_delta, affection_raw = self._sanitize_delta(
-                analysis.get("affection_delta", 0),
-                field_name="affection_delta",
-                min_value=-5,
-                max_value=5,
-            )
-            boredom_delta, boredom_raw = self._sanitize_delta(
-                analysis.get("boredom_delta", 0),
-                field_name="boredom_delta",
-                min_value=-3,
-                max_value=3,
-            )
-            reason = analysis.get("affection_delta_reason", "N/A")
-            print(
-                f"--- [ACTION] APPLYING NEW DELTA: "
-                f"Affection raw={affection_raw} -> applied={affection_delta}, "
-                f"Boredom raw={boredom_raw} -> applied={boredom_delta} ---"
-            )
-            print(
-                f"[NEW SYSTEM] Affection Delta (applied): {affection_delta} "
-                f"(Reason: {reason})"
-            )
-            print(f"[NEW SYSTEM] Boredom Delta (applied): {boredom_delta}")
-            self.apply_analysis_to_state(analysis, user_input, affection_delta, boredom_delta)
-        else:
-            print("[NEW SYSTEM] Analysis failed or not available.")
-            self.handle_analysis_failure(result, user_input)
+        with self._span("state_update"):
+            self.dialogue_history.append({"role": "user", "content": user_input})
+
+            logger.debug("Step 5: updating game state")
+
+            if isinstance(analysis, dict) and "error" not in analysis:
+                affection_delta, affection_raw = self._sanitize_delta(
+                    analysis.get("affection_delta", 0),
+                    field_name="affection_delta",
+                    min_value=-5,
+                    max_value=5,
+                )
+                boredom_delta, boredom_raw = self._sanitize_delta(
+                    analysis.get("boredom_delta", 0),
+                    field_name="boredom_delta",
+                    min_value=-3,
+                    max_value=3,
+                )
+                reason = analysis.get("affection_delta_reason", "N/A")
+                print(
+                    f"--- [ACTION] APPLYING NEW DELTA: "
+                    f"Affection raw={affection_raw} -> applied={affection_delta}, "
+                    f"Boredom raw={boredom_raw} -> applied={boredom_delta} ---"
+                )
+                print(
+                    f"[NEW SYSTEM] Affection Delta (applied): {affection_delta} "
+                    f"(Reason: {reason})"
+                )
+                print(f"[NEW SYSTEM] Boredom Delta (applied): {boredom_delta}")
+                self.apply_analysis_to_state(analysis, user_input, affection_delta, boredom_delta)
+            else:
+                print("[NEW SYSTEM] Analysis failed or not available.")
+                self.handle_analysis_failure(result, user_input)
 
-        self.dialogue_history.append({"role": "assistant", "content": ai_response})
-        self._trim_history()
+            self.dialogue_history.append({"role": "assistant", "content": ai_response})
+            self._trim_history()
+            self._update_dialogue_summary()
 
-        # Phase 1: 更新最后聊天时间
-        self.proactive_system.update_last_chat_time()
+            # Phase 1: 更新最后聊天时间
+            self.proactive_system.update_last_chat_time()
 
-        print("[DEBUG] Step 6: Chat method finished. Returning response.")
+        logger.debug("Step 6: chat turn finished, returning response")
 
-        post_response = self.handle_post_chat_events(user_input, analysis, ai_response)
+        with self._span("post_chat_events"):
+            post_response = self.handle_post_chat_events(user_input, analysis, ai_response)
         if post_response is not None:
             return post_response
         return ai_response
 
     def think_and_chat(self, user_input: str) -> Dict:
         try:
-            prompt_template = self._load_prompt_template()
-        except FileNotFoundError as exc:
-            logger.exception("Prompt template file missing: %s", self.prompt_template_path)
-            print(
-                "错误: Prompt模板文件 '" + str(self.prompt_template_path) + "' 未找到！"
-            )
-            return {"analysis": None, "response": self.get_backup_reply(), "error": str(exc)}
-
-        prompt_variables = self.build_prompt_variables(user_input)
-        filled_prompt = prompt_template.format(**prompt_variables)
+            filled_prompt = self._build_filled_prompt(user_input)
+        except (FileNotFoundError, PromptTemplateError) as exc:
+            return self._prompt_error_reply(exc)
 
         try:
             raw_output = self._call_llm(filled_prompt)
+        except RateLimitExceeded:
+            raise
+        except Exception as exc:
+            logger.error("LLM call failed: %s", exc)
+            logger.debug(traceback.format_exc())
+            return {"analysis": None, "response": self._fallback_reply(exc), "error": str(exc)}
+
+        return self._parse_llm_output(raw_output)
+
+    async def athink_and_chat(self, user_input: str) -> Dict:
+        """think_and_chat() 的协程版本；提示词构建（关键词提取、读模板）在工作线程执行"""
+        try:
+            filled_prompt = await asyncio.to_thread(self._build_filled_prompt, user_input)
+        except (FileNotFoundError, PromptTemplateError) as exc:
+            return self._prompt_error_reply(exc)
+
+        try:
+            raw_output = await self._acall_llm(filled_prompt)
+        except RateLimitExceeded:
+            raise
         except Exception as exc:
             logger.error("LLM call failed: %s", exc)
             logger.debug(traceback.format_exc())
-            return {"analysis": None, "response": self.get_backup_reply(), "error": str(exc)}
+            return {"analysis": None, "response": self._fallback_reply(exc), "error": str(exc)}
 
         return self._parse_llm_output(raw_output)
 
@@ -260,119 +442,220 @@ class BaseCharacter:
     def get_backup_reply(self) -> str:
         raise NotImplementedError("Subclasses must implement get_backup_reply().")
 
-    def build_prompt_variables(self, user_input: str) -> Dict[str, str]:
-        history_str = self._format_history_for_prompt()
-        topics = self.game_state.get("last_topics") or []
-        topics_str = ", ".join(topics) if topics else "无"
+    def _fallback_reply(self, exc: Exception) -> str:
+        """LLM 调用失败时的回复：熔断期间直接使用角色 YAML 的 backup_replies，其余情况交给 get_backup_reply()"""
+        if isinstance(exc, CircuitOpenError):
+            BACKUP_REPLIES.inc(character=self.role_key, reason="circuit_open")
+            replies = self._load_backup_replies()
+            if replies:
+                return random.choice(replies)
+        else:
+            BACKUP_REPLIES.inc(character=self.role_key, reason="llm_error")
+        return self.get_backup_reply()
 
-        # Phase 1: 注入记忆
-        memories = self.memory_system.get_relevant_memories(user_input, top_k=5)
-        memories_str = "\n".join(f"- {m}" for m in memories) if memories else "（暂无重要记忆）"
+    def _load_backup_replies(self) -> List[str]:
+        if self._backup_replies is None:
+            character_config = get_character_loader().load_character(self.role_key)
+            self._backup_replies = list(character_config.backup_replies) if character_config else []
+        return self._backup_replies
 
-        return {
+    def _build_filled_prompt(self, user_input: str) -> str:
+        with self._span("prompt_build"):
+            compiled = self._get_compiled_prompt()
+            return compiled.render(self.build_prompt_variables(user_input))
+
+    def build_prompt_variables(self, user_input: str) -> Dict[str, str]:
+        context = self.prompt_context
+        variables = {
             "relationship_state": self.game_state.get("relationship_state", "初始阶段"),
             "closeness": self.game_state.get("closeness", 30),
             "mood_today": self.game_state.get("mood_today", "normal"),
-            "last_topics": topics_str,
+            "last_topics": context.topics(self.game_state.get("last_topics")),
             "current_scene_description": self.scene_description,
-            "conversation_history": history_str,
             "user_input": user_input,
-            "important_memories": memories_str,
-        }
-
-    def _call_llm(self, filled_prompt: str) -> str:
-        api_key_env = self.api_settings.get("api_key_env", "DEEPSEEK_API_KEY")
-        api_key = os.environ.get(api_key_env)
-        if not api_key:
-            raise ValueError(f"API key not found in environment variable '{api_key_env}'")
-
-        # 以 system + user 的方式组织消息，确保人格与场景牢固注入
-        messages: List[Dict[str, str]] = []
-        for sys_msg in self.system_prompts:
-            if sys_msg:
-                messages.append({"role": "system", "content": sys_msg})
-        messages.append({"role": "user", "content": filled_prompt})
-
-        payload = {
-            "model": self.api_settings.get("model", self.DEFAULT_API["model"]),
-            "messages": messages,
-            "temperature": self.api_settings.get("temperature", self.DEFAULT_API["temperature"]),
-            "max_tokens": self.api_settings.get("max_tokens", self.DEFAULT_API["max_tokens"]),
         }
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
+        # Phase 1: 注入记忆；历史与记忆按 token 预算取舍
+        history_lines, history_costs = context.history(self.dialogue_history)
+        memory_lines, memory_costs = context.memories(self.memory_system, user_input, top_k=5)
+        summary = self.dialogue_summary.text
+        packed = self._pack_prompt(
+            variables, history_lines, memory_lines, history_costs, memory_costs, summary_tokens=estimate_tokens(summary)
+        )
+        variables["conversation_summary"] = summary or "（暂无更早的对话）"
+        variables["conversation_history"] = "\n".join(packed.history) if packed.history else "（你们还没有开始对话）"
+        variables["important_memories"] = "\n".join(packed.memories) if packed.memories else "（暂无重要记忆）"
+        return variables
 
-        import requests as _requests
-        response = _requests.post(
-            self.api_settings.get("endpoint", self.DEFAULT_API["endpoint"]),
-            headers=headers,
-            json=payload,
-            timeout=self.api_settings.get("timeout", self.DEFAULT_API["timeout"]),
+    def _pack_prompt(
+        self,
+        state_variables: Dict,
+        history_lines: List[str],
+        memory_lines: List[str],
+        history_costs: Optional[List[int]] = None,
+        memory_costs: Optional[List[int]] = None,
+        summary_tokens: int = 0,
+    ) -> PackedPrompt:
+        """在预算内选取历史与记忆，并记录各部分 token 数（追踪、指标与 last_prompt_report）"""
+        state_tokens = sum(estimate_tokens(str(value)) for value in state_variables.values())
+        packed = self.prompt_packer.pack(
+            self._get_compiled_prompt().persona_tokens,
+            state_tokens,
+            history_lines,
+            memory_lines,
+            history_costs=history_costs,
+            memory_costs=memory_costs,
+            summary_tokens=summary_tokens,
         )
-        if response.status_code != 200:
-            print(f"API返回错误: {response.status_code} - {response.text}")
-            raise RuntimeError(f"API Error {response.status_code}: {response.text}")
+        report = packed.report()
+        self.last_prompt_report = report
+        if self._trace is not None:
+            self._trace.attrs["prompt_tokens"] = report
+        for section, tokens in packed.sections.items():
+            if tokens:
+                PROMPT_TOKENS.inc(tokens, character=self.role_key, section=section)
+        if packed.dropped or packed.truncated:
+            print(f"[PROMPT] token budget {packed.budget}: dropped={packed.dropped}, truncated={packed.truncated}")
+        return packed
 
-        data = response.json()
-        print("----- RAW API RESPONSE JSON -----")
-        print(data)
-        print("-------------------------------")
-        return data["choices"][0]["message"]["content"]
+    def _call_llm(self, filled_prompt: str) -> str:
+        # 非流式调用一次拿到完整响应，没有首字节时刻，因此只记录 llm，不记录 llm_first_byte（仅流式回合有）
+        with self._span("llm"):
+            response = self._get_llm_adapter().complete(self._build_messages(filled_prompt))
+        self._record_usage(response.usage)
+        print(f"----- LLM RESPONSE: model={response.model}, finish_reason={response.finish_reason}, usage={response.usage} -----")
+        return response.content
+
+    async def _acall_llm(self, filled_prompt: str) -> str:
+        with self._span("llm"):
+            response = await self._get_llm_adapter().acomplete(self._build_messages(filled_prompt))
+        self._record_usage(response.usage)
+        print(f"----- LLM RESPONSE: model={response.model}, finish_reason={response.finish_reason}, usage={response.usage} -----")
+        return response.content
+
+    def _build_messages(self, filled_prompt: str) -> List[Dict[str, str]]:
+        # 固定内容在前：人设 system 消息与模板的固定指令每轮字节完全相同，可命中提供商的前缀缓存；
+        # 随回合变化的状态、记忆、历史与输入（filled_prompt）放在最后一条 user 消息
+        return self._get_compiled_prompt().build_messages(filled_prompt)
+
+    @property
+    def llm_provider_name(self) -> str:
+        """本角色使用的 LLM 提供商名称（用于按提供商做准入控制）"""
+        return (self.api_settings.get("provider") or settings.LLM_PROVIDER).lower()
+
+    def _get_llm_adapter(self) -> LLMAdapter:
+        """通过提供商层调用 LLM：默认按 settings 选择提供商，角色配置的 api 项可覆盖
+
+        相同配置的角色共享同一个提供商实例，从而共享其长连接池。
+        """
+        if self._llm_adapter is None:
+            api = self.api_settings
+            provider = LLMFactory.get_shared(
+                self.llm_provider_name,
+                model=api.get("model") or settings.LLM_MODEL,
+                api_key_env=api.get("api_key_env"),
+                endpoint=api.get("endpoint") or settings.LLM_ENDPOINT,
+                temperature=self._api_value("temperature", settings.LLM_TEMPERATURE),
+                max_tokens=self._api_value("max_tokens", settings.LLM_MAX_TOKENS),
+                timeout=self._api_value("timeout", settings.LLM_TIMEOUT),
+                hedge=api.get("hedge") or settings.LLM_HEDGE_PROVIDER,
+                route=api.get("route") or settings.LLM_ROUTER_CANDIDATES,
+                cache=self._api_value("cache", settings.LLM_CACHE),
+            )
+            self._llm_adapter = LLMAdapter(provider=provider)
+        return self._llm_adapter
+
+    def _api_value(self, key: str, default):
+        value = self.api_settings.get(key)
+        return default if value is None else value
+
+    def _record_usage(self, usage: Optional[Dict]) -> None:
+        """累计本角色实例的 token 用量（含命中提供商前缀缓存的输入 token 数）"""
+        self.llm_usage["calls"] += 1
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            value = (usage or {}).get(key)
+            if isinstance(value, int):
+                self.llm_usage[key] += value
+        cached = prompt_cache_hit_tokens(usage)
+        if cached is not None:
+            self.llm_usage["cache_hit_tokens"] += cached
+            if self._trace is not None:
+                self._trace.attrs["prompt_cache_hit_tokens"] = cached
+
+    def _stream_llm(self, filled_prompt: str) -> Iterator[str]:
+        """以流式方式调用 LLM，逐段产出原始输出"""
+        usage: Dict = {}
+        yield from self._get_llm_adapter().chat_stream(self._build_messages(filled_prompt), on_usage=usage.update)
+        self._record_usage(usage)
+
+    def _prompt_error_reply(self, exc: Exception) -> Dict:
+        """分析模板缺失或无法编译时，本轮降级为备用回复"""
+        if isinstance(exc, FileNotFoundError):
+            logger.exception("Prompt template file missing: %s", self.prompt_template_path)
+            reason = "prompt_missing"
+        else:
+            logger.exception("Prompt template invalid: %s", self.prompt_template_path)
+            reason = "prompt_invalid"
+        BACKUP_REPLIES.inc(character=self.role_key, reason=reason)
+        return {"analysis": None, "response": self.get_backup_reply(), "error": str(exc)}
 
     def _load_prompt_template(self) -> str:
-        if self._prompt_template_cache is None:
-            with open(self.prompt_template_path, "r", encoding="utf-8") as fh:
-                self._prompt_template_cache = fh.read()
-        return self._prompt_template_cache
+        return self._get_compiled_prompt().source
+
+    def _get_compiled_prompt(self) -> CompiledPrompt:
+        """加载并编译分析模板；模板含有 PROMPT_VARIABLES 之外的占位符时抛出 PromptTemplateError"""
+        if self._compiled_prompt is None:
+            self._compiled_prompt = get_compiled_prompt(self.prompt_template_path, self.system_prompts, self.PROMPT_VARIABLES)
+        return self._compiled_prompt
 
     def _parse_llm_output(self, llm_output: str) -> Dict:
-        analysis_json, response_text = None, self.get_backup_reply()
-        print("\n--- LLM Raw Output ---\n", llm_output, "\n----------------------\n")
+        with self._span("parse"):
+            parser = TaggedOutputParser()
+            parser.feed(llm_output)
+            return self._finish_parse(parser, llm_output)
 
-        analysis_match = re.search(r"<analysis>(.*?)</analysis>", llm_output, re.DOTALL)
-        if analysis_match:
-            json_str = analysis_match.group(1).strip()
-            json_match = re.search(r"\{.*\}", json_str, re.DOTALL)
-            if json_match:
-                cleaned_json_str = json_match.group(0)
-                try:
-                    analysis_json = json.loads(cleaned_json_str)
-                except json.JSONDecodeError as exc:
-                    logger.error("Failed to decode analysis JSON: %s", exc)
-                    analysis_json = {"error": f"JSON解析失败: {exc}", "raw_json": cleaned_json_str}
-            else:
-                analysis_json = {"error": "在<analysis>标签内未找到有效的JSON结构。"}
-        else:
+    def _finish_parse(self, parser: TaggedOutputParser, llm_output: str) -> Dict:
+        """结束解析并补齐缺失部分：无 <response> 时使用备用回复"""
+        print("\n--- LLM Raw Output ---\n", llm_output, "\n----------------------\n")
+        parsed = parser.close()
+        if parsed["analysis"] is None:
             print("警告: 在LLM输出中未找到 <analysis> 标签。")
-
-        response_match = re.search(r"<response>(.*?)</response>", llm_output, re.DOTALL)
-        if response_match:
-            response_text = re.sub(r"</?response>", "", response_match.group(1)).strip()
-        elif analysis_match:
-            response_text = llm_output.split("</analysis>")[-1].strip()
-        else:
+        response_text = parsed["response"]
+        if response_text is None:
             print("警告: 在LLM输出中未找到 <response> 标签。")
-
-        print(f"--- PRE-CLEAN RESPONSE_TEXT --- \nrepr(): {repr(response_text)}\n------------------------------")
-        response_text = re.sub(r"</?response>", "", response_text).strip()
-        print(f"--- POST-CLEAN RESPONSE_TEXT --- \nrepr(): {repr(response_text)}\n-----------------------------")
-
-        return {"analysis": analysis_json, "response": response_text}
+            BACKUP_REPLIES.inc(character=self.role_key, reason="no_response_tag")
+            response_text = self.get_backup_reply()
+        print(f"--- PARSED RESPONSE_TEXT --- \nrepr(): {repr(response_text)}\n-----------------------------")
+        return {"analysis": parsed["analysis"], "response": response_text}
 
     def _format_history_for_prompt(self) -> str:
-        dialogue_only = [msg for msg in self.dialogue_history if msg["role"] in {"user", "assistant"}]
-        recent_dialogue = dialogue_only[-10:]
-        if not recent_dialogue:
+        lines = self._history_lines_for_prompt()
+        if not lines:
             return "（你们还没有开始对话）"
-        lines = [
-            f"{self.player_name}: {entry['content']}" if entry["role"] == "user" else f"{self.name}: {entry['content']}"
-            for entry in recent_dialogue
-        ]
         return "\n".join(lines)
 
+    def _update_dialogue_summary(self) -> None:
+        """把移出提示词窗口的对话交给滚动摘要；攒够一批时在后台合并，不阻塞本回合"""
+        if not settings.DIALOGUE_SUMMARY_ENABLED:
+            return
+        self.prompt_context.history(self.dialogue_history)
+        evicted = self.prompt_context.drain_evicted()
+        if evicted:
+            self.dialogue_summary.add(evicted)
+
+    async def _summarize_with_llm(self, previous: str, lines: List[str]) -> str:
+        """用本角色的提供商合并摘要（输入只有旧摘要与新的一批对话，输出很短）"""
+        messages = build_summary_messages(self.name, self.player_name, previous, lines, self.dialogue_summary.max_chars)
+        response = await self._get_llm_adapter().acomplete(
+            messages, temperature=0.3, max_tokens=settings.DIALOGUE_SUMMARY_MAX_TOKENS
+        )
+        return response.content
+
+    def _history_lines_for_prompt(self) -> List[str]:
+        """最近 10 条对话（不含 system 消息）渲染成的文本行，按时间顺序"""
+        lines, _ = self.prompt_context.history(self.dialogue_history)
+        return lines
+
     def _coerce_int(self, value, *, default: int = 0, field_name: str = "value") -> int:
         if isinstance(value, bool):
             logger.warning("%s expected int but received bool; using default %s", field_name, default)
@@ -442,7 +725,7 @@ class BaseCharacter:
             self.game_state["closeness"] = new_value
 
             # 发布好感度变化事件
-            self.event_bus.publish(Event(
+            self._publish_event(Event(
                 event_type=EventType.CLOSENESS_CHANGED,
                 data={
                     "character": self.role_key,
@@ -476,7 +759,7 @@ class BaseCharacter:
             print(f"关系状态更新为: {self.game_state['relationship_state']}")
 
             # 发布关系状态变化事件
-            self.event_bus.publish(Event(
+            self._publish_event(Event(
                 event_type=EventType.RELATIONSHIP_CHANGED,
                 data={
                     "character": self.role_key,
@@ -494,6 +777,7 @@ class BaseCharacter:
         recent_size = self.history_size - len(systems)
         recent_dialogue = [msg for msg in self.dialogue_history if msg["role"] != "system"][-recent_size:]
         self.dialogue_history = systems + recent_dialogue
+        self.prompt_context.history_trimmed(self.dialogue_history, len(recent_dialogue))
 
     def _extract_topics(self, text: str, top_k: int = 3) -> List[str]:
         if not text:
@@ -539,17 +823,19 @@ class BaseCharacter:
             # Phase 1: 持久化记忆和主动系统
             "memory": self.memory_system.to_dict(),
             "proactive": self.proactive_system.to_dict(),
+            "summary": self.dialogue_summary.to_dict(),
         }
         for key in ("label", "name"):
             if key in self.game_state and isinstance(self.game_state[key], str):
                 data["meta"]["label"] = self.game_state[key]
                 break
 
-        result = self.storage.save_game(data, slot)
+        with self._span("save"):
+            result = self.storage.save_game(data, slot)
 
         # 发布游戏保存事件
         if result:
-            self.event_bus.publish(Event(
+            self._publish_event(Event(
                 event_type=EventType.GAME_SAVED,
                 data={
                     "character": self.role_key,
@@ -578,9 +864,10 @@ class BaseCharacter:
             self.memory_system.from_dict(data["memory"])
         if "proactive" in data:
             self.proactive_system.from_dict(data["proactive"])
+        self.dialogue_summary.from_dict(data.get("summary"))
 
         # 发布游戏加载事件
-        self.event_bus.publish(Event(
+        self._publish_event(Event(
             event_type=EventType.GAME_LOADED,
             data={
                 "character": self.role_key,
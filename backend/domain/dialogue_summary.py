@@ -0,0 +1,208 @@
+"""滚动对话摘要 - 把移出提示词窗口的对话合并进一段简短的前情摘要
+
+提示词只包含最近 10 条对话，更早的内容原本会被直接遗忘。这里把移出窗口的行攒成一批，
+在后台事件循环上并入已有摘要（不占用回合的请求路径）。默认使用本地抽取（每行取第一句）；
+开启 DIALOGUE_SUMMARY_LLM 时改用一次简短的 LLM 请求，LLM 不可用、超时或返回空内容时回退到本地抽取。
+摘要长度有上限，作为单独的一节注入提示词，因此会话越长，上下文越完整，而输入 token 数保持不变。
+
+摘要与尚未合并的行随存档保存（见 to_dict / from_dict）。
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import logging
+import re
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from backend.infrastructure.llm.loop_runner import BackgroundLoop, get_background_loop
+from backend.infrastructure.metrics import DIALOGUE_SUMMARIES
+
+logger = logging.getLogger(__name__)
+
+# (已有摘要, 新移出窗口的行) -> 合并后的摘要
+SummarizeFn = Callable[[str, List[str]], Awaitable[str]]
+
+_SENTENCE_RE = re.compile(r"[^。！？!?…\n]+[。！？!?…]*")
+_CLAUSE_SEPARATOR = "；"
+_CLAUSE_CHARS = 40
+
+
+def extractive_summary(previous: str, lines: Sequence[str], max_chars: int) -> str:
+    """本地抽取式摘要：每行保留说话人与第一句话，超出长度时丢弃最早的部分"""
+    clauses = [previous] if previous else []
+    for line in lines:
+        speaker, sep, content = line.partition(": ")
+        if not sep:
+            speaker, content = "", line
+        match = _SENTENCE_RE.search(content.strip())
+        sentence = match.group(0).strip() if match else ""
+        if not sentence:
+            continue
+        if len(sentence) > _CLAUSE_CHARS:
+            sentence = sentence[:_CLAUSE_CHARS] + "…"
+        clauses.append(f"{speaker}：{sentence}" if speaker else sentence)
+    while len(clauses) > 1 and len(_CLAUSE_SEPARATOR.join(clauses)) > max_chars:
+        clauses.pop(0)
+    text = _CLAUSE_SEPARATOR.join(clauses)
+    return text if len(text) <= max_chars else "…" + text[-(max_chars - 1):]
+
+
+def build_summary_messages(
+    character_name: str, player_name: str, previous: str, lines: Sequence[str], max_chars: int
+) -> List[Dict[str, str]]:
+    """摘要请求的消息：只包含已有摘要与新移出窗口的对话，输入很短"""
+    system = (
+        f"你负责为{character_name}和{player_name}之间的对话维护一份前情摘要，供之后的对话回忆使用。"
+        f"只保留事实、{player_name}透露的个人信息、双方的约定、关系与情绪的变化以及未结束的话题；"
+        f"使用第三人称，不超过{max_chars}字，直接输出摘要正文，不要任何标题或解释。"
+    )
+    user = (
+        f"已有摘要：\n{previous or '（无）'}\n\n"
+        "新的对话：\n" + "\n".join(lines) + "\n\n"
+        "请把新的对话并入已有摘要，输出更新后的完整摘要。"
+    )
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+class DialogueSummarizer:
+    """一个会话的滚动摘要
+
+    Args:
+        max_chars: 摘要的最大字数
+        batch: 移出窗口的行攒够多少条后合并一次
+        summarize: 调用 LLM 合并摘要的协程函数；None 时只用本地抽取
+        timeout: LLM 请求的超时秒数
+        loop: 运行合并任务的后台事件循环（默认使用进程共享的循环）
+    """
+
+    def __init__(
+        self,
+        max_chars: int = 300,
+        batch: int = 6,
+        summarize: Optional[SummarizeFn] = None,
+        timeout: float = 20.0,
+        loop: Optional[BackgroundLoop] = None,
+    ):
+        self.max_chars = max(20, int(max_chars))
+        self.batch = max(1, int(batch))
+        self.summarize = summarize
+        self.timeout = timeout
+        self._loop = loop or get_background_loop()
+        self._lock = threading.Lock()
+        self._text = ""
+        self._pending: List[str] = []
+        # 已提交、尚未合并进摘要的一批行（非空表示有合并在进行）
+        self._in_flight: List[str] = []
+        self._folded = 0
+        # 读档或清空时递增；之前提交的合并任务结果作废
+        self._generation = 0
+        self._future: Optional[concurrent.futures.Future] = None
+        self.stats = {"llm": 0, "extractive": 0}
+
+    @property
+    def text(self) -> str:
+        with self._lock:
+            return self._text
+
+    @property
+    def pending(self) -> List[str]:
+        """移出窗口但尚未并入摘要的行（含正在合并的一批）"""
+        with self._lock:
+            return self._in_flight + self._pending
+
+    def add(self, lines: Sequence[str]) -> Optional[concurrent.futures.Future]:
+        """记录移出窗口的行；攒够一批且没有进行中的合并时提交后台合并，返回其 Future"""
+        with self._lock:
+            self._pending.extend(lines)
+            if len(self._pending) < self.batch or self._in_flight:
+                return None
+            previous, batch, generation = self._text, self._pending, self._generation
+            self._pending, self._in_flight = [], batch
+            try:
+                future = self._loop.submit(self._run(previous, batch, generation))
+            except RuntimeError:
+                # 在后台循环线程上被调用（无法提交给自己）：直接用本地抽取
+                self._text = extractive_summary(previous, batch, self.max_chars)
+                self._folded += len(batch)
+                self._in_flight = []
+                self.stats["extractive"] += 1
+                DIALOGUE_SUMMARIES.inc(method="extractive")
+                return None
+            self._future = future
+        return future
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待进行中的合并完成（测试与关闭时使用）；超时返回 False"""
+        future = self._future
+        if future is None:
+            return True
+        try:
+            future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+        except Exception:
+            pass
+        return True
+
+    async def _fold(self, previous: str, lines: List[str]) -> str:
+        if self.summarize is not None:
+            try:
+                text = await asyncio.wait_for(self.summarize(previous, lines), self.timeout)
+                text = (text or "").strip()
+                if text:
+                    with self._lock:
+                        self.stats["llm"] += 1
+                    DIALOGUE_SUMMARIES.inc(method="llm")
+                    return text[: self.max_chars]
+                logger.warning("Dialogue summary LLM returned empty text; using extractive summary")
+            except Exception as exc:
+                logger.warning("Dialogue summary LLM call failed (%r); using extractive summary", exc)
+        with self._lock:
+            self.stats["extractive"] += 1
+        DIALOGUE_SUMMARIES.inc(method="extractive")
+        return extractive_summary(previous, lines, self.max_chars)
+
+    async def _run(self, previous: str, lines: List[str], generation: int) -> str:
+        """合并一批并写回摘要（在后台循环上运行，写回完成后 Future 才结束）"""
+        try:
+            text = await self._fold(previous, lines)
+        except BaseException:
+            # 被取消（如进程退出）：把这一批放回，下次再合并
+            with self._lock:
+                if generation == self._generation:
+                    self._pending[:0] = lines
+                    self._in_flight = []
+            raise
+        with self._lock:
+            if generation == self._generation:
+                self._text = text
+                self._folded += len(lines)
+                self._in_flight = []
+        return text
+
+    def clear(self) -> None:
+        with self._lock:
+            self._text = ""
+            self._pending = []
+            self._in_flight = []
+            self._folded = 0
+            self._generation += 1
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            # 进行中的一批还没并入摘要，按未合并保存
+            return {"text": self._text, "pending": self._in_flight + self._pending, "folded": self._folded}
+
+    def from_dict(self, data: Optional[Dict]) -> None:
+        data = data or {}
+        with self._lock:
+            self._text = str(data.get("text") or "")
+            self._pending = [str(line) for line in data.get("pending") or []]
+            self._in_flight = []
+            self._folded = int(data.get("folded") or 0)
+            self._generation += 1
+
+
+__all__ = ["DialogueSummarizer", "SummarizeFn", "build_summary_messages", "extractive_summary"]
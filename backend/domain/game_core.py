@@ -5,26 +5,47 @@ from backend.domain.characters.gu_pan_character import GuPanCharacter
 from backend.domain.characters.xia_xingwan_character import XiaXingwanCharacter
 
 
+_ROLE_ALIASES = {
+    "su_tang": ("su_tang", "sutang", "苏糖"),
+    "lin_yuhan": ("lin_yuhan", "lin", "yuhan", "林雨含", "linyuhan"),
+    "luo_yimo": ("luo_yimo", "罗一莫", "luoyimo", "luo_yi_mo"),
+    "gu_pan": ("gu_pan", "顾盼", "gupan", "gu-pan"),
+    "xia_xingwan": ("xia_xingwan", "夏星晚", "xiaxingwan", "xia-xingwan"),
+}
+
+_CHARACTER_CLASSES = {
+    "su_tang": SuTangCharacter,
+    "lin_yuhan": LinYuhanCharacter,
+    "luo_yimo": LuoYimoCharacter,
+    "gu_pan": GuPanCharacter,
+    "xia_xingwan": XiaXingwanCharacter,
+}
+
+
+def normalize_role(role: str | None) -> str:
+    """将角色别名归一化为角色键，未知角色回退到苏糖"""
+    key = (role or "su_tang").strip().lower()
+    for role_key, aliases in _ROLE_ALIASES.items():
+        if key in aliases:
+            return role_key
+    return "su_tang"
+
+
+def build_agent(role: str | None = None):
+    """根据角色键创建一个全新的角色实例"""
+    return _CHARACTER_CLASSES[normalize_role(role)](is_new_game=True)
+
+
 class SimpleGameCore:
+    """单玩家游戏核心（命令行/脚本使用；Web 端通过会话注册表为每个玩家分配独立实例）"""
+
     def __init__(self):
         print("[BACKEND] Initializing SimpleGameCore (backend.domain)")
         # 默认角色：苏糖
         self.agent = SuTangCharacter(is_new_game=True)
 
     def _build_agent(self, role: str):
-        key = (role or "su_tang").strip().lower()
-        if key in ("su_tang", "sutang", "苏糖"):
-            return SuTangCharacter(is_new_game=True)
-        if key in ("lin_yuhan", "lin", "yuhan", "林雨含", "linyuhan"):
-            return LinYuhanCharacter(is_new_game=True)
-        if key in ("luo_yimo", "罗一莫", "luoyimo", "luo_yi_mo"):
-            return LuoYimoCharacter(is_new_game=True)
-        if key in ("gu_pan", "顾盼", "gupan", "gu-pan"):
-            return GuPanCharacter(is_new_game=True)
-        if key in ("xia_xingwan", "夏星晚", "xiaxingwan", "xia-xingwan"):
-            return XiaXingwanCharacter(is_new_game=True)
-        # 默认回退到苏糖
-        return SuTangCharacter(is_new_game=True)
+        return build_agent(role)
 
     def start_new_game(self, role: str | None = None):
         # 根据角色键重建 agent
@@ -43,6 +64,3 @@ class SimpleGameCore:
 
     def load_game(self, slot):
         return self.agent.load(slot)
-
-
-game_core = SimpleGameCore()
@@ -37,6 +37,8 @@ class MemorySystem:
     """记忆管理系统"""
     def __init__(self):
         self.memories: List[MemoryCard] = []
+        # 每次增删或修改记忆时递增，供提示词缓存判断是否需要重建
+        self.version = 0
 
     def add_memory(self, content: str, category: str, importance: int = 1):
         """添加新记忆"""
@@ -44,6 +46,7 @@ class MemorySystem:
         if any(m.content == content for m in self.memories):
             return
         self.memories.append(MemoryCard(content, category, importance))
+        self.version += 1
         # 保持最多 50 条记忆
         if len(self.memories) > 50:
             self.memories.sort(key=lambda m: m.importance * m.mention_count, reverse=True)
@@ -64,9 +67,11 @@ class MemorySystem:
             if content in m.content or m.content in content:
                 m.last_mentioned = datetime.now().isoformat()
                 m.mention_count += 1
+                self.version += 1
 
     def to_dict(self):
         return {"memories": [m.to_dict() for m in self.memories]}
 
     def from_dict(self, data: Dict):
         self.memories = [MemoryCard.from_dict(m) for m in data.get("memories", [])]
+        self.version += 1
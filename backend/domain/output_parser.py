@@ -0,0 +1,231 @@
+"""LLM 输出解析器 - 增量识别 <analysis>/<response> 标签
+
+角色模板要求 LLM 先输出 `<analysis>{...}</analysis>`，再输出 `<response>...</response>`。
+`TaggedOutputParser` 是一个状态机：可以逐段喂入流式输出，`<response>` 一旦打开就
+产出可展示的回复文本，`</analysis>` 一旦闭合就解析出分析 JSON。
+每个字符只扫描一次（跨片段时最多保留一个标签长度的尾巴），整体为线性时间。
+"""
+from __future__ import annotations
+
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_OPEN = "<analysis>"
+ANALYSIS_CLOSE = "</analysis>"
+RESPONSE_OPEN = "<response>"
+RESPONSE_CLOSE = "</response>"
+
+_OUTSIDE = "outside"
+_IN_ANALYSIS = "analysis"
+_IN_RESPONSE = "response"
+
+
+def _partial_tag_suffix(text: str, tag: str, start: int = 0) -> int:
+    """返回 text[start:] 末尾可能是 tag 前缀的长度（用于跨片段识别标签）
+
+    标签只在开头含有 '<'，因此候选后缀只能从末尾窗口内最后一个 '<' 开始。
+    """
+    idx = text.rfind("<", max(start, len(text) - len(tag) + 1))
+    if idx >= 0 and tag.startswith(text[idx:]):
+        return len(text) - idx
+    return 0
+
+
+def parse_analysis_json(analysis_text: str) -> Dict:
+    """从 <analysis> 内容中取出第一个 '{' 到最后一个 '}' 之间的 JSON 并解析"""
+    start = analysis_text.find("{")
+    end = analysis_text.rfind("}")
+    if start < 0 or end < start:
+        return {"error": "在<analysis>标签内未找到有效的JSON结构。"}
+    json_str = analysis_text[start:end + 1]
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError as exc:
+        logger.error("Failed to decode analysis JSON: %s", exc)
+        return {"error": f"JSON解析失败: {exc}", "raw_json": json_str}
+
+
+class TaggedOutputParser:
+    """<analysis>/<response> 增量解析器
+
+    用法：
+        parser = TaggedOutputParser()
+        for chunk in stream:
+            visible = parser.feed(chunk)   # 新增的可展示回复文本
+        result = parser.close()            # {"analysis": ..., "response": ...}
+    """
+
+    def __init__(self, on_analysis: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            on_analysis: `</analysis>` 闭合时立即回调解析结果（可选）
+        """
+        self.on_analysis = on_analysis
+        self.analysis: Optional[Dict] = None
+        self.analysis_seen = False
+        self.response_seen = False
+        self.response_closed = False
+
+        self._state = _OUTSIDE
+        self._carry = ""
+        self._analysis_parts: List[str] = []
+        self._response_parts: List[str] = []
+        self._after_analysis_parts: List[str] = []
+        self._response_started = False
+        self._pending_ws = ""
+        self._closed = False
+
+    @property
+    def analysis_ready(self) -> bool:
+        return self.analysis is not None
+
+    def feed(self, chunk: str) -> str:
+        """喂入一段输出，返回本次新增的可展示回复文本（可能为空字符串）"""
+        if self._closed:
+            raise RuntimeError("parser is closed")
+        if not chunk:
+            return ""
+        if not self._carry and "<" not in chunk:
+            # 快速路径：片段内不可能出现标签
+            if self._state == _IN_RESPONSE:
+                return self._emit(chunk)
+            if self._state == _IN_ANALYSIS:
+                self._analysis_parts.append(chunk)
+                return ""
+        data = self._carry + chunk
+        self._carry = ""
+        emitted: List[str] = []
+        pos = 0
+        length = len(data)
+
+        while pos < length:
+            if self._state == _IN_ANALYSIS:
+                end = data.find(ANALYSIS_CLOSE, pos)
+                if end < 0:
+                    pos = self._hold_partial(data, pos, ANALYSIS_CLOSE, self._analysis_parts.append)
+                    break
+                self._analysis_parts.append(data[pos:end])
+                pos = end + len(ANALYSIS_CLOSE)
+                self._finish_analysis()
+                self._state = _OUTSIDE
+
+            elif self._state == _IN_RESPONSE:
+                end = data.find(RESPONSE_CLOSE, pos)
+                if end < 0:
+                    pos = self._hold_partial(data, pos, RESPONSE_CLOSE, lambda text: emitted.append(self._emit(text)))
+                    break
+                emitted.append(self._emit(data[pos:end]))
+                pos = end + len(RESPONSE_CLOSE)
+                self.response_closed = True
+                self._state = _OUTSIDE
+
+            else:
+                targets = []
+                if not self.analysis_seen:
+                    targets.append(ANALYSIS_OPEN)
+                if not self.response_seen:
+                    targets.append(RESPONSE_OPEN)
+                if not targets:
+                    # 两个标签都已处理完，剩余内容无需再扫描
+                    break
+                found, tag = -1, ""
+                for candidate in targets:
+                    idx = data.find(candidate, pos)
+                    if idx >= 0 and (found < 0 or idx < found):
+                        found, tag = idx, candidate
+                if found < 0:
+                    keep = max(_partial_tag_suffix(data, t, pos) for t in targets)
+                    self._record_outside(data[pos:length - keep])
+                    self._carry = data[length - keep:]
+                    break
+                self._record_outside(data[pos:found])
+                pos = found + len(tag)
+                if tag == ANALYSIS_OPEN:
+                    self.analysis_seen = True
+                    self._state = _IN_ANALYSIS
+                else:
+                    self.response_seen = True
+                    self._state = _IN_RESPONSE
+
+        return "".join(emitted)
+
+    def close(self) -> Dict:
+        """结束输入，返回 {"analysis": dict|None, "response": str|None}
+
+        - 未找到 <analysis> 或其未闭合时 analysis 为 None
+        - 未找到 <response> 时，回退为 </analysis> 之后的文本；两者都没有时 response 为 None
+        """
+        if not self._closed:
+            self._closed = True
+            if self._carry:
+                if self._state == _IN_ANALYSIS:
+                    self._analysis_parts.append(self._carry)
+                elif self._state == _IN_RESPONSE:
+                    self._emit(self._carry)
+                else:
+                    self._record_outside(self._carry)
+                self._carry = ""
+
+        if self.response_seen:
+            response: Optional[str] = "".join(self._response_parts)
+        elif self.analysis is not None:
+            response = "".join(self._after_analysis_parts)
+        else:
+            response = None
+        if response is not None:
+            response = response.replace(RESPONSE_OPEN, "").replace(RESPONSE_CLOSE, "").strip()
+        return {"analysis": self.analysis, "response": response}
+
+    def _hold_partial(self, data: str, pos: int, tag: str, sink: Callable[[str], object]) -> int:
+        """消费 data[pos:]，但保留末尾可能是 tag 前缀的部分到下一次 feed"""
+        keep = _partial_tag_suffix(data, tag, pos)
+        sink(data[pos:len(data) - keep])
+        self._carry = data[len(data) - keep:]
+        return len(data)
+
+    def _finish_analysis(self) -> None:
+        self.analysis = parse_analysis_json("".join(self._analysis_parts).strip())
+        self._analysis_parts = []
+        if self.on_analysis is not None:
+            try:
+                self.on_analysis(self.analysis)
+            except Exception as exc:
+                logger.error("on_analysis callback failed: %s", exc)
+
+    def _record_outside(self, text: str) -> None:
+        # 只有在 </analysis> 之后、尚未出现 <response> 时才需要保留（用于回退）
+        if text and self.analysis is not None and not self.response_seen:
+            self._after_analysis_parts.append(text)
+
+    def _emit(self, text: str) -> str:
+        """输出回复文本：去掉开头空白，结尾空白暂存直到后面还有内容"""
+        if not text:
+            return ""
+        if not self._response_started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._response_started = True
+        combined = self._pending_ws + text
+        visible = combined.rstrip()
+        self._pending_ws = combined[len(visible):]
+        if visible:
+            self._response_parts.append(visible)
+        return visible
+
+
+def parse_tagged_output(llm_output: str) -> Dict:
+    """一次性解析完整输出"""
+    parser = TaggedOutputParser()
+    parser.feed(llm_output)
+    return parser.close()
+
+
+__all__ = [
+    "TaggedOutputParser",
+    "parse_analysis_json",
+    "parse_tagged_output",
+]
@@ -0,0 +1,127 @@
+"""会话级提示词上下文 - 缓存每轮提示词中随会话缓慢变化的部分
+
+每轮构建提示词都需要：最近若干条对话渲染成的文本行、最重要的几条记忆、最近话题。
+它们的来源（对话历史、记忆系统、game_state["last_topics"]）大多数回合只变化一点，
+这里按来源分别缓存渲染结果及其估算 token 数，只在来源变化时重建：
+- 历史：固定长度的环形缓冲，只渲染上次之后新增的消息；从末尾向前找上次最新的那条消息，
+  找不到（读档、整体替换）时重建，最多扫描 window 条对话，与历史总长度无关；
+  随对话推进被挤出窗口的行暂存起来，由 drain_evicted() 取走（用于滚动摘要）；
+- 记忆：按 MemorySystem.version 判断是否变化；
+- 话题：按话题列表的内容判断是否变化。
+"""
+from __future__ import annotations
+
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from backend.domain.memory_system import MemorySystem
+from backend.infrastructure.llm.tokens import estimate_tokens
+
+DIALOGUE_ROLES = ("user", "assistant")
+
+
+class PromptContext:
+    """一个会话的提示词缓存（与角色实例一一对应，不跨线程共享）
+
+    Args:
+        player_name: 历史行中玩家的称呼
+        character_name: 历史行中角色的称呼
+        window: 提示词中最多出现的最近对话条数
+        estimator: token 估算函数
+    """
+
+    def __init__(
+        self,
+        player_name: str,
+        character_name: str,
+        window: int = 10,
+        estimator: Callable[[str], int] = estimate_tokens,
+    ):
+        self.player_name = player_name
+        self.character_name = character_name
+        self.window = max(1, int(window))
+        self.estimate = estimator
+        # (消息对象, 渲染后的行, 估算 token 数)，按时间顺序
+        self._ring: Deque[Tuple[Dict[str, str], str, int]] = deque(maxlen=self.window)
+        # 被新消息挤出窗口、尚未取走的行（按时间顺序）
+        self._evicted: List[str] = []
+        self._memory_key: Optional[Tuple] = None
+        self._memories: Tuple[List[str], List[int]] = ([], [])
+        self._topics_key: Optional[Tuple[str, ...]] = None
+        self._topics = "无"
+        # 各部分的重建次数（调试与测试用）
+        self.rebuilds = {"history": 0, "history_lines": 0, "memories": 0, "topics": 0}
+
+    def history(self, dialogue_history: Sequence[Dict[str, str]]) -> Tuple[List[str], List[int]]:
+        """最近 window 条对话（不含 system 消息）的文本行及其 token 数，按时间顺序"""
+        newest = self._ring[-1][0] if self._ring else None
+        fresh: List[Dict[str, str]] = []
+        continued = False
+        for message in reversed(dialogue_history):
+            if message is newest:
+                continued = True
+                break
+            if message.get("role") in DIALOGUE_ROLES:
+                fresh.append(message)
+                if len(fresh) >= self.window:
+                    break
+        if self._ring and not continued:
+            # 接不上上次的历史（读档、整体替换、回退，或一次新增超过窗口）：从头重建，
+            # 旧的行不算作移出窗口
+            self._ring.clear()
+            self.rebuilds["history"] += 1
+        for message in reversed(fresh):
+            if len(self._ring) == self.window:
+                self._evicted.append(self._ring[0][1])
+            line = self._render(message)
+            self._ring.append((message, line, self.estimate(line)))
+        self.rebuilds["history_lines"] += len(fresh)
+        return [line for _, line, _ in self._ring], [tokens for _, _, tokens in self._ring]
+
+    def history_trimmed(self, dialogue_history: Sequence[Dict[str, str]], retained: int) -> None:
+        """对话历史从头部裁剪后只剩 retained 条对话时调用，丢弃已不在历史中的缓存行"""
+        self.history(dialogue_history)
+        while len(self._ring) > max(0, retained):
+            self._evicted.append(self._ring.popleft()[1])
+
+    def drain_evicted(self) -> List[str]:
+        """取走自上次调用以来移出窗口的历史行（按时间顺序）"""
+        evicted, self._evicted = self._evicted, []
+        return evicted
+
+    def memories(self, memory_system: MemorySystem, user_input: str = "", top_k: int = 5) -> Tuple[List[str], List[int]]:
+        """最重要的 top_k 条记忆渲染成的 "- 内容" 行及其 token 数
+
+        目前记忆的排序与本轮输入无关，因此只在记忆本身变化时重新排序。
+        """
+        # 记忆列表被整体替换、或直接追加/删除时 version 不变，一并比较列表对象与长度
+        key = (memory_system, memory_system.memories, memory_system.version, len(memory_system.memories), top_k)
+        cached = self._memory_key
+        if cached is None or any(a is not b for a, b in zip(key[:2], cached[:2])) or key[2:] != cached[2:]:
+            lines = [f"- {m}" for m in memory_system.get_relevant_memories(user_input, top_k=top_k)]
+            self._memories = (lines, [self.estimate(line) for line in lines])
+            self._memory_key = key
+            self.rebuilds["memories"] += 1
+        lines, costs = self._memories
+        return list(lines), list(costs)
+
+    def topics(self, topics: Optional[Sequence[str]]) -> str:
+        key = tuple(topics or ())
+        if key != self._topics_key:
+            self._topics = ", ".join(key) if key else "无"
+            self._topics_key = key
+            self.rebuilds["topics"] += 1
+        return self._topics
+
+    def clear(self) -> None:
+        self._ring.clear()
+        self._evicted = []
+        self._memory_key = None
+        self._topics_key = None
+
+    def _render(self, message: Dict[str, str]) -> str:
+        speaker = self.player_name if message["role"] == "user" else self.character_name
+        return f"{speaker}: {message['content']}"
+
+
+__all__ = ["PromptContext"]
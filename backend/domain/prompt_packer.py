@@ -0,0 +1,163 @@
+"""提示词打包 - 在 token 预算内按优先级选取对话历史与记忆
+
+一次请求由六部分组成，按优先级依次放入预算：
+1. persona：system 消息（人设、场景、指导原则）与分析模板中的固定文字；
+2. state：关系状态、好感度、话题、场景与本轮用户输入；
+3. summary：历史窗口之前的对话的滚动摘要（长度有上限，见 dialogue_summary）；
+4. recent：最新的若干条对话；
+5. memories：与本轮输入相关的记忆（按相关度顺序）；
+6. older：历史窗口内更早的对话（从新到旧）。
+前三部分必须发送，即使已超出预算也不裁剪；其余部分放不下时丢弃，
+最新的一条对话放不下时截断其内容，而不是整条丢弃。
+
+token 数用 backend.infrastructure.llm.tokens 的离线估算（按中日韩字符与其他字符分别计），
+与提供商实际计费会有出入，但足以约束请求规模并看出 token 花在了哪一部分。
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence
+
+from backend.infrastructure.llm.tokens import estimate_tokens
+
+SECTIONS = ("persona", "state", "summary", "recent", "memories", "older")
+
+_ELLIPSIS = "…"
+
+
+@dataclass
+class PackedPrompt:
+    """打包结果：选中的历史（按时间顺序）与记忆，以及每部分的估算 token 数"""
+
+    history: List[str]
+    memories: List[str]
+    sections: Dict[str, int]
+    budget: int
+    dropped: Dict[str, int] = field(default_factory=dict)
+    truncated: bool = False
+
+    @property
+    def total(self) -> int:
+        return sum(self.sections.values())
+
+    def report(self) -> Dict[str, object]:
+        return {
+            "budget": self.budget,
+            "total": self.total,
+            "sections": dict(self.sections),
+            "dropped": dict(self.dropped),
+            "truncated": self.truncated,
+        }
+
+
+class PromptPacker:
+    """按 persona > state > 摘要 > 最新对话 > 记忆 > 更早对话 的顺序填充 token 预算
+
+    Args:
+        budget: 整个请求的估算 token 上限；0 表示不限制（仍统计各部分 token 数）
+        recent_messages: 优先级高于记忆的最新对话条数
+        estimator: token 估算函数
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        recent_messages: int = 4,
+        estimator: Callable[[str], int] = estimate_tokens,
+    ):
+        self.budget = max(0, int(budget))
+        self.recent_messages = max(0, int(recent_messages))
+        self.estimate = estimator
+
+    def pack(
+        self,
+        persona_tokens: int,
+        state_tokens: int,
+        history_lines: Sequence[str],
+        memories: Sequence[str],
+        history_costs: Optional[Sequence[int]] = None,
+        memory_costs: Optional[Sequence[int]] = None,
+        summary_tokens: int = 0,
+    ) -> PackedPrompt:
+        """history_lines 按时间顺序排列（最后一条最新）；memories 按相关度排列
+
+        history_costs / memory_costs 为调用方已缓存的每行估算 token 数（不含换行），
+        与对应的行一一对应；不提供时逐行估算。
+        """
+        sections = {name: 0 for name in SECTIONS}
+        sections["persona"] = persona_tokens
+        sections["state"] = state_tokens
+        sections["summary"] = summary_tokens
+        remaining = self.budget - persona_tokens - state_tokens - summary_tokens if self.budget else None
+        dropped = {"recent": 0, "memories": 0, "older": 0}
+        truncated = False
+
+        newest_first = list(zip(reversed(history_lines), self._costs(history_lines, history_costs)[::-1]))
+        recent, older = newest_first[: self.recent_messages], newest_first[self.recent_messages:]
+        picked_history: List[str] = []
+
+        # 每行（条）另计一个换行符的开销
+        for index, (line, cost) in enumerate(recent):
+            cost += 1
+            if remaining is not None and cost > remaining:
+                if index == 0 and remaining > 1:
+                    line = self._truncate(line, remaining - 1)
+                    cost = self.estimate(line) + 1
+                    truncated = True
+                else:
+                    dropped["recent"] = len(recent) - index
+                    # 最新对话已放不下，更早的对话也不再放入
+                    dropped["older"] = len(older)
+                    older = []
+                    break
+            picked_history.append(line)
+            sections["recent"] += cost
+            if remaining is not None:
+                remaining -= cost
+
+        picked_memories: List[str] = []
+        for index, (memory, cost) in enumerate(zip(memories, self._costs(memories, memory_costs))):
+            cost += 1
+            if remaining is not None and cost > remaining:
+                dropped["memories"] = len(memories) - index
+                break
+            picked_memories.append(memory)
+            sections["memories"] += cost
+            if remaining is not None:
+                remaining -= cost
+
+        for index, (line, cost) in enumerate(older):
+            cost += 1
+            if remaining is not None and cost > remaining:
+                # 历史必须连续：一条放不下，更早的都不放
+                dropped["older"] = len(older) - index
+                break
+            picked_history.append(line)
+            sections["older"] += cost
+            if remaining is not None:
+                remaining -= cost
+
+        return PackedPrompt(
+            history=list(reversed(picked_history)),
+            memories=picked_memories,
+            sections=sections,
+            budget=self.budget,
+            dropped={name: count for name, count in dropped.items() if count},
+            truncated=truncated,
+        )
+
+    def _costs(self, lines: Sequence[str], costs: Optional[Sequence[int]]) -> List[int]:
+        if costs is not None and len(costs) == len(lines):
+            return list(costs)
+        return [self.estimate(line) for line in lines]
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """保留开头部分，使估算 token 数不超过 max_tokens"""
+        keep = len(text)
+        while keep > 0 and self.estimate(text[:keep] + _ELLIPSIS) > max_tokens:
+            # 按比例收缩，至少减少一个字符
+            keep = min(keep - 1, int(keep * max_tokens / max(1, self.estimate(text[:keep] + _ELLIPSIS))))
+        return text[:max(0, keep)] + _ELLIPSIS
+
+
+__all__ = ["PromptPacker", "PackedPrompt", "SECTIONS"]
@@ -0,0 +1,165 @@
+"""预编译的提示词模板 - 每个角色只解析一次，所有会话共享
+
+分析模板按 str.format 语法书写（{name} 为占位符，{{ }} 为转义的花括号）。编译时：
+- 在第一个占位符所在小节的标题之前拆出固定前缀，与人设 system 消息一起组成每轮字节不变的消息前缀；
+- 其余部分拆成字面量片段与占位符片段，字面量已完成转义，渲染时只需填入占位符并拼接；
+- 检查每个占位符都由调用方提供，缺失时立即报错，而不是等到某一轮 format 时抛 KeyError。
+
+编译结果按 (模板路径, system 消息) 缓存在进程内，同一角色的所有会话共用同一个对象；
+对象创建后不再修改，可在多个线程间共享。
+"""
+from __future__ import annotations
+
+import re
+import string
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from backend.infrastructure.llm.tokens import MESSAGE_OVERHEAD_TOKENS, estimate_messages_tokens, estimate_tokens
+
+# 模板中的 str.format 占位符（{{ }} 转义的花括号不算）
+_PLACEHOLDER_RE = re.compile(r"(?<!\{)\{[A-Za-z_][A-Za-z0-9_]*\}")
+_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class PromptTemplateError(ValueError):
+    """模板语法错误，或含有调用方不提供的占位符"""
+
+
+def split_static_prefix(template: str) -> Tuple[str, str]:
+    """在第一个占位符所在的小节（以 "#" 开头的标题行）之前拆分模板
+
+    Returns:
+        (固定前缀（已完成 {{ }} 转义）, 动态部分（仍是 str.format 语法）)。
+        模板没有占位符，或固定部分无法按 str.format 解析时，整个模板都作为动态部分。
+    """
+    match = _PLACEHOLDER_RE.search(template)
+    if match is None:
+        return "", template
+    heading = template.rfind("\n#", 0, match.start())
+    split = heading + 1 if heading >= 0 else template.rfind("\n", 0, match.start()) + 1
+    try:
+        static_prefix = template[:split].format()
+    except (IndexError, KeyError, ValueError):
+        return "", template
+    return static_prefix.rstrip("\n"), template[split:]
+
+
+class CompiledTemplate:
+    """拆成字面量与占位符片段的 str.format 模板"""
+
+    __slots__ = ("source", "placeholders", "literal_text", "_parts", "_slots")
+
+    def __init__(self, source: str):
+        self.source = source
+        parts: List[Optional[str]] = []
+        slots: List[Tuple[int, str, Optional[str], str]] = []
+        literal: List[str] = []
+        try:
+            parsed = list(string.Formatter().parse(source))
+        except ValueError as exc:
+            raise PromptTemplateError(f"Invalid prompt template: {exc}") from exc
+        for text, name, spec, conversion in parsed:
+            if text:
+                # 相邻字面量合并成一个片段
+                if parts and parts[-1] is not None and (not slots or slots[-1][0] != len(parts) - 1):
+                    parts[-1] += text
+                else:
+                    parts.append(text)
+                literal.append(text)
+            if name is None:
+                continue
+            if not _NAME_RE.match(name):
+                raise PromptTemplateError(f"Unsupported placeholder {{{name}}}: only plain names are allowed")
+            slots.append((len(parts), name, conversion, spec or ""))
+            parts.append(None)
+        self._parts: Tuple[Optional[str], ...] = tuple(parts)
+        self._slots: Tuple[Tuple[int, str, Optional[str], str], ...] = tuple(slots)
+        self.placeholders = frozenset(name for _, name, _, _ in slots)
+        self.literal_text = "".join(literal)
+
+    def validate(self, provided: Iterable[str]) -> None:
+        missing = self.placeholders - set(provided)
+        if missing:
+            raise PromptTemplateError(f"Prompt template uses variables that are never supplied: {sorted(missing)}")
+
+    def render(self, variables: Mapping[str, Any]) -> str:
+        """等价于 source.format(**variables)"""
+        parts = list(self._parts)
+        for index, name, conversion, spec in self._slots:
+            value = variables[name]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            elif conversion == "s":
+                value = str(value)
+            parts[index] = value if value.__class__ is str and not spec else format(value, spec)
+        return "".join(parts)  # type: ignore[arg-type]
+
+
+class CompiledPrompt:
+    """一个角色的提示词：固定消息前缀（人设 system 消息 + 模板固定指令）与编译后的动态模板"""
+
+    __slots__ = ("source", "static_messages", "template", "persona_tokens")
+
+    def __init__(self, source: str, system_prompts: Sequence[str], variables: Iterable[str]):
+        self.source = source
+        static_prefix, dynamic = split_static_prefix(source)
+        self.template = CompiledTemplate(dynamic)
+        self.template.validate(variables)
+        contents = [prompt for prompt in system_prompts if prompt]
+        if static_prefix:
+            contents.append(static_prefix)
+        self.static_messages: Tuple[Dict[str, str], ...] = tuple({"role": "system", "content": c} for c in contents)
+        # 每轮原样发送的部分：system 消息、动态模板中的字面量与 user 消息的固定开销
+        self.persona_tokens = (
+            estimate_messages_tokens(contents) + estimate_tokens(self.template.literal_text) + MESSAGE_OVERHEAD_TOKENS
+        )
+
+    def render(self, variables: Mapping[str, Any]) -> str:
+        return self.template.render(variables)
+
+    def build_messages(self, rendered: str) -> List[Dict[str, str]]:
+        """固定消息前缀 + 本轮的 user 消息（固定消息为共享对象，调用方不应修改）"""
+        messages = list(self.static_messages)
+        messages.append({"role": "user", "content": rendered})
+        return messages
+
+
+_compiled: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...]], CompiledPrompt] = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_prompt(template_path: str, system_prompts: Sequence[str], variables: Iterable[str]) -> CompiledPrompt:
+    """读取并编译模板；相同的模板路径、system 消息与变量集合只编译一次
+
+    Raises:
+        FileNotFoundError: 模板文件不存在
+        PromptTemplateError: 模板语法错误或含有不提供的占位符
+    """
+    key = (str(template_path), tuple(system_prompts), tuple(sorted(variables)))
+    compiled = _compiled.get(key)
+    if compiled is not None:
+        return compiled
+    with open(template_path, "r", encoding="utf-8") as fh:
+        source = fh.read()
+    compiled = CompiledPrompt(source, system_prompts, key[2])
+    with _compiled_lock:
+        return _compiled.setdefault(key, compiled)
+
+
+def clear_compiled_prompts() -> None:
+    """清空编译缓存（修改模板文件后或测试中使用）"""
+    with _compiled_lock:
+        _compiled.clear()
+
+
+__all__ = [
+    "CompiledPrompt",
+    "CompiledTemplate",
+    "PromptTemplateError",
+    "clear_compiled_prompts",
+    "get_compiled_prompt",
+    "split_static_prefix",
+]
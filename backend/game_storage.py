@@ -1,7 +1,10 @@
 import json
 import os
+import time
 from datetime import datetime
 
+from backend.infrastructure.metrics import STORAGE_LATENCY
+
 
 class GameStorage:
     def __init__(self, save_dir="saves"):
@@ -52,6 +55,7 @@ class GameStorage:
         if "state" in data and "date" in data["state"] and isinstance(data["state"]["date"], datetime):
             data["state"]["date"] = data["state"]["date"].strftime("%Y-%m-%d")
         
+        started = time.perf_counter()
         try:
             with open(self._get_filepath(slot), 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
@@ -59,6 +63,8 @@ class GameStorage:
         except Exception as e:
             print(f"保存失败: {str(e)}")
             return False
+        finally:
+            STORAGE_LATENCY.observe(time.perf_counter() - started, operation="save")
 
     def load_game(self, slot=1):
         """
@@ -71,6 +77,7 @@ class GameStorage:
             dict or None: 如果加载成功，则返回包含游戏数据的字典；
                           如果存档文件不存在或加载失败，则返回 None。
         """
+        started = time.perf_counter()
         try:
             with open(self._get_filepath(slot), 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -84,6 +91,8 @@ class GameStorage:
         except Exception as e:
             print(f"读取失败: {str(e)}")
             return None
+        finally:
+            STORAGE_LATENCY.observe(time.perf_counter() - started, operation="load")
 
     def list_saves(self):
         """
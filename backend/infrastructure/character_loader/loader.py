@@ -60,6 +60,7 @@ class CharacterConfig:
         # 高级配置
         advanced = config_dict.get("advanced", {})
         self.history_size = advanced.get("history_size", 100)
+        self.prompt_token_budget = advanced.get("prompt_token_budget")
         self.confession_keywords = advanced.get("confession_keywords", [])
         self.backup_replies = advanced.get("backup_replies", [])
         self.guidelines = advanced.get("guidelines", [])
@@ -103,7 +104,9 @@ class CharacterConfig:
             "welcome_message": self.welcome_message,
             "current_scene_description": self.scene_description,
             "history_size": self.history_size,
+            "prompt_token_budget": self.prompt_token_budget,
             "initial_state": self.initial_state,
+            "backup_replies": self.backup_replies,
         }
 
     def _read_prompt_file(self, file_path: Optional[str]) -> str:
@@ -11,6 +11,8 @@ from enum import Enum
 from typing import Any, Callable, Dict, List, Optional
 from uuid import uuid4
 
+from backend.infrastructure.metrics import EVENTS_PUBLISHED
+
 logger = logging.getLogger(__name__)
 
 
@@ -101,6 +103,7 @@ class EventBus:
             event: 事件对象
         """
         logger.info(f"Publishing event: {event}")
+        EVENTS_PUBLISHED.inc(event_type=event.event_type.value)
 
         # 记录事件历史
         self._event_history.append(event)
@@ -1,16 +1,55 @@
 """LLM Infrastructure Package"""
 from .adapter import LLMAdapter
-from .base import BaseLLMProvider, LLMResponse, Message
+from .base import BaseLLMProvider, LLMResponse, Message, ProviderHTTPError, prompt_cache_hit_tokens
+from .cache import CachedProvider, ResponseCache, cache_stats
+from .cassette import CassetteMiss, CassetteProvider
 from .deepseek import DeepSeekProvider
 from .factory import LLMFactory
+from .hedging import HedgedProvider
+from .instrumented import InstrumentedProvider
+from .http_pool import PooledClient, aclose_all_clients, close_all_clients
+from .loop_runner import BackgroundLoop, get_background_loop
 from .openai import OpenAIProvider
+from .rate_limit import RateLimitedProvider, RateLimitExceeded, rate_limit_stats
+from .resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientProvider, circuit_stats
+from .routing import RoutedProvider
+from .tokens import estimate_tokens
+from .wrapper import ProviderWrapper
+
+# 离线录制/回放提供商：LLM_PROVIDER=cassette
+LLMFactory.register_provider("cassette", CassetteProvider)
 
 __all__ = [
     "BaseLLMProvider",
     "LLMResponse",
     "Message",
+    "ProviderHTTPError",
+    "prompt_cache_hit_tokens",
     "DeepSeekProvider",
     "OpenAIProvider",
+    "CassetteProvider",
+    "CassetteMiss",
     "LLMFactory",
     "LLMAdapter",
+    "PooledClient",
+    "close_all_clients",
+    "aclose_all_clients",
+    "BackgroundLoop",
+    "get_background_loop",
+    "ProviderWrapper",
+    "HedgedProvider",
+    "RoutedProvider",
+    "CachedProvider",
+    "InstrumentedProvider",
+    "ResponseCache",
+    "cache_stats",
+    "RateLimitedProvider",
+    "RateLimitExceeded",
+    "rate_limit_stats",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "DeadlineExceeded",
+    "ResilientProvider",
+    "circuit_stats",
+    "estimate_tokens",
 ]
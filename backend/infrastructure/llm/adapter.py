@@ -1,17 +1,19 @@
 """LLM适配器 - 将异步LLM接口适配为同步接口
 
 这个适配器用于在过渡期间，让现有的同步代码能够使用新的异步LLM接口。
+所有协程都提交到进程内共享的后台事件循环（见 loop_runner），多个工作线程可以安全地同时调用。
 未来当整个系统迁移到异步后，可以移除这个适配器。
 """
 from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
 
 from backend import settings
 from .factory import LLMFactory
-from .base import Message
+from .base import BaseLLMProvider, LLMResponse, Message
+from .loop_runner import BackgroundLoop, get_background_loop
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +21,23 @@ logger = logging.getLogger(__name__)
 class LLMAdapter:
     """LLM适配器 - 提供同步接口"""
 
-    def __init__(self):
-        """初始化LLM适配器"""
+    def __init__(self, provider: Optional[BaseLLMProvider] = None, loop: Optional[BackgroundLoop] = None):
+        """初始化LLM适配器
+
+        Args:
+            provider: 已创建的提供商实例（可选，默认按 settings 通过工厂创建）
+            loop: 运行协程的后台事件循环（可选，默认使用进程共享的循环）
+        """
+        self._loop = loop or get_background_loop()
+        if provider is not None:
+            self._provider = provider
+            self.provider_name = type(provider).__name__
+            self.model = provider.model
+            self.temperature = provider.temperature
+            self.max_tokens = provider.max_tokens
+            self.timeout = provider.timeout
+            return
+
         self.provider_name = settings.LLM_PROVIDER
         self.model = settings.LLM_MODEL
         self.temperature = settings.LLM_TEMPERATURE
@@ -39,28 +56,57 @@ class LLMAdapter:
             temperature=self.temperature,
             max_tokens=self.max_tokens,
             timeout=self.timeout,
+            endpoint=settings.LLM_ENDPOINT,
         )
 
-    def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+    def chat(self, messages: List[Dict[str, str]], timeout: Optional[float] = None, **kwargs) -> str:
         """同步聊天接口
 
         Args:
             messages: 消息列表，格式为 [{"role": "user", "content": "..."}]
+            timeout: 等待结果的最长秒数（可选；超时会取消请求并抛出 TimeoutError）
             **kwargs: 其他参数（temperature, max_tokens等）
 
         Returns:
             str: LLM响应文本
         """
+        return self.complete(messages, timeout=timeout, **kwargs).content
+
+    def complete(self, messages: List[Dict[str, str]], timeout: Optional[float] = None, **kwargs) -> LLMResponse:
+        """同步聊天接口，返回完整的 LLMResponse（包含 usage 等信息）
+
+        参数同 chat()。
+        """
         # 转换消息格式
         llm_messages = [Message(role=msg["role"], content=msg["content"]) for msg in messages]
 
-        # 运行异步方法
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        return self._loop.run(self._provider.chat(llm_messages, **kwargs), timeout=timeout)
+
+    async def acomplete(self, messages: List[Dict[str, str]], timeout: Optional[float] = None, **kwargs) -> LLMResponse:
+        """异步聊天接口：直接在调用方的事件循环上等待提供商（用于 ASGI 等异步调用方）
+
+        参数同 chat()；超时抛出 TimeoutError。
+        """
+        llm_messages = [Message(role=msg["role"], content=msg["content"]) for msg in messages]
+        coro = self._provider.chat(llm_messages, **kwargs)
+        if timeout is None:
+            return await coro
         try:
-            response = loop.run_until_complete(
-                self._provider.chat(llm_messages, **kwargs)
-            )
-            return response.content
-        finally:
-            loop.close()
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"LLM call did not finish within {timeout}s")
+
+    def chat_stream(self, messages: List[Dict[str, str]], timeout: Optional[float] = None, **kwargs) -> Iterator[str]:
+        """同步流式接口：逐段产出 LLM 响应文本
+
+        Args:
+            messages: 消息列表，格式为 [{"role": "user", "content": "..."}]
+            timeout: 等待每个片段的最长秒数（可选）
+            **kwargs: 其他参数（temperature, max_tokens等）
+
+        Yields:
+            str: 流式响应的文本片段
+        """
+        llm_messages = [Message(role=msg["role"], content=msg["content"]) for msg in messages]
+
+        yield from self._loop.iterate(self._provider.chat_stream(llm_messages, **kwargs), timeout=timeout)
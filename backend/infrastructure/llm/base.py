@@ -8,6 +8,10 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import AsyncIterator, Dict, List, Optional
 
+import httpx
+
+from .http_pool import PooledClient
+
 
 @dataclass
 class Message:
@@ -16,6 +20,14 @@ class Message:
     content: str
 
 
+class ProviderHTTPError(RuntimeError):
+    """提供商返回了非 200 状态码"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 @dataclass
 class LLMResponse:
     """LLM响应数据类"""
@@ -25,9 +37,30 @@ class LLMResponse:
     finish_reason: Optional[str] = None
 
 
+def prompt_cache_hit_tokens(usage: Optional[Dict]) -> Optional[int]:
+    """usage 中命中提供商前缀缓存的输入 token 数；提供商未报告时返回 None
+
+    DeepSeek 报告 prompt_cache_hit_tokens，OpenAI 报告 prompt_tokens_details.cached_tokens。
+    """
+    if not usage:
+        return None
+    hit = usage.get("prompt_cache_hit_tokens")
+    if isinstance(hit, int):
+        return hit
+    details = usage.get("prompt_tokens_details")
+    if isinstance(details, dict) and isinstance(details.get("cached_tokens"), int):
+        return details["cached_tokens"]
+    return None
+
+
 class BaseLLMProvider(ABC):
     """LLM提供商抽象基类"""
 
+    # 默认读取 API 密钥的环境变量名（子类覆盖）
+    API_KEY_ENV: Optional[str] = None
+    # 是否必须提供 API 密钥（本地/离线提供商可设为 False）
+    REQUIRES_API_KEY: bool = True
+
     def __init__(
         self,
         api_key: str,
@@ -43,6 +76,7 @@ class BaseLLMProvider(ABC):
         self.max_tokens = max_tokens
         self.timeout = timeout
         self.extra_params = kwargs
+        self._http = PooledClient(timeout=timeout)
 
     @abstractmethod
     async def chat(
@@ -79,13 +113,26 @@ class BaseLLMProvider(ABC):
             messages: 消息列表
             temperature: 温度参数（可选，使用实例默认值）
             max_tokens: 最大token数（可选，使用实例默认值）
-            **kwargs: 其他提供商特定参数
+            **kwargs: 其他提供商特定参数；on_usage 回调（可选）在流结束时接收 token 用量，
+                on_finish 回调（可选）接收流的结束原因（"stop"、"length" 等）
 
         Yields:
             str: 流式响应的文本片段
         """
         pass
 
+    def _get_client(self) -> httpx.AsyncClient:
+        """返回长连接 HTTP 客户端（同一事件循环内复用连接）"""
+        return self._http.get()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的 HTTP 客户端"""
+        await self._http.aclose()
+
+    def close(self) -> None:
+        """关闭该提供商在所有事件循环上的 HTTP 客户端"""
+        self._http.close()
+
     def _get_temperature(self, temperature: Optional[float]) -> float:
         """获取温度参数，优先使用传入值"""
         return temperature if temperature is not None else self.temperature
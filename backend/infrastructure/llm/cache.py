@@ -0,0 +1,316 @@
+"""LLM 响应缓存 - 按内容寻址，内存 LRU（按字节上限淘汰）+ SQLite 持久化
+
+缓存键是 (提供商, endpoint, model, messages, temperature, max_tokens, 其他请求参数) 的 SHA-256。
+同一角色在相同初始状态下收到相同的开场白时，填充后的提示词完全一样，可以直接复用上一次的回复。
+只缓存完整的回合输出（<response> 标签闭合、分析 JSON 解析成功，且结束原因为正常结束），
+格式出错或被 max_tokens / 断流截断的回复不会被反复重放。
+
+- 只在温度不高于 LLM_CACHE_MAX_TEMPERATURE 时使用缓存：温度越高，同一提示词的回复本应越多样；
+  压测与回归测试可以把上限调高，以获得可重复、零花费的运行；
+- 内存层是按字节计量的 LRU；磁盘层是一个 SQLite 文件，进程重启后仍然有效，多个工作进程可共享；
+- 命中时返回的 LLMResponse.usage 为 None（本次没有消耗 token），流式命中一次性产出完整回复。
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from backend import settings
+from backend.config import PROJECT_ROOT
+from backend.domain.output_parser import TaggedOutputParser
+from .base import BaseLLMProvider, LLMResponse, Message
+from .wrapper import ProviderWrapper
+
+logger = logging.getLogger(__name__)
+
+# 调用方传入的回调参数，不属于请求内容，不参与缓存键
+CALLBACK_KWARGS = ("on_usage", "on_finish")
+
+
+def cache_key(
+    model: str,
+    messages: List[Message],
+    temperature: float,
+    max_tokens: int,
+    extra: Dict[str, Any],
+    provider: str = "",
+    endpoint: Optional[str] = None,
+) -> str:
+    """请求内容的 SHA-256 摘要（provider / endpoint 为空时不参与，与旧的录制文件保持一致）"""
+    payload: Dict[str, Any] = {
+        "model": model,
+        "messages": [[msg.role, msg.content] for msg in messages],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "extra": extra,
+    }
+    if provider:
+        payload["provider"] = provider
+    if endpoint:
+        payload["endpoint"] = endpoint
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def is_cacheable_output(content: str) -> bool:
+    """完整的回合输出：<response> 标签已闭合，且 <analysis> 中的 JSON 解析成功"""
+    parser = TaggedOutputParser()
+    parser.feed(content)
+    analysis = parser.close()["analysis"]
+    return parser.response_closed and analysis is not None and "error" not in analysis
+
+
+class ResponseCache:
+    """内存 LRU + 可选的 SQLite 持久层（线程安全）"""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, path: Optional[str] = None):
+        """
+        Args:
+            max_bytes: 内存层保存的回复总字节数上限（按 UTF-8 编码计）
+            path: SQLite 文件路径；None 表示只用内存
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.rejected = 0
+        self.stores = 0
+        self.evictions = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        """放入内存层并按字节上限淘汰最久未使用的条目（调用方持有锁）"""
+        size = len(entry["content"].encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= self._sizes[key]
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self.bytes -= self._sizes.pop(old_key)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+        if self.path:
+            row = self._connect().execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                entry = json.loads(row[0])
+                with self._lock:
+                    self._remember(key, entry)
+                    self.disk_hits += 1
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._remember(key, entry)
+            self.stores += 1
+        if self.path:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)",
+                (key, json.dumps(entry, ensure_ascii=False)),
+            )
+
+    @property
+    def blocking(self) -> bool:
+        """启用 SQLite 持久层时 get/put 会做磁盘 I/O"""
+        return bool(self.path)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() 的协程版本：有磁盘层时在工作线程查询，不阻塞事件循环"""
+        if self.blocking:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+
+    async def aput(self, key: str, entry: Dict[str, Any]) -> None:
+        """put() 的协程版本：有磁盘层时在工作线程写入"""
+        if self.blocking:
+            await asyncio.to_thread(self.put, key, entry)
+        else:
+            self.put(key, entry)
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def clear(self) -> None:
+        """清空内存层与磁盘层"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+        if self.path:
+            self._connect().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "rejected": self.rejected,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "path": self.path,
+            }
+
+
+class CachedProvider(ProviderWrapper):
+    """温度策略允许时先查缓存，未命中再调用被包装的提供商并写回"""
+
+    def __init__(self, inner: BaseLLMProvider, cache: ResponseCache, max_temperature: float = 0.3, provider_name: str = ""):
+        """
+        Args:
+            inner: 被包装的提供商
+            cache: 共享的响应缓存
+            max_temperature: 有效温度不高于该值时才使用缓存
+            provider_name: 提供商名，与 endpoint 一起计入缓存键（同名模型在不同提供商/网关上不互相命中）
+        """
+        super().__init__(inner)
+        self.cache = cache
+        self.max_temperature = max_temperature
+        self.provider_name = provider_name
+
+    def _key(self, messages: List[Message], temperature: Optional[float], max_tokens: Optional[int], kwargs: Dict) -> Optional[str]:
+        """可缓存时返回缓存键，否则返回 None"""
+        effective = self._get_temperature(temperature)
+        if effective > self.max_temperature:
+            self.cache.record_bypass()
+            return None
+        extra = {k: v for k, v in kwargs.items() if k not in CALLBACK_KWARGS}
+        return cache_key(
+            self.model, messages, effective, self._get_max_tokens(max_tokens), extra,
+            provider=self.provider_name, endpoint=getattr(self.inner, "endpoint", None),
+        )
+
+    async def _store(self, key: str, entry: Dict[str, Any]) -> None:
+        if is_cacheable_output(entry["content"]):
+            await self.cache.aput(key, entry)
+        else:
+            self.cache.record_rejected()
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        key = self._key(messages, temperature, max_tokens, kwargs)
+        if key is not None:
+            entry = await self.cache.aget(key)
+            if entry is not None:
+                return LLMResponse(content=entry["content"], model=entry["model"], finish_reason=entry.get("finish_reason"))
+        response = await self.inner.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        if key is not None and response.finish_reason in (None, "stop"):
+            await self._store(key, {"content": response.content, "model": response.model, "finish_reason": response.finish_reason})
+        return response
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        key = self._key(messages, temperature, max_tokens, kwargs)
+        if key is not None:
+            entry = await self.cache.aget(key)
+            if entry is not None:
+                yield entry["content"]
+                return
+        chunks: List[str] = []
+        finish: List[str] = []
+        on_finish = kwargs.pop("on_finish", None)
+
+        def capture_finish(reason: str) -> None:
+            finish.append(reason)
+            if on_finish is not None:
+                on_finish(reason)
+
+        async for chunk in self.inner.chat_stream(
+            messages, temperature=temperature, max_tokens=max_tokens, on_finish=capture_finish, **kwargs
+        ):
+            chunks.append(chunk)
+            yield chunk
+        # 只缓存完整读完、且提供商报告正常结束的流（调用方中途关闭时不会执行到这里；
+        # 被 max_tokens 截断或没有结束原因的流不缓存）
+        if key is not None:
+            if finish and finish[-1] == "stop":
+                await self._store(key, {"content": "".join(chunks), "model": self.model, "finish_reason": "stop"})
+            else:
+                self.cache.record_rejected()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """进程共享的响应缓存（按 settings 创建）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            path = None
+            if settings.LLM_CACHE_PERSIST:
+                path = settings.LLM_CACHE_DB or str(PROJECT_ROOT / "cache" / "llm_responses.sqlite3")
+            _cache = ResponseCache(max_bytes=settings.LLM_CACHE_MAX_BYTES, path=path)
+            logger.info(f"LLM response cache enabled (disk: {path or 'off'})")
+        return _cache
+
+
+def cache_stats() -> Optional[Dict[str, Any]]:
+    """缓存统计；尚未有角色启用缓存时返回 None"""
+    return _cache.stats() if _cache is not None else None
+
+
+__all__ = ["CALLBACK_KWARGS", "CachedProvider", "ResponseCache", "cache_key", "cache_stats", "get_response_cache", "is_cacheable_output"]
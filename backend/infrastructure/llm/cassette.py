@@ -0,0 +1,237 @@
+"""录制/回放提供商 - 离线、可重复地运行完整回合流程
+
+`CassetteProvider` 以提供商名 "cassette" 注册到 LLMFactory：
+- record：把请求转发给真实提供商（LLM_CASSETTE_RECORD_PROVIDER），同时把请求键、回复、usage、
+  总耗时以及流式片段之间的间隔追加到磁带文件（每行一条 JSON）；
+- replay：不访问网络，按请求键取出录制的回复，并按原始耗时乘以 LLM_CASSETTE_LATENCY_SCALE 回放
+  （0 表示不等待）。同一个键录了多次时按顺序轮流返回；键不存在时按 LLM_CASSETTE_MISS 处理：
+  "cycle" 按录制顺序轮流返回任意一条，"error" 抛出 CassetteMiss。
+
+请求键与模型名无关（回放时的模型名可能和录制时不同），只取决于消息、温度与 max_tokens。
+这样不需要 API 密钥就能对提示词构建、解析、状态更新与存档做端到端的性能分析。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from backend import settings
+from .base import BaseLLMProvider, LLMResponse, Message
+from .cache import CALLBACK_KWARGS, cache_key
+
+logger = logging.getLogger(__name__)
+
+_PREVIEW_CHARS = 60
+
+
+class CassetteMiss(LookupError):
+    """回放模式下磁带中没有对应的录制"""
+
+
+class CassetteProvider(BaseLLMProvider):
+    """按磁带文件录制或回放 LLM 调用"""
+
+    REQUIRES_API_KEY = False
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "cassette",
+        path: Optional[str] = None,
+        mode: Optional[str] = None,
+        record_provider: Optional[str] = None,
+        latency_scale: Optional[float] = None,
+        on_miss: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        inner: Optional[BaseLLMProvider] = None,
+        **kwargs
+    ):
+        """
+        Args:
+            api_key: 录制模式下传给真实提供商的 API 密钥（可选，默认读其环境变量）
+            model: 模型名；录制模式下同时作为真实提供商的模型
+            path: 磁带文件路径（默认 settings.LLM_CASSETTE_PATH）
+            mode: "record" 或 "replay"（默认 settings.LLM_CASSETTE_MODE）
+            record_provider: 录制时转发到的提供商名（默认 settings.LLM_CASSETTE_RECORD_PROVIDER）
+            latency_scale: 回放耗时倍数，0 表示立即返回（默认 settings.LLM_CASSETTE_LATENCY_SCALE）
+            on_miss: 回放未命中时的策略 "cycle" / "error"（默认 settings.LLM_CASSETTE_MISS）
+            endpoint: 录制时传给真实提供商的 endpoint
+            inner: 直接指定录制时转发到的提供商实例（测试用）
+        """
+        super().__init__(api_key or "", model, **kwargs)
+        self.path = path or settings.LLM_CASSETTE_PATH
+        self.mode = (mode or settings.LLM_CASSETTE_MODE).lower()
+        self.latency_scale = settings.LLM_CASSETTE_LATENCY_SCALE if latency_scale is None else latency_scale
+        self.on_miss = (on_miss or settings.LLM_CASSETTE_MISS).lower()
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.mode == "record":
+            self._inner = inner or self._create_inner(record_provider or settings.LLM_CASSETTE_RECORD_PROVIDER, api_key, endpoint, kwargs)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        elif self.mode == "replay":
+            self._entries: List[Dict[str, Any]] = []
+            self._by_key: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+            self._cursor: Dict[str, int] = defaultdict(int)
+            self._load()
+        else:
+            raise ValueError(f"Unknown cassette mode: {self.mode} (expected 'record' or 'replay')")
+
+    def _create_inner(self, provider_name: str, api_key: Optional[str], endpoint: Optional[str], kwargs: Dict) -> BaseLLMProvider:
+        from .factory import LLMFactory
+
+        model = None if self.model == "cassette" else self.model
+        # cassette 自身由工厂包装重试/熔断/限流/指标，内层只用具体提供商，避免每次请求被计两遍
+        return LLMFactory.create(provider_name, api_key=api_key or None, model=model, endpoint=endpoint, wrap=False, **kwargs)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise ValueError(f"Cassette not found: {self.path}")
+        with open(self.path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.append(entry)
+                    self._by_key[entry["key"]].append(entry)
+        logger.info(f"Loaded {len(self._entries)} recordings from cassette {self.path}")
+
+    def _key(self, messages: List[Message], temperature: Optional[float], max_tokens: Optional[int], kwargs: Dict) -> str:
+        extra = {k: v for k, v in kwargs.items() if k not in CALLBACK_KWARGS}
+        return cache_key("", messages, self._get_temperature(temperature), self._get_max_tokens(max_tokens), extra)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+            self.recorded += 1
+
+    def _lookup(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            candidates = self._by_key.get(key)
+            if candidates:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if self.on_miss != "cycle" or not self._entries:
+                    raise CassetteMiss(f"No recording for request {key[:12]} in {self.path}")
+                key, candidates = "*", self._entries
+            entry = candidates[self._cursor[key] % len(candidates)]
+            self._cursor[key] += 1
+            return entry
+
+    async def _sleep(self, seconds: float) -> None:
+        if self.latency_scale > 0 and seconds > 0:
+            await asyncio.sleep(seconds * self.latency_scale)
+
+    @staticmethod
+    def _preview(messages: List[Message]) -> str:
+        return messages[-1].content[:_PREVIEW_CHARS] if messages else ""
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        key = self._key(messages, temperature, max_tokens, kwargs)
+        if self.mode == "record":
+            started = time.monotonic()
+            response = await self._inner.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+            self._append({
+                "key": key,
+                "preview": self._preview(messages),
+                "model": response.model,
+                "content": response.content,
+                "usage": response.usage,
+                "finish_reason": response.finish_reason,
+                "latency": round(time.monotonic() - started, 4),
+            })
+            return response
+
+        entry = self._lookup(key)
+        await self._sleep(entry["latency"])
+        return LLMResponse(
+            content=entry["content"],
+            model=entry.get("model", self.model),
+            usage=entry.get("usage"),
+            finish_reason=entry.get("finish_reason"),
+        )
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        key = self._key(messages, temperature, max_tokens, kwargs)
+        on_usage = kwargs.pop("on_usage", None)
+        on_finish = kwargs.pop("on_finish", None)
+        if self.mode == "record":
+            usage: Dict = {}
+            finish: List[str] = []
+
+            def capture(data: Dict) -> None:
+                usage.update(data)
+                if on_usage is not None:
+                    on_usage(data)
+
+            def capture_finish(reason: str) -> None:
+                finish.append(reason)
+                if on_finish is not None:
+                    on_finish(reason)
+
+            started = last = time.monotonic()
+            chunks: List[List[Any]] = []
+            async for chunk in self._inner.chat_stream(
+                messages, temperature=temperature, max_tokens=max_tokens, on_usage=capture, on_finish=capture_finish, **kwargs
+            ):
+                now = time.monotonic()
+                chunks.append([round(now - last, 4), chunk])
+                last = now
+                yield chunk
+            self._append({
+                "key": key,
+                "preview": self._preview(messages),
+                "model": self.model,
+                "content": "".join(text for _, text in chunks),
+                "usage": usage or None,
+                "finish_reason": finish[-1] if finish else None,
+                "latency": round(time.monotonic() - started, 4),
+                "chunks": chunks,
+            })
+            return
+
+        entry = self._lookup(key)
+        # 按非流式录制的条目：等待总耗时后一次性产出
+        for delay, text in entry.get("chunks") or [[entry["latency"], entry["content"]]]:
+            await self._sleep(delay)
+            yield text
+        if entry.get("usage") and on_usage is not None:
+            on_usage(entry["usage"])
+        if entry.get("finish_reason") and on_finish is not None:
+            on_finish(entry["finish_reason"])
+
+    async def aclose(self) -> None:
+        if self.mode == "record":
+            await self._inner.aclose()
+
+    def close(self) -> None:
+        if self.mode == "record":
+            self._inner.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "mode": self.mode, "recorded": self.recorded, "hits": self.hits, "misses": self.misses}
+
+
+__all__ = ["CassetteMiss", "CassetteProvider"]
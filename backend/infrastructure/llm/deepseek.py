@@ -5,9 +5,7 @@ import json
 import logging
 from typing import AsyncIterator, Dict, List, Optional
 
-import httpx
-
-from .base import BaseLLMProvider, LLMResponse, Message
+from .base import BaseLLMProvider, LLMResponse, Message, ProviderHTTPError
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +14,7 @@ class DeepSeekProvider(BaseLLMProvider):
     """DeepSeek API提供商实现"""
 
     DEFAULT_ENDPOINT = "https://api.deepseek.com/v1/chat/completions"
+    API_KEY_ENV = "DEEPSEEK_API_KEY"
 
     def __init__(
         self,
@@ -48,28 +47,28 @@ class DeepSeekProvider(BaseLLMProvider):
             "Authorization": f"Bearer {self.api_key}",
         }
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(
-                self.endpoint,
-                headers=headers,
-                json=payload,
-            )
-
-            if response.status_code != 200:
-                error_msg = f"DeepSeek API Error {response.status_code}: {response.text}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
-
-            data = response.json()
-            logger.debug(f"DeepSeek API Response: {data}")
-
-            choice = data["choices"][0]
-            return LLMResponse(
-                content=choice["message"]["content"],
-                model=data.get("model", self.model),
-                usage=data.get("usage"),
-                finish_reason=choice.get("finish_reason"),
-            )
+        client = self._get_client()
+        response = await client.post(
+            self.endpoint,
+            headers=headers,
+            json=payload,
+        )
+
+        if response.status_code != 200:
+            error_msg = f"DeepSeek API Error {response.status_code}: {response.text}"
+            logger.error(error_msg)
+            raise ProviderHTTPError(error_msg, response.status_code)
+
+        data = response.json()
+        logger.debug(f"DeepSeek API Response: {data}")
+
+        choice = data["choices"][0]
+        return LLMResponse(
+            content=choice["message"]["content"],
+            model=data.get("model", self.model),
+            usage=data.get("usage"),
+            finish_reason=choice.get("finish_reason"),
+        )
 
     async def chat_stream(
         self,
@@ -85,7 +84,10 @@ class DeepSeekProvider(BaseLLMProvider):
             "temperature": self._get_temperature(temperature),
             "max_tokens": self._get_max_tokens(max_tokens),
             "stream": True,
+            "stream_options": {"include_usage": True},
         }
+        on_usage = kwargs.pop("on_usage", None)
+        on_finish = kwargs.pop("on_finish", None)
         payload.update(kwargs)
 
         headers = {
@@ -93,29 +95,34 @@ class DeepSeekProvider(BaseLLMProvider):
             "Authorization": f"Bearer {self.api_key}",
         }
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            async with client.stream(
-                "POST",
-                self.endpoint,
-                headers=headers,
-                json=payload,
-            ) as response:
-                if response.status_code != 200:
-                    error_msg = f"DeepSeek API Error {response.status_code}"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
-
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data_str = line[6:]
-                        if data_str == "[DONE]":
-                            break
-                        try:
-                            data = json.loads(data_str)
-                            if "choices" in data and len(data["choices"]) > 0:
-                                delta = data["choices"][0].get("delta", {})
-                                if "content" in delta:
-                                    yield delta["content"]
-                        except json.JSONDecodeError:
-                            logger.warning(f"Failed to parse SSE data: {data_str}")
-                            continue
+        client = self._get_client()
+        async with client.stream(
+            "POST",
+            self.endpoint,
+            headers=headers,
+            json=payload,
+        ) as response:
+            if response.status_code != 200:
+                error_msg = f"DeepSeek API Error {response.status_code}"
+                logger.error(error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    data_str = line[6:]
+                    if data_str == "[DONE]":
+                        break
+                    try:
+                        data = json.loads(data_str)
+                        if data.get("usage") and on_usage is not None:
+                            on_usage(data["usage"])
+                        if "choices" in data and len(data["choices"]) > 0:
+                            choice = data["choices"][0]
+                            delta = choice.get("delta", {})
+                            if "content" in delta:
+                                yield delta["content"]
+                            if choice.get("finish_reason") and on_finish is not None:
+                                on_finish(choice["finish_reason"])
+                    except json.JSONDecodeError:
+                        logger.warning(f"Failed to parse SSE data: {data_str}")
+                        continue
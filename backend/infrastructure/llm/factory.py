@@ -3,11 +3,19 @@ from __future__ import annotations
 
 import logging
 import os
-from typing import Dict, Optional, Type
+import threading
+from typing import Dict, Optional, Tuple, Type
 
+from backend import settings
 from .base import BaseLLMProvider
+from .cache import CachedProvider, get_response_cache
 from .deepseek import DeepSeekProvider
+from .hedging import HedgedProvider
+from .instrumented import InstrumentedProvider
 from .openai import OpenAIProvider
+from .rate_limit import RateLimitedProvider, get_rate_limiter
+from .routing import RoutedProvider
+from .resilience import ResilientProvider, get_circuit_breaker
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +28,10 @@ class LLMFactory:
         "openai": OpenAIProvider,
     }
 
+    # 共享实例：相同配置的调用方复用同一个提供商（及其长连接池）
+    _shared: Dict[Tuple, BaseLLMProvider] = {}
+    _shared_lock = threading.Lock()
+
     @classmethod
     def register_provider(cls, name: str, provider_class: Type[BaseLLMProvider]):
         """注册新的LLM提供商
@@ -37,6 +49,8 @@ class LLMFactory:
         provider_name: str,
         api_key: Optional[str] = None,
         model: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        wrap: bool = True,
         **kwargs
     ) -> BaseLLMProvider:
         """创建LLM提供商实例
@@ -45,10 +59,12 @@ class LLMFactory:
             provider_name: 提供商名称 (deepseek, openai等)
             api_key: API密钥（可选，从环境变量读取）
             model: 模型名称（可选，使用默认值）
+            api_key_env: 读取密钥的环境变量名（可选，默认使用提供商的 API_KEY_ENV）
+            wrap: 为 False 时返回未包装的具体提供商（供自身会被再包装一次的提供商使用，如录制模式的 cassette）
             **kwargs: 其他提供商特定参数
 
         Returns:
-            BaseLLMProvider: LLM提供商实例
+            BaseLLMProvider: LLM提供商实例（外层包装截止时间/重试/熔断；配置了 LLM_RPM / LLM_TPM 时内层包装限流；最内层记录指标）
 
         Raises:
             ValueError: 如果提供商不存在或API密钥缺失
@@ -62,29 +78,199 @@ class LLMFactory:
                 f"Available providers: {available}"
             )
 
+        provider_class = cls._providers[provider_name]
+
         # 获取API密钥
         if api_key is None:
             # 尝试从环境变量读取
-            env_key_map = {
-                "deepseek": "DEEPSEEK_API_KEY",
-                "openai": "OPENAI_API_KEY",
-            }
-            env_key = env_key_map.get(provider_name)
+            env_key = api_key_env or provider_class.API_KEY_ENV
             if env_key:
                 api_key = os.environ.get(env_key)
 
-            if not api_key:
+            if not api_key and provider_class.REQUIRES_API_KEY:
                 raise ValueError(
                     f"API key not provided and not found in environment variable {env_key}"
                 )
 
         # 创建提供商实例
-        provider_class = cls._providers[provider_name]
         if model:
             kwargs["model"] = model
 
         logger.info(f"Creating LLM provider: {provider_name}")
-        return provider_class(api_key=api_key, **kwargs)
+        provider = provider_class(api_key=api_key, **kwargs)
+        if not wrap:
+            return provider
+
+        breaker = get_circuit_breaker(provider_name, provider.model, getattr(provider, "endpoint", None))
+
+        # 指标紧贴具体提供商：每次真实请求（含重试）单独计时，不含限流等待
+        provider = InstrumentedProvider(provider, provider_name)
+
+        # 配额按 API 密钥计算：同一密钥的所有实例共享同一个限流器
+        limiter = get_rate_limiter(provider_name, api_key)
+        if limiter.enabled:
+            provider = RateLimitedProvider(provider, limiter)
+
+        # 重试在限流之外：每次重试都是一次真实请求，需要占用配额；熔断器按 (提供商, 模型, endpoint) 共享
+        return ResilientProvider(
+            provider,
+            breaker,
+            deadline=settings.LLM_TURN_DEADLINE,
+            max_attempts=settings.LLM_RETRY_ATTEMPTS,
+            base_delay=settings.LLM_RETRY_BASE_DELAY,
+            max_delay=settings.LLM_RETRY_MAX_DELAY,
+        )
+
+    @classmethod
+    def get_shared(
+        cls,
+        provider_name: str,
+        api_key: Optional[str] = None,
+        model: Optional[str] = None,
+        api_key_env: Optional[str] = None,
+        **kwargs
+    ) -> BaseLLMProvider:
+        """获取共享的提供商实例（参数同 create），相同配置只创建一次
+
+        提供商本身无会话状态，所有会话共享同一个实例即可复用其连接池。
+        值为 None 的参数视为使用默认值。
+        额外参数 hedge="openai" 或 "openai:gpt-4o-mini" 时返回对冲包装（见 _get_hedged）；
+        route="deepseek,openai:gpt-4o-mini" 时返回按健康度路由的包装（见 _get_routed），两者可以叠加；
+        cache=True 时在最外层加响应缓存（见 _get_cached）。
+        """
+        cache = kwargs.pop("cache", None)
+        hedge = kwargs.pop("hedge", None)
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        provider_name = provider_name.lower()
+        if cache:
+            inner = cls.get_shared(provider_name, api_key=api_key, model=model, api_key_env=api_key_env, hedge=hedge, **kwargs)
+            return cls._get_cached(inner, provider_name)
+        if hedge:
+            return cls._get_hedged(provider_name, hedge, api_key=api_key, model=model, api_key_env=api_key_env, **kwargs)
+        route = kwargs.pop("route", None)
+        if route:
+            return cls._get_routed(provider_name, route, api_key=api_key, model=model, api_key_env=api_key_env, **kwargs)
+        if api_key is None and provider_name in cls._providers:
+            env_key = api_key_env or cls._providers[provider_name].API_KEY_ENV
+            api_key = os.environ.get(env_key) if env_key else None
+        key = (provider_name, api_key, model, tuple(sorted(kwargs.items())))
+        with cls._shared_lock:
+            provider = cls._shared.get(key)
+            if provider is None:
+                provider = cls.create(provider_name, api_key=api_key, model=model, api_key_env=api_key_env, **kwargs)
+                cls._shared[key] = provider
+            return provider
+
+    @classmethod
+    def _get_cached(cls, inner: BaseLLMProvider, provider_name: str) -> BaseLLMProvider:
+        """包装响应缓存的共享实例（所有实例共用进程内同一个缓存，键中区分提供商与 endpoint）"""
+        key = ("cache", id(inner))
+        with cls._shared_lock:
+            cached = cls._shared.get(key)
+            if cached is None:
+                cached = CachedProvider(
+                    inner, get_response_cache(), max_temperature=settings.LLM_CACHE_MAX_TEMPERATURE, provider_name=provider_name
+                )
+                cls._shared[key] = cached
+            return cached
+
+    @classmethod
+    def _get_hedged(cls, provider_name: str, hedge: str, model: Optional[str] = None, **kwargs) -> BaseLLMProvider:
+        """主提供商 + 备用提供商的共享对冲实例
+
+        hedge 形如 "提供商[:模型]"。备用提供商使用相同的温度、max_tokens 与超时，但不继承主提供商的
+        endpoint / API 密钥。备用提供商不可用（如缺少 API 密钥）时记录警告并只使用主提供商。
+        """
+        primary = cls.get_shared(provider_name, model=model, **kwargs)
+        secondary_name, _, secondary_model = hedge.partition(":")
+        secondary_name = secondary_name.strip().lower()
+        key = ("hedge", id(primary), secondary_name, secondary_model)
+        with cls._shared_lock:
+            hedged = cls._shared.get(key)
+        if hedged is not None:
+            return hedged
+
+        common = {k: v for k, v in kwargs.items() if k in ("temperature", "max_tokens", "timeout")}
+        try:
+            secondary = cls.get_shared(secondary_name, model=secondary_model.strip() or None, **common)
+        except ValueError as exc:
+            logger.warning(f"Hedging disabled, secondary provider '{hedge}' unavailable: {exc}")
+            return primary
+        hedged = HedgedProvider(
+            primary,
+            secondary,
+            primary_label=f"{provider_name}:{primary.model}",
+            secondary_label=f"{secondary_name}:{secondary.model}",
+            percentile=settings.LLM_HEDGE_PERCENTILE,
+            min_delay=settings.LLM_HEDGE_MIN_DELAY,
+            initial_delay=settings.LLM_HEDGE_INITIAL_DELAY,
+        )
+        with cls._shared_lock:
+            return cls._shared.setdefault(key, hedged)
+
+    @classmethod
+    def _get_routed(cls, provider_name: str, route: str, model: Optional[str] = None, **kwargs) -> BaseLLMProvider:
+        """在主提供商与 route 中列出的候选之间按健康度路由的共享实例
+
+        route 形如 "提供商[:模型],提供商[:模型]"。主提供商（含其 endpoint 等配置）总是第一个候选；
+        其余候选使用相同的温度、max_tokens 与超时，缺少 API 密钥的候选会被跳过。
+        """
+        primary = cls.get_shared(provider_name, model=model, **kwargs)
+        key = ("route", id(primary), route)
+        with cls._shared_lock:
+            routed = cls._shared.get(key)
+        if routed is not None:
+            return routed
+
+        common = {k: v for k, v in kwargs.items() if k in ("temperature", "max_tokens", "timeout")}
+        candidates = [(f"{provider_name}:{primary.model}", primary)]
+        for spec in route.split(","):
+            name, _, candidate_model = spec.strip().partition(":")
+            name = name.strip().lower()
+            if not name:
+                continue
+            try:
+                provider = cls.get_shared(name, model=candidate_model.strip() or None, **common)
+            except ValueError as exc:
+                logger.warning(f"Routing candidate '{spec.strip()}' skipped: {exc}")
+                continue
+            label = f"{name}:{provider.model}"
+            if provider is not primary and all(label != existing for existing, _ in candidates):
+                candidates.append((label, provider))
+        if len(candidates) == 1:
+            return primary
+
+        routed = RoutedProvider(
+            candidates,
+            alpha=settings.LLM_ROUTER_EWMA_ALPHA,
+            error_penalty=settings.LLM_ROUTER_ERROR_PENALTY,
+            probe_interval=settings.LLM_ROUTER_PROBE_INTERVAL,
+        )
+        with cls._shared_lock:
+            return cls._shared.setdefault(key, routed)
+
+    @classmethod
+    def route_stats(cls) -> list[Dict]:
+        """所有路由实例的统计（每个候选的响应耗时 / 首 token 耗时 / 错误率 EWMA、得分与当前选择）"""
+        with cls._shared_lock:
+            providers = [p for p in cls._shared.values() if isinstance(p, RoutedProvider)]
+        return [provider.stats() for provider in providers]
+
+    @classmethod
+    def hedge_stats(cls) -> list[Dict]:
+        """所有对冲实例的统计（每一路的请求数、获胜数、被取消数，以及完整响应 / 首 token 耗时分位数）"""
+        with cls._shared_lock:
+            providers = [p for p in cls._shared.values() if isinstance(p, HedgedProvider)]
+        return [provider.stats() for provider in providers]
+
+    @classmethod
+    def clear_shared(cls) -> None:
+        """关闭并清空共享实例（测试或切换配置时使用）"""
+        with cls._shared_lock:
+            providers = list(cls._shared.values())
+            cls._shared.clear()
+        for provider in providers:
+            provider.close()
 
     @classmethod
     def list_providers(cls) -> list[str]:
@@ -0,0 +1,265 @@
+"""对冲请求 - 主提供商迟迟没有首个 token 时，向备用提供商/模型发出副本请求并择先完成者
+
+`HedgedProvider` 先只向主提供商发请求；若在「对冲延迟」内没有拿到结果（流式为首个片段），
+再向备用提供商发出同样的请求，两者谁先产出就用谁，另一个立即取消（连接随之关闭）。
+主提供商在对冲延迟之前就失败（如熔断、5xx）时，立即转向备用提供商。
+
+对冲延迟取主提供商近期耗时的分位数（LLM_HEDGE_PERCENTILE，默认 p95）：
+只有落在尾部的那一小部分请求会被复制，额外开销约为 (100 - 分位数)% 的请求量。
+普通调用与流式调用的耗时含义不同（完整响应 / 首个片段），各自保留一个滑动窗口、各自计算对冲延迟。
+每一路都统计请求数、获胜数、被取消数、失败数与两种耗时的分位数，用于判断额外花费是否值得。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Deque, Dict, List, Optional, Tuple
+
+from .base import BaseLLMProvider, LLMResponse, Message
+from .wrapper import ProviderWrapper
+
+logger = logging.getLogger(__name__)
+
+# 样本不足时使用初始延迟；滑动窗口保留的样本数
+_MIN_SAMPLES = 20
+_WINDOW_SIZE = 200
+
+# 耗时窗口的种类及其统计名称：普通调用为完整响应耗时，流式调用为首个片段耗时
+MODES = {"chat": "completion", "stream": "first_token"}
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LegStats:
+    """对冲中一路（一个提供商/模型）的计数与耗时窗口（普通调用、流式调用各一个）"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.requests = 0
+        self.wins = 0
+        self.cancelled = 0
+        self.errors = 0
+        self._latencies: Dict[str, Deque[float]] = {mode: deque(maxlen=_WINDOW_SIZE) for mode in MODES}
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float, mode: str = "chat") -> None:
+        with self._lock:
+            self._latencies[mode].append(latency)
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_win(self, latency: float, mode: str = "chat") -> None:
+        with self._lock:
+            self.wins += 1
+            self._latencies[mode].append(latency)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def record_cancel(self, waited: float, mode: str = "chat") -> None:
+        """落败方被取消；真实耗时未知，按已等待的时间记为下界，避免分位数只统计快的请求而偏低"""
+        with self._lock:
+            self.cancelled += 1
+            self._latencies[mode].append(waited)
+
+    def percentile(self, pct: float, mode: str = "chat") -> Optional[float]:
+        with self._lock:
+            if len(self._latencies[mode]) < _MIN_SAMPLES:
+                return None
+            return _percentile(list(self._latencies[mode]), pct)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            windows = {mode: list(samples) for mode, samples in self._latencies.items()}
+            result: Dict[str, Any] = {
+                "label": self.label,
+                "requests": self.requests,
+                "wins": self.wins,
+                "cancelled": self.cancelled,
+                "errors": self.errors,
+            }
+        for mode, name in MODES.items():
+            samples = windows[mode]
+            for pct in (50, 95, 99):
+                result[f"{name}_p{pct}_s"] = round(_percentile(samples, pct), 3) if samples else None
+        return result
+
+
+class HedgedProvider(ProviderWrapper):
+    """主提供商 + 备用提供商的对冲包装；model、temperature 等属性转发给主提供商"""
+
+    def __init__(
+        self,
+        inner: BaseLLMProvider,
+        secondary: BaseLLMProvider,
+        primary_label: str,
+        secondary_label: str,
+        percentile: float = 95.0,
+        min_delay: float = 0.3,
+        initial_delay: float = 2.0,
+    ):
+        """
+        Args:
+            inner: 主提供商
+            secondary: 备用提供商（另一家提供商或同一提供商的另一个模型）
+            primary_label / secondary_label: 统计展示用的名称，如 "deepseek:deepseek-chat"
+            percentile: 对冲延迟取主提供商耗时的哪个分位数
+            min_delay: 对冲延迟下限（秒），避免样本偏快时几乎每个请求都被复制
+            initial_delay: 样本不足时使用的对冲延迟（秒）
+        """
+        super().__init__(inner)
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.primary_stats = LegStats(primary_label)
+        self.secondary_stats = LegStats(secondary_label)
+        self.calls = 0
+        self.hedged = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, mode: str = "chat") -> float:
+        """当前的对冲延迟：主提供商该调用方式耗时（完整响应 / 首个片段）的分位数，样本不足时为初始延迟"""
+        observed = self.primary_stats.percentile(self.percentile, mode)
+        return self.initial_delay if observed is None else max(self.min_delay, observed)
+
+    async def _race(self, start_primary, start_secondary, mode: str) -> Tuple[Any, str]:
+        """执行对冲竞速
+
+        Args:
+            start_primary / start_secondary: 无参函数，返回该路「首个结果」的可等待对象
+            mode: "chat"（结果为完整响应）或 "stream"（结果为首个片段），决定使用哪个耗时窗口
+
+        Returns:
+            (获胜结果, 获胜方 "primary" / "secondary")；两路都失败时抛出先出现的异常
+        """
+        with self._lock:
+            self.calls += 1
+        legs: Dict[asyncio.Task, Tuple[str, LegStats, float]] = {}
+
+        def launch(name: str, factory, stats: LegStats) -> None:
+            stats.record_request()
+            legs[asyncio.ensure_future(factory())] = (name, stats, time.monotonic())
+
+        launch("primary", start_primary, self.primary_stats)
+        first_error: Optional[BaseException] = None
+        try:
+            done, pending = await asyncio.wait(set(legs), timeout=self.hedge_delay(mode))
+            while True:
+                for task in done:
+                    name, stats, started = legs[task]
+                    if task.exception() is None:
+                        stats.record_win(time.monotonic() - started, mode)
+                        return task.result(), name
+                    stats.record_error()
+                    first_error = first_error or task.exception()
+                    logger.warning(f"Hedged leg {stats.label} failed: {task.exception()!r}")
+                if len(legs) == 1:
+                    # 主提供商超过对冲延迟仍未产出，或已经失败：发出副本请求
+                    with self._lock:
+                        self.hedged += 1
+                    launch("secondary", start_secondary, self.secondary_stats)
+                    pending = {task for task in legs if not task.done()}
+                if not pending:
+                    raise first_error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            losers = [task for task in legs if not task.done()]
+            for task in losers:
+                _, stats, started = legs[task]
+                stats.record_cancel(time.monotonic() - started, mode)
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        def call(provider: BaseLLMProvider):
+            return lambda: provider.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+
+        response, _ = await self._race(call(self.inner), call(self.secondary), "chat")
+        return response
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        streams: Dict[str, AsyncIterator[str]] = {}
+
+        def first_chunk(name: str, provider: BaseLLMProvider):
+            def start() -> Awaitable[Optional[str]]:
+                streams[name] = provider.chat_stream(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+                return self._next_or_none(streams[name])
+            return start
+
+        winner = None
+        try:
+            chunk, winner = await self._race(
+                first_chunk("primary", self.inner), first_chunk("secondary", self.secondary), "stream"
+            )
+        finally:
+            # 落败、失败或被取消的一路：关闭其流（获胜方在下面继续读取）
+            for name, stream in streams.items():
+                if name != winner:
+                    await stream.aclose()
+        stream = streams[winner]
+        try:
+            if chunk is None:
+                return
+            yield chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    @staticmethod
+    async def _next_or_none(stream: AsyncIterator[str]) -> Optional[str]:
+        """流的第一个片段；空流返回 None"""
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def _get_client(self):
+        return self.inner._get_client()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+        await self.secondary.aclose()
+
+    def close(self) -> None:
+        self.inner.close()
+        self.secondary.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls, hedged = self.calls, self.hedged
+        return {
+            "calls": calls,
+            "hedged": hedged,
+            "hedge_rate": round(hedged / calls, 3) if calls else 0.0,
+            "hedge_delay_s": {mode: round(self.hedge_delay(mode), 3) for mode in MODES},
+            "legs": [self.primary_stats.snapshot(), self.secondary_stats.snapshot()],
+        }
+
+
+__all__ = ["HedgedProvider", "LegStats"]
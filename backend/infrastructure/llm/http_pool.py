@@ -0,0 +1,113 @@
+"""LLM HTTP 连接池 - 提供商持有的长连接客户端
+
+每次请求都新建 `httpx.AsyncClient` 意味着每轮对话都要重新做 TCP/TLS 握手。
+`PooledClient` 为每个提供商保留一个长期存活的客户端（连接池 + keep-alive，可选 HTTP/2）。
+
+注意：AsyncClient 的连接绑定在创建它的事件循环上，因此这里按事件循环分别缓存客户端；
+同一个事件循环内的所有请求共享同一个连接池。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import weakref
+
+import httpx
+
+from backend import settings
+
+logger = logging.getLogger(__name__)
+
+_live_pools: "weakref.WeakSet[PooledClient]" = weakref.WeakSet()
+_http2_warned = False
+
+
+def build_limits() -> httpx.Limits:
+    """按 settings 构建连接池限制"""
+    return httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def http2_enabled() -> bool:
+    """LLM_HTTP2 开启且已安装 h2 时返回 True；缺少依赖时回退到 HTTP/1.1"""
+    global _http2_warned
+    if not settings.LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        if not _http2_warned:
+            logger.warning('LLM_HTTP2 is enabled but h2 is not installed (pip install "httpx[http2]"); using HTTP/1.1')
+            _http2_warned = True
+        return False
+    return True
+
+
+class PooledClient:
+    """按事件循环缓存的长连接 AsyncClient"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        _live_pools.add(self)
+
+    def get(self) -> httpx.AsyncClient:
+        """返回当前事件循环上的客户端（不存在或已关闭时新建），必须在协程内调用"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=build_limits(),
+                    http2=http2_enabled(),
+                )
+                self._clients[loop] = client
+            return client
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的客户端"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.pop(loop, None)
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+    def close(self) -> None:
+        """关闭所有事件循环上的客户端（应用关闭时在主线程调用）"""
+        with self._lock:
+            items = list(self._clients.items())
+            self._clients.clear()
+        for loop, client in items:
+            if client.is_closed or loop.is_closed():
+                continue
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+                else:
+                    loop.run_until_complete(client.aclose())
+            except Exception as exc:
+                logger.warning(f"Failed to close pooled HTTP client: {exc}")
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+def close_all_clients() -> None:
+    """关闭进程内所有提供商的长连接客户端"""
+    for pool in list(_live_pools):
+        pool.close()
+
+
+async def aclose_all_clients() -> None:
+    """关闭当前事件循环上所有提供商的客户端（用于 ASGI 服务器关闭时，在其事件循环内调用）"""
+    for pool in list(_live_pools):
+        await pool.aclose()
+
+
+__all__ = ["PooledClient", "aclose_all_clients", "build_limits", "close_all_clients", "http2_enabled"]
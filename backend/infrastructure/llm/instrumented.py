@@ -0,0 +1,107 @@
+"""指标包装 - 记录每次真实上游请求的耗时、错误与 token 用量
+
+位于包装链最内层（紧贴具体提供商）：每次重试、每个对冲请求都单独计数，
+耗时不包含限流等待与重试退避，反映的是提供商本身的表现。
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from backend.infrastructure.metrics import LLM_ERRORS, LLM_FIRST_TOKEN, LLM_LATENCY, LLM_REQUESTS, LLM_TOKENS
+from .base import BaseLLMProvider, LLMResponse, Message, ProviderHTTPError, prompt_cache_hit_tokens
+from .wrapper import ProviderWrapper
+
+
+def error_kind(exc: BaseException) -> str:
+    """错误分类标签：http_<状态码>、timeout 或异常类名"""
+    if isinstance(exc, ProviderHTTPError):
+        return f"http_{exc.status_code}"
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(exc).__name__:
+        return "timeout"
+    return type(exc).__name__
+
+
+class InstrumentedProvider(ProviderWrapper):
+    """按提供商名记录请求数、耗时、错误与 usage 中的 token 数"""
+
+    def __init__(self, inner: BaseLLMProvider, provider_name: str):
+        super().__init__(inner)
+        self.provider_name = provider_name
+
+    def _record(self, mode: str, started: float, exc: Optional[BaseException]) -> None:
+        if isinstance(exc, asyncio.CancelledError):
+            # 对冲取消的落后请求、客户端断开等，不算提供商错误
+            outcome = "cancelled"
+        elif exc is not None:
+            outcome = "error"
+            LLM_ERRORS.inc(provider=self.provider_name, kind=error_kind(exc))
+        else:
+            outcome = "ok"
+        LLM_REQUESTS.inc(provider=self.provider_name, mode=mode, outcome=outcome)
+        LLM_LATENCY.observe(time.perf_counter() - started, provider=self.provider_name, mode=mode)
+
+    def _record_usage(self, usage: Optional[Dict]) -> None:
+        if not usage:
+            return
+        for kind in ("prompt", "completion"):
+            tokens = usage.get(f"{kind}_tokens")
+            if isinstance(tokens, int) and tokens > 0:
+                LLM_TOKENS.inc(tokens, provider=self.provider_name, type=kind)
+        cached = prompt_cache_hit_tokens(usage)
+        if cached:
+            LLM_TOKENS.inc(cached, provider=self.provider_name, type="cache_hit")
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        started = time.perf_counter()
+        try:
+            response = await self.inner.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        except BaseException as exc:
+            self._record("chat", started, exc)
+            raise
+        self._record("chat", started, None)
+        self._record_usage(response.usage)
+        return response
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        on_usage = kwargs.pop("on_usage", None)
+
+        def capture(data: Dict) -> None:
+            self._record_usage(data)
+            if on_usage is not None:
+                on_usage(data)
+
+        started = time.perf_counter()
+        first = True
+        try:
+            async for chunk in self.inner.chat_stream(
+                messages, temperature=temperature, max_tokens=max_tokens, on_usage=capture, **kwargs
+            ):
+                if first and chunk:
+                    first = False
+                    LLM_FIRST_TOKEN.observe(time.perf_counter() - started, provider=self.provider_name)
+                yield chunk
+        except GeneratorExit:
+            # 调用方提前关闭了流（如对冲选中了另一路）
+            self._record("stream", started, asyncio.CancelledError())
+            raise
+        except BaseException as exc:
+            self._record("stream", started, exc)
+            raise
+        self._record("stream", started, None)
+
+
+__all__ = ["InstrumentedProvider", "error_kind"]
@@ -0,0 +1,146 @@
+"""后台事件循环 - 供同步代码调用异步 LLM 接口
+
+进程内只运行一个专用的事件循环线程，同步调用方（如 Flask 工作线程）通过
+`run_coroutine_threadsafe` 把协程提交给它并等待结果。
+与每次调用新建事件循环相比，省去了循环的创建/销毁开销，
+提供商的长连接客户端（PooledClient）也能在多次调用之间复用连接。
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import logging
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """在守护线程中常驻运行的事件循环（首次使用时启动）"""
+
+    def __init__(self, name: str = "llm-event-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """返回正在运行的事件循环，必要时启动线程"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            loop = self._start()
+        return loop
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None and not self._loop.is_closed():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            thread = threading.Thread(target=self._run, args=(loop, ready), name=self.name, daemon=True)
+            thread.start()
+            ready.wait()
+            self._loop, self._thread = loop, thread
+            logger.info(f"Started background event loop thread: {self.name}")
+            return loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop, ready: threading.Event) -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def submit(self, coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+        """把协程提交到后台循环，返回线程安全的 Future
+
+        协程在调用方 contextvars 上下文的副本中运行（便于日志/追踪等上下文透传）。
+        """
+        loop = self.loop
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("BackgroundLoop.submit() called from the loop thread; await the coroutine instead")
+        return contextvars.copy_context().run(asyncio.run_coroutine_threadsafe, coro, loop)
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """同步等待协程结果
+
+        Raises:
+            TimeoutError: 超过 timeout 秒未完成（协程会被取消）
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"LLM call did not finish within {timeout}s")
+        except BaseException:
+            # 调用方被中断（KeyboardInterrupt、线程关闭等）时取消后台任务
+            future.cancel()
+            raise
+
+    def iterate(self, stream: AsyncIterator[T], timeout: Optional[float] = None) -> Iterator[T]:
+        """把异步迭代器转换为同步迭代器
+
+        timeout 作用于每一个片段的等待时间；生成器被提前关闭时会在后台循环上 aclose 异步迭代器。
+        """
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                try:
+                    item = self.run(iterator.__anext__(), timeout=timeout)
+                except StopAsyncIteration:
+                    break
+                yield item
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None and self.running:
+                try:
+                    self.run(aclose(), timeout=5)
+                except Exception as exc:
+                    logger.warning(f"Failed to close async stream: {exc}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止事件循环并等待线程退出（未完成的任务会被取消）"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is None or thread is None:
+            return
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(loop.stop)
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+
+
+_background_loop = BackgroundLoop()
+
+
+def get_background_loop() -> BackgroundLoop:
+    """获取进程内共享的后台事件循环"""
+    return _background_loop
+
+
+# 在模块导入时注册：atexit 后注册先执行，应用注册的客户端关闭逻辑会先于停止循环运行
+atexit.register(_background_loop.stop)
+
+
+__all__ = ["BackgroundLoop", "get_background_loop"]
@@ -0,0 +1,394 @@
+"""按 API 密钥限流 - 请求数（RPM）与 token 数（TPM）双令牌桶
+
+提供商的配额是按 API 密钥计算的，所有会话（以及同机的多个工作进程）共享同一份预算。
+`RateLimitedProvider` 在每次调用前预留预算：
+- 请求桶预留 1 个请求；token 桶预留「估算的提示词 token + 近期平均完成 token」；
+- 桶内余量不足时不会立即失败，而是按补充速率计算需要等待的时间并排队（平滑突发）；
+- 调用结束后按响应中的 usage 多退少补。
+等待时间超过上限时抛出 `RateLimitExceeded`（路由层返回 429）。
+
+状态后端：
+- memory：进程内共享（默认）
+- sqlite：同一台机器上的多个工作进程通过 SQLite 文件共享（事务内原子更新）
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from backend import settings
+from .base import BaseLLMProvider, LLMResponse, Message
+from .tokens import estimate_messages_tokens
+from .wrapper import ProviderWrapper
+
+logger = logging.getLogger(__name__)
+
+_COMPLETION_EWMA_ALPHA = 0.2
+
+
+class RateLimitExceeded(RuntimeError):
+    """按当前配额需要等待的时间超过上限"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """令牌桶参数：capacity 为突发容量，rate 为每秒补充量"""
+
+    name: str
+    capacity: float
+    rate: float
+
+
+def _refill(level: float, updated: float, bucket: Bucket, now: float) -> float:
+    return min(bucket.capacity, level + max(0.0, now - updated) * bucket.rate)
+
+
+def _plan(levels: Sequence[float], buckets: Sequence[Bucket], amounts: Sequence[float]) -> float:
+    """计算所有桶都足够时需要等待的秒数（余量可以为负，代表已被预留的未来额度）"""
+    wait = 0.0
+    for level, bucket, amount in zip(levels, buckets, amounts):
+        if amount > level:
+            wait = max(wait, (amount - level) / bucket.rate)
+    return wait
+
+
+class MemoryRateLimitBackend:
+    """进程内令牌桶状态"""
+
+    blocking = False
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, buckets: Sequence[Bucket], amounts: Sequence[float], max_wait: float) -> Tuple[bool, float]:
+        """原子地在所有桶中预留额度；返回 (是否预留成功, 需要等待的秒数)"""
+        now = time.time()
+        with self._lock:
+            levels = [_refill(*self._state.get(b.name, (b.capacity, now)), b, now) for b in buckets]
+            wait = _plan(levels, buckets, amounts)
+            if wait > max_wait:
+                return False, wait
+            for level, bucket, amount in zip(levels, buckets, amounts):
+                self._state[bucket.name] = (level - amount, now)
+            return True, wait
+
+    def adjust(self, bucket: Bucket, delta: float) -> None:
+        """归还（delta > 0）或追加扣除（delta < 0）额度"""
+        now = time.time()
+        with self._lock:
+            level = _refill(*self._state.get(bucket.name, (bucket.capacity, now)), bucket, now)
+            self._state[bucket.name] = (min(bucket.capacity, level + delta), now)
+
+
+class SQLiteRateLimitBackend:
+    """基于 SQLite 文件的令牌桶状态，供同机多进程共享（BEGIN IMMEDIATE 保证原子性）"""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _levels(self, conn: sqlite3.Connection, buckets: Sequence[Bucket], now: float) -> List[float]:
+        levels = []
+        for bucket in buckets:
+            row = conn.execute("SELECT level, updated FROM buckets WHERE name = ?", (bucket.name,)).fetchone()
+            level, updated = row if row else (bucket.capacity, now)
+            levels.append(_refill(level, updated, bucket, now))
+        return levels
+
+    def reserve(self, buckets: Sequence[Bucket], amounts: Sequence[float], max_wait: float) -> Tuple[bool, float]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            levels = self._levels(conn, buckets, now)
+            wait = _plan(levels, buckets, amounts)
+            if wait > max_wait:
+                conn.execute("ROLLBACK")
+                return False, wait
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                [(b.name, level - amount, now) for level, b, amount in zip(levels, buckets, amounts)],
+            )
+            conn.execute("COMMIT")
+            return True, wait
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def adjust(self, bucket: Bucket, delta: float) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            level = self._levels(conn, [bucket], now)[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                (bucket.name, min(bucket.capacity, level + delta), now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RateLimiter:
+    """单个 API 密钥的请求/token 双令牌桶"""
+
+    def __init__(
+        self,
+        key: str,
+        backend,
+        rpm: int = 0,
+        tpm: int = 0,
+        burst_seconds: float = 10.0,
+        max_wait: float = 20.0,
+    ):
+        """
+        Args:
+            key: 桶名前缀（提供商 + API 密钥摘要）
+            backend: MemoryRateLimitBackend / SQLiteRateLimitBackend
+            rpm / tpm: 每分钟请求数 / token 数上限，0 表示不限制
+            burst_seconds: 突发容量相当于多少秒的配额
+            max_wait: 允许排队等待预算的最长秒数
+        """
+        self.key = key
+        self.backend = backend
+        self.max_wait = max_wait
+        self.request_bucket = self._bucket("rpm", rpm, burst_seconds, minimum=1)
+        self.token_bucket = self._bucket("tpm", tpm, burst_seconds, minimum=1)
+        # 统计计数可能在多个线程中更新（SQLite 后端在线程池中预留）
+        self._stats_lock = threading.Lock()
+        self.throttled = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def _bucket(self, kind: str, per_minute: int, burst_seconds: float, minimum: float) -> Optional[Bucket]:
+        if per_minute <= 0:
+            return None
+        rate = per_minute / 60.0
+        return Bucket(f"{self.key}:{kind}", capacity=max(minimum, rate * burst_seconds), rate=rate)
+
+    @property
+    def enabled(self) -> bool:
+        return self.request_bucket is not None or self.token_bucket is not None
+
+    def _reserve_sync(self, tokens: int) -> float:
+        buckets, amounts = [], []
+        if self.request_bucket is not None:
+            buckets.append(self.request_bucket)
+            amounts.append(1)
+        if self.token_bucket is not None:
+            buckets.append(self.token_bucket)
+            amounts.append(tokens)
+        ok, wait = self.backend.reserve(buckets, amounts, self.max_wait)
+        if not ok:
+            with self._stats_lock:
+                self.rejected += 1
+            raise RateLimitExceeded(
+                f"rate limit for {self.key} needs {wait:.1f}s wait (max {self.max_wait:.0f}s)",
+                retry_after=max(1, int(wait - self.max_wait) + 1),
+            )
+        if wait > 0:
+            with self._stats_lock:
+                self.throttled += 1
+                self.total_wait += wait
+        return wait
+
+    async def acquire(self, tokens: int) -> float:
+        """预留 1 个请求与 tokens 个 token，必要时等待；返回等待的秒数"""
+        if not self.enabled:
+            return 0.0
+        if self.backend.blocking:
+            wait = await asyncio.to_thread(self._reserve_sync, tokens)
+        else:
+            wait = self._reserve_sync(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    async def settle(self, reserved_tokens: int, actual_tokens: Optional[int]) -> None:
+        """按实际用量修正 token 桶（多退少补）"""
+        if self.token_bucket is None or actual_tokens is None:
+            return
+        delta = reserved_tokens - actual_tokens
+        if delta == 0:
+            return
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.adjust, self.token_bucket, delta)
+        else:
+            self.backend.adjust(self.token_bucket, delta)
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            throttled, rejected, total_wait = self.throttled, self.rejected, self.total_wait
+        return {
+            "key": self.key,
+            "rpm": round(self.request_bucket.rate * 60) if self.request_bucket else 0,
+            "tpm": round(self.token_bucket.rate * 60) if self.token_bucket else 0,
+            "throttled": throttled,
+            "rejected": rejected,
+            "throttle_wait_s_total": round(total_wait, 3),
+        }
+
+
+class RateLimitedProvider(ProviderWrapper):
+    """调用前按 API 密钥的配额预留预算，调用后按 usage 修正
+
+    请求失败且没有产出任何内容时归还预留的 token（请求数额度不归还，请求确实发出了）；
+    流式中途失败时按已收到的 usage 修正，没有 usage 则保留预留。被取消的请求同样保留预留，
+    因为提供商可能已经开始计费。
+    """
+
+    def __init__(self, inner: BaseLLMProvider, limiter: RateLimiter):
+        super().__init__(inner)
+        self.limiter = limiter
+        # 完成 token 的近期平均值（首次调用前按 max_tokens 的一半估计）
+        self._completion_ewma = float(inner.max_tokens) / 2
+
+    def _reserve_tokens(self, messages: List[Message], max_tokens: Optional[int]) -> int:
+        prompt = estimate_messages_tokens(msg.content for msg in messages)
+        completion = min(self._completion_ewma, float(self._get_max_tokens(max_tokens)))
+        return int(prompt + completion)
+
+    def _observe(self, usage: Optional[Dict]) -> Optional[int]:
+        if not usage:
+            return None
+        completion = usage.get("completion_tokens")
+        if isinstance(completion, int):
+            self._completion_ewma += _COMPLETION_EWMA_ALPHA * (completion - self._completion_ewma)
+        total = usage.get("total_tokens")
+        return total if isinstance(total, int) else None
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        reserved = self._reserve_tokens(messages, max_tokens)
+        await self.limiter.acquire(reserved)
+        try:
+            response = await self.inner.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        except Exception:
+            await self.limiter.settle(reserved, 0)
+            raise
+        await self.limiter.settle(reserved, self._observe(response.usage))
+        return response
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        reserved = self._reserve_tokens(messages, max_tokens)
+        await self.limiter.acquire(reserved)
+        usage: Dict = {}
+        on_usage = kwargs.pop("on_usage", None)
+
+        def capture(data: Dict) -> None:
+            usage.update(data)
+            if on_usage is not None:
+                on_usage(data)
+
+        started = False
+        try:
+            async for chunk in self.inner.chat_stream(
+                messages, temperature=temperature, max_tokens=max_tokens, on_usage=capture, **kwargs
+            ):
+                started = True
+                yield chunk
+        except Exception:
+            await self.limiter.settle(reserved, self._observe(usage) if started else 0)
+            raise
+        await self.limiter.settle(reserved, self._observe(usage))
+
+
+_backend = None
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        if settings.LLM_RATE_LIMIT_BACKEND == "sqlite":
+            path = settings.LLM_RATE_LIMIT_DB or os.path.join(tempfile.gettempdir(), "lyuyuan_rate_limit.sqlite3")
+            _backend = SQLiteRateLimitBackend(path)
+            logger.info(f"LLM rate limit state shared via SQLite: {path}")
+        else:
+            _backend = MemoryRateLimitBackend()
+    return _backend
+
+
+def rate_limit_key(provider_name: str, api_key: str) -> str:
+    """桶名使用 API 密钥的摘要，避免把密钥写入共享状态文件"""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    return f"{provider_name.lower()}:{digest}"
+
+
+def get_rate_limiter(provider_name: str, api_key: str) -> RateLimiter:
+    """获取某个 API 密钥的限流器（同一密钥的所有提供商实例共享）"""
+    key = rate_limit_key(provider_name, api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(
+                key,
+                _get_backend(),
+                rpm=settings.LLM_RPM,
+                tpm=settings.LLM_TPM,
+                burst_seconds=settings.LLM_RATE_LIMIT_BURST_SECONDS,
+                max_wait=settings.LLM_RATE_LIMIT_MAX_WAIT,
+            )
+            _limiters[key] = limiter
+        return limiter
+
+
+def rate_limit_stats() -> List[Dict[str, float]]:
+    with _limiters_lock:
+        return [limiter.stats() for limiter in _limiters.values() if limiter.enabled]
+
+
+__all__ = [
+    "Bucket",
+    "MemoryRateLimitBackend",
+    "RateLimitExceeded",
+    "RateLimitedProvider",
+    "RateLimiter",
+    "SQLiteRateLimitBackend",
+    "get_rate_limiter",
+    "rate_limit_key",
+    "rate_limit_stats",
+]
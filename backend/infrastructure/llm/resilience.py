@@ -0,0 +1,309 @@
+"""LLM 调用的容错层 - 截止时间、带抖动的退避重试与熔断器
+
+每个回合的 LLM 调用有一个端到端的截止时间（LLM_TURN_DEADLINE），所有尝试和退避等待都在这个预算内完成：
+- 5xx、408/429、连接重置、单次尝试超时视为暂时性故障，按「全抖动」指数退避后重试；
+- 其余错误（鉴权失败、参数错误、本地限流的 RateLimitExceeded 等）直接抛出，不重试、不计入熔断；
+- 每个 (提供商, 模型, endpoint) 一个熔断器：连续失败达到阈值后打开，打开期间调用立即抛出 `CircuitOpenError`，
+  冷却时间过后放行一个探测请求（半开），成功则关闭，失败则重新打开。
+截止时间用完时抛出 `DeadlineExceeded`。流式调用只在尚未产出任何片段时重试。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+from backend import settings
+from .base import BaseLLMProvider, LLMResponse, Message, ProviderHTTPError
+from .wrapper import ProviderWrapper
+
+logger = logging.getLogger(__name__)
+
+# 视为暂时性故障的 HTTP 状态码（另加所有 5xx）
+_RETRYABLE_STATUS = {408, 429}
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器打开，调用未发出"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """回合的 LLM 截止时间已用完"""
+
+
+def is_transient(exc: BaseException) -> bool:
+    """判断异常是否值得重试"""
+    if isinstance(exc, ProviderHTTPError):
+        return exc.status_code >= 500 or exc.status_code in _RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError, TimeoutError))
+
+
+class CircuitBreaker:
+    """按提供商统计连续失败次数的熔断器（线程安全，可被多个事件循环共享）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            name: 熔断器名称（如 "deepseek:deepseek-chat"）
+            failure_threshold: 连续失败多少次后打开，<= 0 表示不熔断
+            reset_timeout: 打开后多少秒放行探测请求
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.short_circuited = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> None:
+        """请求发出前调用；熔断期间抛出 CircuitOpenError"""
+        if self.failure_threshold <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probing:
+                # 冷却结束：只放行一个探测请求
+                self._probing = True
+                return
+            self.short_circuited += 1
+            retry_after = max(0.0, self.reset_timeout - (now - self._opened_at))
+        raise CircuitOpenError(f"circuit for {self.name} is open", retry_after=retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN or self._probing:
+                    self.trips += 1
+                    logger.warning(f"Circuit for {self.name} opened after {self._failures} consecutive failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release_probe(self) -> None:
+        """探测请求因非故障原因结束（如参数错误、被取消）时归还探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self._current_state(time.monotonic()),
+                "consecutive_failures": self._failures,
+                "trips": self.trips,
+                "short_circuited": self.short_circuited,
+            }
+
+
+class ResilientProvider(ProviderWrapper):
+    """在截止时间内重试暂时性故障，并通过熔断器快速失败"""
+
+    def __init__(
+        self,
+        inner: BaseLLMProvider,
+        breaker: CircuitBreaker,
+        deadline: float = 0.0,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 4.0,
+    ):
+        """
+        Args:
+            inner: 被包装的提供商
+            breaker: 该提供商共享的熔断器
+            deadline: 每次调用（含重试与退避）的总预算秒数，<= 0 时使用提供商的 timeout
+            max_attempts: 最多尝试次数（含首次）
+            base_delay / max_delay: 指数退避的基数与上限秒数
+        """
+        super().__init__(inner)
+        self.breaker = breaker
+        self.deadline = deadline if deadline > 0 else float(inner.timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.deadline_exceeded = 0
+
+    def _backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待时间（全抖动：0 到指数上限之间均匀取值）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def _attempt_timeout(self, expires: float) -> float:
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"LLM deadline of {self.deadline:.0f}s exhausted")
+        return min(remaining, float(self.inner.timeout))
+
+    async def _after_failure(self, exc: BaseException, attempt: int, expires: float) -> None:
+        """记录失败；不可重试或预算不足时重新抛出，否则退避等待"""
+        if not is_transient(exc):
+            self.breaker.release_probe()
+            raise exc
+        self.breaker.record_failure()
+        if attempt >= self.max_attempts:
+            raise exc
+        delay = self._backoff(attempt)
+        if time.monotonic() + delay >= expires:
+            self.deadline_exceeded += 1
+            raise DeadlineExceeded(f"LLM deadline of {self.deadline:.0f}s exhausted after {attempt} attempts") from exc
+        logger.warning(f"LLM attempt {attempt} failed ({exc!r}); retrying in {delay:.2f}s")
+        self.retries += 1
+        await asyncio.sleep(delay)
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        expires = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._attempt_timeout(expires)
+            self.breaker.allow()
+            try:
+                response = await asyncio.wait_for(
+                    self.inner.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs),
+                    timeout,
+                )
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as exc:
+                await self._after_failure(exc, attempt, expires)
+                continue
+            self.breaker.record_success()
+            return response
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        expires = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self._attempt_timeout(expires)
+            self.breaker.allow()
+            stream = self.inner.chat_stream(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+            started = False
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), self._attempt_timeout(expires))
+                    except StopAsyncIteration:
+                        break
+                    if not started:
+                        # 首个片段到达即视为提供商可用；之后的失败不再重试（已产出的内容无法撤回）
+                        started = True
+                        self.breaker.record_success()
+                    yield chunk
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as exc:
+                if started:
+                    if is_transient(exc):
+                        self.breaker.record_failure()
+                    raise
+                await self._after_failure(exc, attempt, expires)
+                continue
+            finally:
+                await stream.aclose()
+            if not started:
+                self.breaker.record_success()
+            return
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            **self.breaker.stats(),
+            "deadline_s": self.deadline,
+            "retries": self.retries,
+            "deadline_exceeded": self.deadline_exceeded,
+        }
+
+
+_breakers: Dict[Tuple[str, Optional[str], Optional[str]], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider_name: str, model: Optional[str] = None, endpoint: Optional[str] = None) -> CircuitBreaker:
+    """获取某个 (提供商, 模型, endpoint) 的熔断器（相同配置的所有实例共享）
+
+    同一提供商的不同模型或不同 endpoint 可能一个故障、另一个正常，因此各自熔断。
+    """
+    key = (provider_name.lower(), model, endpoint)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            name = f"{key[0]}:{model}" if model else key[0]
+            breaker = CircuitBreaker(
+                f"{name}@{endpoint}" if endpoint else name,
+                failure_threshold=settings.LLM_BREAKER_THRESHOLD,
+                reset_timeout=settings.LLM_BREAKER_RESET,
+            )
+            _breakers[key] = breaker
+        return breaker
+
+
+def circuit_stats() -> List[Dict[str, object]]:
+    with _breakers_lock:
+        return [breaker.stats() for breaker in _breakers.values()]
+
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "DeadlineExceeded",
+    "ResilientProvider",
+    "circuit_stats",
+    "get_circuit_breaker",
+    "is_transient",
+]
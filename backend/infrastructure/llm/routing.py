@@ -0,0 +1,220 @@
+"""按实时健康度路由 - 在多个提供商/模型之间为每个回合选择当前最好的一个
+
+`RoutedProvider` 为每个候选维护耗时与错误率的指数加权移动平均（EWMA），
+每次调用选择得分最低的候选：
+
+    得分 = 耗时 EWMA + 错误率 EWMA × 错误惩罚秒数（LLM_ROUTER_ERROR_PENALTY）
+
+- 耗时按调用方式分开统计，保证同一个 EWMA 里单位一致：普通调用记完整响应耗时，
+  流式调用记首 token 耗时，各自按本次调用的方式打分；
+- 还没有该方式样本的候选耗时记为 0，会被优先尝试一次；
+- 熔断器打开的候选不参与选择（全部打开时仍按得分选，交给熔断器快速失败）；
+- 本地限流（RateLimitExceeded）没有发出请求，不计入错误率；
+- 某个候选超过探测间隔没有被选中时，在后台发一个 max_tokens=1 的探测请求。探测只更新错误率
+  （它的耗时与正常回合不可比），这样出过错的提供商恢复后能重新被选中，而不必改环境变量重启进程。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+from .base import BaseLLMProvider, LLMResponse, Message
+from .rate_limit import RateLimitExceeded
+from .resilience import CircuitBreaker
+from .wrapper import ProviderWrapper
+
+logger = logging.getLogger(__name__)
+
+_PROBE_MESSAGES = [Message(role="user", content="ping")]
+
+# 耗时 EWMA 的种类：普通调用的完整响应耗时、流式调用的首 token 耗时
+MODES = ("chat", "stream")
+
+
+class ProviderHealth:
+    """单个候选的耗时（按调用方式分开）与错误率 EWMA"""
+
+    def __init__(self, label: str, alpha: float = 0.2):
+        self.label = label
+        self.alpha = alpha
+        self.latency: Dict[str, Optional[float]] = {mode: None for mode in MODES}
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.probes = 0
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, latency: Optional[float], ok: bool, mode: str = "chat") -> None:
+        """记录一次调用结果；失败时 latency 为 None（只更新错误率）"""
+        with self._lock:
+            self.requests += 1
+            self._record_outcome(ok)
+            if ok and latency is not None:
+                previous = self.latency[mode]
+                self.latency[mode] = latency if previous is None else previous + self.alpha * (latency - previous)
+
+    def record_probe(self, ok: bool) -> None:
+        """记录一次探测结果：只更新错误率，不计入请求数与耗时"""
+        with self._lock:
+            self.probes += 1
+            self._record_outcome(ok)
+
+    def _record_outcome(self, ok: bool) -> None:
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.errors += 1
+
+    def score(self, error_penalty: float, mode: str = "chat") -> float:
+        with self._lock:
+            return (self.latency[mode] or 0.0) + self.error_rate * error_penalty
+
+    def snapshot(self, error_penalty: float) -> Dict[str, Any]:
+        with self._lock:
+            latency = dict(self.latency)
+        return {
+            "label": self.label,
+            "latency_ewma_s": round(latency["chat"], 3) if latency["chat"] is not None else None,
+            "first_token_ewma_s": round(latency["stream"], 3) if latency["stream"] is not None else None,
+            "error_rate_ewma": round(self.error_rate, 3),
+            "score": round(self.score(error_penalty), 3),
+            "stream_score": round(self.score(error_penalty, "stream"), 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "probes": self.probes,
+        }
+
+
+class RoutedProvider(ProviderWrapper):
+    """在若干候选提供商之间按健康度路由；model、temperature 等属性转发给第一个候选"""
+
+    def __init__(
+        self,
+        candidates: Sequence[Tuple[str, BaseLLMProvider]],
+        alpha: float = 0.2,
+        error_penalty: float = 10.0,
+        probe_interval: float = 30.0,
+    ):
+        """
+        Args:
+            candidates: (名称, 提供商) 列表，名称如 "deepseek:deepseek-chat"；得分相同时靠前者优先
+            alpha: EWMA 平滑系数，越大越看重最近的调用
+            error_penalty: 错误率 1.0 相当于多少秒的额外耗时
+            probe_interval: 候选超过多少秒未被使用时发出后台探测，<= 0 表示不探测
+        """
+        if not candidates:
+            raise ValueError("RoutedProvider requires at least one candidate")
+        super().__init__(candidates[0][1])
+        self.candidates: List[Tuple[ProviderHealth, BaseLLMProvider]] = [
+            (ProviderHealth(label, alpha), provider) for label, provider in candidates
+        ]
+        self.error_penalty = error_penalty
+        self.probe_interval = probe_interval
+        self._probing: Set[str] = set()
+        self._probe_tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _available(provider: BaseLLMProvider) -> bool:
+        breaker = getattr(provider, "breaker", None)
+        return breaker is None or breaker.state != CircuitBreaker.OPEN
+
+    def choose(self, mode: str = "chat") -> Tuple[ProviderHealth, BaseLLMProvider]:
+        """按 mode（"chat" / "stream"）的耗时选择得分最低的可用候选"""
+        available = [c for c in self.candidates if self._available(c[1])] or self.candidates
+        return min(available, key=lambda c: c[0].score(self.error_penalty, mode))
+
+    def _schedule_probes(self, chosen: ProviderHealth) -> None:
+        """在当前事件循环上为长时间未被选中的候选发出探测（不阻塞本次调用）"""
+        if self.probe_interval <= 0:
+            return
+        now = time.monotonic()
+        chosen.last_used = now
+        for health, provider in self.candidates:
+            if now - health.last_used < self.probe_interval:
+                continue
+            with self._lock:
+                if health.label in self._probing:
+                    continue
+                self._probing.add(health.label)
+            health.last_used = now
+            task = asyncio.ensure_future(self._probe(health, provider))
+            self._probe_tasks.add(task)
+            task.add_done_callback(self._probe_tasks.discard)
+
+    async def _probe(self, health: ProviderHealth, provider: BaseLLMProvider) -> None:
+        try:
+            await provider.chat(_PROBE_MESSAGES, max_tokens=1)
+            health.record_probe(ok=True)
+        except RateLimitExceeded:
+            pass
+        except Exception as exc:
+            logger.info(f"Routing probe to {health.label} failed: {exc!r}")
+            health.record_probe(ok=False)
+        finally:
+            with self._lock:
+                self._probing.discard(health.label)
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        health, provider = self.choose("chat")
+        self._schedule_probes(health)
+        started = time.monotonic()
+        try:
+            response = await provider.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        except (asyncio.CancelledError, RateLimitExceeded):
+            raise
+        except Exception:
+            health.record(None, ok=False)
+            raise
+        health.record(time.monotonic() - started, ok=True, mode="chat")
+        return response
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        health, provider = self.choose("stream")
+        self._schedule_probes(health)
+        started = time.monotonic()
+        first_token: Optional[float] = None
+        try:
+            async for chunk in provider.chat_stream(messages, temperature=temperature, max_tokens=max_tokens, **kwargs):
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit, RateLimitExceeded):
+            raise
+        except Exception:
+            health.record(None, ok=False)
+            raise
+        health.record(first_token if first_token is not None else time.monotonic() - started, ok=True, mode="stream")
+
+    async def aclose(self) -> None:
+        for _, provider in self.candidates:
+            await provider.aclose()
+
+    def close(self) -> None:
+        for _, provider in self.candidates:
+            provider.close()
+
+    def stats(self) -> Dict[str, Any]:
+        chosen, _ = self.choose()
+        return {
+            "current": chosen.label,
+            "candidates": [health.snapshot(self.error_penalty) for health, _ in self.candidates],
+        }
+
+
+__all__ = ["ProviderHealth", "RoutedProvider"]
@@ -0,0 +1,37 @@
+"""Token 估算 - 不依赖分词器的粗略估计
+
+DeepSeek / OpenAI 的分词器都不在依赖中，这里按字符类别估算：
+中日韩字符约 0.6 token/字，其余字符（英文、数字、标点、空白）约 0.3 token/字。
+用于请求前的预算预留；实际用量以响应中的 usage 为准。
+"""
+from __future__ import annotations
+
+from typing import Iterable
+
+# 每条消息的固定开销（role 与分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_RATIO = 0.6
+_OTHER_RATIO = 0.3
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的 token 数
+
+    每轮提示词打包都要对历史与记忆逐条估算，因此不逐字符判断类别，而是用 UTF-8 编码长度推算：
+    中日韩字符（含全角标点）编码为 3 字节，ASCII 为 1 字节，多出的字节数除以 2 即中日韩字符数。
+    少量 2 字节字符（如带重音的拉丁字母）按半个计，对估算精度影响可以忽略。
+    """
+    if not text:
+        return 0
+    length = len(text)
+    cjk = 0 if text.isascii() else min(length, (len(text.encode("utf-8")) - length) // 2)
+    return int(cjk * _CJK_RATIO + (length - cjk) * _OTHER_RATIO) + 1
+
+
+def estimate_messages_tokens(contents: Iterable[str]) -> int:
+    """估算一组消息内容的 token 数（含每条消息的固定开销）"""
+    return sum(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS for content in contents)
+
+
+__all__ = ["estimate_tokens", "estimate_messages_tokens", "MESSAGE_OVERHEAD_TOKENS"]
@@ -0,0 +1,70 @@
+"""提供商包装器基类
+
+限流、重试、缓存等横切能力都以包装器的形式叠加在具体提供商之外，
+对调用方而言包装后的对象仍是一个 `BaseLLMProvider`。
+模型、温度、连接池等配置与资源都属于最内层的提供商，包装器只转发。
+"""
+from __future__ import annotations
+
+from typing import AsyncIterator, List, Optional
+
+import httpx
+
+from .base import BaseLLMProvider, LLMResponse, Message
+
+
+class ProviderWrapper(BaseLLMProvider):
+    """默认把所有调用原样转发给被包装的提供商，子类按需覆盖 chat / chat_stream"""
+
+    def __init__(self, inner: BaseLLMProvider):
+        # 不调用 BaseLLMProvider.__init__：配置与连接池都属于被包装的提供商
+        self.inner = inner
+
+    def __getattr__(self, name):
+        # 仅在自身找不到属性时调用：model、temperature、endpoint 等转发给内层
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    @property
+    def innermost(self) -> BaseLLMProvider:
+        """最内层的具体提供商"""
+        provider = self.inner
+        while isinstance(provider, ProviderWrapper):
+            provider = provider.inner
+        return provider
+
+    @property
+    def API_KEY_ENV(self) -> Optional[str]:  # type: ignore[override]
+        return self.inner.API_KEY_ENV
+
+    async def chat(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> LLMResponse:
+        return await self.inner.chat(messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+
+    async def chat_stream(
+        self,
+        messages: List[Message],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        async for chunk in self.inner.chat_stream(messages, temperature=temperature, max_tokens=max_tokens, **kwargs):
+            yield chunk
+
+    def _get_client(self) -> httpx.AsyncClient:
+        return self.inner._get_client()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+__all__ = ["ProviderWrapper"]
@@ -0,0 +1,324 @@
+"""指标注册表 - 以 Prometheus 文本格式（0.0.4）暴露计数器、直方图与回调仪表
+
+Flask 以多线程处理请求，热点路径（每个请求、每次 LLM 调用、每次事件发布）上不能抢同一把锁：
+- 每个线程把自己的增量写进线程私有的分片（普通 dict，只有本线程写入）；
+- 抓取（/metrics）时把所有分片相加。已结束线程的分片合并进“退役”汇总后丢弃，
+  因此 werkzeug 每个请求一个线程也不会让分片无限增长。
+只有线程第一次写指标（创建分片）和抓取时会拿注册表的锁。
+抓取读到的可能是某个线程正写到一半的直方图（count 已加、sum 未加），对监控来说可以接受。
+
+仪表（当前会话数等）不在热点路径上更新，而是在抓取时调用回调取值。
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# 秒级延迟的默认分桶：覆盖本地操作（毫秒级）到 LLM 调用（数十秒）
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0,
+)
+
+
+class _Shard:
+    """一个线程的指标增量"""
+
+    __slots__ = ("thread", "counters", "histograms")
+
+    def __init__(self, thread: threading.Thread):
+        self.thread = thread
+        self.counters: Dict[Tuple[str, LabelValues], float] = {}
+        # 值为 [各桶计数（非累计，最后一个是 +Inf）..., sum, count]
+        self.histograms: Dict[Tuple[str, LabelValues], List[float]] = {}
+
+
+class _Metric:
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, labelnames: Sequence[str]):
+        self._registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, LabelValues]:
+        return self.name, tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        counters = self._registry._shard().counters
+        key = self._key(labels)
+        counters[key] = counters.get(key, 0.0) + amount
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: object) -> None:
+        histograms = self._registry._shard().histograms
+        key = self._key(labels)
+        data = histograms.get(key)
+        if data is None:
+            data = histograms[key] = [0.0] * (len(self.buckets) + 3)
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+
+class CallbackGauge(_Metric):
+    """抓取时调用 callback 取值；callback 返回一个数，或 {标签值元组: 数} 的字典"""
+
+    type = "gauge"
+
+    def __init__(self, registry, name, help_text, labelnames, callback: Callable[[], object]):
+        super().__init__(registry, name, help_text, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Dict[LabelValues, float]:
+        value = self.callback()
+        if isinstance(value, dict):
+            return {tuple(str(v) for v in k): float(v) for k, v in value.items()}
+        return {(): float(value)}
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """指标注册表；同名指标重复注册时返回已有对象"""
+
+    # 分片数超过该值时，在创建新分片前顺带合并已结束线程的分片
+    _COMPACT_THRESHOLD = 64
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[_Shard] = []
+        self._retired = _Shard(threading.current_thread())
+
+    # --- 注册 ---
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))  # type: ignore[return-value]
+
+    def gauge_callback(
+        self, name: str, help_text: str, callback: Callable[[], object], labelnames: Sequence[str] = ()
+    ) -> CallbackGauge:
+        """注册回调仪表；同名时替换回调（例如测试中重新创建了服务对象）"""
+        gauge = self._register(CallbackGauge(self, name, help_text, labelnames, callback))
+        gauge.callback = callback  # type: ignore[attr-defined]
+        return gauge  # type: ignore[return-value]
+
+    # --- 分片 ---
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = _Shard(threading.current_thread())
+            with self._lock:
+                if len(self._shards) >= self._COMPACT_THRESHOLD:
+                    self._compact_locked()
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _compact_locked(self) -> None:
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self._merge(self._retired, shard.counters, shard.histograms)
+        self._shards = alive
+
+    @staticmethod
+    def _merge(target: _Shard, counters: Dict, histograms: Dict) -> None:
+        for key, value in counters.items():
+            target.counters[key] = target.counters.get(key, 0.0) + value
+        for key, data in histograms.items():
+            existing = target.histograms.get(key)
+            if existing is None:
+                target.histograms[key] = list(data)
+            else:
+                for i, value in enumerate(data):
+                    existing[i] += value
+
+    def collect(self) -> _Shard:
+        """把所有分片相加成一个快照"""
+        total = _Shard(threading.current_thread())
+        with self._lock:
+            self._compact_locked()
+            shards = [self._retired] + list(self._shards)
+            for shard in shards:
+                # dict() 拷贝在 GIL 下一次完成，不会与写入线程的插入冲突
+                self._merge(total, dict(shard.counters), {k: list(v) for k, v in dict(shard.histograms).items()})
+        return total
+
+    def reset(self) -> None:
+        """清空所有已记录的值（测试用）"""
+        with self._lock:
+            for shard in [self._retired] + self._shards:
+                shard.counters.clear()
+                shard.histograms.clear()
+
+    # --- 输出 ---
+    def value(self, name: str, **labels: object) -> float:
+        """读取计数器当前值，或直方图的观测次数（测试与调试用）"""
+        metric = self._metrics[name]
+        key = metric._key(labels)
+        snapshot = self.collect()
+        if isinstance(metric, Histogram):
+            data = snapshot.histograms.get(key)
+            return data[-1] if data else 0.0
+        return snapshot.counters.get(key, 0.0)
+
+    def render(self) -> str:
+        snapshot = self.collect()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            if isinstance(metric, Counter):
+                for (name, values), value in sorted(snapshot.counters.items()):
+                    if name == metric.name:
+                        lines.append(f"{name}{_labels(metric.labelnames, values)} {_format_value(value)}")
+            elif isinstance(metric, Histogram):
+                for (name, values), data in sorted(snapshot.histograms.items()):
+                    if name != metric.name:
+                        continue
+                    cumulative = 0.0
+                    for bound, count in zip(list(metric.buckets) + [math.inf], data[:-2]):
+                        cumulative += count
+                        le = f'le="{_format_value(bound)}"'
+                        lines.append(f"{name}_bucket{_labels(metric.labelnames, values, le)} {_format_value(cumulative)}")
+                    lines.append(f"{name}_sum{_labels(metric.labelnames, values)} {_format_value(data[-2])}")
+                    lines.append(f"{name}_count{_labels(metric.labelnames, values)} {_format_value(data[-1])}")
+            elif isinstance(metric, CallbackGauge):
+                try:
+                    samples = metric.samples()
+                except Exception:
+                    continue
+                for values, value in sorted(samples.items()):
+                    lines.append(f"{metric.name}{_labels(metric.labelnames, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """进程共享的指标注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
+
+
+# --- 各模块共用的指标 ---
+_metrics = get_metrics_registry()
+
+HTTP_REQUESTS = _metrics.counter(
+    "lyuyuan_http_requests_total", "HTTP requests by route, method and status code.", ("route", "method", "status")
+)
+HTTP_LATENCY = _metrics.histogram(
+    "lyuyuan_http_request_duration_seconds", "Time until the response headers were ready, by route.", ("route",)
+)
+LLM_REQUESTS = _metrics.counter(
+    "lyuyuan_llm_requests_total",
+    "Upstream LLM requests by provider, mode (chat/stream) and outcome (ok/error/cancelled).",
+    ("provider", "mode", "outcome"),
+)
+LLM_ERRORS = _metrics.counter(
+    "lyuyuan_llm_errors_total", "Failed upstream LLM requests by provider and error kind.", ("provider", "kind")
+)
+LLM_LATENCY = _metrics.histogram(
+    "lyuyuan_llm_request_duration_seconds", "Upstream LLM request duration by provider and mode.", ("provider", "mode")
+)
+LLM_FIRST_TOKEN = _metrics.histogram(
+    "lyuyuan_llm_first_token_seconds", "Time to the first streamed chunk by provider.", ("provider",)
+)
+LLM_TOKENS = _metrics.counter(
+    "lyuyuan_llm_tokens_total", "Tokens reported in LLM usage, by provider and type (prompt/completion/cache_hit; cache_hit is part of prompt).", ("provider", "type")
+)
+BACKUP_REPLIES = _metrics.counter(
+    "lyuyuan_backup_replies_total", "Turns answered with a backup reply, by character and reason.", ("character", "reason")
+)
+PROMPT_TOKENS = _metrics.counter(
+    "lyuyuan_prompt_section_tokens_total",
+    "Estimated prompt tokens by character and section (persona/state/summary/recent/memories/older).",
+    ("character", "section"),
+)
+DIALOGUE_SUMMARIES = _metrics.counter(
+    "lyuyuan_dialogue_summaries_total", "Rolling dialogue summary updates by method (llm/extractive).", ("method",)
+)
+EVENTS_PUBLISHED = _metrics.counter(
+    "lyuyuan_events_published_total", "Events published on the event bus by type.", ("event_type",)
+)
+STORAGE_LATENCY = _metrics.histogram(
+    "lyuyuan_storage_duration_seconds", "Save-file operation duration by operation (save/load).", ("operation",)
+)
+
+
+__all__ = [
+    "Counter",
+    "Histogram",
+    "CallbackGauge",
+    "MetricsRegistry",
+    "get_metrics_registry",
+    "DEFAULT_BUCKETS",
+    "HTTP_REQUESTS",
+    "HTTP_LATENCY",
+    "LLM_REQUESTS",
+    "LLM_ERRORS",
+    "LLM_LATENCY",
+    "LLM_FIRST_TOKEN",
+    "LLM_TOKENS",
+    "BACKUP_REPLIES",
+    "PROMPT_TOKENS",
+    "DIALOGUE_SUMMARIES",
+    "EVENTS_PUBLISHED",
+    "STORAGE_LATENCY",
+]
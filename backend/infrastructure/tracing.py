@@ -0,0 +1,259 @@
+"""回合耗时追踪 - 按阶段（span）记录每个回合的时间花在了哪里
+
+BaseCharacter 的每个回合（chat / achat / chat_stream）生成一条 TurnTrace，依次记录：
+proactive_check、special_commands、pre_chat_events、prompt_build、llm、parse、
+state_update（其中嵌套 event_publish）、post_chat_events 与 save。span 可以嵌套，depth 表示嵌套层级。
+
+llm_first_byte（从发出请求到收到第一个片段）只在流式回合（chat_stream）中记录：
+chat / achat 一次拿到完整响应，没有首字节时刻，这两种回合的分阶段统计里不会出现该项。
+
+完成的追踪放入进程内有界环形缓冲区（TRACE_RING_SIZE 条），由 /api/debug/timings 查看；
+设置 TRACE_EXPORT_PATH 时，同时以 Chrome Trace Event 格式追加写入该文件，
+可直接用 chrome://tracing 或 Perfetto（ui.perfetto.dev）打开。
+
+同一会话的回合由会话锁串行执行，因此每个回合的追踪对象只在一个线程（或协程）内使用，无需加锁；
+只有环形缓冲区与导出文件在多个会话之间共享。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from backend import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """一个阶段：相对回合开始的起止时间（秒）与嵌套层级"""
+
+    __slots__ = ("name", "start", "end", "depth")
+
+    def __init__(self, name: str, start: float, end: float, depth: int):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.depth = depth
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class TurnTrace:
+    """一个回合的追踪记录"""
+
+    def __init__(self, kind: str, attrs: Optional[Dict[str, Any]] = None):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.attrs: Dict[str, Any] = dict(attrs or {})
+        self.started_at = time.time()
+        self.thread_id = threading.get_ident()
+        self.spans: List[Span] = []
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+        self._t0 = time.perf_counter()
+        self._depth = 0
+
+    def now(self) -> float:
+        """相对回合开始的秒数"""
+        return time.perf_counter() - self._t0
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = self.now()
+        depth = self._depth
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth = depth
+            self.spans.append(Span(name, start, self.now(), depth))
+
+    def add_span(self, name: str, start: float) -> None:
+        """记录一个从 start（now() 的返回值）到现在的阶段，用于无法用 with 包住的区间（如首个片段到达）"""
+        self.spans.append(Span(name, start, self.now(), self._depth))
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            self.error = type(error).__name__
+        self.duration = self.now()
+
+    def breakdown(self) -> Dict[str, float]:
+        """每个阶段名的累计耗时（毫秒）"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration * 1000
+        return {name: round(ms, 3) for name, ms in totals.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="milliseconds"),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "error": self.error,
+            "attrs": self.attrs,
+            "breakdown_ms": self.breakdown(),
+            "spans": [
+                {
+                    "name": span.name,
+                    "start_ms": round(span.start * 1000, 3),
+                    "duration_ms": round(span.duration * 1000, 3),
+                    "depth": span.depth,
+                }
+                for span in sorted(self.spans, key=lambda s: (s.start, s.depth))
+            ],
+        }
+
+    def to_chrome_events(self) -> List[Dict[str, Any]]:
+        """Chrome Trace Event 格式的完整事件（ph="X"），时间单位为微秒"""
+        base_us = self.started_at * 1e6
+        common = {"pid": os.getpid(), "tid": self.thread_id}
+        events = [{
+            "name": self.kind,
+            "cat": "turn",
+            "ph": "X",
+            "ts": round(base_us, 1),
+            "dur": round((self.duration or 0.0) * 1e6, 1),
+            "args": {"trace_id": self.trace_id, "error": self.error, **self.attrs},
+            **common,
+        }]
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": self.kind,
+                "ph": "X",
+                "ts": round(base_us + span.start * 1e6, 1),
+                "dur": round(span.duration * 1e6, 1),
+                "args": {"trace_id": self.trace_id},
+                **common,
+            })
+        return events
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class TraceRing:
+    """最近 N 个回合的追踪（有界），以及可选的 Chrome Trace 文件导出"""
+
+    def __init__(self, size: int = 200, export_path: Optional[str] = None):
+        self._traces: Deque[TurnTrace] = deque(maxlen=max(1, size))
+        self._lock = threading.Lock()
+        self.export_path = export_path
+        self.recorded = 0
+
+    def record(self, trace: TurnTrace) -> None:
+        with self._lock:
+            self._traces.append(trace)
+            self.recorded += 1
+        if self.export_path:
+            self._export(trace)
+
+    def _export(self, trace: TurnTrace) -> None:
+        # JSON Array 格式允许省略结尾的 "]"，因此可以持续追加
+        lines = "".join(json.dumps(event, ensure_ascii=False) + ",\n" for event in trace.to_chrome_events())
+        try:
+            with self._lock:
+                new_file = not os.path.exists(self.export_path)
+                if new_file:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.export_path)), exist_ok=True)
+                with open(self.export_path, "a", encoding="utf-8") as fh:
+                    if new_file:
+                        fh.write("[\n")
+                    fh.write(lines)
+        except OSError as exc:
+            logger.warning(f"Failed to export trace to {self.export_path}: {exc}")
+
+    def snapshot(self) -> List[TurnTrace]:
+        with self._lock:
+            return list(self._traces)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._traces.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """按阶段汇总缓冲区内所有回合：次数、p50、p95、最大值（毫秒）"""
+        samples: Dict[str, List[float]] = {}
+        for trace in self.snapshot():
+            samples.setdefault("turn", []).append((trace.duration or 0.0) * 1000)
+            for name, ms in trace.breakdown().items():
+                samples.setdefault(name, []).append(ms)
+        return {
+            name: {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 50), 3),
+                "p95_ms": round(_percentile(values, 95), 3),
+                "max_ms": round(max(values), 3),
+            }
+            for name, values in samples.items()
+        }
+
+    def stats(self, limit: int = 20, slowest: int = 5) -> Dict[str, Any]:
+        traces = self.snapshot()
+        return {
+            "recorded": self.recorded,
+            "buffered": len(traces),
+            "capacity": self._traces.maxlen,
+            "export_path": self.export_path,
+            "summary": self.summary(),
+            "slowest": [t.to_dict() for t in sorted(traces, key=lambda t: t.duration or 0.0, reverse=True)[:slowest]],
+            "recent": [t.to_dict() for t in reversed(traces[-limit:])] if limit > 0 else [],
+        }
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        events: List[Dict[str, Any]] = []
+        for trace in self.snapshot():
+            events.extend(trace.to_chrome_events())
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+_ring: Optional[TraceRing] = None
+_ring_lock = threading.Lock()
+
+
+def get_trace_ring() -> TraceRing:
+    """进程共享的追踪缓冲区（按 settings 创建）"""
+    global _ring
+    if _ring is None:
+        with _ring_lock:
+            if _ring is None:
+                _ring = TraceRing(settings.TRACE_RING_SIZE, settings.TRACE_EXPORT_PATH)
+    return _ring
+
+
+def start_trace(kind: str, **attrs: Any) -> Optional[TurnTrace]:
+    """开始一个回合的追踪；TRACE_ENABLED=false 时返回 None"""
+    if not settings.TRACE_ENABLED:
+        return None
+    return TurnTrace(kind, attrs)
+
+
+def finish_trace(trace: Optional[TurnTrace], error: Optional[BaseException] = None) -> None:
+    if trace is None:
+        return
+    trace.finish(error)
+    get_trace_ring().record(trace)
+
+
+__all__ = [
+    "Span",
+    "TurnTrace",
+    "TraceRing",
+    "get_trace_ring",
+    "start_trace",
+    "finish_trace",
+]
@@ -0,0 +1,245 @@
+"""准入控制 - 限制同时调用 LLM 的回合数
+
+每个 LLM 提供商一个 `AdmissionController`：最多 `max_concurrent` 个回合同时执行，
+其余回合进入有界 FIFO 队列等待；队列已满或排队超时时立即拒绝（`AdmissionRejected`，
+路由层返回 429 + Retry-After），而不是让请求堆积成一片 45 秒超时。
+线程（Flask 工作线程）与协程（ASGI）可以共用同一个控制器：空出的名额按先来后到直接交给下一个等待者。
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+
+from backend import settings
+
+# Retry-After 估算：尚无样本时假设的单回合耗时，以及建议值的上下限（秒）
+_DEFAULT_SERVICE_SECONDS = 5.0
+_SERVICE_EWMA_ALPHA = 0.2
+_RETRY_AFTER_MIN = 1
+_RETRY_AFTER_MAX = 60
+
+
+class AdmissionRejected(RuntimeError):
+    """LLM 并发已满且等待队列已满（或排队超时），请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _resolve(future: "asyncio.Future[bool]") -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class _Waiter:
+    """队列中的一个等待者：线程用 Event 唤醒，协程用所在事件循环上的 Future 唤醒"""
+
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop is not None else threading.Event()
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+class AdmissionController:
+    """单个提供商的并发上限 + 有界等待队列"""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        """
+        Args:
+            name: 提供商名称（用于统计展示）
+            max_concurrent: 同时调用 LLM 的回合上限
+            max_queue: 等待队列长度上限，超出立即拒绝
+            queue_timeout: 在队列中最多等待的秒数
+        """
+        self.name = name
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._waiters: Deque[_Waiter] = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._service_ewma = _DEFAULT_SERVICE_SECONDS
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @contextmanager
+    def admit(self) -> Iterator[float]:
+        """占用一个名额直到回合结束，产出排队等待的秒数
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        start = time.perf_counter()
+        waiter = self._enter()
+        if waiter is not None:
+            granted = waiter.event.wait(self.queue_timeout)
+            self._settle(waiter, granted, start)
+        waited = self._record_admitted(start)
+        try:
+            yield waited
+        finally:
+            self._release(time.perf_counter() - start - waited)
+
+    @asynccontextmanager
+    async def aadmit(self) -> AsyncIterator[float]:
+        """admit() 的协程版本：排队期间不阻塞事件循环"""
+        start = time.perf_counter()
+        waiter = self._enter(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+                granted = True
+            except asyncio.TimeoutError:
+                granted = False
+            except asyncio.CancelledError:
+                # 被取消时若名额已交给自己，需要归还
+                with self._lock:
+                    if waiter.granted:
+                        self._release_locked()
+                    else:
+                        self._waiters.remove(waiter)
+                raise
+            self._settle(waiter, granted, start)
+        waited = self._record_admitted(start)
+        try:
+            yield waited
+        finally:
+            self._release(time.perf_counter() - start - waited)
+
+    def _enter(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_Waiter]:
+        """有空闲名额时直接占用并返回 None；否则排队并返回等待者；队列已满时拒绝"""
+        with self._lock:
+            if self.in_flight < self.max_concurrent and not self._waiters:
+                self.in_flight += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected(
+                    f"LLM provider '{self.name}' is overloaded ({self.in_flight} in flight, {len(self._waiters)} queued)",
+                    self._retry_after_locked(),
+                )
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _settle(self, waiter: _Waiter, granted: bool, start: float) -> None:
+        """处理排队结果：超时且尚未分到名额时移出队列并拒绝"""
+        with self._lock:
+            if granted or waiter.granted:
+                return
+            self._waiters.remove(waiter)
+            self.timeouts += 1
+            self.rejected += 1
+            retry_after = self._retry_after_locked()
+        raise AdmissionRejected(
+            f"LLM provider '{self.name}' queue wait exceeded {time.perf_counter() - start:.1f}s",
+            retry_after,
+        )
+
+    def _record_admitted(self, start: float) -> float:
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def _release(self, service_seconds: float) -> None:
+        with self._lock:
+            self._service_ewma += _SERVICE_EWMA_ALPHA * (service_seconds - self._service_ewma)
+            self._release_locked()
+
+    def _release_locked(self) -> None:
+        """归还名额：有等待者时直接交给队首（in_flight 不变），否则减一"""
+        if self._waiters:
+            self._waiters.popleft().grant()
+        else:
+            self.in_flight -= 1
+
+    def _retry_after_locked(self) -> int:
+        """按近期单回合耗时估算队列排空所需的秒数"""
+        backlog = len(self._waiters) + 1
+        seconds = self._service_ewma * backlog / self.max_concurrent
+        return int(min(_RETRY_AFTER_MAX, max(_RETRY_AFTER_MIN, math.ceil(seconds))))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            avg = self.total_wait / self.admitted if self.admitted else 0.0
+            return {
+                "provider": self.name,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "queue_wait_ms_avg": round(avg * 1000, 2),
+                "queue_wait_ms_max": round(self.max_wait * 1000, 2),
+                "queue_wait_ms_total": round(self.total_wait * 1000, 2),
+                "service_seconds_ewma": round(self._service_ewma, 3),
+            }
+
+
+class AdmissionRegistry:
+    """按提供商名称懒创建准入控制器"""
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        per_provider: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrent = settings.LLM_MAX_CONCURRENCY if max_concurrent is None else max_concurrent
+        self.max_queue = settings.LLM_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = settings.LLM_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.per_provider = dict(settings.LLM_PROVIDER_CONCURRENCY if per_provider is None else per_provider)
+        self._controllers: Dict[str, AdmissionController] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str) -> AdmissionController:
+        provider = (provider or "default").lower()
+        with self._lock:
+            controller = self._controllers.get(provider)
+            if controller is None:
+                controller = AdmissionController(
+                    provider,
+                    max_concurrent=self.per_provider.get(provider, self.max_concurrent),
+                    max_queue=self.max_queue,
+                    queue_timeout=self.queue_timeout,
+                )
+                self._controllers[provider] = controller
+            return controller
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            controllers = list(self._controllers.values())
+        return {controller.name: controller.stats() for controller in controllers}
+
+
+__all__ = ["AdmissionController", "AdmissionRegistry", "AdmissionRejected"]
@@ -0,0 +1,123 @@
+"""并发控制 - 会话内串行、会话间并行
+
+同一会话（同一浏览器标签页）的回合必须串行执行，否则 `dialogue_history`、
+`game_state` 与 `memory_system` 会被并发修改；不同会话之间互不阻塞。
+每把会话锁都会统计排队深度与等待时间，便于观察多线程下的争用情况。
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+# 协程等待会话锁时的轮询间隔（秒）：从最小值开始指数退避到最大值
+_ASYNC_POLL_MIN = 0.005
+_ASYNC_POLL_MAX = 0.05
+
+
+class SessionBusyError(RuntimeError):
+    """等待会话锁超时（同一会话已有回合长时间占用）"""
+
+
+class SessionLock:
+    """带统计信息的会话锁"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.waiting = 0
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def busy(self) -> bool:
+        """是否有回合正在执行或排队"""
+        return self._lock.locked() or self.waiting > 0
+
+    @property
+    def queue_depth(self) -> int:
+        """正在执行与排队中的回合总数"""
+        return self.waiting + (1 if self._lock.locked() else 0)
+
+    @contextmanager
+    def hold(self, timeout: Optional[float] = None) -> Iterator[float]:
+        """获取会话锁，产出本次等待的秒数
+
+        Args:
+            timeout: 最长等待秒数，None 表示一直等待
+
+        Raises:
+            SessionBusyError: 超时仍未获得锁
+        """
+        start = time.perf_counter()
+        with self._stats_lock:
+            self.waiting += 1
+        acquired = self._lock.acquire(timeout=-1 if timeout is None else max(0.0, timeout))
+        waited = self._record_wait(start, acquired)
+        try:
+            yield waited
+        finally:
+            self._lock.release()
+
+    @asynccontextmanager
+    async def ahold(self, timeout: Optional[float] = None) -> AsyncIterator[float]:
+        """协程版 hold()：等待期间不阻塞事件循环
+
+        以非阻塞方式轮询底层锁，被取消时不会遗留已获取的锁。
+        """
+        start = time.perf_counter()
+        deadline = None if timeout is None else start + max(0.0, timeout)
+        with self._stats_lock:
+            self.waiting += 1
+        delay = _ASYNC_POLL_MIN
+        try:
+            acquired = self._lock.acquire(blocking=False)
+            while not acquired:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _ASYNC_POLL_MAX)
+                acquired = self._lock.acquire(blocking=False)
+        except BaseException:
+            with self._stats_lock:
+                self.waiting -= 1
+            raise
+        waited = self._record_wait(start, acquired)
+        try:
+            yield waited
+        finally:
+            self._lock.release()
+
+    def _record_wait(self, start: float, acquired: bool) -> float:
+        """记录一次等待结果；未获得锁时抛出 SessionBusyError"""
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.waiting -= 1
+            if acquired:
+                self.acquisitions += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+            else:
+                self.timeouts += 1
+        if not acquired:
+            raise SessionBusyError(f"session is busy (waited {waited:.1f}s)")
+        return waited
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            avg = self.total_wait / self.acquisitions if self.acquisitions else 0.0
+            return {
+                "queue_depth": self.queue_depth,
+                "acquisitions": self.acquisitions,
+                "timeouts": self.timeouts,
+                "lock_wait_ms_avg": round(avg * 1000, 2),
+                "lock_wait_ms_max": round(self.max_wait * 1000, 2),
+                "lock_wait_ms_total": round(self.total_wait * 1000, 2),
+            }
+
+
+__all__ = ["SessionBusyError", "SessionLock"]
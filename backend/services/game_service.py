@@ -1,33 +1,162 @@
 from __future__ import annotations
 
 """Backend service wrapper that exposes the domain game core to routes.
-This module is now the single source of truth (no legacy fallback).
+Each browser session gets its own character instance via SessionRegistry.
+Turns within one session are serialized by its SessionLock; turns from
+different sessions run in parallel on separate worker threads.
 """
 
-from backend.domain.game_core import game_core
+import asyncio
+import copy
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from backend import settings
+from backend.domain.game_core import build_agent
+from backend.services.admission import AdmissionController, AdmissionRegistry, AdmissionRejected
+from backend.services.concurrency import SessionBusyError
+from backend.services.session_registry import SessionEntry, SessionRegistry
 
 
 class GameService:
-    def __init__(self):
-        self._core = game_core
-        print("[BACKEND] game_service using backend.domain.game_core")
+    def __init__(
+        self,
+        registry: Optional[SessionRegistry] = None,
+        lock_timeout: Optional[float] = None,
+        admission: Optional[AdmissionRegistry] = None,
+    ):
+        if registry is None:
+            registry = SessionRegistry(build_agent, max_sessions=settings.MAX_SESSIONS)
+        self._registry = registry
+        self._admission = admission if admission is not None else AdmissionRegistry()
+        self._lock_timeout = settings.SESSION_LOCK_TIMEOUT if lock_timeout is None else lock_timeout
+        print(f"[BACKEND] game_service using per-session registry (max_sessions={self._registry.max_sessions})")
+
+    @property
+    def registry(self) -> SessionRegistry:
+        return self._registry
+
+    @contextmanager
+    def _session_lock(self, session_id: str) -> Iterator[None]:
+        """持有会话锁（会话尚不存在时也可以，随后创建的条目沿用这把锁）"""
+        lock = self._registry.lock_for(session_id)
+        try:
+            with lock.hold(timeout=self._lock_timeout):
+                yield
+        finally:
+            # 超时或创建失败时会话没有建成，不能让待用锁一直留在注册表里
+            self._registry.discard_pending(session_id, lock)
+
+    @contextmanager
+    def _locked_entry(self, session_id: str, role: Optional[str] = None) -> Iterator[SessionEntry]:
+        """先持有会话锁，再获取（或创建）会话条目，直到回合结束
+
+        先取条目再等锁的话，等待期间条目可能被 start_game / load 替换，回合会落在旧的角色实例上。
+        """
+        with self._session_lock(session_id):
+            yield self._registry.get_or_create(session_id, role)
+
+    def _admission_for(self, agent) -> AdmissionController:
+        """回合按角色所用的 LLM 提供商做准入控制（会话锁之后获取，排队中的同会话请求不占名额）"""
+        return self._admission.get(getattr(agent, "llm_provider_name", None) or settings.LLM_PROVIDER)
+
+    @asynccontextmanager
+    async def _alocked_entry(self, session_id: str, role: Optional[str] = None) -> AsyncIterator[SessionEntry]:
+        """_locked_entry 的协程版本：排队等待会话锁时不阻塞事件循环
+
+        新会话的角色构造（读 YAML / 模板、初始化分词器）放到工作线程执行。
+        """
+        lock = self._registry.lock_for(session_id)
+        try:
+            async with lock.ahold(timeout=self._lock_timeout):
+                yield await asyncio.to_thread(self._registry.get_or_create, session_id, role)
+        finally:
+            self._registry.discard_pending(session_id, lock)
+
+    @staticmethod
+    def _snapshot(agent) -> Dict:
+        return {
+            "game_state": copy.deepcopy(agent.game_state),
+            "history": copy.deepcopy(agent.dialogue_history),
+            "character_name": str(getattr(agent, "name", "") or ""),
+        }
+
+    def get_agent(self, session_id: str, role: Optional[str] = None):
+        """获取会话的角色实例；会话不存在时按 role 创建（不加锁，只读场景使用）"""
+        return self._registry.get_or_create(session_id, role).agent
+
+    def start_game(self, session_id: str, role=None):
+        with self._session_lock(session_id):
+            entry = self._registry.create(session_id, role)
+            initial = entry.agent.start_new_game(is_new_game=True)
+            initial["character_name"] = str(getattr(entry.agent, "name", "") or "")
+            return initial
+
+    def chat(self, session_id: str, message: str, role: Optional[str] = None) -> str:
+        return self.chat_turn(session_id, message, role)["response"]
+
+    def chat_turn(self, session_id: str, message: str, role: Optional[str] = None) -> Dict:
+        """执行一个完整回合，并在同一把锁内取回复与状态快照"""
+        with self._locked_entry(session_id, role) as entry, self._admission_for(entry.agent).admit():
+            response = entry.agent.chat(message)
+            snapshot = self._snapshot(entry.agent)
+            snapshot["response"] = response
+            return snapshot
+
+    async def achat_turn(self, session_id: str, message: str, role: Optional[str] = None) -> Dict:
+        """chat_turn() 的协程版本：等待 LLM 期间不占用线程"""
+        async with self._alocked_entry(session_id, role) as entry, self._admission_for(entry.agent).aadmit():
+            response = await entry.agent.achat(message)
+            snapshot = self._snapshot(entry.agent)
+            snapshot["response"] = response
+            return snapshot
+
+    def chat_stream_turn(self, session_id: str, message: str, role: Optional[str] = None) -> Iterator[Tuple[str, object]]:
+        """流式回合：产出 ("delta", 文本片段)，最后产出 ("done", 快照字典)
+
+        会话锁在整个流式回合期间保持，生成器被关闭（如客户端断开）时释放。
+        """
+        with self._locked_entry(session_id, role) as entry, self._admission_for(entry.agent).admit():
+            for kind, value in entry.agent.chat_stream(message):
+                if kind == "done":
+                    snapshot = self._snapshot(entry.agent)
+                    snapshot["response"] = value
+                    yield "done", snapshot
+                else:
+                    yield kind, value
+
+    def get_state(self, session_id: str):
+        with self._locked_entry(session_id) as entry:
+            return copy.deepcopy(entry.agent.game_state)
 
-    def start_game(self, role=None):
-        return self._core.start_new_game(role)
+    def save(self, session_id: str, slot, label: Optional[str] = None):
+        with self._locked_entry(session_id) as entry:
+            # label 写入当前 state，BaseCharacter.save 会自动带入 meta
+            if label and isinstance(entry.agent.game_state, dict):
+                entry.agent.game_state["label"] = str(label)
+            return entry.agent.save(slot)
 
-    def chat(self, message: str) -> str:
-        return self._core.chat(message)
+    def load(self, session_id: str, slot, role: Optional[str] = None) -> Optional[Dict]:
+        """读取存档；给定 role 时先切换到该角色。成功返回状态快照，失败返回 None"""
+        with self._session_lock(session_id):
+            if role:
+                entry = self._registry.create(session_id, role)
+            else:
+                entry = self._registry.get_or_create(session_id)
+            if not entry.agent.load(slot):
+                return None
+            return self._snapshot(entry.agent)
 
-    def get_state(self):
-        return self._core.get_current_state()
+    def end_session(self, session_id: str) -> bool:
+        return self._registry.remove(session_id)
 
-    def save(self, slot):
-        return self._core.save_game(slot)
+    def session_stats(self):
+        return self._registry.stats()
 
-    def load(self, slot):
-        return self._core.load_game(slot)
+    def admission_stats(self):
+        return self._admission.stats()
 
 
 game_service = GameService()
 
-__all__ = ["game_service", "GameService"]
+__all__ = ["game_service", "GameService", "SessionBusyError", "AdmissionRejected"]
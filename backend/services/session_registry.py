@@ -0,0 +1,199 @@
+"""会话注册表 - 为每个玩家（浏览器会话）维护独立的角色实例
+
+Web 端的每个 Flask 会话对应一个 `BaseCharacter`，互不干扰。
+注册表设置存活会话上限，超出后按 LRU 淘汰最久未访问的会话，
+并可估算每个会话占用的内存。每个会话附带一把 `SessionLock`，
+保证同一会话的回合串行执行；正在执行或排队的会话不会被淘汰。
+"""
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.services.concurrency import SessionLock
+
+logger = logging.getLogger(__name__)
+
+AgentFactory = Callable[[Optional[str]], Any]
+
+
+def _deep_sizeof(obj: Any, seen: Optional[set] = None) -> int:
+    """递归估算对象占用的字节数（容器、字符串与普通对象的 __dict__）"""
+    if seen is None:
+        seen = set()
+    obj_id = id(obj)
+    if obj_id in seen:
+        return 0
+    seen.add(obj_id)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_sizeof(key, seen) + _deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _deep_sizeof(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_sizeof(vars(obj), seen)
+    return size
+
+
+@dataclass
+class SessionEntry:
+    """单个会话的条目"""
+
+    session_id: str
+    agent: Any
+    role_key: str
+    lock: SessionLock = field(default_factory=SessionLock)
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+
+    def touch(self) -> None:
+        self.last_access = time.time()
+
+    def estimate_memory_bytes(self) -> int:
+        """估算该会话独占的内存：对话历史、状态、记忆与系统提示词"""
+        agent = self.agent
+        seen: set = set()
+        total = 0
+        for attr in ("dialogue_history", "game_state", "memory_system", "system_prompts"):
+            value = getattr(agent, attr, None)
+            if value is not None:
+                total += _deep_sizeof(value, seen)
+        return total
+
+    def describe(self) -> Dict[str, Any]:
+        """用于调试接口的会话摘要（只暴露会话ID前缀）"""
+        return {
+            "session": self.session_id[:8],
+            "role": self.role_key,
+            "history_len": len(getattr(self.agent, "dialogue_history", []) or []),
+            "memory_bytes": self.estimate_memory_bytes(),
+            "idle_seconds": round(time.time() - self.last_access, 1),
+            "age_seconds": round(time.time() - self.created_at, 1),
+            "llm_usage": dict(getattr(self.agent, "llm_usage", None) or {}),
+            **self.lock.stats(),
+        }
+
+
+class SessionRegistry:
+    """按会话ID保存角色实例的 LRU 注册表（线程安全）"""
+
+    def __init__(self, agent_factory: AgentFactory, max_sessions: int = 500):
+        """
+        Args:
+            agent_factory: 根据角色键创建角色实例的函数
+            max_sessions: 最多同时保留的会话数，超出后淘汰最久未访问的会话
+        """
+        self._agent_factory = agent_factory
+        self.max_sessions = max(1, int(max_sessions))
+        self._entries: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        # 尚未创建角色实例的会话锁（例如首次 start_game 正在构造角色）
+        self._pending_locks: Dict[str, SessionLock] = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[SessionEntry]:
+        """获取会话条目并刷新其 LRU 位置，不存在时返回 None"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                entry.touch()
+            return entry
+
+    def get_or_create(self, session_id: str, role: Optional[str] = None) -> SessionEntry:
+        """获取会话条目；不存在时按角色键创建新实例"""
+        entry = self.get(session_id)
+        if entry is not None:
+            return entry
+        return self.create(session_id, role)
+
+    def lock_for(self, session_id: str) -> SessionLock:
+        """获取会话锁；会话尚不存在时也返回同一把锁，供随后创建的条目沿用"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                return entry.lock
+            return self._pending_locks.setdefault(session_id, SessionLock())
+
+    def discard_pending(self, session_id: str, lock: SessionLock) -> None:
+        """lock_for 取得的锁最终没有用来创建会话（等锁超时、创建失败）时调用，丢弃这把空闲的待用锁
+
+        只有该锁仍是此会话的待用锁且没有回合在持有或排队时才会丢弃；已被条目沿用时什么也不做。
+        """
+        with self._lock:
+            if self._pending_locks.get(session_id) is lock and not lock.busy:
+                del self._pending_locks[session_id]
+
+    def create(self, session_id: str, role: Optional[str] = None) -> SessionEntry:
+        """为会话创建（或替换为）一个新的角色实例，沿用该会话已有的锁"""
+        # 角色实例的构造涉及文件读取，放在锁外执行
+        agent = self._agent_factory(role)
+        role_key = getattr(agent, "role_key", None) or (role or "")
+        with self._lock:
+            previous = self._entries.get(session_id)
+            lock = previous.lock if previous is not None else self._pending_locks.pop(session_id, None)
+            entry = SessionEntry(
+                session_id=session_id,
+                agent=agent,
+                role_key=str(role_key),
+                lock=lock or SessionLock(),
+            )
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            self._evict_locked()
+        return entry
+
+    def remove(self, session_id: str) -> bool:
+        """移除会话，返回是否存在"""
+        with self._lock:
+            self._pending_locks.pop(session_id, None)
+            return self._entries.pop(session_id, None) is not None
+
+    def _evict_locked(self) -> None:
+        overflow = len(self._entries) - self.max_sessions
+        if overflow <= 0:
+            return
+        # 从最久未访问的会话开始淘汰，跳过仍有回合在执行或排队的会话
+        victims = [sid for sid, entry in self._entries.items() if not entry.lock.busy][:overflow]
+        for evicted_id in victims:
+            del self._entries[evicted_id]
+            self.evictions += 1
+            logger.info(f"Evicted idle session {evicted_id[:8]} (max_sessions={self.max_sessions})")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def entries(self) -> List[SessionEntry]:
+        """按最近访问顺序（最新在后）返回会话条目快照"""
+        with self._lock:
+            return list(self._entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """返回注册表统计信息与每个会话的内存估算"""
+        sessions = [entry.describe() for entry in self.entries()]
+        return {
+            "active_sessions": len(sessions),
+            "max_sessions": self.max_sessions,
+            "evictions": self.evictions,
+            "total_memory_bytes": sum(s["memory_bytes"] for s in sessions),
+            "busy_sessions": sum(1 for s in sessions if s["queue_depth"] > 0),
+            "queued_turns": sum(s["queue_depth"] for s in sessions),
+            "lock_wait_ms_max": max((s["lock_wait_ms_max"] for s in sessions), default=0.0),
+            "sessions": sessions,
+        }
+
+
+__all__ = ["SessionEntry", "SessionRegistry"]
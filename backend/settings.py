@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import os
 import secrets
-from typing import Optional
+from typing import Dict, Optional
 
 
 def _get_bool(name: str, default: bool = False) -> bool:
@@ -20,6 +20,28 @@ def _get_int(name: str, default: int) -> int:
         return default
 
 
+def _get_float(name: str, default: float) -> float:
+    val = os.environ.get(name)
+    try:
+        return float(val) if val is not None else default
+    except Exception:
+        return default
+
+
+def _get_int_map(name: str) -> Dict[str, int]:
+    """解析 "deepseek=16,openai=8" 形式的配置"""
+    result: Dict[str, int] = {}
+    for item in (os.environ.get(name) or "").split(","):
+        key, sep, value = item.partition("=")
+        if not sep:
+            continue
+        try:
+            result[key.strip().lower()] = int(value)
+        except ValueError:
+            continue
+    return result
+
+
 # Secret key for Flask session
 SECRET_KEY: str = os.environ.get("SECRET_KEY") or secrets.token_hex(32)
 
@@ -27,14 +49,93 @@ SECRET_KEY: str = os.environ.get("SECRET_KEY") or secrets.token_hex(32)
 HOST: str = os.environ.get("HOST", "0.0.0.0")
 PORT: int = _get_int("PORT", 8080)
 DEBUG: bool = _get_bool("DEBUG", False)
+DEBUG_ENDPOINTS: bool = _get_bool("DEBUG_ENDPOINTS", False)  # 是否开放 /api/debug/* 内部状态接口（无鉴权，只应在受信网络中开启）
+SERVER_MODE: str = os.environ.get("SERVER_MODE", "wsgi").lower()  # wsgi: Flask 多线程；asgi: uvicorn + 协程 /api/chat
+ASGI_WSGI_WORKERS: int = _get_int("ASGI_WSGI_WORKERS", 32)  # asgi 模式下运行其余 Flask 路由的线程数
 
 # LLM Provider settings
 LLM_PROVIDER: str = os.environ.get("LLM_PROVIDER", "deepseek").lower()
-LLM_MODEL: Optional[str] = os.environ.get("LLM_MODEL")  # None = use provider default
+LLM_MODEL: Optional[str] = os.environ.get("LLM_MODEL") or None  # None = use provider default
+LLM_ENDPOINT: Optional[str] = os.environ.get("LLM_ENDPOINT") or None  # None = use provider default (OpenAI-compatible URL)
 LLM_TEMPERATURE: float = float(os.environ.get("LLM_TEMPERATURE", "0.8"))
 LLM_MAX_TOKENS: int = _get_int("LLM_MAX_TOKENS", 1500)
 LLM_TIMEOUT: int = _get_int("LLM_TIMEOUT", 45)
 
+# LLM HTTP connection pool (one long-lived client per provider)
+LLM_POOL_MAX_CONNECTIONS: int = _get_int("LLM_POOL_MAX_CONNECTIONS", 20)  # 每个提供商最多同时打开的连接数
+LLM_POOL_MAX_KEEPALIVE: int = _get_int("LLM_POOL_MAX_KEEPALIVE", 10)  # 空闲时保留的 keep-alive 连接数
+LLM_POOL_KEEPALIVE_EXPIRY: float = _get_float("LLM_POOL_KEEPALIVE_EXPIRY", 30.0)  # 空闲连接保留秒数
+LLM_HTTP2: bool = _get_bool("LLM_HTTP2", False)  # 需要安装 h2（pip install "httpx[http2]"）
+
+# LLM admission control (per provider)
+LLM_MAX_CONCURRENCY: int = _get_int("LLM_MAX_CONCURRENCY", 16)  # 每个提供商同时进行的回合上限
+LLM_PROVIDER_CONCURRENCY: Dict[str, int] = _get_int_map("LLM_PROVIDER_CONCURRENCY")  # 按提供商覆盖，如 "deepseek=16,openai=8"
+LLM_MAX_QUEUE: int = _get_int("LLM_MAX_QUEUE", 64)  # 等待队列长度上限，超出立即返回 429
+LLM_QUEUE_TIMEOUT: float = _get_float("LLM_QUEUE_TIMEOUT", 10.0)  # 在队列中最多等待的秒数
+
+# LLM rate limit (per provider API key, shared by all sessions)
+LLM_RPM: int = _get_int("LLM_RPM", 0)  # 每分钟请求数上限，0 表示不限制
+LLM_TPM: int = _get_int("LLM_TPM", 0)  # 每分钟 token 数上限，0 表示不限制
+LLM_RATE_LIMIT_BURST_SECONDS: float = _get_float("LLM_RATE_LIMIT_BURST_SECONDS", 10.0)  # 允许的突发量（相当于多少秒的配额）
+LLM_RATE_LIMIT_MAX_WAIT: float = _get_float("LLM_RATE_LIMIT_MAX_WAIT", 20.0)  # 等待配额的最长秒数，超出返回 429
+LLM_RATE_LIMIT_BACKEND: str = os.environ.get("LLM_RATE_LIMIT_BACKEND", "memory").lower()  # memory 或 sqlite（多进程共享）
+LLM_RATE_LIMIT_DB: Optional[str] = os.environ.get("LLM_RATE_LIMIT_DB") or None  # sqlite 文件路径，默认在系统临时目录
+
+# LLM resilience (deadline / retry / circuit breaker)
+LLM_TURN_DEADLINE: float = _get_float("LLM_TURN_DEADLINE", 0.0)  # 每回合 LLM 调用（含重试）的总预算秒数，0 表示使用 LLM_TIMEOUT
+LLM_RETRY_ATTEMPTS: int = _get_int("LLM_RETRY_ATTEMPTS", 3)  # 暂时性故障（5xx、连接重置、超时）最多尝试次数
+LLM_RETRY_BASE_DELAY: float = _get_float("LLM_RETRY_BASE_DELAY", 0.5)  # 指数退避基数（秒），实际等待带随机抖动
+LLM_RETRY_MAX_DELAY: float = _get_float("LLM_RETRY_MAX_DELAY", 4.0)  # 单次退避等待上限（秒）
+LLM_BREAKER_THRESHOLD: int = _get_int("LLM_BREAKER_THRESHOLD", 5)  # 连续失败多少次后熔断，0 表示不熔断
+LLM_BREAKER_RESET: float = _get_float("LLM_BREAKER_RESET", 30.0)  # 熔断后多少秒放行一个探测请求
+
+# LLM hedging (opt-in duplicate request to a secondary provider/model)
+LLM_HEDGE_PROVIDER: Optional[str] = os.environ.get("LLM_HEDGE_PROVIDER") or None  # 如 "openai" 或 "openai:gpt-4o-mini"；为空不对冲
+LLM_HEDGE_PERCENTILE: float = _get_float("LLM_HEDGE_PERCENTILE", 95.0)  # 主提供商首 token 耗时超过该分位数时发出副本请求
+LLM_HEDGE_MIN_DELAY: float = _get_float("LLM_HEDGE_MIN_DELAY", 0.3)  # 对冲延迟下限（秒）
+LLM_HEDGE_INITIAL_DELAY: float = _get_float("LLM_HEDGE_INITIAL_DELAY", 2.0)  # 样本不足时的对冲延迟（秒）
+
+# LLM routing (pick the healthiest provider/model per turn)
+LLM_ROUTER_CANDIDATES: Optional[str] = os.environ.get("LLM_ROUTER_CANDIDATES") or None  # 如 "openai:gpt-4o-mini,deepseek:deepseek-reasoner"；为空不路由
+LLM_ROUTER_EWMA_ALPHA: float = _get_float("LLM_ROUTER_EWMA_ALPHA", 0.2)  # 耗时/错误率 EWMA 的平滑系数
+LLM_ROUTER_ERROR_PENALTY: float = _get_float("LLM_ROUTER_ERROR_PENALTY", 10.0)  # 错误率 1.0 折算的额外秒数
+LLM_ROUTER_PROBE_INTERVAL: float = _get_float("LLM_ROUTER_PROBE_INTERVAL", 30.0)  # 候选闲置多少秒后发后台探测，0 表示不探测
+
+# LLM response cache (opt-in per character via api.cache, or globally)
+LLM_CACHE: bool = _get_bool("LLM_CACHE", False)  # 所有角色默认启用缓存；角色配置 api.cache 可单独开关
+LLM_CACHE_MAX_TEMPERATURE: float = _get_float("LLM_CACHE_MAX_TEMPERATURE", 0.3)  # 温度高于此值的请求不走缓存
+LLM_CACHE_MAX_BYTES: int = _get_int("LLM_CACHE_MAX_BYTES", 32 * 1024 * 1024)  # 内存 LRU 的字节上限
+LLM_CACHE_PERSIST: bool = _get_bool("LLM_CACHE_PERSIST", True)  # 是否写入 SQLite，重启后仍可命中
+LLM_CACHE_DB: Optional[str] = os.environ.get("LLM_CACHE_DB") or None  # SQLite 文件路径，默认 cache/llm_responses.sqlite3
+
+# LLM cassette provider (LLM_PROVIDER=cassette: record real calls, or replay them offline)
+LLM_CASSETTE_PATH: str = os.environ.get("LLM_CASSETTE_PATH") or "cassettes/default.jsonl"  # 磁带文件（每行一条录制）
+LLM_CASSETTE_MODE: str = os.environ.get("LLM_CASSETTE_MODE", "replay").lower()  # record：录制真实调用；replay：离线回放
+LLM_CASSETTE_RECORD_PROVIDER: str = os.environ.get("LLM_CASSETTE_RECORD_PROVIDER", "deepseek").lower()  # 录制时转发到的提供商
+LLM_CASSETTE_LATENCY_SCALE: float = _get_float("LLM_CASSETTE_LATENCY_SCALE", 1.0)  # 回放耗时倍数，0 表示立即返回
+LLM_CASSETTE_MISS: str = os.environ.get("LLM_CASSETTE_MISS", "cycle").lower()  # 未命中时：cycle 轮流返回录制，error 报错
+
+# Per-turn latency tracing (/api/debug/timings)
+TRACE_ENABLED: bool = _get_bool("TRACE_ENABLED", True)  # 记录每个回合各阶段的耗时
+TRACE_RING_SIZE: int = _get_int("TRACE_RING_SIZE", 200)  # 内存中保留最近多少个回合的追踪
+TRACE_EXPORT_PATH: Optional[str] = os.environ.get("TRACE_EXPORT_PATH") or None  # 同时追加写入 Chrome Trace 格式文件；为空不导出
+
+# Prompt packing (token budget per turn; characters may override with config["prompt_token_budget"])
+PROMPT_TOKEN_BUDGET: int = _get_int("PROMPT_TOKEN_BUDGET", 4000)  # 每轮请求的估算 token 上限，0 表示不限制
+PROMPT_RECENT_MESSAGES: int = _get_int("PROMPT_RECENT_MESSAGES", 4)  # 优先级高于记忆的最新对话条数
+
+# Rolling dialogue summary (turns that leave the prompt window are folded into a summary in the background)
+DIALOGUE_SUMMARY_ENABLED: bool = _get_bool("DIALOGUE_SUMMARY_ENABLED", True)  # 是否维护滚动摘要
+DIALOGUE_SUMMARY_LLM: bool = _get_bool("DIALOGUE_SUMMARY_LLM", False)  # 用 LLM 生成摘要（每次合并多一次付费请求，默认关闭）；关闭时只用本地抽取
+DIALOGUE_SUMMARY_BATCH: int = _get_int("DIALOGUE_SUMMARY_BATCH", 6)  # 移出窗口的消息攒够多少条后合并一次
+DIALOGUE_SUMMARY_MAX_CHARS: int = _get_int("DIALOGUE_SUMMARY_MAX_CHARS", 300)  # 摘要的最大字数
+DIALOGUE_SUMMARY_MAX_TOKENS: int = _get_int("DIALOGUE_SUMMARY_MAX_TOKENS", 400)  # 摘要请求的输出 token 上限
+DIALOGUE_SUMMARY_TIMEOUT: float = _get_float("DIALOGUE_SUMMARY_TIMEOUT", 20.0)  # 摘要请求超时秒数，超时改用本地抽取
+
+# Session settings
+MAX_SESSIONS: int = _get_int("MAX_SESSIONS", 500)  # 单进程最多同时保留的玩家会话数（LRU 淘汰）
+SESSION_LOCK_TIMEOUT: float = _get_float("SESSION_LOCK_TIMEOUT", 120.0)  # 同一会话排队等待上一回合的最长秒数
+
 
 # Expose selected config for imports
 __all__ = [
@@ -42,9 +143,64 @@ __all__ = [
     "HOST",
     "PORT",
     "DEBUG",
+    "DEBUG_ENDPOINTS",
+    "SERVER_MODE",
+    "ASGI_WSGI_WORKERS",
     "LLM_PROVIDER",
     "LLM_MODEL",
+    "LLM_ENDPOINT",
     "LLM_TEMPERATURE",
     "LLM_MAX_TOKENS",
     "LLM_TIMEOUT",
+    "LLM_POOL_MAX_CONNECTIONS",
+    "LLM_POOL_MAX_KEEPALIVE",
+    "LLM_POOL_KEEPALIVE_EXPIRY",
+    "LLM_HTTP2",
+    "LLM_MAX_CONCURRENCY",
+    "LLM_PROVIDER_CONCURRENCY",
+    "LLM_MAX_QUEUE",
+    "LLM_QUEUE_TIMEOUT",
+    "LLM_RPM",
+    "LLM_TPM",
+    "LLM_RATE_LIMIT_BURST_SECONDS",
+    "LLM_RATE_LIMIT_MAX_WAIT",
+    "LLM_RATE_LIMIT_BACKEND",
+    "LLM_RATE_LIMIT_DB",
+    "LLM_TURN_DEADLINE",
+    "LLM_RETRY_ATTEMPTS",
+    "LLM_RETRY_BASE_DELAY",
+    "LLM_RETRY_MAX_DELAY",
+    "LLM_BREAKER_THRESHOLD",
+    "LLM_BREAKER_RESET",
+    "LLM_HEDGE_PROVIDER",
+    "LLM_HEDGE_PERCENTILE",
+    "LLM_HEDGE_MIN_DELAY",
+    "LLM_HEDGE_INITIAL_DELAY",
+    "LLM_ROUTER_CANDIDATES",
+    "LLM_ROUTER_EWMA_ALPHA",
+    "LLM_ROUTER_ERROR_PENALTY",
+    "LLM_ROUTER_PROBE_INTERVAL",
+    "LLM_CACHE",
+    "LLM_CACHE_MAX_TEMPERATURE",
+    "LLM_CACHE_MAX_BYTES",
+    "LLM_CACHE_PERSIST",
+    "LLM_CACHE_DB",
+    "LLM_CASSETTE_PATH",
+    "LLM_CASSETTE_MODE",
+    "LLM_CASSETTE_RECORD_PROVIDER",
+    "LLM_CASSETTE_LATENCY_SCALE",
+    "LLM_CASSETTE_MISS",
+    "TRACE_ENABLED",
+    "TRACE_RING_SIZE",
+    "TRACE_EXPORT_PATH",
+    "PROMPT_TOKEN_BUDGET",
+    "PROMPT_RECENT_MESSAGES",
+    "DIALOGUE_SUMMARY_ENABLED",
+    "DIALOGUE_SUMMARY_LLM",
+    "DIALOGUE_SUMMARY_BATCH",
+    "DIALOGUE_SUMMARY_MAX_CHARS",
+    "DIALOGUE_SUMMARY_MAX_TOKENS",
+    "DIALOGUE_SUMMARY_TIMEOUT",
+    "MAX_SESSIONS",
+    "SESSION_LOCK_TIMEOUT",
 ]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""微基准：每次请求新建 AsyncClient vs 提供商长连接池
+
+在本机启动一个 OpenAI 兼容的桩服务器，分别用两种方式连续调用 N 次：
+1. per-call：旧实现，每次 `async with httpx.AsyncClient()`，每次都要新建连接
+2. pooled：DeepSeekProvider.chat（PooledClient，keep-alive 复用连接）
+
+本机回环上的 TCP 握手几乎没有成本，可用 --handshake-ms 模拟真实网络下
+新建连接（TCP + TLS）的额外往返耗时。
+
+运行：python benchmarks/bench_http_pool.py [--calls N] [--handshake-ms MS]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm import DeepSeekProvider, Message
+
+REPLY = {
+    "model": "stub",
+    "choices": [{"message": {"role": "assistant", "content": "<response>嗯。</response>"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+    disable_nagle_algorithm = True  # 避免 keep-alive 连接上头部与正文分两次写入时的延迟 ACK
+    handshake_delay = 0.0
+    connections = 0
+    _count_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubHandler._count_lock:
+            StubHandler.connections += 1
+        if self.handshake_delay:
+            time.sleep(self.handshake_delay)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps(REPLY).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def per_call(endpoint: str, payload: dict) -> None:
+    """旧实现：每次请求新建客户端"""
+    async with httpx.AsyncClient(timeout=10) as client:
+        response = await client.post(endpoint, json=payload)
+        response.json()
+
+
+async def run(label: str, func, calls: int):
+    StubHandler.connections = 0
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(
+        f"  {label:<10} mean={statistics.mean(samples):7.2f} ms  "
+        f"p50={statistics.median(samples):7.2f} ms  p95={p95:7.2f} ms  "
+        f"connections={StubHandler.connections}"
+    )
+    return statistics.mean(samples)
+
+
+async def main_async(args):
+    server = start_stub_server()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    StubHandler.handshake_delay = args.handshake_ms / 1000.0
+
+    messages = [Message(role="user", content="你好")]
+    payload = {"model": "stub", "messages": [{"role": "user", "content": "你好"}]}
+    provider = DeepSeekProvider(api_key="bench", endpoint=endpoint, timeout=10)
+
+    print("=" * 60)
+    print(f"HTTP client pool benchmark: {args.calls} sequential calls, handshake={args.handshake_ms} ms")
+    print("=" * 60)
+    # 预热（导入、DNS 解析等一次性开销）
+    await per_call(endpoint, payload)
+    await provider.chat(messages)
+
+    before = await run("per-call", lambda: per_call(endpoint, payload), args.calls)
+    after = await run("pooled", lambda: provider.chat(messages), args.calls)
+    print(f"  speedup: {before / after:.2f}x")
+
+    await provider.aclose()
+    server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--handshake-ms", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""微基准：增量标签解析器 vs 旧的正则解析路径
+
+对比三种用法：
+1. 完整输出一次性解析（regex vs TaggedOutputParser）
+2. 流式场景：每到一个片段都需要知道当前可展示的回复文本。
+   正则路径只能对累积的全文反复重扫（O(n²)），增量解析器每个字符只看一次。
+
+运行：python benchmarks/bench_output_parser.py [--repeat N]
+"""
+
+import argparse
+import json
+import logging
+import re
+import sys
+import timeit
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.output_parser import TaggedOutputParser, parse_tagged_output
+
+FIXTURES_DIR = project_root / "tests" / "fixtures" / "llm_outputs"
+
+
+def parse_with_regex(llm_output: str):
+    """旧版 BaseCharacter._parse_llm_output 的正则实现（去掉打印，作为基准参照）"""
+    analysis_json, response_text = None, None
+    analysis_match = re.search(r"<analysis>(.*?)</analysis>", llm_output, re.DOTALL)
+    if analysis_match:
+        json_str = analysis_match.group(1).strip()
+        json_match = re.search(r"\{.*\}", json_str, re.DOTALL)
+        if json_match:
+            try:
+                analysis_json = json.loads(json_match.group(0))
+            except json.JSONDecodeError as exc:
+                analysis_json = {"error": f"JSON解析失败: {exc}", "raw_json": json_match.group(0)}
+        else:
+            analysis_json = {"error": "在<analysis>标签内未找到有效的JSON结构。"}
+
+    response_match = re.search(r"<response>(.*?)</response>", llm_output, re.DOTALL)
+    if response_match:
+        response_text = re.sub(r"</?response>", "", response_match.group(1)).strip()
+    elif analysis_match:
+        response_text = llm_output.split("</analysis>")[-1].strip()
+    if response_text is not None:
+        response_text = re.sub(r"</?response>", "", response_text).strip()
+    return {"analysis": analysis_json, "response": response_text}
+
+
+def regex_stream(chunks):
+    """正则路径模拟流式：每个片段到达后对累积全文重扫一次"""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        match = re.search(r"<response>(.*?)(?:</response>|$)", buffer, re.DOTALL)
+        if match:
+            _ = match.group(1)
+    return parse_with_regex(buffer)
+
+
+def parser_stream(chunks):
+    parser = TaggedOutputParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def split_chunks(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def build_long_output(response_chars: int) -> str:
+    """构造一个较长的回复（模拟放宽字数限制或长分析的情况）"""
+    base = (FIXTURES_DIR / "standard.txt").read_text(encoding="utf-8")
+    filler = "我其实一直在想，下次活动要做什么甜点比较好。" * (response_chars // 22 + 1)
+    return base.replace("</response>", filler[:response_chars] + "\n</response>")
+
+
+def bench(label: str, func, repeat: int) -> float:
+    seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"  {label:<38} {seconds * 1e6:>10.1f} µs")
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+    logging.disable(logging.ERROR)  # invalid_json 夹具会触发预期内的解析错误日志
+
+    print("=" * 60)
+    print("Output parser microbenchmark")
+    print("=" * 60)
+
+    fixtures = sorted(FIXTURES_DIR.glob("*.txt"))
+    texts = [f.read_text(encoding="utf-8") for f in fixtures]
+
+    print(f"\n[one-shot] {len(texts)} fixtures per iteration")
+    bench("regex", lambda: [parse_with_regex(t) for t in texts], args.repeat)
+    bench("TaggedOutputParser", lambda: [parse_tagged_output(t) for t in texts], args.repeat)
+
+    for response_chars in (80, 800, 4000):
+        text = build_long_output(response_chars)
+        chunks = split_chunks(text, 4)  # 典型流式片段：每个 delta 1~4 个汉字
+        print(f"\n[stream] output={len(text)} chars, {len(chunks)} chunks")
+        repeat = max(5, args.repeat // (response_chars // 80))
+        t_regex = bench("regex rescan per chunk", lambda: regex_stream(chunks), repeat)
+        t_parser = bench("TaggedOutputParser.feed", lambda: parser_stream(chunks), repeat)
+        print(f"  speedup: {t_regex / t_parser:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
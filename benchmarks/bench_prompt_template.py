@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""微基准：预编译提示词模板 vs 每轮 str.format
+
+变量（状态、记忆、历史、输入）预先算好，只比较模板填充与消息组装：
+1. str.format：每轮重新解析动态模板，并逐条拼出 system 消息
+2. CompiledPrompt：模板只解析一次，每轮按片段拼接，固定消息直接复用
+另外给出一次编译（读文件、拆分、校验）的耗时，说明为什么要在会话之间共享。
+
+运行：python benchmarks/bench_prompt_template.py [--repeat N]
+"""
+
+import argparse
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.prompt_template import CompiledPrompt, split_static_prefix
+from backend.game_storage import GameStorage
+
+HISTORY_SIZES = (10, 50, 100)
+
+USER_LINE = "学姐，你们烘焙社平时都做些什么呀？我之前完全没接触过烘焙，不知道能不能跟得上。"
+ASSISTANT_LINE = "（笑着把宣传单递过来）不用担心，我们每周五都有新手课，从最简单的曲奇开始教，很快就能上手啦~"
+
+
+def format_messages(system_prompts, static_prefix: str, dynamic: str, variables):
+    """改造前的做法：每轮 str.format 动态模板，并重新组装 system 消息"""
+    messages = [{"role": "system", "content": p} for p in system_prompts if p]
+    messages.append({"role": "system", "content": static_prefix})
+    messages.append({"role": "user", "content": dynamic.format(**variables)})
+    return messages
+
+
+def bench(label: str, func, repeat: int) -> float:
+    seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"  {label:<38} {seconds * 1e6:>10.1f} µs")
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("Prompt template microbenchmark")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=tmp), config_override={"prompt_token_budget": 0})
+    source = character._load_prompt_template()
+    static_prefix, dynamic = split_static_prefix(source)
+    compiled = character._get_compiled_prompt()
+
+    print(f"\n[compile] template={len(source)} chars, {len(compiled.template.placeholders)} placeholders")
+    bench("CompiledPrompt()", lambda: CompiledPrompt(source, character.system_prompts, character.PROMPT_VARIABLES), max(20, args.repeat // 20))
+
+    for size in HISTORY_SIZES:
+        for i in range(size // 2):
+            character.dialogue_history.append({"role": "user", "content": f"{USER_LINE}（第{i}轮）"})
+            character.dialogue_history.append({"role": "assistant", "content": ASSISTANT_LINE})
+        character.dialogue_history = character.dialogue_history[-size:]
+        variables = character.build_prompt_variables(USER_LINE)
+        assert compiled.render(variables) == dynamic.format(**variables)
+
+        print(f"\n[render] history={size} messages, user prompt={len(compiled.render(variables))} chars")
+        t_format = bench("str.format + messages", lambda: format_messages(character.system_prompts, static_prefix, dynamic, variables), args.repeat)
+        t_compiled = bench("CompiledPrompt render + messages", lambda: compiled.build_messages(compiled.render(variables)), args.repeat)
+        print(f"  speedup: {t_format / t_compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
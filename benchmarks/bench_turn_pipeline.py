@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""微基准：回合流水线中的热点路径（不调用 LLM）
+
+分别计时：
+- 提示词构建：build_prompt_variables + 预编译分析模板渲染（不同历史长度；turn 为追加对话并裁剪后的稳态回合）
+- 输出解析：_parse_llm_output
+- 状态更新：apply_analysis_to_state（显式话题 / jieba 提取）
+- 历史裁剪：_trim_history
+- 记忆：MemorySystem.add_memory / get_relevant_memories（不同记忆条数）
+- 事件：EventBus.publish（不同事件历史长度）
+- 存档：GameStorage.save_game / load_game / list_saves_detailed（不同历史长度）
+- 角色配置：CharacterLoader.load_character（冷加载 / 缓存命中）
+
+结果（每次调用的 µs，取多轮中的最小值）与 benchmarks/baselines/turn_pipeline.json 比较，
+慢于基线超过 --threshold 的条目标记为 REGRESSION。基线文件纳入版本管理，
+改动热点代码后用 --save-baseline 重新生成，回归就会体现在 diff 里。
+
+运行：python benchmarks/bench_turn_pipeline.py [--filter prompt] [--save-baseline] [--check]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.memory_system import MemorySystem
+from backend.game_storage import GameStorage
+from backend.infrastructure.character_loader import CharacterLoader
+from backend.infrastructure.events import Event, EventBus, EventType
+
+BASELINE_PATH = project_root / "benchmarks" / "baselines" / "turn_pipeline.json"
+FIXTURES_DIR = project_root / "tests" / "fixtures" / "llm_outputs"
+CHARACTERS_DIR = project_root / "characters"
+
+HISTORY_SIZES = (10, 50, 100)
+SAVE_HISTORY_SIZES = (10, 100, 1000)
+MEMORY_COUNTS = (10, 50)
+EVENT_HISTORY_SIZES = (0, 500, 1000)
+
+USER_LINE = "学姐，你们烘焙社平时都做些什么呀？我之前完全没接触过烘焙，不知道能不能跟得上。"
+ASSISTANT_LINE = "（笑着把宣传单递过来）不用担心，我们每周五都有新手课，从最简单的曲奇开始教，很快就能上手啦~"
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def make_history(character, turns: int) -> List[Dict[str, str]]:
+    history = [{"role": "system", "content": p} for p in character.system_prompts]
+    for i in range(turns):
+        history.append({"role": "user", "content": f"{USER_LINE}（第{i}轮）"})
+        history.append({"role": "assistant", "content": ASSISTANT_LINE})
+    return history[: len(character.system_prompts) + turns]
+
+
+def make_character(save_dir: str) -> SuTangCharacter:
+    character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=save_dir))
+    for i in range(20):
+        character.memory_system.add_memory(f"陈辰说过他喜欢第{i}种甜点", "preference", importance=i % 5 + 1)
+    character.game_state["last_topics"] = ["烘焙", "新手课", "曲奇"]
+    return character
+
+
+def prompt_cases(character) -> List[Case]:
+    cases = []
+    for size in HISTORY_SIZES:
+        history = make_history(character, size)
+
+        def build(history=history):
+            character.dialogue_history = history
+            return character._build_filled_prompt(USER_LINE)
+
+        cases.append((f"prompt.build_and_format[history={size}]", build))
+
+    for size in HISTORY_SIZES:
+        live = {"history": make_history(character, size)}
+
+        def turn(live=live, size=size):
+            # 稳态回合：追加一问一答、裁剪到 history_size，再构建提示词
+            character.dialogue_history = live["history"]
+            character.history_size = len(character.system_prompts) + size
+            character.dialogue_history.append({"role": "user", "content": USER_LINE})
+            character.dialogue_history.append({"role": "assistant", "content": ASSISTANT_LINE})
+            character._trim_history()
+            live["history"] = character.dialogue_history
+            return character._build_filled_prompt(USER_LINE)
+
+        cases.append((f"prompt.turn[history={size}]", turn))
+    return cases
+
+
+def parse_cases(character) -> List[Case]:
+    text = (FIXTURES_DIR / "standard.txt").read_text(encoding="utf-8")
+    return [("parse.llm_output[standard]", lambda: character._parse_llm_output(text))]
+
+
+def state_cases(character) -> List[Case]:
+    explicit = {"affection_delta": 1, "boredom_delta": 0, "affection_delta_reason": "礼貌", "triggered_topics": ["烘焙"]}
+    extracted = {"affection_delta": 1, "boredom_delta": 0, "affection_delta_reason": "礼貌"}
+    character._extract_topics(USER_LINE)  # 预热 jieba 词典
+
+    def apply(analysis):
+        character.game_state["closeness"] = 30
+        character.apply_analysis_to_state(analysis, USER_LINE, 1, 0)
+
+    return [
+        ("state.apply_analysis[topics]", lambda: apply(explicit)),
+        ("state.apply_analysis[jieba]", lambda: apply(extracted)),
+    ]
+
+
+def trim_cases(character) -> List[Case]:
+    cases = []
+    for size in HISTORY_SIZES:
+        character.history_size = size
+        history = make_history(character, size + 2)
+
+        def trim(history=history, size=size):
+            character.history_size = size
+            character.dialogue_history = list(history)
+            character._trim_history()
+
+        cases.append((f"history.trim[history={size}]", trim))
+    return cases
+
+
+def memory_cases() -> List[Case]:
+    cases = []
+    for count in MEMORY_COUNTS:
+        memory = MemorySystem()
+        for i in range(count):
+            memory.add_memory(f"记忆{i}：陈辰提到了一件小事", "shared_moment", importance=i % 5 + 1)
+        counter = iter(range(10 ** 9))
+
+        def add(memory=memory, count=count):
+            memory.add_memory(f"新记忆{next(counter)}", "player_info", importance=3)
+            if len(memory.memories) > count:
+                memory.memories.pop()
+
+        cases.append((f"memory.add[memories={count}]", add))
+        cases.append((f"memory.relevant[memories={count}]", lambda memory=memory: memory.get_relevant_memories(USER_LINE, top_k=5)))
+    return cases
+
+
+def event_cases() -> List[Case]:
+    cases = []
+    for size in EVENT_HISTORY_SIZES:
+        bus = EventBus()
+        bus.subscribe(EventType.CLOSENESS_CHANGED, lambda event: None)
+        event = Event(
+            event_type=EventType.CLOSENESS_CHANGED,
+            data={"character": "su_tang", "old_value": 30, "new_value": 31, "delta": 1},
+            source="character.su_tang",
+        )
+        for _ in range(size):
+            bus.publish(event)
+
+        def publish(bus=bus, event=event, size=size):
+            bus.publish(event)
+            del bus._event_history[max(size, 1):]  # 保持历史长度不变（已满 1000 条时由 publish 自己淘汰）
+
+        cases.append((f"events.publish[history={size}]", publish))
+    return cases
+
+
+def storage_cases(character, save_dir: str) -> List[Case]:
+    storage = GameStorage(save_dir=save_dir)
+    cases = []
+    for size in SAVE_HISTORY_SIZES:
+        data = {
+            "history": make_history(character, size),
+            "state": dict(character.game_state),
+            "meta": {"role": "su_tang", "character_name": "苏糖"},
+            "memory": character.memory_system.to_dict(),
+            "proactive": character.proactive_system.to_dict(),
+        }
+        slot = f"bench_{size}"
+        storage.save_game(data, slot)
+        cases.append((f"storage.save[history={size}]", lambda data=data, slot=slot: storage.save_game(data, slot)))
+        cases.append((f"storage.load[history={size}]", lambda slot=slot: storage.load_game(slot)))
+    for i in range(20 - len(SAVE_HISTORY_SIZES)):
+        shutil.copy(os.path.join(save_dir, "save_bench_100.json"), os.path.join(save_dir, f"save_extra_{i}.json"))
+    cases.append(("storage.list_saves_detailed[saves=20]", storage.list_saves_detailed))
+    return cases
+
+
+def loader_cases() -> List[Case]:
+    cached = CharacterLoader(str(CHARACTERS_DIR))
+    cached.load_character("su_tang")
+    return [
+        ("loader.load_character[cold]", lambda: CharacterLoader(str(CHARACTERS_DIR)).load_character("su_tang")),
+        ("loader.load_character[cached]", lambda: cached.load_character("su_tang")),
+    ]
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """返回每次调用的最短耗时（µs）"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def load_baseline() -> Dict[str, float]:
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text(encoding="utf-8")).get("results", {})
+
+
+def save_baseline(results: Dict[str, float]) -> None:
+    merged = {**load_baseline(), **results}
+    BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "python": platform.python_version(),
+        "platform": platform.platform(terse=True),
+        "unit": "us_per_call",
+        "results": {name: merged[name] for name in sorted(merged)},
+    }
+    BASELINE_PATH.write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the turn pipeline hot paths")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing rounds per case (min is reported)")
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this text")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative slowdown reported as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write results to {BASELINE_PATH.relative_to(project_root)}")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero when a case regressed")
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+
+    tmp = tempfile.mkdtemp(prefix="bench_turn_pipeline_")
+    baseline = load_baseline()
+    results: Dict[str, float] = {}
+    regressions: List[str] = []
+    try:
+        # 角色代码在热点路径上大量 print；输出到 devnull，保留格式化开销但排除终端速度的影响
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            character = make_character(os.path.join(tmp, "saves"))
+            cases = (
+                prompt_cases(character) + parse_cases(character) + state_cases(character)
+                + trim_cases(character) + memory_cases() + event_cases()
+                + storage_cases(character, os.path.join(tmp, "storage")) + loader_cases()
+            )
+
+        print("=" * 72)
+        print(f"Turn pipeline microbenchmarks (python {platform.python_version()}, min of {args.repeat} rounds)")
+        print("=" * 72)
+        print(f"  {'case':<42}{'µs/call':>12}{'baseline':>12}{'change':>10}")
+        for name, func in cases:
+            if args.filter not in name:
+                continue
+            with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+                micros = measure(func, args.repeat)
+            results[name] = round(micros, 2)
+            line = f"  {name:<42}{micros:>12.2f}"
+            if name in baseline:
+                change = micros / baseline[name] - 1
+                line += f"{baseline[name]:>12.2f}{change * 100:>+9.1f}%"
+                if change > args.threshold:
+                    line += "  REGRESSION"
+                    regressions.append(name)
+            print(line)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.save_baseline:
+        save_baseline(results)
+        print(f"\n  baseline written to {BASELINE_PATH.relative_to(project_root)}")
+    elif not baseline:
+        print("\n  no baseline yet; run with --save-baseline to record one")
+    if regressions:
+        print(f"\n  {len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""压测：模拟 N 个并发玩家访问 Web API，统计单个 web_start.py 进程的承载能力
+
+默认会启动两个子进程：
+1. benchmarks/mock_llm_server.py（模拟 DeepSeek 上游，--mock-profile 选择延迟/故障档位）；
+2. web_start.py（LLM_ENDPOINT 指向模拟服务器，--server-mode 选择 wsgi / asgi）。
+
+每个虚拟玩家轮流选择五个角色之一，按脚本完成：开始游戏 → 若干轮聊天（带思考时间）→
+中途存档 → 列出存档 → 读档 → 继续聊天。所有请求共用同一个 cookie 会话。
+
+报告：每个接口的请求数、错误数与 p50/p95/p99 延迟，总吞吐量，以及按时间窗口统计的
+请求数、错误数和服务器 RSS。出现串会话（回复来自别的角色、读档得到别人的历史）时视为
+硬失败，进程以非零状态退出。
+
+运行：python benchmarks/load_test.py --players 50 --turns 8 [--server-mode asgi] [--output report.json]
+      python benchmarks/load_test.py --url http://127.0.0.1:8080 --server-pid 1234  # 压测已启动的服务器
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+try:
+    import psutil
+except ImportError:  # psutil 不在依赖中；Linux 下回退到 /proc
+    psutil = None
+
+ROLES = ["su_tang", "lin_yuhan", "luo_yimo", "gu_pan", "xia_xingwan"]
+
+# 每个角色一段脚本化的对话；玩家编号会附加在每句话后面，用于检查读档时有没有串会话
+SCRIPTS: Dict[str, List[str]] = {
+    "su_tang": ["你好，这里是烘焙社吗？", "你们平时都做什么点心？", "我完全没基础，能学会吗？",
+                "你最喜欢做哪种蛋糕？", "周五的试听课几点开始？", "那我到时候来找你！"],
+    "lin_yuhan": ["学姐好，我想了解一下学生会。", "学生会平时工作多吗？", "你是怎么兼顾学习的？",
+                  "下周的活动需要帮忙吗？", "我可以先做志愿者吗？", "谢谢学姐，辛苦了。"],
+    "luo_yimo": ["你在画什么？", "这幅画的颜色好特别。", "你一般去哪里找灵感？",
+                 "美术社还收新人吗？", "可以给我看看你的速写本吗？", "下次一起去写生吧。"],
+    "gu_pan": ["同学，图书馆这本书还有吗？", "你也喜欢推理小说？", "最近有什么推荐的书？",
+               "读书会是每周几？", "我可以借你的笔记看看吗？", "那下次读书会见。"],
+    "xia_xingwan": ["你好，天文社在招人吗？", "今晚能看到星星吗？", "你最喜欢哪个星座？",
+                    "望远镜好难调啊。", "下次观测活动带上我吧！", "今天聊得很开心。"],
+}
+
+ENDPOINTS = ["start_game", "chat", "save", "saves", "load"]
+
+
+class StateBleed(AssertionError):
+    """响应属于另一个会话或角色"""
+
+
+@dataclass
+class Sample:
+    endpoint: str
+    status: int  # 0 表示连接错误或超时
+    latency: float
+    finished_at: float
+
+
+@dataclass
+class Results:
+    started_at: float = field(default_factory=time.monotonic)
+    samples: List[Sample] = field(default_factory=list)
+    bleeds: List[str] = field(default_factory=list)
+    rss: List[List[float]] = field(default_factory=list)  # [秒, RSS MB]
+    players_done: int = 0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / 1024 / 1024
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def wait_until_ready(url: str, proc: Optional[subprocess.Popen], timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"{url} exited early with status {proc.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+class Player:
+    """一个虚拟玩家：独立 cookie 会话，按脚本与固定角色对话"""
+
+    def __init__(self, index: int, client: httpx.AsyncClient, results: Results, args, run_id: str):
+        self.index = index
+        self.role = ROLES[index % len(ROLES)]
+        self.marker = f"P{index:04d}"
+        self.slot = f"loadtest-{run_id}-{index}"
+        self.client = client
+        self.results = results
+        self.args = args
+        self.rng = random.Random(f"{args.seed}:{index}")
+        self.character_name = ""
+
+    def bleed(self, message: str) -> None:
+        self.results.bleeds.append(f"{self.marker} ({self.role}): {message}")
+        raise StateBleed(message)
+
+    async def call(self, endpoint: str, method: str, path: str, **kwargs) -> Optional[Dict]:
+        started = time.monotonic()
+        status = 0
+        body = None
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            status = response.status_code
+            if status == 200:
+                body = response.json()
+        except httpx.HTTPError:
+            pass
+        finished = time.monotonic()
+        self.results.samples.append(Sample(endpoint, status, finished - started, finished - self.results.started_at))
+        return body
+
+    async def think(self) -> None:
+        if self.args.think_time > 0:
+            await asyncio.sleep(min(self.rng.expovariate(1 / self.args.think_time), self.args.think_time * 4))
+
+    def check_character(self, body: Dict, endpoint: str) -> None:
+        if body.get("character_key") != self.role:
+            self.bleed(f"{endpoint} returned character_key={body.get('character_key')!r}")
+        name = body.get("character_name")
+        if name and self.character_name and name != self.character_name:
+            self.bleed(f"{endpoint} returned character_name={name!r}, expected {self.character_name!r}")
+
+    def check_history(self, history: List[Dict]) -> None:
+        for message in history:
+            if message.get("role") != "user":
+                continue
+            content = message.get("content", "")
+            if "（P" in content and f"（{self.marker}）" not in content:
+                self.bleed(f"loaded history contains another player's message: {content[:40]!r}")
+
+    async def chat(self, line: str) -> None:
+        body = await self.call("chat", "POST", "/api/chat", json={"message": f"{line}（{self.marker}）"})
+        if body is not None:
+            self.check_character(body, "chat")
+
+    async def run(self) -> None:
+        body = await self.call("start_game", "POST", "/api/start_game", json={"role": self.role})
+        if body is None:
+            return
+        self.character_name = body.get("character_name", "")
+        self.check_character(body, "start_game")
+
+        script = SCRIPTS[self.role]
+        save_after = max(1, self.args.turns // 2)
+        for turn in range(self.args.turns):
+            await self.think()
+            await self.chat(script[turn % len(script)])
+            if turn + 1 == save_after:
+                await self.call("save", "POST", "/api/save", json={"slot": self.slot, "label": self.marker})
+                await self.call("saves", "GET", "/api/saves")
+                loaded = await self.call("load", "POST", "/api/load", json={"slot": self.slot})
+                if loaded is not None and loaded.get("success"):
+                    self.check_character(loaded, "load")
+                    self.check_history(loaded.get("history") or [])
+        self.results.players_done += 1
+
+
+async def sample_rss(pid: Optional[int], results: Results, interval: float, stop: asyncio.Event) -> None:
+    while pid is not None and not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            results.rss.append([round(time.monotonic() - results.started_at, 1), round(rss, 1)])
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_players(args, base_url: str, server_pid: Optional[int], run_id: str) -> Results:
+    results = Results()
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(server_pid, results, args.rss_interval, stop))
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+
+    async def one(index: int) -> None:
+        await asyncio.sleep(args.ramp_up * index / max(1, args.players))
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            try:
+                await Player(index, client, results, args, run_id).run()
+            except StateBleed:
+                pass
+
+    await asyncio.gather(*(one(i) for i in range(args.players)))
+    results.wall = time.monotonic() - results.started_at
+    stop.set()
+    await sampler
+    return results
+
+
+def build_report(args, results: Results, mock_stats: Optional[Dict]) -> Dict:
+    by_endpoint: Dict[str, List[Sample]] = defaultdict(list)
+    for sample in results.samples:
+        by_endpoint[sample.endpoint].append(sample)
+
+    endpoints = {}
+    for name in ENDPOINTS:
+        samples = by_endpoint.get(name, [])
+        latencies = [s.latency * 1000 for s in samples if s.status == 200]
+        statuses: Dict[str, int] = defaultdict(int)
+        for s in samples:
+            if s.status != 200:
+                statuses[str(s.status)] += 1
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": sum(statuses.values()),
+            "error_statuses": dict(statuses),
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+        }
+
+    window = max(1.0, args.window)
+    timeline: Dict[int, Dict] = {}
+    for sample in results.samples:
+        bucket = timeline.setdefault(int(sample.finished_at // window), {"requests": 0, "errors": 0, "rss_mb": None})
+        bucket["requests"] += 1
+        bucket["errors"] += sample.status != 200
+    for at, rss in results.rss:
+        bucket = timeline.setdefault(int(at // window), {"requests": 0, "errors": 0, "rss_mb": None})
+        bucket["rss_mb"] = max(bucket["rss_mb"] or 0, rss)
+
+    total = len(results.samples)
+    errors = sum(1 for s in results.samples if s.status != 200)
+    turns = endpoints["chat"]["requests"] - endpoints["chat"]["errors"]
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output",)},
+        "players": args.players,
+        "players_completed": results.players_done,
+        "wall_seconds": round(results.wall, 2),
+        "requests": total,
+        "throughput_rps": round(total / results.wall, 2) if results.wall else 0.0,
+        "turns_per_second": round(turns / results.wall, 2) if results.wall else 0.0,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "endpoints": endpoints,
+        "timeline": [
+            {"t": key * window, **timeline[key]} for key in sorted(timeline)
+        ],
+        "rss_mb": {
+            "start": results.rss[0][1] if results.rss else None,
+            "peak": max((r for _, r in results.rss), default=None),
+            "end": results.rss[-1][1] if results.rss else None,
+        },
+        "state_bleed": results.bleeds,
+        "mock_llm": mock_stats,
+    }
+
+
+def print_report(report: Dict) -> None:
+    print("=" * 60)
+    print(
+        f"{report['players']} players ({report['players_completed']} completed) in {report['wall_seconds']}s: "
+        f"{report['throughput_rps']} req/s, {report['turns_per_second']} turns/s, "
+        f"error rate {report['error_rate'] * 100:.2f}%"
+    )
+    print("=" * 60)
+    print(f"  {'endpoint':<12}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in report["endpoints"].items():
+        print(f"  {name:<12}{row['requests']:>9}{row['errors']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+              + (f"  {row['error_statuses']}" if row["error_statuses"] else ""))
+    print("\n  timeline (requests / errors / RSS MB):")
+    for bucket in report["timeline"]:
+        rss = "-" if bucket["rss_mb"] is None else f"{bucket['rss_mb']:.1f}"
+        print(f"    t={bucket['t']:>6.0f}s  {bucket['requests']:>6} / {bucket['errors']:<4} {rss:>8}")
+    rss = report["rss_mb"]
+    if rss["peak"] is not None:
+        print(f"  server RSS: start={rss['start']} MB  peak={rss['peak']} MB  end={rss['end']} MB")
+    if report["mock_llm"]:
+        stats = report["mock_llm"]
+        print(f"  mock LLM: {stats['requests']} calls, {stats['rate_limited']} x 429, "
+              f"{stats['server_errors']} x 500, max in flight {stats['max_in_flight']}")
+    if report["state_bleed"]:
+        print(f"\n  STATE BLEED ({len(report['state_bleed'])}):")
+        for line in report["state_bleed"][:20]:
+            print(f"    {line}")
+
+
+def start_processes(args):
+    """启动模拟 LLM 与 Web 服务器子进程，返回 (base_url, mock_url, processes)"""
+    mock_port, web_port = free_port(), free_port()
+    log = open(args.server_log, "a", encoding="utf-8") if args.server_log else subprocess.DEVNULL
+    mock_cmd = [sys.executable, str(project_root / "benchmarks" / "mock_llm_server.py"),
+                "--port", str(mock_port), "--profile", args.mock_profile, "--seed", str(args.seed)]
+    mock = subprocess.Popen(mock_cmd, stdout=log, stderr=log)
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    wait_until_ready(f"{mock_url}/stats", mock)
+
+    env = dict(os.environ)
+    env.update({
+        "HOST": "127.0.0.1",
+        "PORT": str(web_port),
+        "SERVER_MODE": args.server_mode,
+        "LLM_PROVIDER": "deepseek",
+        "LLM_ENDPOINT": f"{mock_url}/v1/chat/completions",
+        "DEEPSEEK_API_KEY": "mock",
+    })
+    web = subprocess.Popen([sys.executable, str(project_root / "web_start.py")], env=env, stdout=log, stderr=log)
+    base_url = f"http://127.0.0.1:{web_port}"
+    wait_until_ready(f"{base_url}/api/saves", web)
+    return base_url, mock_url, [web, mock]
+
+
+def cleanup_saves(run_id: str) -> None:
+    for path in (project_root / "saves").glob(f"save_loadtest-{run_id}-*.json"):
+        path.unlink(missing_ok=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent players against the web API")
+    parser.add_argument("--players", type=int, default=50, help="Concurrent virtual players")
+    parser.add_argument("--turns", type=int, default=8, help="Chat turns per player")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds between a player's turns")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which players join")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mock-profile", default="deepseek", help="Profile of benchmarks/mock_llm_server.py")
+    parser.add_argument("--server-mode", choices=["wsgi", "asgi"], default="wsgi")
+    parser.add_argument("--url", help="Target an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID of the --url server, for RSS sampling")
+    parser.add_argument("--server-log", help="Append subprocess output to this file")
+    parser.add_argument("--rss-interval", type=float, default=1.0)
+    parser.add_argument("--window", type=float, default=5.0, help="Timeline bucket size in seconds")
+    parser.add_argument("--max-error-rate", type=float, default=0.05, help="Exit non-zero above this error rate")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    run_id = f"{os.getpid()}"
+    processes: List[subprocess.Popen] = []
+    mock_url = None
+    try:
+        if args.url:
+            base_url, server_pid = args.url.rstrip("/"), args.server_pid
+        else:
+            base_url, mock_url, processes = start_processes(args)
+            server_pid = processes[0].pid
+        print(f"Load test: {args.players} players x {args.turns} turns against {base_url} "
+              f"(mock profile={args.mock_profile if mock_url else 'external'}, server mode={args.server_mode})")
+        results = asyncio.run(run_players(args, base_url, server_pid, run_id))
+        mock_stats = httpx.get(f"{mock_url}/stats", timeout=5).json() if mock_url else None
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        cleanup_saves(run_id)
+
+    report = build_report(args, results, mock_stats)
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n  report written to {args.output}")
+
+    if report["state_bleed"]:
+        return 2
+    if report["error_rate"] > args.max_error_rate:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""本地 OpenAI / DeepSeek 兼容的模拟 LLM 服务器（压测与容量测试的上游替身）
+
+行为尽量贴近 DeepSeek 的 /v1/chat/completions：
+- 支持普通 JSON 响应与 SSE 流式响应（stream_options.include_usage 时最后发送 usage）；
+- 首 token 延迟、每秒 token 数可调，流式按 token 逐个发送；
+- 按比例返回 429（带 Retry-After）与 500；
+- 模拟前缀缓存：除最后一条外的消息与之前的请求相同时，usage 报告 prompt_cache_hit_tokens；
+- 输出是按模板生成的 <analysis>{JSON}</analysis> + <response>文本</response>，能被角色正常解析；
+- HTTP/1.1 keep-alive（流式使用 chunked 编码），与真实提供商一样可以复用连接。
+
+预设档位（--profile）：fast（几乎无延迟）、deepseek（接近线上）、degraded（供应商故障的下午）。
+命令行参数会覆盖档位中的对应值。
+
+让应用指向模拟服务器（DeepSeekProvider.endpoint 与 BaseCharacter.DEFAULT_API["endpoint"]
+都默认取 settings.LLM_ENDPOINT）：
+
+    python benchmarks/mock_llm_server.py --profile deepseek --port 8900
+    set -a; . benchmarks/mock_llm.env; set +a; python web_start.py
+
+GET /stats 返回请求数、错误数与当前并发。
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm.tokens import estimate_messages_tokens
+
+RESPONSES = [
+    "（笑着点点头）嗯嗯，我在听呢，你继续说～",
+    "（歪头想了想）这个问题有点意思，我们社团里也有人问过。",
+    "（把宣传单递给你）你可以先看看这个，有兴趣的话周五来试听一次？",
+    "（有点不好意思地笑了）谢谢你这么说，其实我也还在学。",
+    "（看了看摊位后面的烤箱）刚出炉的小饼干，要不要尝一块？",
+]
+THOUGHTS = ["对方态度友好，正常回应。", "话题与社团相关，可以多介绍一些。", "对方有点冒失，保持礼貌。"]
+
+
+@dataclass(frozen=True)
+class Profile:
+    """模拟上游的延迟与故障参数"""
+
+    first_token_ms: float = 800.0  # 首 token 延迟均值
+    jitter: float = 0.3  # 首 token 延迟的相对抖动（±比例，均匀分布）
+    tokens_per_second: float = 30.0  # 流式输出速度；<= 0 表示一次性输出
+    rate_429: float = 0.0  # 返回 429 的概率
+    rate_500: float = 0.0  # 返回 500 的概率
+    retry_after: int = 1  # 429 响应的 Retry-After 秒数
+    tokens_per_char: int = 1  # 每个 token 包含的字符数
+
+
+PROFILES: Dict[str, Profile] = {
+    "fast": Profile(first_token_ms=5, jitter=0.0, tokens_per_second=0),
+    "deepseek": Profile(first_token_ms=800, jitter=0.3, tokens_per_second=30, rate_429=0.01, rate_500=0.005),
+    "degraded": Profile(first_token_ms=3000, jitter=0.6, tokens_per_second=10, rate_429=0.05, rate_500=0.05),
+}
+
+
+def render_output(rng: random.Random) -> str:
+    """按模板生成一条带 <analysis> 与 <response> 的角色输出"""
+    analysis = {
+        "thought_process": rng.choice(THOUGHTS),
+        "affection_delta": rng.randint(-1, 2),
+        "affection_delta_reason": "模拟服务器生成",
+        "boredom_delta": rng.randint(-1, 1),
+    }
+    return (
+        f"<analysis>{json.dumps(analysis, ensure_ascii=False)}</analysis>\n"
+        f"<response>{rng.choice(RESPONSES)}</response>"
+    )
+
+
+def split_tokens(text: str, chars_per_token: int) -> List[str]:
+    size = max(1, chars_per_token)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: "MockLLMServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        self.server.begin()
+        try:
+            self._complete(payload)
+        finally:
+            self.server.end()
+
+    def _complete(self, payload: Dict) -> None:
+        profile = self.server.profile
+        rng = self.server.rng()
+        roll = rng.random()
+        if roll < profile.rate_429:
+            self.server.count("rate_limited")
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                {"Retry-After": str(profile.retry_after)},
+            )
+            return
+        if roll < profile.rate_429 + profile.rate_500:
+            self.server.count("server_errors")
+            self._send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+            return
+
+        model = payload.get("model") or "mock-chat"
+        content = render_output(rng)
+        tokens = split_tokens(content, profile.tokens_per_char)
+        max_tokens = payload.get("max_tokens")
+        finish_reason = "stop"
+        if isinstance(max_tokens, int) and 0 < max_tokens < len(tokens):
+            tokens, finish_reason = tokens[:max_tokens], "length"
+        messages = payload.get("messages", [])
+        prompt_tokens = estimate_messages_tokens(m.get("content", "") for m in messages)
+        cache_hit = self.server.prefix_cache_hit(messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_cache_hit_tokens": cache_hit,
+            "prompt_cache_miss_tokens": prompt_tokens - cache_hit,
+        }
+        first_token = profile.first_token_ms / 1000.0 * (1 + rng.uniform(-profile.jitter, profile.jitter))
+        per_token = 1.0 / profile.tokens_per_second if profile.tokens_per_second > 0 else 0.0
+        time.sleep(max(0.0, first_token))
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if not payload.get("stream"):
+            time.sleep(per_token * max(0, len(tokens) - 1))
+            self.server.count("completed")
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(body: Dict) -> None:
+            self._write_chunk(f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        base = {"id": completion_id, "object": "chat.completion.chunk", "model": model}
+        try:
+            event({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+            for i, token in enumerate(tokens):
+                if i and per_token:
+                    time.sleep(per_token)
+                event({**base, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+            event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                event({**base, "choices": [], "usage": usage})
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+            self.server.count("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途断开（例如对冲请求中落败的一方被取消）
+            self.server.count("client_disconnects")
+            self.close_connection = True
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """可在测试与压测脚本中直接启动的模拟服务器"""
+
+    daemon_threads = True
+    # 前缀缓存最多记住多少个不同的前缀（按最近使用淘汰），长时间压测时内存不随请求数增长
+    MAX_PREFIXES = 4096
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, profile: Profile = PROFILES["fast"], seed: Optional[int] = None):
+        super().__init__((host, port), MockLLMHandler)
+        self.profile = profile
+        self._seed = seed
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "requests": 0, "completed": 0, "rate_limited": 0, "server_errors": 0, "client_disconnects": 0, "cache_hits": 0,
+        }
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # 前缀的 SHA-256 摘要（固定 32 字节）-> None，按最近使用排序
+        self._prefixes: "OrderedDict[bytes, None]" = OrderedDict()
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def rng(self) -> random.Random:
+        """每个请求一个随机数生成器；指定 seed 时第 n 个请求的结果可重复"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        return random.Random(None if self._seed is None else f"{self._seed}:{seq}")
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def prefix_cache_hit(self, messages: List[Dict]) -> int:
+        """模拟 DeepSeek 的前缀缓存：除最后一条外的消息与之前某次请求完全相同时，按 64 token 为单位计为命中"""
+        prefix = json.dumps(messages[:-1], ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(prefix.encode("utf-8")).digest()
+        with self._lock:
+            seen = digest in self._prefixes
+            self._prefixes[digest] = None
+            self._prefixes.move_to_end(digest)
+            if len(self._prefixes) > self.MAX_PREFIXES:
+                self._prefixes.popitem(last=False)
+            if seen:
+                self.counters["cache_hits"] += 1
+        if not seen or len(messages) < 2:
+            return 0
+        return estimate_messages_tokens(m.get("content", "") for m in messages[:-1]) // 64 * 64
+
+    def begin(self) -> None:
+        with self._lock:
+            self.counters["requests"] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "profile": asdict(self.profile),
+            }
+
+    def start(self) -> "MockLLMServer":
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, name="mock-llm-server", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="deepseek")
+    parser.add_argument("--first-token-ms", type=float)
+    parser.add_argument("--jitter", type=float)
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--rate-429", type=float)
+    parser.add_argument("--rate-500", type=float)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    overrides = {
+        field: getattr(args, field)
+        for field in ("first_token_ms", "jitter", "tokens_per_second", "rate_429", "rate_500")
+        if getattr(args, field) is not None
+    }
+    profile = replace(PROFILES[args.profile], **overrides)
+    server = MockLLMServer(args.host, args.port, profile=profile, seed=args.seed)
+    print(f"Mock LLM server on {server.endpoint} ({args.profile}: {asdict(profile)})")
+    print(f'Point the app at it with: LLM_ENDPOINT="{server.endpoint}" DEEPSEEK_API_KEY="mock"')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
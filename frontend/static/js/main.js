@@ -220,7 +220,7 @@ function listSaves() {
 }
 
 /**
- * 发送用户消息 (伪打字机版本)
+ * 发送用户消息：优先走流式接口 /api/chat/stream，浏览器不支持时回退到 /api/chat
  */
 function sendMessage() {
     const userInput = $("#user-input").val().trim();
@@ -235,10 +235,131 @@ function sendMessage() {
     // 滚动到底部
     scrollChatToBottom();
     
-    // 显示旧的“正在输入”动画，让用户知道系统有反应
+    // 显示“正在输入”动画，直到第一个字到达
     showTypingIndicator(); 
-    
-    // 发送消息到服务器 (这里是你原来的、能正常工作的 $.ajax 调用)
+
+    if (window.fetch && window.ReadableStream && window.TextDecoder) {
+        sendMessageStream(userInput);
+    } else {
+        sendMessageBlocking(userInput);
+    }
+}
+
+// 回复结束后统一刷新状态（好感度条、立绘、角色名）
+function applyChatResult(data) {
+    updateGameState(data.game_state);
+    updateCharacterImage(
+        data.game_state && data.game_state.closeness,
+        data.character_key || (data.game_state && data.game_state.role)
+    );
+    if (data.character_name) {
+        $("#character-name").text(String(data.character_name));
+    } else if (data.character_key) {
+        $("#character-name").text(mapKeyToName(data.character_key));
+    }
+}
+
+/**
+ * 流式发送：服务端每到达一段 <response> 文本就推送一个 delta 事件，最后推送 done 事件
+ */
+function sendMessageStream(userInput) {
+    let messageElement = null;
+    let streamedText = "";
+    let finished = false;
+
+    function ensureBubble() {
+        if (!messageElement) {
+            removeTypingIndicator();
+            $("#chat-history").append(`<div class="assistant-message"></div>`);
+            messageElement = $("#chat-history .assistant-message").last();
+        }
+        return messageElement;
+    }
+
+    function handleEvent(eventName, data) {
+        if (eventName === "delta") {
+            streamedText += data.text || "";
+            ensureBubble().html(formatMessage(streamedText));
+            scrollChatToBottom();
+        } else if (eventName === "done") {
+            finished = true;
+            // 以服务端最终回复为准（剧情事件或备用回复可能与流式片段不同）
+            ensureBubble().html(formatMessage(String(data.response || "")));
+            scrollChatToBottom();
+            applyChatResult(data);
+        } else if (eventName === "error") {
+            finished = true;
+            removeTypingIndicator();
+            addSystemMessage("发送消息失败：" + escapeHtml(String(data.error || '未知错误')));
+        }
+    }
+
+    fetch("/api/chat/stream", {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+        credentials: "same-origin",
+        body: JSON.stringify({ message: userInput })
+    }).then(function(response) {
+        if (!response.ok || !response.body) {
+            throw new Error("HTTP " + response.status);
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder("utf-8");
+        let buffer = "";
+
+        function pump() {
+            return reader.read().then(function(result) {
+                if (result.done) {
+                    if (!finished) {
+                        removeTypingIndicator();
+                        addSystemMessage("连接中断，回复可能不完整。");
+                    }
+                    return;
+                }
+                buffer += decoder.decode(result.value, { stream: true });
+                // SSE 事件以空行分隔
+                let boundary = buffer.indexOf("\n\n");
+                while (boundary >= 0) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let eventName = "message";
+                    let dataLines = [];
+                    rawEvent.split("\n").forEach(function(line) {
+                        if (line.startsWith("event:")) {
+                            eventName = line.slice(6).trim();
+                        } else if (line.startsWith("data:")) {
+                            dataLines.push(line.slice(5).trim());
+                        }
+                    });
+                    if (dataLines.length > 0) {
+                        try {
+                            handleEvent(eventName, JSON.parse(dataLines.join("\n")));
+                        } catch (e) {
+                            console.warn("无法解析流式事件", e);
+                        }
+                    }
+                    boundary = buffer.indexOf("\n\n");
+                }
+                return pump();
+            });
+        }
+        return pump();
+    }).catch(function(error) {
+        if (!messageElement && !finished) {
+            // 尚未输出任何内容：回退到非流式接口
+            console.warn("流式接口不可用，回退到 /api/chat", error);
+            sendMessageBlocking(userInput);
+        } else {
+            removeTypingIndicator();
+            addSystemMessage("发送消息失败：" + escapeHtml(String(error || '未知错误')));
+        }
+    });
+}
+
+/**
+ * 非流式发送 (伪打字机版本)
+ */
+function sendMessageBlocking(userInput) {
     $.ajax({
         url: "/api/chat",
         type: "POST",
@@ -272,23 +393,16 @@ function sendMessage() {
                     clearInterval(typingInterval);
                     
                     // 打字结束后，再更新游戏状态（好感度条等），这样动画效果更自然
-                    updateGameState(data.game_state);
-                    updateCharacterImage(
-                        data.game_state.closeness,
-                        data.character_key || (data.game_state && data.game_state.role)
-                    );
-                    if (data.character_name) {
-                        $("#character-name").text(String(data.character_name));
-                    } else if (data.character_key) {
-                        $("#character-name").text(mapKeyToName(data.character_key));
-                    }
+                    applyChatResult(data);
                 }
             }, typingSpeed);
 
         },
         error: function(xhr, status, error) {
             removeTypingIndicator();
-            addSystemMessage("发送消息失败：" + escapeHtml(String(error || '未知错误')));
+            // 429（服务繁忙）/ 409（上一条仍在处理）等情况优先显示服务端给出的提示
+            const serverMessage = xhr.responseJSON && xhr.responseJSON.error;
+            addSystemMessage("发送消息失败：" + escapeHtml(String(serverMessage || error || '未知错误')));
         }
     });
 }
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 LLM 准入控制（并发上限、有界队列与 429 快速拒绝）"""
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.services.admission import AdmissionController, AdmissionRegistry, AdmissionRejected
+from backend.services.game_service import GameService
+from backend.services.session_registry import SessionRegistry
+
+
+class SlowAgent:
+    """每个回合耗时固定的角色替身，记录同时执行的回合数"""
+
+    active = 0
+    peak = 0
+    _lock = threading.Lock()
+
+    def __init__(self, role):
+        self.role_key = role or "su_tang"
+        self.dialogue_history = []
+        self.game_state = {}
+        self.name = self.role_key
+        self.llm_provider_name = "deepseek"
+
+    def chat(self, message):
+        with SlowAgent._lock:
+            SlowAgent.active += 1
+            SlowAgent.peak = max(SlowAgent.peak, SlowAgent.active)
+        time.sleep(0.2)
+        with SlowAgent._lock:
+            SlowAgent.active -= 1
+        return "ok"
+
+
+def _hold(controller, seconds, results, index):
+    try:
+        with controller.admit() as waited:
+            time.sleep(seconds)
+            results[index] = ("ok", waited)
+    except AdmissionRejected as exc:
+        results[index] = ("rejected", exc.retry_after)
+
+
+def test_queue_full_rejects_immediately():
+    """并发与队列都满时立即拒绝，并给出 Retry-After"""
+    controller = AdmissionController("test", max_concurrent=2, max_queue=1, queue_timeout=5)
+    results = [None] * 4
+    threads = [threading.Thread(target=_hold, args=(controller, 0.3, results, i)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    _hold(controller, 0, results, 3)
+    assert results[3][0] == "rejected" and results[3][1] >= 1
+    assert time.perf_counter() - start < 0.05
+    for thread in threads:
+        thread.join()
+    assert [r[0] for r in results[:3]] == ["ok", "ok", "ok"]
+    assert results[2][1] >= 0.2  # 第三个回合排队等到了名额
+    stats = controller.stats()
+    assert stats["rejected"] == 1 and stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["queue_wait_ms_max"] >= 200
+    print(f"[OK] Overflow rejected with Retry-After={results[3][1]}s")
+
+
+def test_queue_timeout_rejects():
+    """排队超过 queue_timeout 时拒绝，名额不泄漏"""
+    controller = AdmissionController("test", max_concurrent=1, max_queue=4, queue_timeout=0.1)
+    results = [None] * 2
+    holder = threading.Thread(target=_hold, args=(controller, 0.4, results, 0))
+    holder.start()
+    time.sleep(0.05)
+    _hold(controller, 0, results, 1)
+    holder.join()
+    assert results[1][0] == "rejected"
+    assert controller.stats()["timeouts"] == 1
+    with controller.admit():
+        assert controller.in_flight == 1
+    assert controller.in_flight == 0
+    print("[OK] Queue timeout rejects without leaking slots")
+
+
+def test_async_waiters_share_slots_with_threads():
+    """协程与线程共用同一个控制器；被取消的协程不占名额"""
+    controller = AdmissionController("test", max_concurrent=1, max_queue=4, queue_timeout=2)
+    order = []
+
+    async def run():
+        async def worker(name):
+            async with controller.aadmit():
+                order.append(name)
+                await asyncio.sleep(0.05)
+
+        results = [None]
+        holder = threading.Thread(target=_hold, args=(controller, 0.2, results, 0))
+        holder.start()
+        await asyncio.sleep(0.05)
+        cancelled = asyncio.create_task(worker("cancelled"))
+        tasks = [asyncio.create_task(worker(f"w{i}")) for i in range(2)]
+        await asyncio.sleep(0.05)
+        cancelled.cancel()
+        await asyncio.gather(*tasks)
+        await asyncio.to_thread(holder.join)
+
+    asyncio.run(run())
+    assert order == ["w0", "w1"]
+    assert controller.in_flight == 0 and controller.queued == 0
+    print("[OK] Async waiters served FIFO after thread holder")
+
+
+def test_game_service_limits_concurrent_turns():
+    """不同会话同时聊天时，同一提供商的并发回合数不超过上限，超出队列的请求被拒绝"""
+    SlowAgent.active = SlowAgent.peak = 0
+    service = GameService(
+        registry=SessionRegistry(SlowAgent, max_sessions=50),
+        admission=AdmissionRegistry(max_concurrent=3, max_queue=3, queue_timeout=5),
+    )
+    outcomes = []
+
+    def player(i):
+        try:
+            service.chat_turn(f"s{i}", "hi")
+            outcomes.append("ok")
+        except AdmissionRejected:
+            outcomes.append("429")
+
+    threads = [threading.Thread(target=player, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SlowAgent.peak == 3
+    assert outcomes.count("ok") == 6 and outcomes.count("429") == 4
+    assert service.admission_stats()["deepseek"]["rejected"] == 4
+    print("[OK] 10 players -> 3 in flight, 3 queued, 4 rejected")
+
+
+def test_chat_route_returns_429_with_retry_after():
+    """路由层把拒绝转换为 429 + Retry-After"""
+    import app as app_module
+
+    def overloaded(*args, **kwargs):
+        raise AdmissionRejected("overloaded", retry_after=7)
+
+    original = app_module.game_service.chat_turn
+    app_module.game_service.chat_turn = overloaded
+    try:
+        client = app_module.app.test_client()
+        response = client.post("/api/chat", json={"message": "hi"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "7"
+        assert response.get_json()["retry_after"] == 7
+        print("[OK] /api/chat returns 429 with Retry-After")
+    finally:
+        app_module.game_service.chat_turn = original
+
+
+if __name__ == "__main__":
+    test_queue_full_rejects_immediately()
+    test_queue_timeout_rejects()
+    test_async_waiters_share_slots_with_threads()
+    test_game_service_limits_concurrent_turns()
+    test_chat_route_returns_429_with_retry_after()
+    print("\nAll admission control tests passed!")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 ASGI 入口：协程版 /api/chat 与 Flask 路由共享会话（本地桩 LLM，不依赖真实 API）"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.infrastructure.llm import LLMFactory
+
+LLM_DELAY = 0.3
+LLM_OUTPUT = '<analysis>{"affection_delta": 1}</analysis><response>嗯嗯，你好~</response>'
+
+
+class SlowStubHandler(BaseHTTPRequestHandler):
+    """每个请求延迟 LLM_DELAY 秒，模拟 LLM 生成耗时"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(LLM_DELAY)
+        body = json.dumps({"choices": [{"message": {"content": LLM_OUTPUT}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowStubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _configure(server):
+    os.environ["DEEPSEEK_API_KEY"] = os.environ.get("DEEPSEEK_API_KEY") or "sk-stub"
+    original = settings.LLM_PROVIDER, settings.LLM_ENDPOINT
+    settings.LLM_PROVIDER = "deepseek"
+    settings.LLM_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return original
+
+
+def test_async_chat_shares_flask_session():
+    """先经 Flask 开始游戏，再调用协程版 /api/chat：会话与角色一致"""
+    from asgi import application
+
+    server = _start_stub()
+    original = _configure(server)
+
+    async def run():
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = await client.post("/api/start_game", json={"role": "luo_yimo"})
+            assert start.status_code == 200
+            reply = await client.post("/api/chat", json={"message": "你好"})
+            assert reply.status_code == 200, reply.text
+            data = reply.json()
+            assert data["response"] == "嗯嗯，你好~"
+            assert data["character_key"] == "luo_yimo"
+            empty = await client.post("/api/chat", json={"message": ""})
+            assert empty.status_code == 400
+
+    try:
+        asyncio.run(run())
+        print("[OK] Async /api/chat shares the Flask session")
+    finally:
+        settings.LLM_PROVIDER, settings.LLM_ENDPOINT = original
+        LLMFactory.clear_shared()
+        server.shutdown()
+
+
+def test_concurrent_turns_do_not_need_threads():
+    """多个会话同时等待 LLM 时总耗时接近单次耗时，且不为每个回合占用线程"""
+    from asgi import application
+
+    server = _start_stub()
+    original = _configure(server)
+    sessions = 20
+
+    async def one_player():
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/api/start_game", json={"role": "su_tang"})
+            reply = await client.post("/api/chat", json={"message": "你好"})
+            return reply.status_code
+
+    async def run():
+        await one_player()  # 预热：建立连接池、加载角色配置
+        threads_before = threading.active_count()
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(one_player() for _ in range(sessions)))
+        return statuses, time.perf_counter() - start, threads_before
+
+    try:
+        statuses, elapsed, threads_before = asyncio.run(run())
+        assert statuses == [200] * sessions
+        assert elapsed < sessions * LLM_DELAY / 3, elapsed
+        print(f"[OK] {sessions} concurrent async turns took {elapsed:.2f}s (LLM delay {LLM_DELAY}s each)")
+    finally:
+        settings.LLM_PROVIDER, settings.LLM_ENDPOINT = original
+        LLMFactory.clear_shared()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_async_chat_shares_flask_session()
+    test_concurrent_turns_do_not_need_threads()
+    print("\nAll ASGI chat tests passed!")
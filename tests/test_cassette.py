@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试录制/回放提供商：录制真实调用（此处为桩提供商），离线回放完整回合"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.game_storage import GameStorage
+from backend.infrastructure.llm import BaseLLMProvider, CassetteMiss, CassetteProvider, LLMFactory, LLMResponse, Message
+from backend.infrastructure.llm.deepseek import DeepSeekProvider
+
+LLM_OUTPUT = (
+    '<analysis>{"affection_delta": 2, "boredom_delta": 0}</analysis>\n'
+    "<response>欢迎来烘焙社！</response>"
+)
+USAGE = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+MESSAGES = [Message(role="user", content="你好")]
+
+
+class SlowStubProvider(BaseLLMProvider):
+    """模拟真实提供商：普通调用等待 0.1s，流式每个片段间隔 0.05s"""
+
+    def __init__(self):
+        super().__init__(api_key="test-key", model="stub-model")
+        self.calls = 0
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.1)
+        return LLMResponse(content=LLM_OUTPUT, model=self.model, usage=USAGE, finish_reason="stop")
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        for i in range(0, len(LLM_OUTPUT), 20):
+            await asyncio.sleep(0.05)
+            yield LLM_OUTPUT[i:i + 20]
+        if kwargs.get("on_usage"):
+            kwargs["on_usage"](USAGE)
+
+
+def _record(path):
+    recorder = CassetteProvider(path=str(path), mode="record", inner=SlowStubProvider())
+
+    async def run():
+        await recorder.chat(MESSAGES)
+        return [chunk async for chunk in recorder.chat_stream([Message(role="user", content="流式")])]
+
+    chunks = asyncio.run(run())
+    assert "".join(chunks) == LLM_OUTPUT and recorder.recorded == 2
+    return chunks
+
+
+def test_record_then_replay_with_scaled_latency(tmp_path):
+    """录制的回复、usage 与片段间隔在回放时重现，耗时按倍数缩放"""
+    path = tmp_path / "session.jsonl"
+    chunks = _record(path)
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert lines[0]["latency"] >= 0.1 and lines[1]["chunks"][0][1] == chunks[0]
+
+    replay = CassetteProvider(path=str(path), mode="replay", latency_scale=0.5)
+    start = time.perf_counter()
+    response = asyncio.run(replay.chat(MESSAGES))
+    elapsed = time.perf_counter() - start
+    assert response.content == LLM_OUTPUT and response.usage == USAGE
+    assert 0.04 <= elapsed < 0.1, elapsed
+
+    usage = {}
+
+    async def stream():
+        return [c async for c in replay.chat_stream([Message(role="user", content="流式")], on_usage=usage.update)]
+
+    assert asyncio.run(stream()) == chunks
+    assert usage == USAGE and replay.hits == 2
+    print("[OK] Replay reproduces content, usage and scaled timings")
+
+
+def test_replay_miss_policy(tmp_path):
+    """未录制的请求：cycle 模式轮流返回已有录制，error 模式抛出 CassetteMiss"""
+    path = tmp_path / "session.jsonl"
+    _record(path)
+    other = [Message(role="user", content="没录过")]
+
+    cycling = CassetteProvider(path=str(path), mode="replay", latency_scale=0)
+    assert asyncio.run(cycling.chat(other)).content == LLM_OUTPUT
+    assert cycling.misses == 1
+
+    strict = CassetteProvider(path=str(path), mode="replay", latency_scale=0, on_miss="error")
+    try:
+        asyncio.run(strict.chat(other))
+    except CassetteMiss:
+        pass
+    else:
+        raise AssertionError("expected CassetteMiss")
+    print("[OK] Miss policy honoured")
+
+
+def test_recorder_forwards_to_unwrapped_provider(tmp_path):
+    """录制模式转发到具体提供商本身：重试/熔断/限流/指标只由工厂在 cassette 外层包装一次"""
+    recorder = CassetteProvider(path=str(tmp_path / "session.jsonl"), mode="record", record_provider="deepseek", api_key="test-key")
+    try:
+        assert type(recorder._inner) is DeepSeekProvider
+    finally:
+        recorder.close()
+    print("[OK] Recorder forwards to the unwrapped provider")
+
+
+def test_character_turn_runs_offline(tmp_path):
+    """LLM_PROVIDER=cassette 时，完整回合（提示词、解析、状态更新、存档）无需 API 密钥"""
+    path = tmp_path / "session.jsonl"
+    _record(path)
+    original = (settings.LLM_CASSETTE_PATH, settings.LLM_CASSETTE_LATENCY_SCALE)
+    settings.LLM_CASSETTE_PATH, settings.LLM_CASSETTE_LATENCY_SCALE = str(path), 0.0
+    try:
+        character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path / "saves")))
+        character.proactive_system.last_chat_time = None
+        character.api_settings["provider"] = "cassette"
+        assert character.chat("你好") == "欢迎来烘焙社！"
+        assert character.game_state["closeness"] == 32
+        assert character.llm_usage["total_tokens"] == 120
+        assert character.save("cassette_slot")
+        print("[OK] Character turn replayed offline")
+    finally:
+        settings.LLM_CASSETTE_PATH, settings.LLM_CASSETTE_LATENCY_SCALE = original
+        LLMFactory.clear_shared()
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_record_then_replay_with_scaled_latency(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_replay_miss_policy(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_recorder_forwards_to_unwrapped_provider(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_character_turn_runs_offline(Path(tmp))
+    print("\nAll cassette tests passed!")
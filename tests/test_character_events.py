@@ -3,12 +3,14 @@
 """测试BaseCharacter事件集成"""
 
 import sys
+import tempfile
 from pathlib import Path
 
 # 添加项目根目录到路径
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+from backend.game_storage import GameStorage
 from backend.infrastructure.events import Event, EventType, get_event_bus
 from backend.infrastructure.character_loader.loader import CharacterLoader
 
@@ -52,7 +54,9 @@ def test_character_events():
     # 导入BaseCharacter
     from backend.domain.characters.base_character import BaseCharacter
 
-    character = BaseCharacter(config=base_config)
+    # 存档写入临时目录，不在仓库的 saves/ 下留下文件
+    save_dir = tempfile.TemporaryDirectory()
+    character = BaseCharacter(config=base_config, storage=GameStorage(save_dir=save_dir.name))
     print("[OK] Character created")
 
     # 开始新游戏 - 应该触发GAME_STARTED事件
@@ -141,6 +145,8 @@ def test_character_events():
     for event_type, count in sorted(event_counts.items()):
         print(f"  {event_type}: {count}")
 
+    save_dir.cleanup()
+
     print("\n" + "=" * 60)
     print("All integration tests passed!")
     print("=" * 60)
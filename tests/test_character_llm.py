@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试角色回合经由提供商层调用 LLM（本地桩服务器，不依赖真实 API）"""
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.game_storage import GameStorage
+from backend.infrastructure.llm import LLMFactory
+
+LLM_OUTPUT = (
+    '<analysis>{"affection_delta": 2, "boredom_delta": 0}</analysis>\n'
+    "<response>欢迎来烘焙社！</response>"
+)
+USAGE = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+    requests = []
+
+    def setup(self):
+        super().setup()
+        StubHandler.connections += 1
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        StubHandler.requests.append((self.headers.get("Authorization"), payload))
+        if payload.get("stream"):
+            events = [{"choices": [{"delta": {"content": LLM_OUTPUT[i:i + 6]}}]} for i in range(0, len(LLM_OUTPUT), 6)]
+            events.append({"choices": [], "usage": USAGE})
+            body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps({"model": "stub", "choices": [{"message": {"content": LLM_OUTPUT}}], "usage": USAGE})
+            content_type = "application/json"
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_stub():
+    StubHandler.connections = 0
+    StubHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def _make_character(tmp_dir, endpoint):
+    character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_dir)))
+    character.proactive_system.last_chat_time = None
+    character.api_settings.update({"endpoint": endpoint, "api_key_env": "STUB_LLM_API_KEY", "model": "stub-model"})
+    return character
+
+
+def test_chat_goes_through_shared_provider(tmp_path):
+    """两个会话的普通回合共享同一个提供商实例与连接池，并记录 token 用量"""
+    server, endpoint = _start_stub()
+    os.environ["STUB_LLM_API_KEY"] = "sk-stub"
+    try:
+        first = _make_character(tmp_path, endpoint)
+        second = _make_character(tmp_path, endpoint)
+        assert first.chat("你好") == "欢迎来烘焙社！"
+        assert second.chat("你好") == "欢迎来烘焙社！"
+        assert first.chat("再见") == "欢迎来烘焙社！"
+
+        assert first._get_llm_adapter()._provider is second._get_llm_adapter()._provider
+        assert StubHandler.connections == 1
+        auth, payload = StubHandler.requests[0]
+        assert auth == "Bearer sk-stub" and payload["model"] == "stub-model"
+        assert first.llm_usage == {
+            "calls": 2, "prompt_tokens": 200, "completion_tokens": 40, "total_tokens": 240, "cache_hit_tokens": 0,
+        }
+        assert first.game_state["closeness"] == 34
+        print("[OK] Character turns use the shared pooled provider")
+    finally:
+        LLMFactory.clear_shared()
+        server.shutdown()
+
+
+def test_stream_records_usage(tmp_path):
+    """流式回合通过提供商的 chat_stream，并从最后一个事件中取得用量"""
+    server, endpoint = _start_stub()
+    os.environ["STUB_LLM_API_KEY"] = "sk-stub"
+    try:
+        character = _make_character(tmp_path, endpoint)
+        events = list(character.chat_stream("你好"))
+        assert "".join(v for k, v in events if k == "delta") == "欢迎来烘焙社！"
+        assert events[-1] == ("done", "欢迎来烘焙社！")
+        assert StubHandler.requests[0][1]["stream_options"] == {"include_usage": True}
+        assert character.llm_usage["calls"] == 1 and character.llm_usage["total_tokens"] == 120
+        print("[OK] Streaming turn records usage")
+    finally:
+        LLMFactory.clear_shared()
+        server.shutdown()
+
+
+def test_missing_key_falls_back_to_backup_reply(tmp_path):
+    """缺少 API 密钥时回合不会崩溃，返回备用回复"""
+    character = _make_character(tmp_path, "http://127.0.0.1:9/unused")
+    character.api_settings["api_key_env"] = "STUB_LLM_MISSING_KEY"
+    os.environ.pop("STUB_LLM_MISSING_KEY", None)
+    reply = character.chat("你好")
+    assert reply
+    assert character.llm_usage["calls"] == 0
+    print("[OK] Missing key falls back to backup reply")
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_chat_goes_through_shared_provider(Path(tmp))
+        test_stream_records_usage(Path(tmp))
+        test_missing_key_falls_back_to_backup_reply(Path(tmp))
+    print("\nAll character LLM tests passed!")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试流式回合（不依赖真实 LLM）"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.game_storage import GameStorage
+
+LLM_OUTPUT = (
+    '<analysis>{"affection_delta": 3, "boredom_delta": -1, "triggered_topics": ["烘焙"]}</analysis>\n'
+    "<response>你好呀，欢迎来烘焙社看看！</response>"
+)
+
+
+def _fake_stream(chunk_size):
+    def stream(filled_prompt):
+        for i in range(0, len(LLM_OUTPUT), chunk_size):
+            yield LLM_OUTPUT[i:i + chunk_size]
+    return stream
+
+
+def _make_character(tmp_dir):
+    character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_dir)))
+    character.proactive_system.last_chat_time = None
+    return character
+
+
+def test_stream_emits_only_response_text(tmp_path):
+    """delta 只包含 <response> 内的文本，标签跨片段时也不泄露"""
+    for chunk_size in (1, 3, 7, 64):
+        character = _make_character(tmp_path)
+        character._stream_llm = _fake_stream(chunk_size)
+
+        events = list(character.chat_stream("你好"))
+        deltas = "".join(value for kind, value in events if kind == "delta")
+        kind, final = events[-1]
+
+        assert kind == "done"
+        assert deltas == "你好呀，欢迎来烘焙社看看！"
+        assert final == deltas
+        assert "<" not in deltas
+    print("[OK] Stream deltas contain only response text")
+
+
+def test_stream_updates_state_like_chat(tmp_path):
+    """流式回合与普通回合一样更新好感度与历史"""
+    character = _make_character(tmp_path)
+    character._stream_llm = _fake_stream(5)
+    before = character.game_state["closeness"]
+
+    list(character.chat_stream("你好"))
+
+    assert character.game_state["closeness"] == before + 3
+    assert character.dialogue_history[-1] == {"role": "assistant", "content": "你好呀，欢迎来烘焙社看看！"}
+    assert character.dialogue_history[-2]["role"] == "user"
+    print("[OK] Stream turn applied analysis to state")
+
+
+def test_stream_failure_falls_back_to_backup(tmp_path):
+    """LLM 流失败时 done 事件携带备用回复"""
+    character = _make_character(tmp_path)
+
+    def broken(filled_prompt):
+        raise RuntimeError("connection reset")
+        yield  # pragma: no cover
+
+    character._stream_llm = broken
+    events = list(character.chat_stream("你好"))
+    kind, final = events[-1]
+    assert kind == "done"
+    assert final
+    assert character.dialogue_history[-1]["content"] == final
+    print("[OK] Stream failure falls back to backup reply")
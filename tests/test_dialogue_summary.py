@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试滚动对话摘要：本地抽取、后台合并与回退、存档往返，以及摘要作为单独一节注入提示词"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.dialogue_summary import DialogueSummarizer, extractive_summary
+from backend.game_storage import GameStorage
+from backend.infrastructure.llm import BaseLLMProvider, LLMAdapter, LLMResponse
+
+LLM_OUTPUT = (
+    '<analysis>{"affection_delta": 1, "boredom_delta": 0, "triggered_topics": ["烘焙"]}</analysis>\n'
+    "<response>嗯嗯，我记下啦。</response>"
+)
+
+
+class SummaryAwareProvider(BaseLLMProvider):
+    """回合请求返回固定的分析输出；摘要请求返回固定的摘要，并记录其输入"""
+
+    def __init__(self):
+        super().__init__(api_key="test-key", model="fake")
+        self.turn_requests = []
+        self.summary_requests = []
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        if "前情摘要" in messages[0].content:
+            self.summary_requests.append(messages[-1].content)
+            return LLMResponse(content=f"摘要第{len(self.summary_requests)}版：陈辰在学做曲奇。", model=self.model)
+        self.turn_requests.append(messages[-1].content)
+        return LLMResponse(content=LLM_OUTPUT, model=self.model)
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        response = await self.chat(messages)
+        yield response.content
+
+
+def test_extractive_summary_keeps_first_sentences_within_limit():
+    """每行保留说话人与第一句话；超出长度时先丢弃最早的部分"""
+    lines = ["陈辰: 我下周要参加数学竞赛。有点紧张。", "苏糖: 加油呀！我给你做曲奇。"]
+    text = extractive_summary("", lines, max_chars=100)
+    assert text == "陈辰：我下周要参加数学竞赛。；苏糖：加油呀！"
+    trimmed = extractive_summary("很早以前的摘要" * 5, lines, max_chars=30)
+    assert trimmed.startswith("陈辰：") and len(trimmed) <= 30
+    assert len(extractive_summary("", ["陈辰: " + "长" * 500], max_chars=25)) <= 25
+    print("[OK] Extractive summary keeps first sentences within the limit")
+
+
+def test_summarizer_batches_and_falls_back():
+    """攒够一批才合并；LLM 失败或超时改用本地抽取；读档后旧任务的结果作废"""
+    calls = []
+
+    async def summarize(previous, lines):
+        calls.append((previous, list(lines)))
+        return f"{previous}+{len(lines)}"
+
+    summarizer = DialogueSummarizer(max_chars=100, batch=3, summarize=summarize)
+    assert summarizer.add(["陈辰: 一", "苏糖: 二"]) is None
+    summarizer.add(["陈辰: 三"]).result(timeout=5)
+    assert summarizer.text == "+3" and summarizer.pending == []
+    summarizer.add(["陈辰: 四", "苏糖: 五", "陈辰: 六"]).result(timeout=5)
+    assert summarizer.text == "+3+3" and calls[-1][0] == "+3"
+    assert summarizer.to_dict() == {"text": "+3+3", "pending": [], "folded": 6}
+
+    async def failing(previous, lines):
+        raise RuntimeError("provider down")
+
+    async def slow(previous, lines):
+        await asyncio.sleep(5)
+        return "太慢了"
+
+    for summarize_fn, timeout in ((failing, 5.0), (slow, 0.05)):
+        fallback = DialogueSummarizer(max_chars=100, batch=1, summarize=summarize_fn, timeout=timeout)
+        fallback.add(["陈辰: 我喜欢抹茶。"]).result(timeout=5)
+        assert fallback.text == "陈辰：我喜欢抹茶。" and fallback.stats == {"llm": 0, "extractive": 1}
+
+    stale = DialogueSummarizer(max_chars=100, batch=1, summarize=slow, timeout=1.0)
+    future = stale.add(["陈辰: 旧存档的对话"])
+    stale.from_dict({"text": "读档后的摘要", "pending": ["陈辰: 未合并"]})
+    future.result(timeout=5)
+    assert stale.text == "读档后的摘要" and stale.pending == ["陈辰: 未合并"]
+    print("[OK] Summarizer batches, falls back and discards stale results")
+
+
+def test_character_injects_summary_and_persists_it(tmp_path):
+    """移出窗口的对话在后台合并；摘要作为单独一节进入提示词，历史仍只有 10 条，并随存档保存"""
+    original = settings.DIALOGUE_SUMMARY_LLM
+    settings.DIALOGUE_SUMMARY_LLM = True
+    try:
+        storage = GameStorage(save_dir=str(tmp_path))
+        character = SuTangCharacter(is_new_game=True, storage=storage)
+        character.proactive_system.last_chat_time = None
+        provider = SummaryAwareProvider()
+        character._llm_adapter = LLMAdapter(provider=provider)
+
+        for i in range(9):
+            character.chat(f"第{i}句：学姐，我想学做曲奇。")
+            assert character.dialogue_summary.wait(timeout=5)
+        # 18 条对话，8 条移出窗口：攒够 6 条时合并了一次，剩下 2 条等待下一批
+        assert len(provider.summary_requests) == 1
+        assert "第0句" in provider.summary_requests[0] and "第3句" not in provider.summary_requests[0]
+        assert character.dialogue_summary.text == "摘要第1版：陈辰在学做曲奇。"
+        assert len(character.dialogue_summary.pending) == 2
+
+        character.chat("还记得我们最早聊了什么吗？")
+        prompt = provider.turn_requests[-1]
+        assert "# [Earlier Conversation Summary]" in prompt and "摘要第1版" in prompt
+        history = prompt.split("# [Recent Conversation History]\n", 1)[1].split("\n\n# ", 1)[0]
+        assert len(history.splitlines()) == 10 and "第0句" not in history
+        assert character.last_prompt_report["sections"]["summary"] > 0
+
+        assert character.save(1)
+        restored = SuTangCharacter(is_new_game=True, storage=storage)
+        assert restored.load(1)
+        assert restored.dialogue_summary.to_dict() == character.dialogue_summary.to_dict()
+        assert "摘要第1版" in restored.build_prompt_variables("你好")["conversation_summary"]
+        restored.start_new_game(is_new_game=True)
+        assert restored.dialogue_summary.text == ""
+        print("[OK] Summary injected as its own section and saved with the session")
+    finally:
+        settings.DIALOGUE_SUMMARY_LLM = original
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_extractive_summary_keeps_first_sentences_within_limit()
+    test_summarizer_batches_and_falls_back()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_character_injects_summary_and_persists_it(Path(tmp))
+    print("\nAll dialogue summary tests passed!")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试对冲请求：慢的主提供商被备用提供商超越，落败方被取消"""
+
+import asyncio
+import os
+import sys
+import threading
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm import BaseLLMProvider, HedgedProvider, LLMFactory, LLMResponse, Message, ProviderHTTPError
+
+MESSAGES = [Message(role="user", content="hi")]
+
+
+class TimedProvider(BaseLLMProvider):
+    """等待固定秒数后返回自己的名字；记录被取消与完成的次数"""
+
+    def __init__(self, name, delay, error=None):
+        super().__init__(api_key="test-key", model=name)
+        self.delay = delay
+        self.error = error
+        self.started = 0
+        self.cancelled = 0
+        self.closed_streams = 0
+
+    async def _wait(self):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        await self._wait()
+        return LLMResponse(content=self.model, model=self.model)
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        try:
+            await self._wait()
+            for part in (self.model, "-", "done"):
+                yield part
+        finally:
+            self.closed_streams += 1
+
+
+def _hedged(primary, secondary, **kwargs):
+    options = {"initial_delay": 0.05, "min_delay": 0.01, **kwargs}
+    return HedgedProvider(primary, secondary, "primary", "secondary", **options)
+
+
+def test_fast_primary_is_not_hedged():
+    """主提供商在对冲延迟内完成时不发出副本请求"""
+    primary, secondary = TimedProvider("deepseek", 0.0), TimedProvider("openai", 0.0)
+    provider = _hedged(primary, secondary)
+    assert asyncio.run(provider.chat(MESSAGES)).content == "deepseek"
+    assert secondary.started == 0 and provider.hedged == 0
+    print("[OK] Fast primary answers alone")
+
+
+def test_slow_primary_loses_and_is_cancelled():
+    """主提供商超过对冲延迟后发出副本请求；备用提供商先完成，主提供商被取消"""
+    primary, secondary = TimedProvider("deepseek", 5.0), TimedProvider("openai", 0.05)
+    provider = _hedged(primary, secondary)
+    assert asyncio.run(provider.chat(MESSAGES)).content == "openai"
+    assert primary.cancelled == 1 and provider.hedged == 1
+    stats = {leg["label"]: leg for leg in provider.stats()["legs"]}
+    assert stats["secondary"]["wins"] == 1 and stats["primary"]["cancelled"] == 1
+    print("[OK] Slow primary hedged, loser cancelled")
+
+
+def test_primary_failure_fails_over_immediately():
+    """主提供商在对冲延迟之前失败时立即转向备用提供商"""
+    primary = TimedProvider("deepseek", 0.0, error=ProviderHTTPError("down", 503))
+    secondary = TimedProvider("openai", 0.0)
+    provider = _hedged(primary, secondary, initial_delay=5.0)
+    assert asyncio.run(provider.chat(MESSAGES)).content == "openai"
+    assert provider.stats()["legs"][0]["errors"] == 1
+
+    both_down = _hedged(primary, TimedProvider("openai", 0.0, error=ProviderHTTPError("also down", 502)))
+    try:
+        asyncio.run(both_down.chat(MESSAGES))
+    except ProviderHTTPError as exc:
+        assert exc.status_code == 503  # 抛出主提供商的错误
+    else:
+        raise AssertionError("expected both legs to fail")
+    print("[OK] Failed primary falls over to secondary")
+
+
+def test_stream_race_closes_loser():
+    """流式对冲以首个片段决胜，继续读取获胜方的流并关闭落败方"""
+    primary, secondary = TimedProvider("deepseek", 5.0), TimedProvider("openai", 0.05)
+    provider = _hedged(primary, secondary)
+
+    async def collect():
+        return [chunk async for chunk in provider.chat_stream(MESSAGES)]
+
+    assert asyncio.run(collect()) == ["openai", "-", "done"]
+    assert primary.cancelled == 1 and primary.closed_streams == 1 and secondary.closed_streams == 1
+    print("[OK] Stream race keeps winner and closes loser")
+
+
+def test_hedge_delay_tracks_percentile():
+    """样本足够后，对冲延迟取主提供商耗时的分位数；普通调用与流式首 token 各用各的窗口"""
+    provider = _hedged(TimedProvider("deepseek", 0.0), TimedProvider("openai", 0.0), percentile=90, min_delay=0.01)
+    assert provider.hedge_delay() == 0.05
+    for i in range(1, 21):
+        provider.primary_stats.observe(i / 10)
+    assert provider.hedge_delay() == 1.8 and provider.hedge_delay("stream") == 0.05
+    for i in range(1, 21):
+        provider.primary_stats.observe(i / 100, "stream")
+    assert provider.hedge_delay("stream") == 0.18 and provider.hedge_delay("chat") == 1.8
+    legs = provider.stats()["legs"][0]
+    assert legs["completion_p50_s"] == 1.0 and legs["first_token_p50_s"] == 0.1
+    print("[OK] Hedge delay follows the configured percentile per mode")
+
+
+def test_counters_exact_across_threads():
+    """多个工作线程（各自的事件循环）共用同一个对冲包装时，计数不丢失"""
+    provider = _hedged(TimedProvider("deepseek", 0.0), TimedProvider("openai", 0.0))
+    workers, calls = 8, 25
+
+    async def run():
+        for _ in range(calls):
+            await provider.chat(MESSAGES)
+
+    threads = [threading.Thread(target=asyncio.run, args=(run(),)) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = provider.stats()
+    primary = stats["legs"][0]
+    assert stats["calls"] == workers * calls
+    assert primary["requests"] == primary["wins"] == workers * calls
+    print("[OK] Hedge counters exact across threads")
+
+
+def test_factory_builds_shared_hedge():
+    """get_shared(hedge=...) 返回共享的对冲实例；备用提供商缺少密钥时退回主提供商"""
+    os.environ["HEDGE_TEST_PRIMARY_KEY"] = "sk-primary"
+    saved = os.environ.pop("OPENAI_API_KEY", None)
+    try:
+        plain = LLMFactory.get_shared("deepseek", api_key_env="HEDGE_TEST_PRIMARY_KEY", hedge="openai")
+        assert not isinstance(plain, HedgedProvider)
+        os.environ["OPENAI_API_KEY"] = "sk-secondary"
+        first = LLMFactory.get_shared("deepseek", api_key_env="HEDGE_TEST_PRIMARY_KEY", hedge="openai:gpt-4o-mini")
+        second = LLMFactory.get_shared("deepseek", api_key_env="HEDGE_TEST_PRIMARY_KEY", hedge="openai:gpt-4o-mini")
+        assert isinstance(first, HedgedProvider) and first is second
+        assert first.secondary.model == "gpt-4o-mini" and first.model == "deepseek-chat"
+        assert LLMFactory.hedge_stats()[0]["legs"][1]["label"] == "openai:gpt-4o-mini"
+        print("[OK] Factory shares hedged providers")
+    finally:
+        LLMFactory.clear_shared()
+        os.environ.pop("OPENAI_API_KEY", None)
+        if saved is not None:
+            os.environ["OPENAI_API_KEY"] = saved
+
+
+if __name__ == "__main__":
+    test_fast_primary_is_not_hedged()
+    test_slow_primary_loses_and_is_cancelled()
+    test_primary_failure_fails_over_immediately()
+    test_stream_race_closes_loser()
+    test_hedge_delay_tracks_percentile()
+    test_counters_exact_across_threads()
+    test_factory_builds_shared_hedge()
+    print("\nAll hedging tests passed!")
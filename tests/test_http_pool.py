@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 LLM 提供商的长连接 HTTP 客户端"""
+
+import asyncio
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm import DeepSeekProvider, LLMAdapter, Message
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容桩：普通请求返回 JSON，stream=True 时返回 SSE"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StubHandler.connections += 1
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if payload.get("stream"):
+            lines = [
+                "data: " + json.dumps({"choices": [{"delta": {"content": piece}}]})
+                for piece in ("你", "好")
+            ]
+            body = ("\n\n".join(lines + ["data: [DONE]"]) + "\n\n").encode("utf-8")
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps({"choices": [{"message": {"content": "你好"}}]}).encode("utf-8")
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_stub():
+    StubHandler.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return server, DeepSeekProvider(api_key="test", endpoint=endpoint, timeout=5)
+
+
+def test_connection_reused_within_loop():
+    """同一事件循环内多次 chat/chat_stream 复用同一个连接"""
+    server, provider = _start_stub()
+    messages = [Message(role="user", content="hi")]
+
+    async def run():
+        for _ in range(5):
+            assert (await provider.chat(messages)).content == "你好"
+        chunks = [chunk async for chunk in provider.chat_stream(messages)]
+        assert "".join(chunks) == "你好"
+        await provider.aclose()
+
+    try:
+        asyncio.run(run())
+        assert StubHandler.connections == 1
+        assert len(provider._http) == 0
+        print("[OK] Connection reused across calls")
+    finally:
+        server.shutdown()
+
+
+def test_close_releases_clients_on_all_loops():
+    """每个事件循环各有一个客户端，close() 统一关闭"""
+    server, provider = _start_stub()
+    loops = [asyncio.new_event_loop() for _ in range(2)]
+    try:
+        clients = []
+        for loop in loops:
+            loop.run_until_complete(provider.chat([Message(role="user", content="hi")]))
+            clients.append(provider._http._clients[loop])
+        assert clients[0] is not clients[1]
+        provider.close()
+        assert all(client.is_closed for client in clients)
+        assert len(provider._http) == 0
+        print("[OK] close() releases clients on every loop")
+    finally:
+        for loop in loops:
+            loop.close()
+        server.shutdown()
+
+
+def test_adapter_reuses_connection_across_threads():
+    """同步适配器在共享后台循环上运行，多个线程的多次调用复用连接池"""
+    server, provider = _start_stub()
+    adapter = LLMAdapter(provider=provider)
+    results = []
+
+    def worker():
+        for _ in range(3):
+            results.append(adapter.chat([{"role": "user", "content": "hi"}]))
+
+    try:
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == ["你好"] * 12
+        assert "".join(adapter.chat_stream([{"role": "user", "content": "hi"}])) == "你好"
+        assert len(provider._http) == 1
+        assert StubHandler.connections <= 4
+        print(f"[OK] 13 sync calls from 4 threads used {StubHandler.connections} connection(s)")
+    finally:
+        provider.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_connection_reused_within_loop()
+    test_close_releases_clients_on_all_loops()
+    test_adapter_reuses_connection_across_threads()
+    print("\nAll HTTP pool tests passed!")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试后台事件循环"""
+
+import asyncio
+import contextvars
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm import BackgroundLoop
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_run_from_many_threads_shares_one_loop():
+    """多个线程提交的协程都在同一个后台循环上执行"""
+    runner = BackgroundLoop(name="test-loop")
+    seen = []
+
+    async def which_loop():
+        await asyncio.sleep(0.01)
+        return asyncio.get_running_loop()
+
+    def worker():
+        seen.append(runner.run(which_loop()))
+
+    try:
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(seen) == 8 and all(loop is runner.loop for loop in seen)
+        print("[OK] Coroutines from 8 threads ran on one loop")
+    finally:
+        runner.stop()
+
+
+def test_timeout_cancels_coroutine():
+    """超时抛出 TimeoutError，并取消后台协程"""
+    runner = BackgroundLoop(name="test-loop")
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    try:
+        start = time.perf_counter()
+        try:
+            runner.run(slow(), timeout=0.05)
+            raise AssertionError("expected TimeoutError")
+        except TimeoutError:
+            pass
+        assert time.perf_counter() - start < 1
+        assert cancelled.wait(1)
+        print("[OK] Timeout cancels the coroutine")
+    finally:
+        runner.stop()
+
+
+def test_iterate_closes_stream_early():
+    """同步迭代提前结束时，异步生成器会在后台循环上被关闭"""
+    runner = BackgroundLoop(name="test-loop")
+    closed = threading.Event()
+
+    async def numbers():
+        try:
+            for i in range(100):
+                yield i
+        finally:
+            closed.set()
+
+    try:
+        iterator = runner.iterate(numbers())
+        assert [next(iterator) for _ in range(3)] == [0, 1, 2]
+        iterator.close()
+        assert closed.is_set()
+        print("[OK] Early close finalizes the async stream")
+    finally:
+        runner.stop()
+
+
+def test_context_propagates_to_loop():
+    """调用方的 contextvars 会带入后台协程"""
+    runner = BackgroundLoop(name="test-loop")
+
+    async def read_var():
+        return request_id.get()
+
+    try:
+        request_id.set("abc")
+        assert runner.run(read_var()) == "abc"
+        print("[OK] contextvars propagated")
+    finally:
+        runner.stop()
+
+
+if __name__ == "__main__":
+    test_run_from_many_threads_shares_one_loop()
+    test_timeout_cancels_coroutine()
+    test_iterate_closes_stream_early()
+    test_context_propagates_to_loop()
+    print("\nAll background loop tests passed!")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试指标注册表：线程分片汇总、Prometheus 文本格式、LLM 包装与 /metrics 端点"""
+
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.infrastructure.llm import BaseLLMProvider, DeepSeekProvider, InstrumentedProvider, LLMFactory, LLMResponse, Message
+from backend.infrastructure.llm.base import ProviderHTTPError
+from backend.infrastructure.metrics import MetricsRegistry, get_metrics_registry
+
+
+class UsageProvider(BaseLLMProvider):
+    """第一次普通调用返回 503，之后返回固定 usage；流式在结束时回调 usage"""
+
+    def __init__(self):
+        super().__init__(api_key="test-key", model="fake")
+        self.calls = 0
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise ProviderHTTPError("busy", 503)
+        return LLMResponse(content="ok", model=self.model, usage={"prompt_tokens": 12, "completion_tokens": 5})
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        yield "o"
+        yield "k"
+        kwargs["on_usage"]({"prompt_tokens": 7, "completion_tokens": 2})
+
+
+def test_thread_shards_are_summed_without_losing_increments():
+    """多个线程（含已结束的线程）并发累加，抓取结果等于总次数"""
+    registry = MetricsRegistry()
+    registry._COMPACT_THRESHOLD = 4  # 让分片合并在测试中实际发生
+    counter = registry.counter("test_ops_total", "ops", ("kind",))
+    histogram = registry.histogram("test_seconds", "latency", buckets=(0.1, 1.0))
+
+    def worker():
+        for i in range(1000):
+            counter.inc(kind="a" if i % 2 else "b")
+            histogram.observe(0.05 if i % 2 else 0.5)
+
+    for _ in range(3):
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert registry.value("test_ops_total", kind="a") == 12000
+    assert registry.value("test_ops_total", kind="b") == 12000
+    assert registry.value("test_seconds") == 24000
+    assert len(registry._shards) <= 4  # 已结束线程的分片已并入汇总
+    print("[OK] Per-thread shards summed across live and finished threads")
+
+
+def test_render_prometheus_text():
+    """直方图输出累计分桶、_sum 与 _count；标签值转义；回调仪表在抓取时取值"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_duration_seconds", "Duration.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        histogram.observe(value, route="/api/chat")
+    registry.counter("test_requests_total", "Requests.", ("route",)).inc(route='say "hi"')
+    sessions = [1, 2]
+    registry.gauge_callback("test_sessions", "Sessions.", lambda: len(sessions))
+    sessions.append(3)
+
+    text = registry.render()
+    assert "# TYPE test_duration_seconds histogram" in text
+    assert 'test_duration_seconds_bucket{route="/api/chat",le="0.1"} 1' in text
+    assert 'test_duration_seconds_bucket{route="/api/chat",le="1"} 2' in text
+    assert 'test_duration_seconds_bucket{route="/api/chat",le="+Inf"} 3' in text
+    assert 'test_duration_seconds_sum{route="/api/chat"} 2.55' in text
+    assert 'test_duration_seconds_count{route="/api/chat"} 3' in text
+    assert 'test_requests_total{route="say \\"hi\\""} 1' in text
+    assert "test_sessions 3" in text
+    print("[OK] Prometheus text exposition rendered")
+
+
+def test_instrumented_provider_records_latency_errors_and_tokens():
+    """每次上游请求计数；错误按状态码分类；普通与流式调用的 usage 都累计到 token 计数"""
+    registry = get_metrics_registry()
+    provider = InstrumentedProvider(UsageProvider(), "metrics-test")
+    messages = [Message(role="user", content="hi")]
+
+    async def run():
+        try:
+            await provider.chat(messages)
+        except ProviderHTTPError:
+            pass
+        await provider.chat(messages)
+        seen = []
+        async for chunk in provider.chat_stream(messages, on_usage=seen.append):
+            pass
+        return seen
+
+    seen = asyncio.run(run())
+    assert seen == [{"prompt_tokens": 7, "completion_tokens": 2}]  # 调用方的 on_usage 仍会收到
+    assert registry.value("lyuyuan_llm_errors_total", provider="metrics-test", kind="http_503") == 1
+    assert registry.value("lyuyuan_llm_requests_total", provider="metrics-test", mode="chat", outcome="ok") == 1
+    assert registry.value("lyuyuan_llm_requests_total", provider="metrics-test", mode="stream", outcome="ok") == 1
+    assert registry.value("lyuyuan_llm_request_duration_seconds", provider="metrics-test", mode="chat") == 2
+    assert registry.value("lyuyuan_llm_first_token_seconds", provider="metrics-test") == 1
+    assert registry.value("lyuyuan_llm_tokens_total", provider="metrics-test", type="prompt") == 19
+    assert registry.value("lyuyuan_llm_tokens_total", provider="metrics-test", type="completion") == 7
+
+    # 工厂把指标包装放在最内层，紧贴具体提供商
+    wrapper = LLMFactory.create("deepseek", api_key="sk-metrics")
+    while not isinstance(wrapper, InstrumentedProvider):
+        wrapper = wrapper.inner
+    assert isinstance(wrapper.inner, DeepSeekProvider) and wrapper.provider_name == "deepseek"
+    print("[OK] LLM requests, errors and tokens recorded per provider")
+
+
+def test_metrics_endpoint(tmp_path):
+    """/metrics 返回文本格式，包含按路由模板记录的请求与各类业务指标"""
+    from app import app
+    from backend.game_storage import GameStorage
+
+    storage = GameStorage(save_dir=str(tmp_path))
+    storage.save_game({"history": []}, "metrics")
+    storage.load_game("metrics")
+
+    client = app.test_client()
+    original = settings.DEBUG_ENDPOINTS
+    settings.DEBUG_ENDPOINTS = True
+    try:
+        client.get("/api/debug/sessions")
+    finally:
+        settings.DEBUG_ENDPOINTS = original
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert 'lyuyuan_http_requests_total{route="/api/debug/sessions",method="GET",status="200"}' in text
+    assert 'lyuyuan_http_request_duration_seconds_count{route="/api/debug/sessions"}' in text
+    assert 'lyuyuan_storage_duration_seconds_count{operation="save"}' in text
+    assert 'lyuyuan_storage_duration_seconds_count{operation="load"}' in text
+    assert "# TYPE lyuyuan_active_sessions gauge" in text and "\nlyuyuan_active_sessions " in text
+    for name in ("lyuyuan_backup_replies_total", "lyuyuan_events_published_total", "lyuyuan_llm_tokens_total"):
+        assert f"# TYPE {name} counter" in text
+    print("[OK] /metrics endpoint serves Prometheus text")
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_thread_shards_are_summed_without_losing_increments()
+    test_render_prometheus_text()
+    test_instrumented_provider_records_latency_errors_and_tokens()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_metrics_endpoint(Path(tmp))
+    print("\nAll metrics tests passed!")
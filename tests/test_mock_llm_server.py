@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试本地模拟 LLM 服务器：DeepSeekProvider 指向它时普通/流式调用、延迟参数与错误注入"""
+
+import asyncio
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm import DeepSeekProvider, Message, ProviderHTTPError
+from backend.domain.output_parser import parse_tagged_output
+from benchmarks.mock_llm_server import PROFILES, MockLLMServer
+
+MESSAGES = [Message(role="system", content="你是苏糖"), Message(role="user", content="你好")]
+
+
+def _provider(server):
+    return DeepSeekProvider(api_key="mock", endpoint=server.endpoint)
+
+
+def test_chat_returns_parseable_output():
+    """普通调用返回能被解析的 <analysis>/<response>，并带 usage"""
+    server = MockLLMServer(profile=PROFILES["fast"], seed=1).start()
+    try:
+        response = asyncio.run(_provider(server).chat(MESSAGES))
+        parsed = parse_tagged_output(response.content)
+        assert parsed["response"] and isinstance(parsed["analysis"].get("affection_delta"), int)
+        assert response.usage["completion_tokens"] > 0
+        print("[OK] Mock completion parses like a real reply")
+    finally:
+        server.stop()
+
+
+def test_stream_honours_latency_profile():
+    """流式按 token 逐个到达：首 token 延迟与总耗时符合档位参数，最后回调 usage"""
+    profile = replace(PROFILES["fast"], first_token_ms=100, tokens_per_second=2000)
+    server = MockLLMServer(profile=profile, seed=2).start()
+    usage = {}
+    finish = []
+
+    async def collect():
+        provider = _provider(server)
+        started = time.perf_counter()
+        first = None
+        chunks = []
+        async for chunk in provider.chat_stream(MESSAGES, on_usage=usage.update, on_finish=finish.append):
+            if not chunk:  # 与 DeepSeek 一样，首个事件只带 role
+                continue
+            if first is None:
+                first = time.perf_counter() - started
+            chunks.append(chunk)
+        await provider.aclose()
+        return first, time.perf_counter() - started, chunks
+
+    try:
+        first, total, chunks = asyncio.run(collect())
+        assert 0.09 <= first < 0.5, first
+        assert len(chunks) > 20 and total >= first + (len(chunks) - 1) / 2000
+        assert parse_tagged_output("".join(chunks))["response"]
+        assert usage["completion_tokens"] == len(chunks)
+        assert finish == ["stop"]
+        print("[OK] Stream timing follows the profile")
+    finally:
+        server.stop()
+
+
+def test_error_injection_rates():
+    """按比例注入 429 与 500，且同一 seed 下结果可重复"""
+    profile = replace(PROFILES["fast"], first_token_ms=0, rate_429=0.2, rate_500=0.2)
+
+    async def run(provider, n):
+        statuses = []
+        for _ in range(n):
+            try:
+                await provider.chat(MESSAGES)
+                statuses.append(200)
+            except ProviderHTTPError as e:
+                statuses.append(e.status_code)
+        await provider.aclose()
+        return statuses
+
+    results = []
+    for _ in range(2):
+        server = MockLLMServer(profile=profile, seed=7).start()
+        try:
+            results.append(asyncio.run(run(_provider(server), 200)))
+            stats = server.stats()
+        finally:
+            server.stop()
+    assert results[0] == results[1]
+    assert 20 <= results[0].count(429) <= 60 and 20 <= results[0].count(500) <= 60
+    assert stats["rate_limited"] == results[0].count(429) and stats["requests"] == 200
+    print("[OK] Error rates injected reproducibly")
+
+
+def test_prefix_cache_is_bounded():
+    """前缀缓存只保存固定大小的摘要，超过上限时淘汰最久未用的前缀"""
+    server = MockLLMServer(profile=PROFILES["fast"], seed=3)
+    server.MAX_PREFIXES = 2
+    try:
+        turn = [{"role": "system", "content": "人设" * 200}, {"role": "user", "content": "你好"}]
+        assert server.prefix_cache_hit(turn) == 0
+        assert server.prefix_cache_hit(turn) > 0
+        for i in range(2):
+            server.prefix_cache_hit([{"role": "system", "content": f"其他人设{i}"}, {"role": "user", "content": "你好"}])
+        assert server.prefix_cache_hit(turn) == 0
+        assert len(server._prefixes) == 2 and all(len(digest) == 32 for digest in server._prefixes)
+        print("[OK] Prefix cache keeps a bounded set of digests")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    test_chat_returns_parseable_output()
+    test_stream_honours_latency_profile()
+    test_error_injection_rates()
+    test_prefix_cache_is_bounded()
+    print("\nAll mock LLM server tests passed!")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 <analysis>/<response> 增量解析器"""
+
+import json
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.output_parser import TaggedOutputParser
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "llm_outputs"
+CHUNK_SIZES = (1, 2, 3, 5, 8, 13, 10_000)
+
+
+def _fixtures():
+    for txt in sorted(FIXTURES_DIR.glob("*.txt")):
+        expected = json.loads(txt.with_suffix(".json").read_text(encoding="utf-8"))
+        yield txt.stem, txt.read_text(encoding="utf-8"), expected
+
+
+def _stream(text, size, on_analysis=None):
+    parser = TaggedOutputParser(on_analysis=on_analysis)
+    deltas = []
+    for i in range(0, len(text), size):
+        deltas.append(parser.feed(text[i:i + size]))
+    return parser, deltas, parser.close()
+
+
+def test_fixtures_match_expected_for_any_chunking():
+    """任意切片方式下解析结果都与期望一致"""
+    for name, text, expected in _fixtures():
+        for size in CHUNK_SIZES:
+            _, _, result = _stream(text, size)
+            assert result == expected, f"{name} (chunk={size}): {result} != {expected}"
+        print(f"[OK] {name}")
+
+
+def test_streamed_deltas_equal_final_response():
+    """流式产出的文本拼接后与最终回复一致，且不包含标签"""
+    for name, text, expected in _fixtures():
+        if "<response>" not in text:
+            continue
+        for size in CHUNK_SIZES:
+            _, deltas, result = _stream(text, size)
+            streamed = "".join(deltas)
+            assert streamed == result["response"], f"{name} (chunk={size}): {streamed!r}"
+            assert "<" + "/response" not in streamed
+    print("[OK] Streamed deltas match final response")
+
+
+def test_analysis_available_before_response_text():
+    """</analysis> 闭合时立即得到分析结果，早于第一段回复文本"""
+    text = (FIXTURES_DIR / "standard.txt").read_text(encoding="utf-8")
+    timeline = []
+    parser = TaggedOutputParser(on_analysis=lambda a: timeline.append(("analysis", a)))
+    for ch in text:
+        if parser.feed(ch):
+            timeline.append(("delta", None))
+        if parser.analysis_ready and len(timeline) == 1:
+            # 回调触发的那一刻，解析器上的结果也已就绪
+            assert parser.analysis["affection_delta"] == 3
+
+    assert timeline[0][0] == "analysis"
+    assert timeline[0][1]["triggered_topics"] == ["烘焙", "曲奇"]
+    assert all(kind == "delta" for kind, _ in timeline[1:])
+    print("[OK] Analysis parsed as soon as </analysis> closes")
+
+
+def test_partial_tags_are_not_leaked():
+    """跨片段的半截标签不会作为回复文本输出"""
+    parser = TaggedOutputParser()
+    out = [
+        parser.feed("<analysis>{}</anal"),
+        parser.feed("ysis><resp"),
+        parser.feed("onse>你好</re"),
+        parser.feed("sponse>"),
+    ]
+    assert "".join(out) == "你好"
+    assert parser.close() == {"analysis": {}, "response": "你好"}
+    print("[OK] Partial tags held back across chunks")
+
+
+if __name__ == "__main__":
+    test_fixtures_match_expected_for_any_chunking()
+    test_streamed_deltas_equal_final_response()
+    test_analysis_available_before_response_text()
+    test_partial_tags_are_not_leaked()
+    print("\nAll output parser tests passed!")
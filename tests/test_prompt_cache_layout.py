@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试缓存友好的提示词布局：固定前缀每轮字节不变、动态内容在最后，以及缓存命中 token 的记录"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.gu_pan_character import GuPanCharacter
+from backend.domain.characters.lin_yuhan_character import LinYuhanCharacter
+from backend.domain.characters.luo_yimo_character import LuoYimoCharacter
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.characters.xia_xingwan_character import XiaXingwanCharacter
+from backend.domain.prompt_template import split_static_prefix
+from backend.game_storage import GameStorage
+from backend.infrastructure.llm import BaseLLMProvider, LLMAdapter, LLMResponse, prompt_cache_hit_tokens
+from backend.infrastructure.tracing import get_trace_ring
+
+LLM_OUTPUT = (
+    '<analysis>{"affection_delta": 3, "boredom_delta": 0, "triggered_topics": ["烘焙"]}</analysis>\n'
+    "<response>你好呀！</response>"
+)
+
+
+class CapturingProvider(BaseLLMProvider):
+    """记录每次请求的消息；usage 按 DeepSeek 的格式报告缓存命中"""
+
+    def __init__(self):
+        super().__init__(api_key="test-key", model="fake")
+        self.requests = []
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.requests.append([(m.role, m.content) for m in messages])
+        usage = {"prompt_tokens": 3000, "completion_tokens": 50, "total_tokens": 3050, "prompt_cache_hit_tokens": 2816}
+        return LLMResponse(content=LLM_OUTPUT, model=self.model, usage=usage)
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        response = await self.chat(messages)
+        yield response.content
+        kwargs["on_usage"](response.usage)
+
+
+def test_static_prefix_is_byte_stable_across_turns(tmp_path):
+    """每个角色两轮请求除最后一条 user 消息外完全相同；状态、记忆、历史与输入都只出现在最后一条"""
+    for cls in (SuTangCharacter, GuPanCharacter, LinYuhanCharacter, LuoYimoCharacter, XiaXingwanCharacter):
+        character = cls(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path)))
+        character.proactive_system.last_chat_time = None
+        provider = CapturingProvider()
+        character._llm_adapter = LLMAdapter(provider=provider)
+
+        character.chat("你好，第一次见面")
+        character.game_state["closeness"] = 77
+        character.memory_system.add_memory("陈辰养了一只叫豆豆的猫", "preference", importance=5)
+        character.chat("还记得我喜欢什么吗")
+
+        first, second = provider.requests
+        assert first[:-1] == second[:-1], cls.__name__
+        assert [role for role, _ in first] == ["system"] * (len(first) - 1) + ["user"]
+        static_text = "".join(content for _, content in second[:-1])
+        for volatile in ("77", "陈辰养了一只叫豆豆的猫", "还记得我喜欢什么吗", "你好，第一次见面"):
+            assert volatile not in static_text, (cls.__name__, volatile)
+        last = second[-1][1]
+        assert "77" in last and "陈辰养了一只叫豆豆的猫" in last and "还记得我喜欢什么吗" in last
+        assert "{{" not in static_text and '"affection_delta"' in static_text  # 固定前缀已完成转义
+    print("[OK] Static prompt prefix is byte-stable for every character")
+
+
+def test_split_prompt_template():
+    """按第一个占位符所在小节拆分；没有占位符时整个模板都是动态部分"""
+    template = "# A\n固定 {{x}}\n\n# B\n状态 {closeness}\n# C\n{user_input}\n"
+    static_prefix, dynamic = split_static_prefix(template)
+    assert static_prefix == "# A\n固定 {x}"
+    assert dynamic == "# B\n状态 {closeness}\n# C\n{user_input}\n"
+    assert split_static_prefix("没有占位符") == ("", "没有占位符")
+    print("[OK] Template split at the first dynamic section")
+
+
+def test_cache_hit_tokens_recorded(tmp_path):
+    """usage 中的缓存命中 token 累计到 llm_usage，并记录在回合追踪上"""
+    assert prompt_cache_hit_tokens({"prompt_cache_hit_tokens": 128}) == 128
+    assert prompt_cache_hit_tokens({"prompt_tokens_details": {"cached_tokens": 64}}) == 64
+    assert prompt_cache_hit_tokens({"prompt_tokens": 10}) is None
+
+    ring = get_trace_ring()
+    ring.clear()
+    character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path)))
+    character.proactive_system.last_chat_time = None
+    character._llm_adapter = LLMAdapter(provider=CapturingProvider())
+    character.chat("你好")
+    asyncio.run(character.achat("再见"))
+    assert character.llm_usage["cache_hit_tokens"] == 2816 * 2
+    assert ring.snapshot()[-1].attrs["prompt_cache_hit_tokens"] == 2816
+    print("[OK] Provider cache hits recorded per session and per turn")
+
+
+def test_mock_server_reports_prefix_cache_hits():
+    """模拟服务器对重复的前缀报告缓存命中，压测时可以直接观察布局的效果"""
+    import httpx
+    from benchmarks.mock_llm_server import MockLLMServer
+
+    server = MockLLMServer().start()
+    try:
+        prefix = [{"role": "system", "content": "人设" * 300}]
+        usages = []
+        for text in ("你好", "再见"):
+            body = {"model": "m", "messages": prefix + [{"role": "user", "content": text}]}
+            usages.append(httpx.post(server.endpoint, json=body, timeout=5).json()["usage"])
+        assert usages[0]["prompt_cache_hit_tokens"] == 0
+        assert usages[1]["prompt_cache_hit_tokens"] > 0
+        assert usages[1]["prompt_cache_hit_tokens"] % 64 == 0
+        assert server.stats()["cache_hits"] == 1
+    finally:
+        server.stop()
+    print("[OK] Mock server simulates prefix cache hits")
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_static_prefix_is_byte_stable_across_turns(Path(tmp))
+    test_split_prompt_template()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_cache_hit_tokens_recorded(Path(tmp))
+    test_mock_server_reports_prefix_cache_hits()
+    print("\nAll prompt cache layout tests passed!")
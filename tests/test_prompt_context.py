@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试会话级提示词上下文：历史行增量渲染、记忆与话题按来源变化失效、与整表重算的结果一致"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.memory_system import MemorySystem
+from backend.domain.prompt_context import PromptContext
+from backend.game_storage import GameStorage
+
+
+def naive_lines(history, window=10):
+    dialogue = [m for m in history if m["role"] in ("user", "assistant")][-window:]
+    return [f"{'陈辰' if m['role'] == 'user' else '苏糖'}: {m['content']}" for m in dialogue]
+
+
+def test_history_ring_renders_only_new_messages():
+    """追加消息只渲染新增的行；整体替换或回退时重建；结果始终与整表重算一致"""
+    context = PromptContext("陈辰", "苏糖", window=4, estimator=len)
+    history = [{"role": "system", "content": "人设"}]
+    for i in range(1000):
+        history.append({"role": "user" if i % 2 == 0 else "assistant", "content": f"消息{i}"})
+    lines, costs = context.history(history)
+    assert lines == naive_lines(history, 4) and costs == [len(line) for line in lines]
+    assert context.rebuilds["history_lines"] == 4  # 只渲染窗口内的消息，与历史总长度无关
+
+    history.append({"role": "user", "content": "新消息"})
+    lines, _ = context.history(history)
+    assert lines == naive_lines(history, 4) and context.rebuilds["history_lines"] == 5
+    context.history(history)
+    assert context.rebuilds["history_lines"] == 5  # 没有新消息时直接复用
+
+    replaced = [{"role": "user", "content": f"读档{i}"} for i in range(3)]
+    assert context.history(replaced)[0] == naive_lines(replaced, 4)
+    assert context.rebuilds["history"] == 1
+    assert context.history(replaced[:2])[0] == naive_lines(replaced[:2], 4)  # 回退了最新一条
+    assert context.history([])[0] == []
+    print("[OK] History lines rendered incrementally")
+
+
+def test_memories_and_topics_invalidated_by_source():
+    """记忆与话题在来源变化前复用缓存，变化后重建"""
+    context = PromptContext("陈辰", "苏糖")
+    memory = MemorySystem()
+    memory.add_memory("陈辰喜欢曲奇", "preference", importance=3)
+    assert context.memories(memory)[0] == ["- 陈辰喜欢曲奇"]
+    context.memories(memory)
+    assert context.rebuilds["memories"] == 1
+
+    memory.add_memory("陈辰的生日在五月", "player_info", importance=5)
+    assert context.memories(memory)[0] == ["- 陈辰的生日在五月", "- 陈辰喜欢曲奇"]
+    memory.from_dict({"memories": []})
+    assert context.memories(memory)[0] == []
+    assert context.rebuilds["memories"] == 3
+
+    assert context.topics(None) == "无"
+    assert context.topics(["烘焙", "钢琴"]) == "烘焙, 钢琴"
+    context.topics(["烘焙", "钢琴"])
+    assert context.rebuilds["topics"] == 2
+    print("[OK] Memories and topics cached until their source changes")
+
+
+def test_character_prompt_tracks_history_trim_and_load(tmp_path):
+    """角色回合中裁剪历史、读档后，提示词中的历史与整表重算一致"""
+    storage = GameStorage(save_dir=str(tmp_path))
+    character = SuTangCharacter(is_new_game=True, storage=storage, config_override={"prompt_token_budget": 0})
+    character.set_dialogue_history_size(10)  # 两条 system 消息之外只保留 8 条对话，少于窗口
+    for i in range(20):
+        character.dialogue_history.append({"role": "user", "content": f"第{i}句"})
+        character.dialogue_history.append({"role": "assistant", "content": f"回复{i}"})
+        character._trim_history()
+        assert character._history_lines_for_prompt() == naive_lines(character.dialogue_history)
+    character.game_state["last_topics"] = ["曲奇"]
+    assert character.save(1)
+
+    character.dialogue_history.append({"role": "user", "content": "存档之后说的话"})
+    character.game_state["last_topics"] = ["钢琴"]
+    assert character.load(1)
+    variables = character.build_prompt_variables("你好")
+    assert "存档之后说的话" not in variables["conversation_history"]
+    assert variables["conversation_history"] == "\n".join(naive_lines(character.dialogue_history))
+    assert variables["last_topics"] == "曲奇"
+    print("[OK] Prompt history follows trims and loads")
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_history_ring_renders_only_new_messages()
+    test_memories_and_topics_invalidated_by_source()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_character_prompt_tracks_history_trim_and_load(Path(tmp))
+    print("\nAll prompt context tests passed!")
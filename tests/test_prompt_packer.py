@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试按 token 预算打包提示词：优先级、截断、各部分 token 统计与角色接入"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.prompt_packer import PromptPacker
+from backend.game_storage import GameStorage
+
+
+def count_chars(text):
+    """测试用估算：每个字符 1 token"""
+    return len(text)
+
+
+def test_priority_order_fills_budget():
+    """预算依次分给最新对话、记忆、更早对话；历史保持时间顺序且连续"""
+    packer = PromptPacker(budget=100, recent_messages=2, estimator=count_chars)
+    history = [f"line{i}-" + "x" * 8 for i in range(6)]  # 每行 14 字符，计入换行 15
+    memories = ["- m" + "y" * 16, "- n" + "z" * 16]  # 每条 19 字符，计入换行 20
+
+    packed = packer.pack(persona_tokens=20, state_tokens=10, history_lines=history, memories=memories)
+    # 剩余 70：最新两条 30，两条记忆 40，更早的对话放不下
+    assert packed.history == history[-2:]
+    assert packed.memories == memories
+    assert packed.sections == {"persona": 20, "state": 10, "summary": 0, "recent": 30, "memories": 40, "older": 0}
+    assert packed.dropped == {"older": 4} and packed.total == 100
+
+    roomy = PromptPacker(budget=145, recent_messages=2, estimator=count_chars)
+    packed = roomy.pack(20, 10, history, memories)
+    assert packed.history == history[-5:] and packed.sections["older"] == 45
+    print("[OK] Budget filled in priority order")
+
+
+def test_newest_line_truncated_and_fixed_sections_always_kept():
+    """最新一条超长时截断保留开头；persona 与 state 超出预算也照常计入"""
+    packer = PromptPacker(budget=60, recent_messages=4, estimator=count_chars)
+    pasted = "陈辰: " + "很长的粘贴内容" * 50
+    packed = packer.pack(20, 10, ["陈辰: 你好", pasted], ["- 记忆"])
+    assert packed.truncated and len(packed.history) == 1
+    assert packed.history[0].startswith("陈辰: 很长") and packed.history[0].endswith("…")
+    assert packed.sections["recent"] <= 30 and packed.total <= 60
+    assert packed.dropped == {"recent": 1, "memories": 1}
+
+    over = PromptPacker(budget=25, estimator=count_chars).pack(20, 10, ["a", "b"], ["- c"])
+    assert over.history == [] and over.memories == [] and over.total == 30
+    unlimited = PromptPacker(budget=0, estimator=count_chars).pack(20, 10, ["a", "b"], ["- c"])
+    assert unlimited.history == ["a", "b"] and unlimited.dropped == {}
+    print("[OK] Oversized newest line truncated, persona/state never dropped")
+
+
+def test_character_reports_sections_per_turn(tmp_path):
+    """角色按配置的预算打包历史，last_prompt_report 给出每部分的 token 数"""
+    character = SuTangCharacter(
+        is_new_game=True,
+        storage=GameStorage(save_dir=str(tmp_path)),
+        config_override={"prompt_token_budget": 3000},
+    )
+    assert character.prompt_packer.budget == 3000
+    for i in range(5):
+        character.dialogue_history.append({"role": "user", "content": f"第{i}条：" + "学姐你好" * 200})
+        character.dialogue_history.append({"role": "assistant", "content": f"回复{i}"})
+    character.memory_system.add_memory("陈辰喜欢曲奇", "preference", importance=5)
+
+    variables = character.build_prompt_variables("今天做什么甜点？")
+    report = character.last_prompt_report
+    sections = report["sections"]
+    assert set(sections) == {"persona", "state", "summary", "recent", "memories", "older"}
+    assert sections["persona"] > 1000 and report["total"] <= 3000
+    assert report["dropped"]  # 长消息把更早的对话挤出了预算
+    assert "回复4" in variables["conversation_history"]
+    assert "第0条" not in variables["conversation_history"]
+    print("[OK] Character packs history within its budget and reports sections")
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_priority_order_fills_budget()
+    test_newest_line_truncated_and_fixed_sections_always_kept()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_character_reports_sections_per_turn(Path(tmp))
+    print("\nAll prompt packer tests passed!")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试预编译提示词模板：渲染结果与 str.format 一致、加载时校验占位符、同一角色的会话共享编译结果"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.base_character import BaseCharacter
+from backend.domain.characters.gu_pan_character import GuPanCharacter
+from backend.domain.characters.lin_yuhan_character import LinYuhanCharacter
+from backend.domain.characters.luo_yimo_character import LuoYimoCharacter
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.domain.characters.xia_xingwan_character import XiaXingwanCharacter
+from backend.domain.prompt_template import (
+    CompiledTemplate,
+    PromptTemplateError,
+    clear_compiled_prompts,
+    get_compiled_prompt,
+    split_static_prefix,
+)
+from backend.game_storage import GameStorage
+
+CHARACTERS = (SuTangCharacter, GuPanCharacter, LinYuhanCharacter, LuoYimoCharacter, XiaXingwanCharacter)
+
+
+def test_render_matches_str_format():
+    """字面量转义、相邻占位符、格式说明与转换都与 str.format 相同"""
+    source = "{{json}} {a}{b}\n{n:03d} {a!r} 尾部"
+    template = CompiledTemplate(source)
+    variables = {"a": "甲", "b": "乙", "n": 7}
+    assert template.render(variables) == source.format(**variables)
+    assert template.placeholders == {"a", "b", "n"}
+    assert template.literal_text == "{json} \n  尾部"
+    print("[OK] Compiled render matches str.format")
+
+
+def test_invalid_or_unsupplied_placeholders_rejected(tmp_path):
+    """不支持的占位符与调用方不提供的变量在加载模板时就报错"""
+    for source in ("{user.name}", "未闭合 {user_input"):
+        try:
+            CompiledTemplate(source)
+        except PromptTemplateError:
+            pass
+        else:
+            raise AssertionError(f"expected {source!r} to be rejected")
+
+    path = tmp_path / "analysis_prompt.txt"
+    path.write_text("# 指令\n固定\n\n# 输入\n{user_input} {player_name}\n", encoding="utf-8")
+    try:
+        get_compiled_prompt(str(path), [], ["user_input"])
+    except PromptTemplateError as exc:
+        assert "player_name" in str(exc)
+    else:
+        raise AssertionError("expected missing variable to be reported")
+    print("[OK] Unknown placeholders rejected at load time")
+
+
+def test_characters_render_like_before(tmp_path):
+    """每个角色的固定消息 + 渲染结果与直接 str.format 整个模板的内容相同"""
+    for cls in CHARACTERS:
+        character = cls(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path)))
+        character.dialogue_history.append({"role": "user", "content": "你好"})
+        variables = character.build_prompt_variables("今天{天气}怎么样？")
+        compiled = character._get_compiled_prompt()
+        messages = character._build_messages(compiled.render(variables))
+        static_prefix, dynamic = split_static_prefix(compiled.source)
+        assert messages[-2]["content"] == static_prefix
+        assert messages[-1]["content"] == dynamic.format(**variables)
+        assert "今天{天气}怎么样？" in messages[-1]["content"]
+    print("[OK] Every character renders the same prompt as str.format")
+
+
+def test_sessions_share_compiled_prompt(tmp_path):
+    """同一角色的多个会话共用一个编译结果；固定消息在多轮之间是同一批对象"""
+    clear_compiled_prompts()
+    first = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path)))
+    second = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path)))
+    assert first._get_compiled_prompt() is second._get_compiled_prompt()
+    assert first._get_compiled_prompt() is not GuPanCharacter(
+        is_new_game=True, storage=GameStorage(save_dir=str(tmp_path))
+    )._get_compiled_prompt()
+
+    turn1 = first._build_messages("第一轮")
+    turn2 = second._build_messages("第二轮")
+    assert all(a is b for a, b in zip(turn1[:-1], turn2[:-1]))
+    print("[OK] Compiled prompt shared across sessions")
+
+
+def test_broken_template_fails_when_character_is_built(tmp_path):
+    """占位符写错的模板在构造角色时就报错；模板文件缺失时本轮降级为备用回复"""
+    storage = GameStorage(save_dir=str(tmp_path))
+    broken = tmp_path / "broken_prompt.txt"
+    broken.write_text("# 输入\n{user_input} {no_such_variable}\n", encoding="utf-8")
+    try:
+        BaseCharacter(config={"name": "测试", "prompt_template_path": str(broken)}, storage=storage)
+    except PromptTemplateError as exc:
+        assert "no_such_variable" in str(exc)
+    else:
+        raise AssertionError("expected broken template to fail at construction")
+
+    class FallbackCharacter(BaseCharacter):
+        def get_backup_reply(self) -> str:
+            return "嗯？"
+
+    missing = tmp_path / "missing_prompt.txt"
+    character = FallbackCharacter(config={"name": "测试", "prompt_template_path": str(missing)}, storage=storage)
+    result = character.think_and_chat("你好")
+    assert result["analysis"] is None and result["response"] == "嗯？"
+    print("[OK] Broken template rejected when the character is built")
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_render_matches_str_format()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_invalid_or_unsupplied_placeholders_rejected(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_characters_render_like_before(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_sessions_share_compiled_prompt(Path(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        test_broken_template_fails_when_character_is_built(Path(tmp))
+    print("\nAll prompt template tests passed!")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试按 API 密钥的请求/token 令牌桶限流"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.infrastructure.llm import BaseLLMProvider, LLMFactory, LLMResponse, Message
+from backend.infrastructure.llm.rate_limit import (
+    Bucket,
+    MemoryRateLimitBackend,
+    RateLimitedProvider,
+    RateLimiter,
+    RateLimitExceeded,
+    SQLiteRateLimitBackend,
+    get_rate_limiter,
+)
+
+
+class FakeProvider(BaseLLMProvider):
+    """立即返回的提供商，记录每次调用的时间，usage 固定"""
+
+    def __init__(self, total_tokens=50, error=None):
+        super().__init__(api_key="test-key", model="fake", max_tokens=200)
+        self.total_tokens = total_tokens
+        self.error = error
+        self.calls = []
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls.append(time.perf_counter())
+        if self.error is not None:
+            raise self.error
+        usage = {"prompt_tokens": 10, "completion_tokens": self.total_tokens - 10, "total_tokens": self.total_tokens}
+        return LLMResponse(content="ok", model=self.model, usage=usage)
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls.append(time.perf_counter())
+        if self.error is not None:
+            raise self.error
+        on_usage = kwargs.get("on_usage")
+        yield "o"
+        yield "k"
+        if on_usage:
+            on_usage({"completion_tokens": self.total_tokens - 10, "total_tokens": self.total_tokens})
+
+
+def _level(backend, bucket):
+    level, updated = backend._state[bucket.name]
+    return min(bucket.capacity, level + (time.time() - updated) * bucket.rate)
+
+
+def test_burst_is_smoothed():
+    """突发容量用完后，后续请求按补充速率排队而不是失败"""
+    limiter = RateLimiter("test:burst", MemoryRateLimitBackend(), rpm=600, burst_seconds=0.2, max_wait=5)
+    provider = FakeProvider()
+    limited = RateLimitedProvider(provider, limiter)
+
+    async def run():
+        messages = [Message(role="user", content="hi")]
+        start = time.perf_counter()
+        await asyncio.gather(*(limited.chat(messages) for _ in range(6)))
+        return start
+
+    start = asyncio.run(run())
+    offsets = sorted(t - start for t in provider.calls)
+    # 容量 2 个请求立即发出，其余 4 个以 10 req/s 的速度间隔约 0.1s
+    assert offsets[1] < 0.05
+    assert 0.35 <= offsets[-1] < 0.6, offsets
+    assert limiter.throttled == 4 and limiter.rejected == 0
+    print(f"[OK] 6 requests at 10 rps with burst 2 spread over {offsets[-1]:.2f}s")
+
+
+def test_token_budget_reconciled_with_usage():
+    """token 桶先按估算预留，响应后按 usage.total_tokens 退还多预留的部分"""
+    backend = MemoryRateLimitBackend()
+    limiter = RateLimiter("test:tokens", backend, tpm=600, burst_seconds=60, max_wait=5)
+    limited = RateLimitedProvider(FakeProvider(total_tokens=30), limiter)
+    bucket = limiter.token_bucket
+    messages = [Message(role="user", content="你好" * 20)]
+
+    reserved = limited._reserve_tokens(messages, None)
+    assert reserved > 30
+    asyncio.run(limited.chat(messages))
+    used = bucket.capacity - _level(backend, bucket)
+    assert 29 <= used <= 30, used  # 实际只消耗 30（补充速率 10 token/s，允许少量误差）
+
+    async def stream():
+        return [chunk async for chunk in limited.chat_stream(messages)]
+
+    assert asyncio.run(stream()) == ["o", "k"]
+    used = bucket.capacity - _level(backend, bucket)
+    assert 58 <= used <= 60, used
+    # 完成 token 的估计向实际值（20）收敛
+    assert limited._completion_ewma < 100
+    print("[OK] Token reservation refunded to actual usage (chat + stream)")
+
+
+def test_failed_request_refunds_tokens():
+    """提供商报错且没有产出内容时归还预留的 token，请求数额度照常扣除"""
+    backend = MemoryRateLimitBackend()
+    limiter = RateLimiter("test:refund", backend, rpm=600, tpm=600, burst_seconds=60, max_wait=5)
+    limited = RateLimitedProvider(FakeProvider(error=RuntimeError("503")), limiter)
+    messages = [Message(role="user", content="你好" * 20)]
+
+    async def stream():
+        return [chunk async for chunk in limited.chat_stream(messages)]
+
+    for call in (lambda: limited.chat(messages), stream):
+        try:
+            asyncio.run(call())
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("expected RuntimeError")
+    assert limiter.token_bucket.capacity - _level(backend, limiter.token_bucket) < 1
+    assert 1 <= limiter.request_bucket.capacity - _level(backend, limiter.request_bucket) <= 2
+    print("[OK] Failed requests refund their token reservation")
+
+
+def test_wait_beyond_max_raises_without_reserving():
+    """需要等待的时间超过上限时抛出 RateLimitExceeded，且不扣除额度"""
+    backend = MemoryRateLimitBackend()
+    limiter = RateLimiter("test:max", backend, rpm=6, burst_seconds=10, max_wait=1)
+    limited = RateLimitedProvider(FakeProvider(), limiter)
+    messages = [Message(role="user", content="hi")]
+
+    asyncio.run(limited.chat(messages))  # 用掉唯一的突发额度
+    level_before = _level(backend, limiter.request_bucket)
+    try:
+        asyncio.run(limited.chat(messages))
+    except RateLimitExceeded as exc:
+        assert exc.retry_after >= 1
+    else:
+        raise AssertionError("expected RateLimitExceeded")
+    assert _level(backend, limiter.request_bucket) - level_before < 0.1
+    assert limiter.rejected == 1
+    print("[OK] Over-long wait rejected with Retry-After, budget untouched")
+
+
+def test_sqlite_backend_shared_between_processes():
+    """两个后端实例（代表两个工作进程）通过同一个 SQLite 文件共享预算"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "buckets.sqlite3")
+        worker_a = SQLiteRateLimitBackend(path)
+        worker_b = SQLiteRateLimitBackend(path)
+        bucket = Bucket("deepseek:abc:rpm", capacity=3, rate=1.0)
+
+        for _ in range(3):
+            ok, wait = worker_a.reserve([bucket], [1], max_wait=5)
+            assert ok and wait == 0
+        ok, wait = worker_b.reserve([bucket], [1], max_wait=5)
+        assert ok and 0.9 < wait <= 1.0  # A 用完的额度对 B 可见
+        ok, wait = worker_b.reserve([bucket], [1], max_wait=1.5)
+        assert not ok and wait > 1.5
+
+        worker_a.adjust(bucket, 2)
+        ok, wait = worker_b.reserve([bucket], [1], max_wait=5)
+        assert ok and wait == 0
+    print("[OK] SQLite buckets shared across backend instances")
+
+
+def test_factory_wraps_when_limits_configured():
+    """配置了 LLM_RPM / LLM_TPM 时工厂返回限流包装，同一密钥共享限流器"""
+    original = (settings.LLM_RPM, settings.LLM_TPM)
+    settings.LLM_RPM, settings.LLM_TPM = 0, 0
+    try:
+        plain = LLMFactory.create("deepseek", api_key="sk-unlimited")
+        assert not isinstance(plain.inner, RateLimitedProvider)
+        settings.LLM_RPM, settings.LLM_TPM = 60, 100000
+        first = LLMFactory.create("deepseek", api_key="sk-limited")
+        second = LLMFactory.create("deepseek", api_key="sk-limited", model="deepseek-reasoner")
+        assert isinstance(first.inner, RateLimitedProvider)  # 外层是 ResilientProvider
+        assert first.limiter is second.limiter is get_rate_limiter("deepseek", "sk-limited")
+        assert first.model == "deepseek-chat" and first.API_KEY_ENV == "DEEPSEEK_API_KEY"
+        assert "sk-limited" not in first.limiter.key
+        print("[OK] Factory wraps providers and shares limiter per API key")
+    finally:
+        settings.LLM_RPM, settings.LLM_TPM = original
+
+
+if __name__ == "__main__":
+    test_burst_is_smoothed()
+    test_token_budget_reconciled_with_usage()
+    test_failed_request_refunds_tokens()
+    test_wait_beyond_max_raises_without_reserving()
+    test_sqlite_backend_shared_between_processes()
+    test_factory_wraps_when_limits_configured()
+    print("\nAll rate limit tests passed!")
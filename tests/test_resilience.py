@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 LLM 调用的截止时间、退避重试与熔断器"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.game_storage import GameStorage
+from backend.infrastructure.character_loader import get_character_loader
+from backend.infrastructure.llm import BaseLLMProvider, LLMAdapter, LLMFactory, LLMResponse, Message, ProviderHTTPError
+from backend.infrastructure.llm.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    ResilientProvider,
+    get_circuit_breaker,
+)
+
+MESSAGES = [Message(role="user", content="hi")]
+
+
+class FlakyProvider(BaseLLMProvider):
+    """按预设脚本依次失败或成功的提供商；"slow" 表示挂起直到被取消"""
+
+    def __init__(self, script):
+        super().__init__(api_key="test-key", model="fake", timeout=45)
+        self.script = list(script)
+        self.calls = 0
+
+    async def _step(self):
+        self.calls += 1
+        outcome = self.script.pop(0) if self.script else "ok"
+        if outcome == "slow":
+            await asyncio.sleep(60)
+        if isinstance(outcome, Exception):
+            raise outcome
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        await self._step()
+        return LLMResponse(content="ok", model=self.model)
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        await self._step()
+        yield "o"
+        if self.script and isinstance(self.script[0], Exception):
+            raise self.script.pop(0)
+        yield "k"
+
+
+def _wrap(script, threshold=5, reset_timeout=0.2, **kwargs):
+    options = {"deadline": 5.0, "max_attempts": 3, "base_delay": 0.01, "max_delay": 0.02, **kwargs}
+    inner = FlakyProvider(script)
+    breaker = CircuitBreaker("fake", failure_threshold=threshold, reset_timeout=reset_timeout)
+    return inner, ResilientProvider(inner, breaker, **options)
+
+
+def test_transient_failures_are_retried():
+    """5xx 与连接重置会在退避后重试，最终成功时熔断器计数清零"""
+    inner, provider = _wrap([ProviderHTTPError("boom", 503), httpx.ConnectError("reset")])
+    response = asyncio.run(provider.chat(MESSAGES))
+    assert response.content == "ok"
+    assert inner.calls == 3 and provider.retries == 2
+    assert provider.breaker.stats()["consecutive_failures"] == 0
+    print("[OK] Transient failures retried with backoff")
+
+
+def test_client_errors_are_not_retried():
+    """4xx（如鉴权失败）直接抛出，不重试也不计入熔断"""
+    inner, provider = _wrap([ProviderHTTPError("bad key", 401)])
+    try:
+        asyncio.run(provider.chat(MESSAGES))
+    except ProviderHTTPError as exc:
+        assert exc.status_code == 401
+    else:
+        raise AssertionError("expected ProviderHTTPError")
+    assert inner.calls == 1 and provider.breaker.stats()["consecutive_failures"] == 0
+    print("[OK] Client errors surface immediately")
+
+
+def test_deadline_bounds_a_hung_provider():
+    """挂起的提供商在截止时间到达时被取消，而不是等满提供商的 45 秒超时"""
+    inner, provider = _wrap(["slow", "slow", "slow"], deadline=0.3)
+    start = time.perf_counter()
+    try:
+        asyncio.run(provider.chat(MESSAGES))
+    except DeadlineExceeded:
+        pass
+    else:
+        raise AssertionError("expected the deadline to expire")
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.6, elapsed
+    assert provider.deadline_exceeded == 1 and inner.calls == 1
+    print(f"[OK] Hung provider cut off after {elapsed:.2f}s")
+
+
+def test_breaker_opens_and_recovers():
+    """连续失败达到阈值后熔断，冷却后放行一个探测请求，成功则恢复"""
+    failures = [ProviderHTTPError("down", 502)] * 4
+    inner, provider = _wrap(failures, threshold=4, max_attempts=2)
+    for _ in range(2):
+        try:
+            asyncio.run(provider.chat(MESSAGES))
+        except ProviderHTTPError:
+            pass
+    assert provider.breaker.state == CircuitBreaker.OPEN and inner.calls == 4
+
+    try:
+        asyncio.run(provider.chat(MESSAGES))
+    except CircuitOpenError as exc:
+        assert exc.retry_after <= 0.2
+    else:
+        raise AssertionError("expected CircuitOpenError")
+    assert inner.calls == 4  # 熔断期间不会发出请求
+
+    time.sleep(0.25)
+    assert provider.breaker.state == CircuitBreaker.HALF_OPEN
+    assert asyncio.run(provider.chat(MESSAGES)).content == "ok"
+    assert provider.breaker.state == CircuitBreaker.CLOSED
+    assert provider.breaker.stats()["trips"] == 1
+    print("[OK] Circuit opens after repeated failures and closes after a good probe")
+
+
+def test_stream_retries_only_before_first_chunk():
+    """流式调用在首个片段之前失败会重试；开始输出后失败则直接抛出"""
+    inner, provider = _wrap([ProviderHTTPError("overloaded", 503)])
+
+    async def collect():
+        return [chunk async for chunk in provider.chat_stream(MESSAGES)]
+
+    assert asyncio.run(collect()) == ["o", "k"]
+    assert inner.calls == 2
+
+    inner, provider = _wrap(["ok", httpx.ReadError("reset mid-stream")])
+    try:
+        asyncio.run(collect())
+    except httpx.ReadError:
+        pass
+    else:
+        raise AssertionError("expected mid-stream failure to surface")
+    assert inner.calls == 1
+    print("[OK] Streams retry only before output starts")
+
+
+def test_breakers_are_per_model_and_endpoint():
+    """同一提供商的不同模型 / endpoint 各自熔断；默认截止时间沿用提供商的超时"""
+    chat = get_circuit_breaker("deepseek", "deepseek-chat")
+    assert get_circuit_breaker("DeepSeek", "deepseek-chat") is chat
+    assert get_circuit_breaker("deepseek", "deepseek-reasoner") is not chat
+    assert get_circuit_breaker("deepseek", "deepseek-chat", "http://127.0.0.1:9/v1") is not chat
+
+    first = LLMFactory.create("deepseek", api_key="sk-test", model="deepseek-chat")
+    second = LLMFactory.create("deepseek", api_key="sk-test", model="deepseek-chat", endpoint="http://127.0.0.1:9/v1")
+    try:
+        assert first.breaker is get_circuit_breaker("deepseek", "deepseek-chat", first.endpoint)
+        assert second.breaker is not first.breaker
+        assert first.deadline == float(first.timeout)
+    finally:
+        first.close()
+        second.close()
+    print("[OK] Breakers keyed by provider, model and endpoint")
+
+
+def test_open_circuit_uses_yaml_backup_replies(tmp_path):
+    """熔断期间角色直接使用 YAML 中的 backup_replies，不调用提供商"""
+    inner, provider = _wrap([], threshold=1, reset_timeout=60)
+    provider.breaker.record_failure()
+    character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_path)))
+    character.proactive_system.last_chat_time = None
+    character._llm_adapter = LLMAdapter(provider=provider)
+
+    reply = character.chat("你好")
+    assert reply in get_character_loader().load_character("su_tang").backup_replies
+    assert inner.calls == 0
+    print("[OK] Open circuit falls back to YAML backup replies")
+
+
+if __name__ == "__main__":
+    import tempfile
+    test_transient_failures_are_retried()
+    test_client_errors_are_not_retried()
+    test_deadline_bounds_a_hung_provider()
+    test_breaker_opens_and_recovers()
+    test_stream_retries_only_before_first_chunk()
+    test_breakers_are_per_model_and_endpoint()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_open_circuit_uses_yaml_backup_replies(Path(tmp))
+    print("\nAll resilience tests passed!")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试按内容寻址的 LLM 响应缓存（内存 LRU、SQLite 持久化、温度策略）"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.infrastructure.llm import BaseLLMProvider, CachedProvider, LLMFactory, LLMResponse, Message, ResponseCache
+from backend.infrastructure.llm.cache import is_cacheable_output
+
+MESSAGES = [Message(role="system", content="你是苏糖"), Message(role="user", content="你好")]
+ANALYSIS = '<analysis>{"affection_delta": 0}</analysis>'
+
+
+def _turn(reply):
+    return f"{ANALYSIS}<response>{reply}</response>"
+
+
+class CountingProvider(BaseLLMProvider):
+    """每次调用返回递增编号的回复，便于判断是否命中缓存；malformed=True 时输出不带 <response> 标签"""
+
+    def __init__(self, temperature=0.0, malformed=False):
+        super().__init__(api_key="test-key", model="fake", temperature=temperature)
+        self.calls = 0
+        self.malformed = malformed
+        self.finish_reason = "stop"
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        content = f"reply-{self.calls}" if self.malformed else _turn(f"reply-{self.calls}")
+        return LLMResponse(content=content, model=self.model, usage={"total_tokens": 10}, finish_reason="stop")
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        for part in (ANALYSIS, "<response>stream-", f"{self.calls}</response>"):
+            yield part
+        if kwargs.get("on_finish"):
+            kwargs["on_finish"](self.finish_reason)
+
+
+def _chat(provider, messages=MESSAGES, **kwargs):
+    return asyncio.run(provider.chat(messages, **kwargs))
+
+
+def test_identical_requests_hit_cache():
+    """相同的模型、消息与参数命中缓存；任一项不同则重新请求"""
+    inner = CountingProvider()
+    cache = ResponseCache()
+    provider = CachedProvider(inner, cache)
+    first = _chat(provider)
+    again = _chat(provider)
+    assert first.content == again.content == _turn("reply-1")
+    assert again.usage is None  # 命中时没有消耗 token
+    assert _chat(provider, max_tokens=10).content == _turn("reply-2")
+    assert _chat(provider, [Message(role="user", content="再见")]).content == _turn("reply-3")
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 3
+    print("[OK] Identical requests served from cache")
+
+
+def test_temperature_policy_bypasses_cache():
+    """有效温度高于上限时不读也不写缓存"""
+    inner = CountingProvider(temperature=0.8)
+    cache = ResponseCache()
+    provider = CachedProvider(inner, cache, max_temperature=0.3)
+    assert _chat(provider).content == _turn("reply-1")
+    assert _chat(provider).content == _turn("reply-2")
+    assert _chat(provider, temperature=0.0).content == _turn("reply-3")
+    assert _chat(provider, temperature=0.0).content == _turn("reply-3")
+    assert cache.stats()["bypassed"] == 2
+    print("[OK] Hot requests bypass the cache")
+
+
+def test_lru_evicts_by_bytes():
+    """内存层超过字节上限时淘汰最久未使用的条目"""
+    cache = ResponseCache(max_bytes=30)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"content": "x" * 10, "model": "m"})
+    cache.get("a")  # a 变为最近使用
+    cache.put("d", {"content": "y" * 10, "model": "m"})
+    assert cache.get("b") is None and cache.get("a") is not None
+    assert cache.bytes <= 30 and cache.stats()["evictions"] == 1
+    print("[OK] LRU eviction honours the byte cap")
+
+
+def test_disk_store_survives_restart():
+    """SQLite 持久层在新的缓存实例（模拟进程重启）中仍能命中"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        provider = CachedProvider(CountingProvider(), ResponseCache(path=path))
+        assert _chat(provider).content == _turn("reply-1")
+
+        restarted = CachedProvider(CountingProvider(), ResponseCache(path=path))
+        assert _chat(restarted).content == _turn("reply-1")
+        assert restarted.inner.calls == 0 and restarted.cache.stats()["disk_hits"] == 1
+    print("[OK] Disk store survives a restart")
+
+
+def test_disk_io_runs_off_event_loop():
+    """有磁盘层时，协程路径上的 SQLite 读写在工作线程执行"""
+    threads = []
+
+    class RecordingCache(ResponseCache):
+        def get(self, key):
+            threads.append(threading.get_ident())
+            return super().get(key)
+
+        def put(self, key, entry):
+            threads.append(threading.get_ident())
+            super().put(key, entry)
+
+    async def run():
+        loop_thread = threading.get_ident()
+        await provider.chat(MESSAGES)
+        await provider.chat(MESSAGES)
+        return loop_thread
+
+    with tempfile.TemporaryDirectory() as tmp:
+        provider = CachedProvider(CountingProvider(), RecordingCache(path=os.path.join(tmp, "cache.sqlite3")))
+        loop_thread = asyncio.run(run())
+    assert len(threads) == 3 and loop_thread not in threads  # get（未命中）、put、get（命中）
+    assert provider.inner.calls == 1
+    print("[OK] Disk cache I/O runs off the event loop")
+
+
+def test_stream_is_cached_after_completion():
+    """完整读完的流写入缓存，下次流式请求一次性返回完整回复"""
+    inner = CountingProvider()
+    provider = CachedProvider(inner, ResponseCache())
+
+    async def collect():
+        return [chunk async for chunk in provider.chat_stream(MESSAGES)]
+
+    assert asyncio.run(collect()) == [ANALYSIS, "<response>stream-", "1</response>"]
+    assert asyncio.run(collect()) == [_turn("stream-1")]
+    assert _chat(provider).content == _turn("stream-1")  # 普通调用与流式共用同一个键
+    assert inner.calls == 1
+    print("[OK] Completed streams are cached")
+
+
+def test_incomplete_outputs_are_not_stored():
+    """没有 <response> 标签或分析 JSON 解析失败的输出不写入缓存"""
+    inner = CountingProvider(malformed=True)
+    cache = ResponseCache()
+    provider = CachedProvider(inner, cache)
+    assert _chat(provider).content == "reply-1"
+    assert _chat(provider).content == "reply-2"
+    assert cache.stats()["rejected"] == 2 and cache.stats()["stores"] == 0
+    assert not is_cacheable_output("<analysis>不是 JSON</analysis><response>嗯</response>")
+    assert is_cacheable_output(_turn("嗯"))
+    print("[OK] Incomplete outputs are not cached")
+
+
+def test_truncated_outputs_are_not_stored():
+    """<response> 未闭合（max_tokens 截断、断流）或流没有正常结束时不写入缓存"""
+    truncated = (Path(__file__).parent / "fixtures" / "llm_outputs" / "truncated_response.txt").read_text(encoding="utf-8")
+    assert not is_cacheable_output(truncated)
+
+    class TruncatingProvider(CountingProvider):
+        async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+            self.calls += 1
+            return LLMResponse(content=truncated, model=self.model, finish_reason=None)
+
+    cache = ResponseCache()
+    provider = CachedProvider(TruncatingProvider(), cache)
+    _chat(provider)
+    _chat(provider)
+    assert provider.inner.calls == 2 and cache.stats()["stores"] == 0
+
+    inner = CountingProvider()
+    inner.finish_reason = "length"
+    streaming = CachedProvider(inner, cache)
+
+    async def collect():
+        return [chunk async for chunk in streaming.chat_stream(MESSAGES)]
+
+    asyncio.run(collect())
+    asyncio.run(collect())
+    assert inner.calls == 2 and cache.stats()["stores"] == 0 and cache.stats()["rejected"] == 4
+    print("[OK] Truncated outputs are not cached")
+
+
+def test_key_includes_provider_and_endpoint():
+    """同名模型在不同提供商或 endpoint 上不互相命中"""
+    cache = ResponseCache()
+    deepseek = CachedProvider(CountingProvider(), cache, provider_name="deepseek")
+    openai = CachedProvider(CountingProvider(), cache, provider_name="openai")
+    assert _chat(deepseek).content == _chat(openai).content == _turn("reply-1")
+    assert openai.inner.calls == 1
+
+    gateway = CountingProvider()
+    gateway.endpoint = "http://127.0.0.1:9/v1/chat/completions"
+    assert _chat(CachedProvider(gateway, cache, provider_name="deepseek")).content == _turn("reply-1")
+    assert gateway.calls == 1
+    assert _chat(deepseek).usage is None
+    print("[OK] Cache key separates providers and endpoints")
+
+
+def test_factory_wraps_only_when_requested():
+    """get_shared(cache=True) 在最外层加缓存包装，默认不加"""
+    os.environ["CACHE_TEST_KEY"] = "sk-cache"
+    original = settings.LLM_CACHE_PERSIST
+    settings.LLM_CACHE_PERSIST = False
+    try:
+        plain = LLMFactory.get_shared("deepseek", api_key_env="CACHE_TEST_KEY")
+        cached = LLMFactory.get_shared("deepseek", api_key_env="CACHE_TEST_KEY", cache=True)
+        assert not isinstance(plain, CachedProvider)
+        assert isinstance(cached, CachedProvider) and cached.inner is plain
+        assert cached is LLMFactory.get_shared("deepseek", api_key_env="CACHE_TEST_KEY", cache=True)
+        print("[OK] Factory adds the cache only when enabled")
+    finally:
+        settings.LLM_CACHE_PERSIST = original
+        LLMFactory.clear_shared()
+
+
+if __name__ == "__main__":
+    test_identical_requests_hit_cache()
+    test_temperature_policy_bypasses_cache()
+    test_lru_evicts_by_bytes()
+    test_incomplete_outputs_are_not_stored()
+    test_truncated_outputs_are_not_stored()
+    test_key_includes_provider_and_endpoint()
+    test_disk_store_survives_restart()
+    test_disk_io_runs_off_event_loop()
+    test_stream_is_cached_after_completion()
+    test_factory_wraps_only_when_requested()
+    print("\nAll response cache tests passed!")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试按耗时 / 错误率 EWMA 在多个提供商之间路由"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.infrastructure.llm import BaseLLMProvider, LLMFactory, LLMResponse, Message, ProviderHTTPError, RoutedProvider
+from backend.infrastructure.llm.rate_limit import RateLimitExceeded
+from backend.infrastructure.llm.resilience import CircuitBreaker, ResilientProvider
+
+MESSAGES = [Message(role="user", content="hi")]
+
+
+class ScriptedProvider(BaseLLMProvider):
+    """以可调的耗时返回自己的名字，可切换为总是失败"""
+
+    def __init__(self, name, delay):
+        super().__init__(api_key="test-key", model=name)
+        self.delay = delay
+        self.failing = False
+        self.calls = 0
+        self.probe_calls = 0
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        if max_tokens == 1:
+            self.probe_calls += 1
+        await asyncio.sleep(self.delay)
+        if self.failing:
+            raise ProviderHTTPError("down", 503)
+        return LLMResponse(content=self.model, model=self.model)
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        response = await self.chat(messages, temperature=temperature, max_tokens=max_tokens)
+        yield response.content
+
+
+def _run_turns(provider, count):
+    async def run():
+        results = []
+        for _ in range(count):
+            try:
+                results.append((await provider.chat(MESSAGES)).content)
+            except ProviderHTTPError:
+                results.append("error")
+        return results
+    return asyncio.run(run())
+
+
+def test_routes_to_faster_provider():
+    """每个候选先被尝试一次，之后的回合走耗时更低的候选"""
+    slow, fast = ScriptedProvider("slow", 0.05), ScriptedProvider("fast", 0.0)
+    router = RoutedProvider([("slow", slow), ("fast", fast)], probe_interval=0)
+    results = _run_turns(router, 6)
+    assert results[:2] == ["slow", "fast"]
+    assert results[2:] == ["fast"] * 4
+    assert router.stats()["current"] == "fast"
+    print("[OK] Turns follow the lower-latency provider")
+
+
+def test_errors_shift_traffic_and_probe_recovers():
+    """失败会抬高错误率从而切走流量；闲置候选被后台探测，恢复后重新被选中"""
+    primary, backup = ScriptedProvider("primary", 0.0), ScriptedProvider("backup", 0.02)
+    router = RoutedProvider([("primary", primary), ("backup", backup)], error_penalty=10, probe_interval=0.05)
+    _run_turns(router, 2)
+    primary.failing = True
+    results = _run_turns(router, 4)
+    assert results[0] == "error" and results[1:] == ["backup"] * 3
+
+    primary.failing = False
+
+    async def wait_for_recovery():
+        # 持续有回合进来，闲置的 primary 会被探测；若干次成功探测后得分降回 backup 之下
+        for _ in range(200):
+            await router.chat(MESSAGES)
+            await asyncio.sleep(0.01)
+            if router.choose()[0].label == "primary":
+                return True
+        return False
+
+    assert asyncio.run(wait_for_recovery())
+    assert primary.probe_calls >= 1
+    print(f"[OK] Traffic moved away on errors and came back after {primary.probe_calls} probes")
+
+
+def test_latency_units_and_local_rate_limits():
+    """普通调用与流式首 token 分开统计；探测只更新错误率；本地限流不算提供商错误"""
+    provider = ScriptedProvider("only", 0.02)
+    router = RoutedProvider([("only", provider)], probe_interval=0)
+    health = router.candidates[0][0]
+    _run_turns(router, 1)
+
+    async def stream():
+        return [chunk async for chunk in router.chat_stream(MESSAGES)]
+
+    asyncio.run(stream())
+    assert health.latency["chat"] >= 0.02 and health.latency["stream"] >= 0.02
+    assert health.requests == 2
+
+    latency = dict(health.latency)
+    asyncio.run(router._probe(health, ScriptedProvider("probe", 0.05)))
+    assert health.latency == latency and health.probes == 1 and health.requests == 2
+
+    class LimitedProvider(ScriptedProvider):
+        async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+            raise RateLimitExceeded("local quota", retry_after=1)
+
+    limited = RoutedProvider([("limited", LimitedProvider("limited", 0.0))], probe_interval=0)
+    try:
+        asyncio.run(limited.chat(MESSAGES))
+    except RateLimitExceeded:
+        pass
+    else:
+        raise AssertionError("expected RateLimitExceeded")
+    limited_health = limited.candidates[0][0]
+    assert limited_health.errors == 0 and limited_health.error_rate == 0.0
+    print("[OK] Latency kept per mode; probes and local rate limits do not skew health")
+
+
+def test_open_breaker_is_skipped():
+    """熔断器打开的候选不参与选择"""
+    good = ScriptedProvider("good", 0.0)
+    broken = ResilientProvider(ScriptedProvider("broken", 0.0), CircuitBreaker("broken", failure_threshold=1, reset_timeout=60))
+    broken.breaker.record_failure()
+    router = RoutedProvider([("broken", broken), ("good", good)], probe_interval=0)
+    assert _run_turns(router, 3) == ["good"] * 3
+    print("[OK] Open circuits are routed around")
+
+
+def test_factory_builds_shared_router():
+    """get_shared(route=...) 以主提供商为第一个候选构建共享路由，跳过缺少密钥的候选"""
+    os.environ["ROUTE_TEST_KEY"] = "sk-primary"
+    saved = os.environ.pop("OPENAI_API_KEY", None)
+    try:
+        lone = LLMFactory.get_shared("deepseek", api_key_env="ROUTE_TEST_KEY", route="openai")
+        assert not isinstance(lone, RoutedProvider)
+        os.environ["OPENAI_API_KEY"] = "sk-openai"
+        router = LLMFactory.get_shared("deepseek", api_key_env="ROUTE_TEST_KEY", route="openai:gpt-4o-mini, deepseek")
+        assert isinstance(router, RoutedProvider)
+        assert router is LLMFactory.get_shared("deepseek", api_key_env="ROUTE_TEST_KEY", route="openai:gpt-4o-mini, deepseek")
+        labels = [candidate["label"] for candidate in LLMFactory.route_stats()[0]["candidates"]]
+        assert labels[:2] == ["deepseek:deepseek-chat", "openai:gpt-4o-mini"]
+        print("[OK] Factory shares routed providers")
+    finally:
+        LLMFactory.clear_shared()
+        os.environ.pop("OPENAI_API_KEY", None)
+        if saved is not None:
+            os.environ["OPENAI_API_KEY"] = saved
+
+
+if __name__ == "__main__":
+    test_routes_to_faster_provider()
+    test_errors_shift_traffic_and_probe_recovers()
+    test_latency_units_and_local_rate_limits()
+    test_open_breaker_is_skipped()
+    test_factory_builds_shared_router()
+    print("\nAll routing tests passed!")
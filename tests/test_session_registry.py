@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试会话注册表"""
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.domain.memory_system import MemorySystem
+from backend.services.concurrency import SessionBusyError
+from backend.services.game_service import GameService
+from backend.services.session_registry import SessionRegistry
+
+
+class FakeAgent:
+    """轻量角色替身，只包含注册表关心的属性"""
+
+    def __init__(self, role):
+        self.role_key = role or "su_tang"
+        self.dialogue_history = []
+        self.game_state = {"closeness": 30}
+        self.memory_system = MemorySystem()
+        self.system_prompts = ["persona"]
+        self.name = self.role_key
+        self.in_turn = 0
+        self.max_in_turn = 0
+
+    def chat(self, message):
+        # 记录同一实例上是否出现重入
+        self.in_turn += 1
+        self.max_in_turn = max(self.max_in_turn, self.in_turn)
+        time.sleep(0.2)
+        self.dialogue_history.append({"role": "user", "content": message})
+        self.in_turn -= 1
+        return f"echo:{message}"
+
+
+def test_sessions_are_isolated():
+    """不同会话拿到不同的角色实例"""
+    registry = SessionRegistry(FakeAgent, max_sessions=10)
+
+    a = registry.get_or_create("session-a", "su_tang").agent
+    b = registry.get_or_create("session-b", "gu_pan").agent
+
+    assert a is not b
+    assert registry.get_or_create("session-a").agent is a
+    assert b.role_key == "gu_pan"
+
+    a.dialogue_history.append({"role": "user", "content": "你好"})
+    assert b.dialogue_history == []
+    print("[OK] Sessions are isolated")
+
+
+def test_lru_eviction():
+    """超出上限时淘汰最久未访问的会话"""
+    registry = SessionRegistry(FakeAgent, max_sessions=2)
+    registry.get_or_create("s1")
+    registry.get_or_create("s2")
+    registry.get("s1")  # 刷新 s1
+    registry.get_or_create("s3")
+
+    assert len(registry) == 2
+    assert "s1" in registry
+    assert "s2" not in registry
+    assert registry.evictions == 1
+    print("[OK] LRU eviction works")
+
+
+def test_create_replaces_agent():
+    """重新开始游戏会替换会话的角色实例"""
+    registry = SessionRegistry(FakeAgent, max_sessions=2)
+    first = registry.create("s1", "su_tang").agent
+    second = registry.create("s1", "lin_yuhan").agent
+    assert first is not second
+    assert registry.get("s1").role_key == "lin_yuhan"
+    assert len(registry) == 1
+    print("[OK] Restart replaces agent")
+
+
+def test_memory_stats_grow_with_history():
+    """内存估算随对话历史增长"""
+    registry = SessionRegistry(FakeAgent, max_sessions=5)
+    entry = registry.get_or_create("s1")
+    before = entry.estimate_memory_bytes()
+    for i in range(50):
+        entry.agent.dialogue_history.append({"role": "user", "content": f"第{i}句话" * 10})
+    after = entry.estimate_memory_bytes()
+    assert after > before
+
+    stats = registry.stats()
+    assert stats["active_sessions"] == 1
+    assert stats["total_memory_bytes"] == stats["sessions"][0]["memory_bytes"]
+    assert stats["sessions"][0]["history_len"] == 50
+    print(f"[OK] Memory estimate {before} -> {after} bytes")
+
+
+def _run_parallel(targets):
+    threads = [threading.Thread(target=t) for t in targets]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def test_turns_serialized_within_session():
+    """同一会话的并发回合串行执行，且都被记录"""
+    service = GameService(SessionRegistry(FakeAgent, max_sessions=10))
+    service.get_agent("tab")
+    elapsed = _run_parallel([lambda: service.chat("tab", "a"), lambda: service.chat("tab", "b")])
+
+    agent = service.get_agent("tab")
+    assert agent.max_in_turn == 1
+    assert len(agent.dialogue_history) == 2
+    assert elapsed >= 0.4
+    stats = service.session_stats()
+    assert stats["sessions"][0]["acquisitions"] == 2
+    assert stats["sessions"][0]["lock_wait_ms_max"] > 0
+    print(f"[OK] Same-session turns serialized ({elapsed:.2f}s)")
+
+
+def test_turns_parallel_across_sessions():
+    """不同会话的回合并行执行"""
+    service = GameService(SessionRegistry(FakeAgent, max_sessions=10))
+    sessions = [f"s{i}" for i in range(4)]
+    for sid in sessions:
+        service.get_agent(sid)
+    elapsed = _run_parallel([lambda sid=sid: service.chat(sid, "hi") for sid in sessions])
+    assert elapsed < 0.6
+    print(f"[OK] Cross-session turns ran in parallel ({elapsed:.2f}s)")
+
+
+def test_lock_timeout_raises_busy():
+    """等待超时时抛出 SessionBusyError"""
+    service = GameService(SessionRegistry(FakeAgent, max_sessions=10), lock_timeout=0.05)
+    service.get_agent("tab")
+    errors = []
+
+    def second():
+        time.sleep(0.05)
+        try:
+            service.chat("tab", "b")
+        except SessionBusyError as exc:
+            errors.append(exc)
+
+    _run_parallel([lambda: service.chat("tab", "a"), second])
+    assert len(errors) == 1
+    assert service.session_stats()["sessions"][0]["timeouts"] == 1
+    print("[OK] Busy session rejected after timeout")
+
+
+def test_queued_turn_uses_replacement_agent():
+    """排队等锁期间会话被替换（重新开始 / 读档切换角色）时，回合落在新的角色实例上"""
+    registry = SessionRegistry(FakeAgent, max_sessions=10)
+    service = GameService(registry)
+    old = service.get_agent("tab")
+    with registry.lock_for("tab").hold():
+        worker = threading.Thread(target=lambda: service.chat("tab", "排队中"))
+        worker.start()
+        time.sleep(0.05)
+        new = registry.create("tab", "gu_pan").agent
+    worker.join()
+    assert old.dialogue_history == [] and len(new.dialogue_history) == 1
+    print("[OK] Queued turn runs on the replacement agent")
+
+
+def test_pending_lock_dropped_when_session_never_created():
+    """会话没能创建（角色构造失败、等锁超时）时，不遗留待用锁"""
+    def factory(role):
+        if role == "broken":
+            raise ValueError("unknown role")
+        return FakeAgent(role)
+
+    registry = SessionRegistry(factory, max_sessions=10)
+    service = GameService(registry, lock_timeout=0.05)
+    try:
+        service.start_game("new-tab", "broken")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+    assert registry._pending_locks == {}
+
+    holder = registry.lock_for("busy-tab")
+    with holder.hold():
+        try:
+            service.start_game("busy-tab", "su_tang")
+        except SessionBusyError:
+            pass
+        else:
+            raise AssertionError("expected SessionBusyError")
+        assert registry._pending_locks == {"busy-tab": holder}
+    registry.discard_pending("busy-tab", holder)
+    assert registry._pending_locks == {} and "busy-tab" not in registry
+    print("[OK] Pending locks pruned for sessions never created")
+
+
+def test_busy_sessions_not_evicted():
+    """正在执行回合的会话不会被 LRU 淘汰"""
+    registry = SessionRegistry(FakeAgent, max_sessions=1)
+    entry = registry.get_or_create("busy")
+    with entry.lock.hold():
+        registry.get_or_create("other")
+        assert "busy" in registry
+    registry.get_or_create("third")
+    assert "busy" not in registry
+    print("[OK] Busy sessions survive eviction")
+
+
+def test_async_hold_waits_without_blocking_loop():
+    """协程等待会话锁时事件循环仍可运行其他任务；超时抛出 SessionBusyError"""
+    registry = SessionRegistry(FakeAgent, max_sessions=4)
+    lock = registry.lock_for("tab")
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        with lock.hold():
+            task = asyncio.create_task(ticker())
+            try:
+                async with lock.ahold(timeout=0.2):
+                    raise AssertionError("lock should be busy")
+            except SessionBusyError:
+                pass
+            task.cancel()
+        async with lock.ahold(timeout=0.2) as waited:
+            assert waited < 0.1
+        return ticks
+
+    assert asyncio.run(run()) >= 5
+    assert lock.stats()["timeouts"] == 1 and lock.queue_depth == 0
+    print("[OK] Async lock wait keeps the event loop responsive")
+
+
+def test_async_turn_builds_agent_off_loop():
+    """协程回合在工作线程构造新会话的角色，事件循环线程不做文件读取与初始化"""
+    built_on = []
+
+    class AsyncAgent(FakeAgent):
+        def __init__(self, role):
+            built_on.append(threading.get_ident())
+            super().__init__(role)
+
+        async def achat(self, message):
+            return f"echo:{message}"
+
+    service = GameService(SessionRegistry(AsyncAgent, max_sessions=4))
+
+    async def run():
+        turn = await service.achat_turn("tab", "hi")
+        return turn["response"], threading.get_ident()
+
+    response, loop_thread = asyncio.run(run())
+    assert response == "echo:hi"
+    assert built_on and built_on[0] != loop_thread
+    print("[OK] Async turn builds the agent on a worker thread")
+
+
+if __name__ == "__main__":
+    test_turns_serialized_within_session()
+    test_turns_parallel_across_sessions()
+    test_lock_timeout_raises_busy()
+    test_queued_turn_uses_replacement_agent()
+    test_pending_lock_dropped_when_session_never_created()
+    test_busy_sessions_not_evicted()
+    test_async_hold_waits_without_blocking_loop()
+    test_async_turn_builds_agent_off_loop()
+    test_sessions_are_isolated()
+    test_lru_eviction()
+    test_create_replaces_agent()
+    test_memory_stats_grow_with_history()
+    print("\nAll session registry tests passed!")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试回合耗时追踪：各阶段 span、有界缓冲区、Chrome Trace 导出与 /api/debug/timings"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend import settings
+from backend.domain.characters.su_tang_character import SuTangCharacter
+from backend.game_storage import GameStorage
+from backend.infrastructure.llm import BaseLLMProvider, LLMAdapter, LLMResponse
+from backend.infrastructure.tracing import TraceRing, TurnTrace, get_trace_ring
+
+LLM_OUTPUT = (
+    '<analysis>{"affection_delta": 3, "boredom_delta": 0, "triggered_topics": ["烘焙"]}</analysis>\n'
+    "<response>你好呀，欢迎来烘焙社看看！</response>"
+)
+
+
+class SlowProvider(BaseLLMProvider):
+    """普通调用等待 0.05s；流式首个片段前等待 0.05s"""
+
+    def __init__(self):
+        super().__init__(api_key="test-key", model="fake")
+
+    async def chat(self, messages, temperature=None, max_tokens=None, **kwargs):
+        await asyncio.sleep(0.05)
+        return LLMResponse(content=LLM_OUTPUT, model=self.model, usage={"total_tokens": 10})
+
+    async def chat_stream(self, messages, temperature=None, max_tokens=None, **kwargs):
+        await asyncio.sleep(0.05)
+        for i in range(0, len(LLM_OUTPUT), 16):
+            yield LLM_OUTPUT[i:i + 16]
+
+
+def _make_character(tmp_dir):
+    character = SuTangCharacter(is_new_game=True, storage=GameStorage(save_dir=str(tmp_dir)))
+    character.proactive_system.last_chat_time = None
+    character._llm_adapter = LLMAdapter(provider=SlowProvider())
+    return character
+
+
+def test_chat_turn_records_span_breakdown(tmp_path):
+    """一个普通回合按顺序记录各阶段，LLM 阶段占据主要耗时，状态更新中嵌套事件发布"""
+    ring = get_trace_ring()
+    ring.clear()
+    character = _make_character(tmp_path)
+    assert character.chat("你好") == "你好呀，欢迎来烘焙社看看！"
+
+    trace = ring.snapshot()[-1]
+    names = [span["name"] for span in trace.to_dict()["spans"]]
+    for name in ("proactive_check", "special_commands", "prompt_build", "llm", "parse", "state_update", "event_publish"):
+        assert name in names, names
+    assert names.index("prompt_build") < names.index("llm") < names.index("parse") < names.index("state_update")
+    assert "llm_first_byte" not in names  # 只有流式回合记录首字节
+    publish = next(s for s in trace.spans if s.name == "event_publish")
+    assert publish.depth == 1  # 嵌套在 state_update 中
+    breakdown = trace.breakdown()
+    assert breakdown["llm"] >= 50 and trace.duration * 1000 >= breakdown["llm"]
+    assert trace.kind == "chat" and trace.attrs["role"] == "su_tang" and trace.error is None
+    assert character._trace is None
+    print("[OK] Chat turn traced with per-span breakdown")
+
+
+def test_stream_turn_records_first_byte(tmp_path):
+    """流式回合额外记录 llm_first_byte，且不超过整个 LLM 阶段"""
+    ring = get_trace_ring()
+    ring.clear()
+    character = _make_character(tmp_path)
+    list(character.chat_stream("你好"))
+
+    trace = ring.snapshot()[-1]
+    breakdown = trace.breakdown()
+    assert trace.kind == "chat_stream"
+    assert 50 <= breakdown["llm_first_byte"] <= breakdown["llm"]
+    print("[OK] Stream turn records time to first byte")
+
+
+def test_ring_is_bounded_and_exports_chrome_trace(tmp_path):
+    """缓冲区只保留最近 N 个回合；导出文件是 Chrome Trace 的 JSON Array 格式"""
+    export = tmp_path / "traces" / "turns.json"
+    ring = TraceRing(size=3, export_path=str(export))
+    for i in range(5):
+        trace = TurnTrace("chat", {"n": i})
+        with trace.span("llm"):
+            time.sleep(0.001)
+        trace.finish()
+        ring.record(trace)
+
+    assert [t.attrs["n"] for t in ring.snapshot()] == [2, 3, 4] and ring.recorded == 5
+    stats = ring.stats(limit=2)
+    assert [t["attrs"]["n"] for t in stats["recent"]] == [4, 3]
+    assert stats["summary"]["llm"]["count"] == 3
+
+    text = export.read_text(encoding="utf-8")
+    events = json.loads(text.rstrip().rstrip(",") + "]")
+    assert len(events) == 10 and {e["ph"] for e in events} == {"X"}
+    assert {e["name"] for e in events} == {"chat", "llm"}
+    print("[OK] Ring bounded, Chrome trace export loadable")
+
+
+def test_timings_endpoint(tmp_path):
+    """/api/debug/timings 默认关闭；开启后返回汇总与最近回合，format=chrome 返回 traceEvents"""
+    from app import app
+
+    ring = get_trace_ring()
+    ring.clear()
+    _make_character(tmp_path).chat("你好")
+    client = app.test_client()
+
+    original = settings.DEBUG_ENDPOINTS
+    try:
+        settings.DEBUG_ENDPOINTS = False
+        assert client.get("/api/debug/timings").status_code == 404
+        settings.DEBUG_ENDPOINTS = True
+
+        body = client.get("/api/debug/timings?limit=1").get_json()
+        assert body["buffered"] == 1 and len(body["recent"]) == 1
+        assert "llm" in body["summary"] and body["recent"][0]["breakdown_ms"]["llm"] >= 50
+
+        chrome = client.get("/api/debug/timings?format=chrome").get_json()
+        assert any(e["name"] == "prompt_build" for e in chrome["traceEvents"])
+    finally:
+        settings.DEBUG_ENDPOINTS = original
+    print("[OK] Timings endpoint serves summary and Chrome trace")
+
+
+if __name__ == "__main__":
+    import tempfile
+    for test in (
+        test_chat_turn_records_span_breakdown,
+        test_stream_turn_records_first_byte,
+        test_ring_is_bounded_and_exports_chrome_trace,
+        test_timings_endpoint,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            test(Path(tmp))
+    print("\nAll tracing tests passed!")
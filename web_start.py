@@ -73,10 +73,21 @@ def main():
 
     # 3. 运行Flask应用
     try:
-        from backend.settings import PORT, HOST
+        from backend.settings import PORT, HOST, SERVER_MODE
         logging.info(f"正在启动Web服务器，请在浏览器中访问 http://127.0.0.1:{PORT}")
         logging.info("按 CTRL+C 退出服务器。")
-        app.run(debug=False, host=HOST, port=PORT)
+        if SERVER_MODE == "asgi":
+            # 协程处理 /api/chat，等待 LLM 的回合不再各占一个线程
+            try:
+                from asgi import application
+                import uvicorn
+            except ImportError as e:
+                logging.error(f"无法以 ASGI 模式启动: {e}")
+                logging.error('请执行 pip install ".[asgi]"，或将 SERVER_MODE 设为 "wsgi"。')
+                return
+            uvicorn.run(application, host=HOST, port=PORT, log_level="info")
+        else:
+            app.run(debug=False, host=HOST, port=PORT, threaded=True)
     except Exception as e:
         logging.error(f"启动Web应用时发生未知错误: {e}")
 